@@ -23,6 +23,7 @@ from mutagen.id3 import ID3, TIT2, TPE1, TPE2, TALB, TDRC, TCON, TCOM, COMM, TRC
 from mutagen.mp3 import MP3
 from mutagen.easyid3 import EasyID3
 import subprocess
+from ffmpeg_runner import ffmpeg_runner
 import hashlib
 import json
 import re
@@ -158,54 +159,80 @@ class AudioProcessor:
             temp_input.write(audio_bytes)
             temp_input.close()
             
+            final_path = None
             try:
-                # الحصول على معلومات المقطع الصوتي
-                audio_info = self.get_audio_info(temp_input.name)
-                if not audio_info:
-                    logger.error("فشل في الحصول على معلومات المقطع الصوتي")
-                    return audio_bytes
-                
-                # معالجة الوسوم في نفس الملف لتقليل I/O
-                if self._apply_metadata_template_inplace(
+                final_path = self.process_audio_file(
                     temp_input.name,
                     metadata_template,
-                    audio_info,
                     album_art_path,
-                    apply_art_to_all
-                ):
-                    logger.info("✅ تم تطبيق الوسوم بنجاح (in-place)")
-                    # دمج مقاطع صوتية إضافية إذا تم تحديدها
-                    final_path = temp_input.name
-                    if audio_intro_path or audio_outro_path:
-                        merged = self._merge_audio_segments(
-                            temp_input.name, audio_intro_path, audio_outro_path, intro_position
-                        )
-                        final_path = merged
-                    # قراءة الملف المعالج
-                    with open(final_path, 'rb') as f:
-                        processed_bytes = f.read()
-                    # تنظيف الملفات المؤقتة
-                    if os.path.exists(temp_input.name):
-                        os.unlink(temp_input.name)
-                    if final_path != temp_input.name and os.path.exists(final_path):
+                    apply_art_to_all,
+                    audio_intro_path,
+                    audio_outro_path,
+                    intro_position,
+                )
+                if not final_path:
+                    return audio_bytes
+                # قراءة الملف المعالج
+                with open(final_path, 'rb') as f:
+                    return f.read()
+            finally:
+                # تنظيف الملفات المؤقتة
+                for path in (temp_input.name, final_path):
+                    if path and os.path.exists(path):
                         try:
-                            os.unlink(final_path)
+                            os.unlink(path)
                         except Exception:
                             pass
-                    return processed_bytes
-                else:
-                    logger.error("فشل في تطبيق الوسوم")
-                    os.unlink(temp_input.name)
-                    return audio_bytes
-                    
-            except Exception as e:
-                logger.error(f"خطأ في معالجة الوسوم: {e}")
-                os.unlink(temp_input.name)
-                return audio_bytes
                 
         except Exception as e:
             logger.error(f"خطأ عام في معالجة الوسوم الصوتية: {e}")
             return audio_bytes
+
+    def process_audio_file(self, audio_path: str,
+                           metadata_template: Dict[str, str],
+                           album_art_path: Optional[str] = None,
+                           apply_art_to_all: bool = False,
+                           audio_intro_path: Optional[str] = None,
+                           audio_outro_path: Optional[str] = None,
+                           intro_position: str = 'start') -> Optional[str]:
+        """
+        معالجة الوسوم على ملف صوتي موجود على القرص (يُعدَّل في مكانه)
+        ترجع مسار الملف النهائي (نفس الملف أو ملف الدمج الجديد)، أو None عند الفشل
+        """
+        try:
+            # الحصول على معلومات المقطع الصوتي
+            audio_info = self.get_audio_info(audio_path)
+            if not audio_info:
+                logger.error("فشل في الحصول على معلومات المقطع الصوتي")
+                return None
+            
+            # معالجة الوسوم في نفس الملف لتقليل I/O
+            if not self._apply_metadata_template_inplace(
+                audio_path,
+                metadata_template,
+                audio_info,
+                album_art_path,
+                apply_art_to_all
+            ):
+                logger.error("فشل في تطبيق الوسوم")
+                return None
+            
+            logger.info("✅ تم تطبيق الوسوم بنجاح (in-place)")
+            # دمج مقاطع صوتية إضافية إذا تم تحديدها
+            if audio_intro_path or audio_outro_path:
+                merged = self._merge_audio_segments(
+                    audio_path, audio_intro_path, audio_outro_path, intro_position
+                )
+                if merged != audio_path:
+                    # إبقاء ناتج الدمج بجوار الملف الأصلي (نفس المجلد المؤقت) ليُحذف معه
+                    merged_path = os.path.splitext(audio_path)[0] + '_merged.mp3'
+                    shutil.move(merged, merged_path)
+                    return merged_path
+            return audio_path
+                
+        except Exception as e:
+            logger.error(f"خطأ في معالجة الوسوم: {e}")
+            return None
     
     def _apply_metadata_template(self, input_path: str, output_path: str, 
                                 template: Dict[str, str], audio_info: Dict[str, Any],
@@ -229,14 +256,9 @@ class AudioProcessor:
             
             # تطبيق الوسوم من القالب (مع خيار تنظيف النصوص من إعدادات المهمة)
             # جلب إعدادات تنظيف الوسوم الصوتية
-            try:
-                from database import get_database
-                db = get_database()
-                # ملاحظة: audio_info لا يحتوي task_id هنا، لذا التنظيف يتم خارجياً عادة
-                # سيتم توفير دالة عامة لاستخدامها خارجياً عند النداء من userbot مع task_id
-                cleaning_settings = None
-            except Exception:
-                cleaning_settings = None
+            # ملاحظة: audio_info لا يحتوي task_id هنا، لذا التنظيف يتم خارجياً عادة
+            # سيتم توفير دالة عامة لاستخدامها خارجياً عند النداء من userbot مع task_id
+            cleaning_settings = None
 
             for tag_key, tag_value in template.items():
                 if tag_value:
@@ -490,7 +512,7 @@ class AudioProcessor:
             ])
             
             # تنفيذ الدمج
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            result = ffmpeg_runner.run_sync(cmd, timeout=600)
             
             if result.returncode == 0:
                 logger.info("✅ تم دمج المقاطع الصوتية بنجاح")
@@ -548,10 +570,8 @@ class AudioProcessor:
                                          task_id: int = 0) -> Optional[bytes]:
         """معالجة المقطع الصوتي مرة واحدة لإعادة الاستخدام"""
         try:
-            # إنشاء مفتاح cache ثابت باستخدام MD5 لجزء من البداية والنهاية + القالب
-            head = audio_bytes[:1024*1024]
-            tail = audio_bytes[-1024*1024:] if len(audio_bytes) > 1024*1024 else b''
-            content_hash = hashlib.md5(head + tail if tail else head).hexdigest()
+            # إنشاء مفتاح cache ثابت من تجزئة المحتوى كاملاً + القالب (البداية والنهاية فقط قد تتصادم)
+            content_hash = hashlib.blake2b(audio_bytes, digest_size=16).hexdigest()
             template_hash = hashlib.md5(json.dumps(metadata_template, sort_keys=True).encode()).hexdigest()
             cache_key = f"{task_id}_{content_hash}_{template_hash}_{file_name}"
             
@@ -603,4 +623,4 @@ class AudioProcessor:
         return {
             'cache_size': len(self.processed_audio_cache),
             'cache_keys': list(self.processed_audio_cache.keys())
-        }
\ No newline at end of file
+        }
\ No newline at end of file
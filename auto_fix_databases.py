@@ -9,6 +9,9 @@ def fix_all_databases():
     """Fix all database files before starting the bot"""
     print("🔧 Starting automatic database fix...")
     
+    # With WAL enabled the -wal file holds committed data and must be kept
+    wal_mode = os.getenv('SQLITE_JOURNAL_MODE', 'delete').strip().lower() == 'wal'
+
     # Discover data and sessions directories
     data_dir = os.getenv('DATA_DIR', '/app/data')
     sessions_dir = os.getenv('SESSIONS_DIR', os.path.join(data_dir, 'sessions'))
@@ -42,7 +45,8 @@ def fix_all_databases():
             if db_file.endswith('.db') or db_file.endswith('.session'):
                 conn = sqlite3.connect(db_file, timeout=30)
                 try:
-                    conn.execute('PRAGMA journal_mode=DELETE')
+                    if not (wal_mode and db_file.endswith('.db')):
+                        conn.execute('PRAGMA journal_mode=DELETE')
                     conn.execute('PRAGMA synchronous=NORMAL') 
                     conn.execute('PRAGMA temp_store=MEMORY')
                     conn.execute('PRAGMA locking_mode=NORMAL')
@@ -57,7 +61,9 @@ def fix_all_databases():
             print(f"❌ Error with {db_file}: {e}")
     
     # Clean up journal/wal files
-    cleanup_patterns = ['*.db-wal', '*.db-shm', '*.session-journal', '*.session-wal']
+    cleanup_patterns = ['*.session-journal', '*.session-wal']
+    if not wal_mode:
+        cleanup_patterns = ['*.db-wal', '*.db-shm'] + cleanup_patterns
     for base in scan_dirs:
         for pattern in cleanup_patterns:
             for file_path in glob.glob(os.path.join(base, pattern)):
@@ -297,8 +297,8 @@ class SimpleTelegramBot:
         # Add event handlers
         self.bot.add_event_handler(self.handle_start, events.NewMessage(pattern='/start'))
         self.bot.add_event_handler(self.handle_login, events.NewMessage(pattern='/login'))
-        self.bot.add_event_handler(self.handle_callback, events.CallbackQuery())
-        self.bot.add_event_handler(self.handle_message, events.NewMessage())
+        self.bot.add_event_handler(self._with_settings_invalidation(self.handle_callback), events.CallbackQuery())
+        self.bot.add_event_handler(self._with_settings_invalidation(self.handle_message), events.NewMessage())
 
         # Start notification monitoring task
         asyncio.create_task(self.monitor_notifications())
@@ -308,6 +308,22 @@ class SimpleTelegramBot:
         logger.info("✅ Bot started successfully!")
         return True
 
+    def _with_settings_invalidation(self, handler):
+        """Wrap a handler so the userbot drops its cached task settings afterwards"""
+        async def wrapper(event):
+            try:
+                await handler(event)
+            finally:
+                self.invalidate_userbot_settings(event.sender_id)
+        return wrapper
+
+    def invalidate_userbot_settings(self, user_id, task_id=None):
+        """Tell the userbot that task settings of this user may have changed"""
+        try:
+            userbot_instance.invalidate_task_settings(task_id=task_id, user_id=user_id)
+        except Exception as e:
+            logger.debug(f"تعذر إبطال إعدادات المهام المخزنة للمستخدم {user_id}: {e}")
+
     # ===== Audio Metadata method wrappers (inside class) =====
     async def audio_metadata_settings(self, event, task_id):
         user_id = event.sender_id
@@ -1800,6 +1816,22 @@ class SimpleTelegramBot:
                 except ValueError as e:
                     logger.error(f"❌ خطأ في تحليل معرف المهمة لأنواع الوسائط للعلامة المائية: {e}, data='{data}'")
                     await event.answer("❌ خطأ في تحليل البيانات")
+            elif data.startswith("watermark_encoding_"): # Video encoding profile selector
+                try:
+                    # Extract task_id from data like "watermark_encoding_123"
+                    task_id = int(data.replace("watermark_encoding_", ""))
+                    await self.show_watermark_encoding_profiles(event, task_id)
+                except ValueError as e:
+                    logger.error(f"❌ خطأ في تحليل معرف المهمة لملف ترميز الفيديو: {e}, data='{data}'")
+                    await event.answer("❌ خطأ في تحليل البيانات")
+            elif data.startswith("set_watermark_encoding_"): # Set video encoding profile
+                try:
+                    # Extract profile and task_id from data like "set_watermark_encoding_balanced_123"
+                    profile, task_id = data.replace("set_watermark_encoding_", "").rsplit("_", 1)
+                    await self.set_watermark_encoding_profile(event, int(task_id), profile)
+                except ValueError as e:
+                    logger.error(f"❌ خطأ في تحليل بيانات ملف ترميز الفيديو: {e}, data='{data}'")
+                    await event.answer("❌ خطأ في تحليل البيانات")
             elif data.startswith("watermark_size_up_"): # Increase watermark size
                 try:
                     # Extract task_id from data like "watermark_size_up_123"
@@ -3382,6 +3414,15 @@ class SimpleTelegramBot:
                     except ValueError as e:
                         logger.error(f"❌ خطأ في تحليل معرف المهمة لتبديل فحص الوسائط: {e}")
                         await event.answer("❌ خطأ في تحليل البيانات")
+            elif data.startswith("toggle_duplicate_phash_"): # Handler for toggling perceptual media matching
+                parts = data.split("_")
+                if len(parts) >= 4:
+                    try:
+                        task_id = int(parts[3])
+                        await self.toggle_duplicate_perceptual_check(event, task_id)
+                    except ValueError as e:
+                        logger.error(f"❌ خطأ في تحليل معرف المهمة لتبديل البصمة الإدراكية: {e}")
+                        await event.answer("❌ خطأ في تحليل البيانات")
             elif data.startswith("set_duplicate_threshold_"): # Handler for setting duplicate threshold
                 parts = data.split("_")
                 if len(parts) >= 4:
@@ -5136,6 +5177,34 @@ class SimpleTelegramBot:
             logger.error(f"خطأ في تبديل فحص الوسائط: {e}")
             await event.answer("❌ حدث خطأ في التحديث")
 
+    async def toggle_duplicate_perceptual_check(self, event, task_id):
+        """Toggle perceptual (thumbnail hash) matching of duplicate media"""
+        user_id = event.sender_id
+        task = self.db.get_task(task_id, user_id)
+        
+        if not task:
+            await event.answer("❌ المهمة غير موجودة")
+            return
+        
+        try:
+            settings = self.db.get_duplicate_settings(task_id)
+            new_value = not settings.get('check_media_perceptual', False)
+            
+            success = self.db.update_duplicate_setting(task_id, 'check_media_perceptual', new_value)
+            
+            if success:
+                status = "تم تفعيل" if new_value else "تم تعطيل"
+                await event.answer(f"✅ {status} كشف الوسائط المشابهة")
+                
+                # Refresh the settings page
+                await self.show_duplicate_settings(event, task_id)
+            else:
+                await event.answer("❌ فشل في تحديث الإعداد")
+            
+        except Exception as e:
+            logger.error(f"خطأ في تبديل البصمة الإدراكية للوسائط: {e}")
+            await event.answer("❌ حدث خطأ في التحديث")
+
     async def start_set_duplicate_threshold(self, event, task_id):
         """Start setting duplicate threshold conversation"""
         user_id = event.sender_id
@@ -5641,12 +5710,14 @@ class SimpleTelegramBot:
         time_window = settings.get('time_window_hours', 24)
         check_text = settings.get('check_text', True)
         check_media = settings.get('check_media', True)
+        check_perceptual = settings.get('check_media_perceptual', False)
         
         buttons = [
             [Button.inline(f"📏 نسبة التشابه ({threshold}%)", f"set_duplicate_threshold_{task_id}")],
             [Button.inline(f"⏱️ النافذة الزمنية ({time_window}ساعة)", f"set_duplicate_time_{task_id}")],
             [Button.inline(f"📝 فحص النص {'✅' if check_text else '❌'}", f"toggle_duplicate_text_{task_id}")],
             [Button.inline(f"🎬 فحص الوسائط {'✅' if check_media else '❌'}", f"toggle_duplicate_media_{task_id}")],
+            [Button.inline(f"🖼️ الوسائط المشابهة {'✅' if check_perceptual else '❌'}", f"toggle_duplicate_phash_{task_id}")],
             [Button.inline("🔙 رجوع لفلتر التكرار", f"duplicate_filter_{task_id}")]
         ]
         
@@ -5667,12 +5738,14 @@ class SimpleTelegramBot:
         time_window = settings.get('time_window_hours', 24)
         check_text = settings.get('check_text', True)
         check_media = settings.get('check_media', True)
+        check_perceptual = settings.get('check_media_perceptual', False)
         
         buttons = [
             [Button.inline(f"📏 نسبة التشابه ({threshold}%)", f"set_duplicate_threshold_{task_id}")],
             [Button.inline(f"⏱️ النافذة الزمنية ({time_window}ساعة)", f"set_duplicate_time_{task_id}")],
             [Button.inline(f"📝 فحص النص {'✅' if check_text else '❌'}", f"toggle_duplicate_text_{task_id}")],
             [Button.inline(f"🎬 فحص الوسائط {'✅' if check_media else '❌'}", f"toggle_duplicate_media_{task_id}")],
+            [Button.inline(f"🖼️ الوسائط المشابهة {'✅' if check_perceptual else '❌'}", f"toggle_duplicate_phash_{task_id}")],
             [Button.inline("🔙 رجوع لفلتر التكرار", f"duplicate_filter_{task_id}")]
         ]
         
@@ -5685,7 +5758,8 @@ class SimpleTelegramBot:
             f"📏 نسبة التشابه: {threshold}%\n"
             f"⏱️ النافذة الزمنية: {time_window} ساعة\n"
             f"📝 فحص النص: {'مفعل' if check_text else 'معطل'}\n"
-            f"🎬 فحص الوسائط: {'مفعل' if check_media else 'معطل'}\n\n"
+            f"🎬 فحص الوسائط: {'مفعل' if check_media else 'معطل'}\n"
+            f"🖼️ الوسائط المشابهة (إعادة رفع/ضغط): {'مفعل' if check_perceptual else 'معطل'}\n\n"
             f"💡 اضبط هذه الإعدادات لتحكم أدق في كشف التكرار\n"
             f"⏰ آخر تحديث: {timestamp}"
         )
@@ -6745,6 +6819,7 @@ class SimpleTelegramBot:
             [Button.inline("🎨 إعدادات المظهر", f"watermark_appearance_{task_id}")],
             [Button.inline("🎭 نوع العلامة", f"watermark_type_{task_id}")],
             [Button.inline("📱 اختيار الوسائط", f"watermark_media_{task_id}")],
+            [Button.inline("🎞️ ترميز الفيديو", f"watermark_encoding_{task_id}")],
             [Button.inline("🔙 عودة للمهمة", f"task_settings_{task_id}")]
         ]
 
@@ -7021,6 +7096,48 @@ class SimpleTelegramBot:
         # Refresh position selector display
         await self.show_watermark_position_selector(event, task_id)
     
+    async def show_watermark_encoding_profiles(self, event, task_id):
+        """Show video encoding profile selection for watermarked videos"""
+        from encoding_profiles import PROFILES, DEFAULT_PROFILE
+        watermark_settings = self.db.get_watermark_settings(task_id)
+        current_profile = watermark_settings.get('encoding_profile') or DEFAULT_PROFILE
+        
+        descriptions = {
+            'fast': 'أقل زمن انتظار (حوالي نصف مدة الفيديو)',
+            'balanced': 'زمن قريب من مدة الفيديو مع ضغط جيد',
+            'quality': 'جودة أعلى بزمن أطول',
+            'compact': 'أصغر حجم للملف بأطول زمن'
+        }
+        
+        buttons = []
+        for name, profile in PROFILES.items():
+            checkmark = " ✅" if name == current_profile else ""
+            buttons.append([Button.inline(f"{profile.label}{checkmark}", f"set_watermark_encoding_{name}_{task_id}")])
+        
+        buttons.append([Button.inline("🔙 عودة للعلامة المائية", f"watermark_settings_{task_id}")])
+        
+        profile_lines = "\n".join(f"• {PROFILES[name].label}: {text}" for name, text in descriptions.items())
+        message_text = (
+            f"🎞️ ترميز الفيديو - المهمة #{task_id}\n\n"
+            f"الملف الحالي: {PROFILES.get(current_profile, PROFILES[DEFAULT_PROFILE]).label}\n\n"
+            f"{profile_lines}\n\n"
+            f"ℹ️ تُختار سرعة الترميز والجودة تلقائياً حسب دقة الفيديو ومدته وقدرة الخادم"
+        )
+        
+        await self.force_new_message(event, message_text, buttons=buttons)
+
+    async def set_watermark_encoding_profile(self, event, task_id, profile):
+        """Set video encoding profile"""
+        from encoding_profiles import PROFILES
+        if profile not in PROFILES:
+            await event.answer("❌ ملف ترميز غير صحيح")
+            return
+        
+        self.db.update_watermark_settings(task_id, encoding_profile=profile)
+        await event.answer(f"✅ ملف الترميز: {PROFILES[profile].label}")
+        
+        await self.show_watermark_encoding_profiles(event, task_id)
+
     async def show_watermark_position_settings(self, event, task_id):
         """Show watermark position settings (alias for position selector)"""
         await self.show_watermark_position_selector(event, task_id)
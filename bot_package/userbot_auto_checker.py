@@ -83,9 +83,9 @@ class UserbotAutoChecker:
             
             # استيراد الوحدات المطلوبة
             from userbot_service.userbot import start_userbot_service
-            from database.database import Database
+            from database import DatabaseFactory
             
-            db = Database()
+            db = DatabaseFactory.get_shared_sqlite_database()
             
             # الحصول على جميع الجلسات المحفوظة
             with db.get_connection() as conn:
@@ -140,8 +140,8 @@ class UserbotAutoChecker:
         try:
             logger.info(f"🔄 إعادة تشغيل جلسة المستخدم {user_id}...")
             
-            from database.database import Database
-            db = Database()
+            from database import DatabaseFactory
+            db = DatabaseFactory.get_shared_sqlite_database()
             
             # الحصول على جلسة المستخدم
             session_string = db.get_user_session_string(user_id)
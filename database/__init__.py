@@ -4,10 +4,10 @@ Database Package - يدعم SQLite و PostgreSQL
 
 from .database_factory import DatabaseFactory
 
-# إنشاء قاعدة البيانات الافتراضية
+# قاعدة البيانات المشتركة للعملية
 def get_database():
-    """الحصول على قاعدة البيانات المناسبة"""
-    return DatabaseFactory.create_database()
+    """الحصول على قاعدة البيانات المناسبة (نسخة واحدة مشتركة لكل العملية)"""
+    return DatabaseFactory.get_shared_database()
 
 # تصدير المصنع للاستخدام المباشر
 __all__ = ['DatabaseFactory', 'get_database']
@@ -0,0 +1,89 @@
+"""
+Compiled Task Cache - ذاكرة مؤقتة للكائنات المُجمّعة لكل مهمة
+Keeps one compiled object (matcher, replacement program, ...) per task and
+rebuilds it only after the task's rules were changed through invalidate(),
+plus a small LRU memo for results keyed by a task's rule version.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class CompiledTaskCache:
+    """Versioned per-task cache of objects built from database rows
+
+    The builder runs outside the lock; a result is only stored if no
+    invalidate() happened meanwhile, so an edit made while a build is in
+    flight is never hidden behind a stale entry.
+    """
+
+    def __init__(self, builder: Callable[[int], Any]):
+        self._builder = builder
+        self._entries: Dict[int, Tuple[tuple, Any]] = {}
+        self._versions: Dict[int, int] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def version(self, task_id: int) -> tuple:
+        """Current version of a task's rules (changes on every invalidate)"""
+        with self._lock:
+            return (self._generation, self._versions.get(task_id, 0))
+
+    def get(self, task_id: int) -> Any:
+        with self._lock:
+            version = (self._generation, self._versions.get(task_id, 0))
+            entry = self._entries.get(task_id)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+
+        value = self._builder(task_id)
+
+        with self._lock:
+            if version == (self._generation, self._versions.get(task_id, 0)):
+                self._entries[task_id] = (version, value)
+        return value
+
+    def invalidate(self, task_id: Optional[int] = None):
+        """Drop one task's compiled object, or all of them when task_id is None"""
+        with self._lock:
+            if task_id is None:
+                self._generation += 1
+                self._entries.clear()
+            else:
+                self._versions[task_id] = self._versions.get(task_id, 0) + 1
+                self._entries.pop(task_id, None)
+
+
+class ResultMemo:
+    """Small thread-safe LRU memo for results of deterministic transforms"""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._entries: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every entry whose key matches predicate; returns how many were removed"""
+        with self._lock:
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -6,6 +6,11 @@ import logging
 import os
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime
+from .sqlite_pool import SQLiteConnectionPool
+from .migrations import MigrationRunner
+from .compiled_cache import CompiledTaskCache, ResultMemo
+from .word_filter_engine import CompiledWordFilter
+from .text_replacement_engine import ReplacementProgram
 
 logger = logging.getLogger(__name__)
 
@@ -37,68 +42,49 @@ class Database:
         except Exception:
             # Fallback in case env handling fails
             self.db_path = 'telegram_bot.db'
-        self.init_database()
-
-    def get_connection(self):
-        """Get SQLite database connection"""
-        # إصلاح صلاحيات الملف قبل الاتصال
+        self._fix_file_permissions()
+        self._pool = SQLiteConnectionPool(self.db_path)
+        self._word_filter_cache = CompiledTaskCache(self._build_word_filter)
+        self._replacement_programs = CompiledTaskCache(self._build_replacement_program)
+        self._replacement_results = ResultMemo(maxsize=256)
+        self.migrations = MigrationRunner(self, 'sqlite')
+        self.migrations.run()
+
+    def _fix_file_permissions(self):
+        """إصلاح صلاحيات ملف قاعدة البيانات مرة واحدة عند البدء"""
         try:
-            import os
             if os.path.exists(self.db_path):
                 os.chmod(self.db_path, 0o666)
                 logger.info(f"✅ تم تصحيح صلاحيات قاعدة البيانات: {self.db_path}")
         except Exception as e:
             logger.warning(f"تحذير في تصحيح صلاحيات قاعدة البيانات: {e}")
-        
-        conn = sqlite3.connect(self.db_path, timeout=120, check_same_thread=False, isolation_level=None)
-        conn.row_factory = sqlite3.Row
+
+    def get_connection(self):
+        """Get this thread's persistent SQLite connection from the pool"""
         try:
-            # Improve concurrency and reduce lock errors
-            conn.execute('PRAGMA journal_mode=DELETE')  # Fixed: Use DELETE instead of WAL to prevent readonly errors
-            conn.execute('PRAGMA synchronous=NORMAL')
-            conn.execute('PRAGMA busy_timeout=120000')
-            conn.execute('PRAGMA foreign_keys=ON')
-            conn.execute('PRAGMA locking_mode=NORMAL')
-            conn.execute('PRAGMA temp_store=memory')
-            conn.execute('PRAGMA cache_size=2000')
-            
-            # التأكد من أن قاعدة البيانات قابلة للكتابة
-            conn.execute('BEGIN IMMEDIATE')
-            conn.execute('ROLLBACK')
-            
-            logger.info("✅ تم تطبيق إعدادات PRAGMA آمنة وتأكيد إمكانية الكتابة")
+            return self._pool.get_connection()
         except sqlite3.OperationalError as e:
-            if "readonly database" in str(e).lower():
-                logger.error(f"❌ مشكلة readonly في قاعدة البيانات: {e}")
-                logger.error("🔧 محاولة إصلاح الصلاحيات...")
-                try:
-                    import os
-                    os.chmod(self.db_path, 0o666)
-                    logger.info("✅ تم إصلاح الصلاحيات، إعادة المحاولة...")
-                    # إعادة إنشاء الاتصال
-                    conn.close()
-                    conn = sqlite3.connect(self.db_path, timeout=120, check_same_thread=False, isolation_level=None)
-                    conn.row_factory = sqlite3.Row
-                    conn.execute('PRAGMA journal_mode=DELETE')
-                    conn.execute('PRAGMA synchronous=NORMAL')
-                    conn.execute('PRAGMA busy_timeout=120000')
-                    conn.execute('PRAGMA foreign_keys=ON')
-                    conn.execute('PRAGMA locking_mode=NORMAL')
-                    conn.execute('PRAGMA temp_store=memory')
-                    conn.execute('PRAGMA cache_size=2000')
-                    conn.execute('BEGIN IMMEDIATE')
-                    conn.execute('ROLLBACK')
-                    logger.info("✅ تم إصلاح قاعدة البيانات بنجاح")
-                except Exception as fix_error:
-                    logger.error(f"❌ فشل في إصلاح قاعدة البيانات: {fix_error}")
-                    raise
-            else:
+            if "readonly database" not in str(e).lower():
                 logger.error(f"❌ خطأ في قاعدة البيانات: {e}")
                 raise
-        except Exception:
-            # Ignore pragma failures on some platforms
-            pass
-        return conn
+            logger.error(f"❌ مشكلة readonly في قاعدة البيانات: {e}")
+            logger.error("🔧 محاولة إصلاح الصلاحيات...")
+            self._fix_file_permissions()
+            conn = self._pool.get_connection()
+            logger.info("✅ تم إصلاح قاعدة البيانات بنجاح")
+            return conn
+
+    def checkpoint(self, mode: str = 'PASSIVE'):
+        """Run a WAL checkpoint when WAL mode is enabled"""
+        return self._pool.checkpoint(mode=mode)
+
+    def close(self):
+        """Close all pooled connections"""
+        self._pool.close_all()
+
+    def get_schema_version(self) -> int:
+        """Get the applied schema migration version"""
+        return self.migrations.current_version()
 
     def init_database(self):
         """Initialize database tables"""
@@ -877,16 +863,6 @@ class Database:
                 )
             ''')
 
-            # Rate limit tracking table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS rate_limit_tracking (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    task_id INTEGER NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (task_id) REFERENCES tasks (id) ON DELETE CASCADE
-                )
-            ''')
-
             # Task text formatting settings table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS task_text_formatting_settings (
@@ -926,18 +902,6 @@ class Database:
 
             conn.commit()
             logger.info("✅ تم تهيئة جداول SQLite بنجاح مع الفلاتر المتقدمة والميزات الجديدة")
-            
-        # Create message duplicates table  
-        self.create_message_duplicates_table()
-        
-        # Add missing duplicate filter columns if they don't exist
-        self.add_duplicate_filter_columns()
-        
-        # Add language filter mode support
-        self.add_language_filter_mode_support()
-        
-        # Update character limit table structure
-        self.update_character_limit_table()
 
     # User Session Management
     def save_user_session(self, user_id: int, phone_number: str, session_string: str):
@@ -1253,6 +1217,8 @@ class Database:
             cursor.execute('DELETE FROM tasks WHERE id = ? AND user_id = ?', 
                          (task_id, user_id))
             conn.commit()
+            self._word_filter_cache.invalidate(task_id)
+            self._invalidate_replacements(task_id)
             return cursor.rowcount > 0
 
     def get_active_tasks(self, user_id: int) -> List[Dict]:
@@ -1619,6 +1585,7 @@ class Database:
                 VALUES (?, ?, ?, CURRENT_TIMESTAMP)
             ''', (task_id, filter_type, is_enabled))
             conn.commit()
+            self._word_filter_cache.invalidate(task_id)
             return cursor.rowcount > 0
 
     def get_word_filter_id(self, task_id: int, filter_type: str):
@@ -1640,6 +1607,7 @@ class Database:
                 VALUES (?, ?, TRUE)
             ''', (task_id, filter_type))
             conn.commit()
+            self._word_filter_cache.invalidate(task_id)
             return cursor.lastrowid
 
     def add_word_to_filter(self, task_id: int, filter_type: str, word_or_phrase: str, is_case_sensitive: bool = False, is_whole_word: bool = False):
@@ -1662,6 +1630,7 @@ class Database:
                 VALUES (?, ?, ?, ?)
             ''', (filter_id, word_or_phrase, is_case_sensitive, is_whole_word))
             conn.commit()
+            self._word_filter_cache.invalidate(task_id)
             return cursor.lastrowid
 
     def remove_word_from_filter(self, task_id: int, filter_type: str, word_or_phrase: str):
@@ -1675,6 +1644,7 @@ class Database:
                 WHERE filter_id = ? AND word_or_phrase = ?
             ''', (filter_id, word_or_phrase))
             conn.commit()
+            self._word_filter_cache.invalidate(task_id)
             return cursor.rowcount > 0
 
     def get_filter_words(self, task_id: int, filter_type: str):
@@ -1746,6 +1716,8 @@ class Database:
                 DELETE FROM word_filter_entries WHERE id = ?
             ''', (word_id,))
             conn.commit()
+            # لا يتوفر رقم المهمة هنا - إبطال جميع الفلاتر المُجمّعة
+            self._word_filter_cache.invalidate()
             return cursor.rowcount > 0
 
     def clear_filter_words(self, task_id: int, filter_type: str):
@@ -1756,75 +1728,38 @@ class Database:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM word_filter_entries WHERE filter_id = ?', (filter_id,))
             conn.commit()
+            self._word_filter_cache.invalidate(task_id)
             return cursor.rowcount >= 0
 
+    def _build_word_filter(self, task_id: int) -> CompiledWordFilter:
+        """Compile a task's whitelist/blacklist (cached until the lists change)"""
+        settings = self.get_task_word_filter_settings(task_id)
+        rows = {
+            filter_type: self.get_filter_words(task_id, filter_type) if settings[filter_type]['enabled'] else []
+            for filter_type in ('whitelist', 'blacklist')
+        }
+        return CompiledWordFilter.from_rows(settings, rows['whitelist'], rows['blacklist'])
+
     def is_message_allowed_by_word_filter(self, task_id: int, message_text: str):
         """Check if message is allowed by word filters"""
         if not message_text:
             return True  # No text to filter
 
-        settings = self.get_task_word_filter_settings(task_id)
+        word_filter = self._word_filter_cache.get(task_id)
 
-        # Check whitelist first (if enabled)
-        if settings['whitelist']['enabled']:
-            whitelist_words = self.get_filter_words(task_id, 'whitelist')
-            if whitelist_words:  # If whitelist has words
-                # Message must contain at least one whitelisted word/phrase
-                message_lower = message_text.lower()
-                found_match = False
-
-                for word_data in whitelist_words:
-                    word = word_data[2]  # word_or_phrase
-                    is_case_sensitive = bool(word_data[3])
-                    is_whole_word = bool(word_data[4]) if len(word_data) > 4 else False
-
-                    if is_whole_word:
-                        import re
-                        flags = 0 if is_case_sensitive else re.IGNORECASE
-                        pattern = r'\b' + re.escape(word) + r'\b'
-                        if re.search(pattern, message_text, flags=flags):
-                            found_match = True
-                            break
-                    else:
-                        if is_case_sensitive:
-                            if word in message_text:
-                                found_match = True
-                                break
-                        else:
-                            if word.lower() in message_lower:
-                                found_match = True
-                                break
-
-                if not found_match:
-                    logger.info(f"🚫 الرسالة محظورة: لا تحتوي على كلمات من القائمة البيضاء")
-                    return False
+        # Check whitelist first (if enabled and has words)
+        if word_filter.whitelist:
+            # Message must contain at least one whitelisted word/phrase
+            if word_filter.whitelist.search(message_text) is None:
+                logger.info(f"🚫 الرسالة محظورة: لا تحتوي على كلمات من القائمة البيضاء")
+                return False
 
         # Check blacklist (if enabled)
-        if settings['blacklist']['enabled']:
-            blacklist_words = self.get_filter_words(task_id, 'blacklist')
-            message_lower = message_text.lower()
-
-            for word_data in blacklist_words:
-                word = word_data[2]
-                is_case_sensitive = bool(word_data[3])
-                is_whole_word = bool(word_data[4]) if len(word_data) > 4 else False
-
-                if is_whole_word:
-                    import re
-                    flags = 0 if is_case_sensitive else re.IGNORECASE
-                    pattern = r'\b' + re.escape(word) + r'\b'
-                    if re.search(pattern, message_text, flags=flags):
-                        logger.info(f"🚫 الرسالة محظورة: تحتوي على كلمة محظورة '{word}' (تطابق كلمة كاملة)")
-                        return False
-                else:
-                    if is_case_sensitive:
-                        if word in message_text:
-                            logger.info(f"🚫 الرسالة محظورة: تحتوي على كلمة محظورة '{word}'")
-                            return False
-                    else:
-                        if word.lower() in message_lower:
-                            logger.info(f"🚫 الرسالة محظورة: تحتوي على كلمة محظورة '{word}'")
-                            return False
+        if word_filter.blacklist:
+            matched = word_filter.blacklist.search(message_text)
+            if matched is not None:
+                logger.info(f"🚫 الرسالة محظورة: تحتوي على كلمة محظورة '{matched}'")
+                return False
 
         return True  # Message is allowed
 
@@ -1852,6 +1787,7 @@ class Database:
                         added_count += 1
 
             conn.commit()
+            self._word_filter_cache.invalidate(task_id)
             logger.info(f"✅ تم إضافة {added_count} كلمة إلى فلتر {filter_type} للمهمة {task_id}")
             return added_count
 
@@ -1924,6 +1860,7 @@ class Database:
                 VALUES (?, TRUE)
             ''', (task_id,))
             conn.commit()
+            self._invalidate_replacements(task_id)
             return cursor.lastrowid
 
     def is_text_replacement_enabled(self, task_id: int):
@@ -1949,6 +1886,7 @@ class Database:
                 WHERE id = ?
             ''', (is_enabled, replacement_id))
             conn.commit()
+            self._invalidate_replacements(task_id)
             return cursor.rowcount > 0
 
     def add_text_replacement(self, task_id: int, find_text: str, replace_text: str, 
@@ -1964,6 +1902,7 @@ class Database:
                 VALUES (?, ?, ?, ?, ?)
             ''', (replacement_id, find_text, replace_text, is_case_sensitive, is_whole_word))
             conn.commit()
+            self._invalidate_replacements(task_id)
             return cursor.lastrowid
 
     def get_text_replacements(self, task_id: int):
@@ -1989,6 +1928,8 @@ class Database:
                 DELETE FROM text_replacement_entries WHERE id = ?
             ''', (replacement_entry_id,))
             conn.commit()
+            # لا يتوفر رقم المهمة هنا - إبطال جميع برامج الاستبدال
+            self._invalidate_replacements()
             return cursor.rowcount > 0
 
     def clear_text_replacements(self, task_id: int):
@@ -2001,6 +1942,7 @@ class Database:
                 DELETE FROM text_replacement_entries WHERE replacement_id = ?
             ''', (replacement_id,))
             conn.commit()
+            self._invalidate_replacements(task_id)
             return cursor.rowcount >= 0
 
     def add_multiple_text_replacements(self, task_id: int, replacements_list: list):
@@ -2035,55 +1977,48 @@ class Database:
                             added_count += 1
 
             conn.commit()
+            self._invalidate_replacements(task_id)
             logger.info(f"✅ تم إضافة {added_count} استبدال نصي للمهمة {task_id}")
             return added_count
 
+    def _invalidate_replacements(self, task_id: Optional[int] = None):
+        """Rebuild a task's replacement program (all tasks when None) and drop its memoized results"""
+        self._replacement_programs.invalidate(task_id)
+        if task_id is None:
+            self._replacement_results.clear()
+        else:
+            self._replacement_results.discard(lambda key: key[0] == task_id)
+
+    def _build_replacement_program(self, task_id: int) -> Optional[ReplacementProgram]:
+        """Compile a task's replacement rules (None when disabled or empty)"""
+        if not self.is_text_replacement_enabled(task_id):
+            return None
+        rules = [
+            (row['find_text'], row['replace_text'], bool(row['is_case_sensitive']), bool(row['is_whole_word']))
+            for row in self.get_text_replacements(task_id)
+        ]
+        program = ReplacementProgram(rules)
+        return program if program else None
+
     def apply_text_replacements(self, task_id: int, message_text: str):
         """Apply text replacements to message text"""
-        if not message_text or not self.is_text_replacement_enabled(task_id):
+        if not message_text:
             return message_text
 
-        replacements = self.get_text_replacements(task_id)
-        if not replacements:
-            return message_text
+        # نفس النص يصل لكل هدف من أهداف المهمة - يُحسب مرة واحدة لكل إصدار من القواعد
+        memo_key = (task_id, self._replacement_programs.version(task_id), message_text)
+        cached = self._replacement_results.get(memo_key)
+        if cached is not None:
+            return cached
 
+        program = self._replacement_programs.get(task_id)
         modified_text = message_text
-        replacement_count = 0
-
-        for replacement in replacements:
-            find_text = replacement['find_text']
-            replace_text = replacement['replace_text']
-            is_case_sensitive = replacement['is_case_sensitive']
-            is_whole_word = replacement['is_whole_word']
-
-            if is_whole_word:
-                # Use word boundary matching
-                import re
-                pattern = r'\b' + re.escape(find_text) + r'\b'
-                flags = 0 if is_case_sensitive else re.IGNORECASE
-
-                old_text = modified_text
-                modified_text = re.sub(pattern, replace_text, modified_text, flags=flags)
-                if old_text != modified_text:
-                    replacement_count += 1
-            else:
-                # Simple text replacement
-                if is_case_sensitive:
-                    if find_text in modified_text:
-                        modified_text = modified_text.replace(find_text, replace_text)
-                        replacement_count += 1
-                else:
-                    # Case insensitive replacement
-                    import re
-                    pattern = re.escape(find_text)
-                    old_text = modified_text
-                    modified_text = re.sub(pattern, replace_text, modified_text, flags=re.IGNORECASE)
-                    if old_text != modified_text:
-                        replacement_count += 1
-
-        if replacement_count > 0:
-            logger.info(f"✅ تم تطبيق {replacement_count} استبدال على الرسالة للمهمة {task_id}")
+        if program:
+            modified_text, replacement_count = program.apply(message_text)
+            if replacement_count > 0:
+                logger.info(f"✅ تم تطبيق {replacement_count} استبدال على الرسالة للمهمة {task_id}")
 
+        self._replacement_results.put(memo_key, modified_text)
         return modified_text
 
     def get_message_settings(self, task_id: int) -> dict:
@@ -3706,7 +3641,7 @@ class Database:
             # Then get the duplicate settings
             cursor.execute('''
                 SELECT check_text_similarity, check_media_similarity, 
-                       similarity_threshold, time_window_hours
+                       similarity_threshold, time_window_hours, check_media_perceptual
                 FROM task_duplicate_settings WHERE task_id = ?
             ''', (task_id,))
             result = cursor.fetchone()
@@ -3716,6 +3651,7 @@ class Database:
                     'enabled': is_filter_enabled,  # Use actual enabled status from advanced filters
                     'check_text': bool(result['check_text_similarity']),
                     'check_media': bool(result['check_media_similarity']),
+                    'check_media_perceptual': bool(result['check_media_perceptual']),
                     'similarity_threshold': int(result['similarity_threshold'] * 100),  # Convert to percentage
                     'time_window_hours': int(result['time_window_hours'])
                 }
@@ -3726,6 +3662,7 @@ class Database:
                     'enabled': is_filter_enabled,  # Use actual enabled status from advanced filters
                     'check_text': True,
                     'check_media': True,
+                    'check_media_perceptual': False,
                     'similarity_threshold': 80,  # Percentage
                     'time_window_hours': 24
                 }
@@ -3801,6 +3738,12 @@ class Database:
                     SET check_media_similarity = ?
                     WHERE task_id = ?
                 ''', (value, task_id))
+            elif setting_type == 'check_media_perceptual':
+                cursor.execute('''
+                    UPDATE task_duplicate_settings 
+                    SET check_media_perceptual = ?
+                    WHERE task_id = ?
+                ''', (value, task_id))
             elif setting_type == 'similarity_threshold':
                 # Convert percentage to decimal
                 decimal_value = value / 100.0 if isinstance(value, (int, float)) else 0.8
@@ -4301,60 +4244,37 @@ class Database:
             logger.error(f"خطأ في تحديث إعدادات حد الرسائل: {e}")
             return False
 
-    def track_message_for_rate_limit(self, task_id: int) -> bool:
-        """Track a message for rate limiting"""
+    def load_rate_limit_state(self) -> Dict[int, List[float]]:
+        """Load the checkpointed send times of the in-memory rate limiter"""
+        import json
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO rate_limit_tracking (task_id)
-                    VALUES (?)
-                ''', (task_id,))
-                conn.commit()
-                return True
+                cursor.execute('SELECT task_id, timestamps FROM rate_limit_state')
+                return {row[0]: json.loads(row[1]) for row in cursor.fetchall()}
         except Exception as e:
-            logger.error(f"خطأ في تتبع الرسالة لحد الرسائل: {e}")
-            return False
-
-    def check_rate_limit(self, task_id: int) -> bool:
-        """Check if task has exceeded rate limit"""
-        settings = self.get_rate_limit_settings(task_id)
-        if not settings['enabled']:
-            return False  # No rate limit enabled
-        
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT COUNT(*) as count
-                    FROM rate_limit_tracking 
-                    WHERE task_id = ? 
-                    AND timestamp > datetime('now', '-{} seconds')
-                '''.format(settings['time_period_seconds']), (task_id,))
-                result = cursor.fetchone()
-                current_count = result['count'] if result else 0
-                return current_count >= settings['message_count']
-        except Exception as e:
-            logger.error(f"خطأ في فحص حد الرسائل: {e}")
-            return False
+            logger.error(f"خطأ في تحميل حالة حد الرسائل: {e}")
+            return {}
 
-    def cleanup_old_rate_limit_tracking(self, hours_old: int = 24):
-        """Clean up old rate limit tracking records"""
+    def save_rate_limit_state(self, states: Dict[int, List[float]]) -> bool:
+        """Checkpoint the rate limiter send times per task (an empty list removes the task)"""
+        import json
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    DELETE FROM rate_limit_tracking 
-                    WHERE timestamp < datetime('now', '-{} hours')
-                '''.format(hours_old))
-                deleted_count = cursor.rowcount
+                for task_id, timestamps in states.items():
+                    if timestamps:
+                        cursor.execute('''
+                            INSERT OR REPLACE INTO rate_limit_state (task_id, timestamps, updated_at)
+                            VALUES (?, ?, CURRENT_TIMESTAMP)
+                        ''', (task_id, json.dumps([round(t, 3) for t in timestamps])))
+                    else:
+                        cursor.execute('DELETE FROM rate_limit_state WHERE task_id = ?', (task_id,))
                 conn.commit()
-                if deleted_count > 0:
-                    logger.info(f"🧹 تم حذف {deleted_count} سجل قديم من تتبع حد الرسائل")
-                return deleted_count
+                return True
         except Exception as e:
-            logger.error(f"خطأ في تنظيف سجلات حد الرسائل: {e}")
-            return 0
+            logger.error(f"خطأ في حفظ حالة حد الرسائل: {e}")
+            return False
 
     # ===== Forwarding Delay Settings =====
     
@@ -5050,7 +4970,7 @@ class Database:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    SELECT id, message_text, media_hash, media_type, timestamp
+                    SELECT id, message_text, media_hash, media_type, timestamp, media_phash
                     FROM message_duplicates
                     WHERE task_id = ? AND timestamp > ?
                     ORDER BY timestamp DESC
@@ -5064,7 +4984,8 @@ class Database:
                         'message_text': row[1],
                         'media_hash': row[2],
                         'media_type': row[3],
-                        'timestamp': row[4]
+                        'timestamp': row[4],
+                        'media_phash': row[5]
                     })
                 
                 logger.debug(f"🔍 تم العثور على {len(messages)} رسالة حديثة لفحص التكرار للمهمة {task_id}")
@@ -5074,15 +4995,16 @@ class Database:
             logger.error(f"خطأ في الحصول على الرسائل الحديثة لفحص التكرار: {e}")
             return []
 
-    def track_message_for_duplicate_check(self, task_id: int, message_text: str, media_hash: str, media_type: str, timestamp: int):
+    def track_message_for_duplicate_check(self, task_id: int, message_text: str, media_hash: str, media_type: str, timestamp: int,
+                                          media_phash: str = ""):
         """Track message for duplicate checking"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    INSERT INTO message_duplicates (task_id, message_text, media_hash, media_type, timestamp)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (task_id, message_text, media_hash, media_type, timestamp))
+                    INSERT INTO message_duplicates (task_id, message_text, media_hash, media_type, timestamp, media_phash)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (task_id, message_text, media_hash, media_type, timestamp, media_phash or None))
                 conn.commit()
                 return cursor.lastrowid
         except Exception as e:
@@ -5120,6 +5042,21 @@ class Database:
         except Exception as e:
             logger.error(f"خطأ في تحديث طابع الوقت للرسالة المكررة: {e}")
 
+    def delete_duplicate_messages_before(self, task_id: int, cutoff_timestamp: int) -> int:
+        """Delete duplicate-check messages that left the task's time window"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    DELETE FROM message_duplicates
+                    WHERE task_id = ? AND timestamp <= ?
+                ''', (task_id, cutoff_timestamp))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"خطأ في حذف الرسائل المنتهية من سجل التكرار: {e}")
+            return 0
+
     def create_message_duplicates_table(self):
         """Create message_duplicates table if it doesn't exist"""
         try:
@@ -5384,7 +5321,7 @@ class Database:
                     SELECT enabled, watermark_type, watermark_text, watermark_image_path,
                            position, size_percentage, opacity, text_color, use_original_color,
                            apply_to_photos, apply_to_videos, apply_to_documents, font_size, 
-                           default_size, offset_x, offset_y
+                           default_size, offset_x, offset_y, encoding_profile
                     FROM task_watermark_settings WHERE task_id = ?
                 ''', (task_id,))
                 
@@ -5406,7 +5343,8 @@ class Database:
                         'font_size': result[12],
                         'default_size': result[13] if len(result) > 13 and result[13] is not None else 50,
                         'offset_x': result[14] if len(result) > 14 and result[14] is not None else 0,
-                        'offset_y': result[15] if len(result) > 15 and result[15] is not None else 0
+                        'offset_y': result[15] if len(result) > 15 and result[15] is not None else 0,
+                        'encoding_profile': result[16] if len(result) > 16 and result[16] else 'balanced'
                     }
                 else:
                     return {
@@ -5425,7 +5363,8 @@ class Database:
                         'font_size': 24,
                         'default_size': 50,
                         'offset_x': 0,
-                        'offset_y': 0
+                        'offset_y': 0,
+                        'encoding_profile': 'balanced'
                     }
         except Exception as e:
             logger.error(f"خطأ في الحصول على إعدادات العلامة المائية: {e}")
@@ -5449,8 +5388,8 @@ class Database:
                         task_id, enabled, watermark_type, watermark_text, watermark_image_path,
                         position, size_percentage, opacity, text_color, use_original_color,
                         apply_to_photos, apply_to_videos, apply_to_documents, font_size, default_size,
-                        offset_x, offset_y, updated_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                        offset_x, offset_y, encoding_profile, updated_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
                 ''', (
                     task_id,
                     current_settings.get('enabled', False),
@@ -5468,7 +5407,8 @@ class Database:
                     current_settings.get('font_size', 24),
                     current_settings.get('default_size', 50),
                     current_settings.get('offset_x', 0),
-                    current_settings.get('offset_y', 0)
+                    current_settings.get('offset_y', 0),
+                    current_settings.get('encoding_profile', 'balanced')
                 ))
                 conn.commit()
                 return True
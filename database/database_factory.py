@@ -4,13 +4,59 @@ Database Factory - يدعم SQLite و PostgreSQL
 
 import os
 import logging
+import threading
 from typing import Union
 
 logger = logging.getLogger(__name__)
 
 class DatabaseFactory:
     """مصنع قاعدة البيانات - يختار النوع المناسب حسب الإعدادات"""
-    
+
+    _shared_instance = None
+    _shared_sqlite = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def get_shared_database(cls) -> Union['SQLiteDatabase', 'PostgreSQLDatabase']:
+        """الحصول على نسخة قاعدة البيانات المشتركة للعملية (تُنشأ مرة واحدة عند أول طلب)"""
+        instance = cls._shared_instance
+        if instance is None:
+            with cls._shared_lock:
+                instance = cls._shared_instance
+                if instance is None:
+                    instance = cls.create_database()
+                    cls._shared_instance = instance
+        return instance
+
+    @classmethod
+    def get_shared_sqlite_database(cls):
+        """الحصول على نسخة SQLite المشتركة (للوظائف غير المتوفرة في PostgreSQL بعد)"""
+        from .database import Database as SQLiteDatabase
+        shared = cls.get_shared_database()
+        if isinstance(shared, SQLiteDatabase):
+            return shared
+        instance = cls._shared_sqlite
+        if instance is None:
+            with cls._shared_lock:
+                instance = cls._shared_sqlite
+                if instance is None:
+                    instance = SQLiteDatabase()
+                    cls._shared_sqlite = instance
+        return instance
+
+    @classmethod
+    def reset_shared_database(cls):
+        """إغلاق النسخ المشتركة وإزالتها (للاختبارات أو عند تغيير الإعدادات)"""
+        with cls._shared_lock:
+            instances = [cls._shared_instance, cls._shared_sqlite]
+            cls._shared_instance = cls._shared_sqlite = None
+        for instance in instances:
+            if instance is not None and hasattr(instance, 'close'):
+                try:
+                    instance.close()
+                except Exception as e:
+                    logger.warning(f"تحذير في إغلاق قاعدة البيانات المشتركة: {e}")
+
     @staticmethod
     def create_database() -> Union['SQLiteDatabase', 'PostgreSQLDatabase']:
         """إنشاء قاعدة البيانات المناسبة حسب الإعدادات"""
@@ -133,4 +179,4 @@ class DatabaseFactory:
                 'success': False,
                 'type': 'unknown',
                 'message': f'❌ خطأ عام في اختبار الاتصال: {e}'
-            }
\ No newline at end of file
+            }
\ No newline at end of file
@@ -0,0 +1,169 @@
+"""
+Schema Migrations - ترحيلات مخطط قاعدة البيانات
+An ordered list of schema migrations shared by the SQLite and PostgreSQL
+backends. Applied versions are recorded in the schema_migrations table, so a
+warm start only runs a single version query.
+
+To change the schema, append a Migration with the next version number; never
+edit or reorder one that has already shipped.
+"""
+import logging
+import sqlite3
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# خطوة الترحيل: اسم دالة في قاعدة البيانات، أو قائمة أوامر SQL، أو دالة تستقبل قاعدة البيانات
+MigrationStep = Union[str, Sequence[str], Callable]
+
+
+class Migration:
+    """One schema change, with an optional step per backend"""
+
+    def __init__(self, version: int, name: str,
+                 sqlite: Optional[MigrationStep] = None,
+                 postgresql: Optional[MigrationStep] = None):
+        self.version = version
+        self.name = name
+        self.steps = {'sqlite': sqlite, 'postgresql': postgresql}
+
+    def step_for(self, dialect: str) -> Optional[MigrationStep]:
+        return self.steps.get(dialect)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'baseline', sqlite='init_database', postgresql='init_database'),
+    Migration(2, 'message_duplicates_table', sqlite='create_message_duplicates_table'),
+    Migration(3, 'duplicate_filter_columns', sqlite='add_duplicate_filter_columns'),
+    Migration(4, 'language_filter_mode', sqlite='add_language_filter_mode_support'),
+    Migration(5, 'character_limit_mode', sqlite='update_character_limit_table'),
+    Migration(6, 'sqlite_hot_path_indexes', sqlite=[
+        'CREATE INDEX IF NOT EXISTS idx_tasks_user_active ON tasks(user_id, is_active)',
+        'CREATE INDEX IF NOT EXISTS idx_task_sources_task ON task_sources(task_id)',
+        'CREATE INDEX IF NOT EXISTS idx_task_targets_task ON task_targets(task_id)',
+        'CREATE INDEX IF NOT EXISTS idx_word_filter_entries_filter ON word_filter_entries(filter_id)',
+        'CREATE INDEX IF NOT EXISTS idx_text_replacement_entries_replacement ON text_replacement_entries(replacement_id)',
+        'CREATE INDEX IF NOT EXISTS idx_task_admin_filters_task_source ON task_admin_filters(task_id, source_chat_id)',
+        'CREATE INDEX IF NOT EXISTS idx_task_inline_buttons_task ON task_inline_buttons(task_id)',
+        'CREATE INDEX IF NOT EXISTS idx_task_audio_template_settings_task ON task_audio_template_settings(task_id)',
+        'CREATE INDEX IF NOT EXISTS idx_pending_messages_source ON pending_messages(task_id, source_chat_id, source_message_id)',
+        'CREATE INDEX IF NOT EXISTS idx_pending_messages_user_status ON pending_messages(user_id, status)',
+    ]),
+    # ملف ترميز الفيديو للعلامة المائية (fast / balanced / quality / compact)
+    Migration(7, 'watermark_encoding_profile', sqlite=[
+        "ALTER TABLE task_watermark_settings ADD COLUMN encoding_profile TEXT DEFAULT 'balanced'",
+    ]),
+    # البصمة الإدراكية للوسائط في فلتر التكرار
+    Migration(8, 'duplicate_perceptual_hash', sqlite=[
+        'ALTER TABLE message_duplicates ADD COLUMN media_phash TEXT',
+        'ALTER TABLE task_duplicate_settings ADD COLUMN check_media_perceptual BOOLEAN DEFAULT FALSE',
+    ]),
+    # حد المعدل أصبح في الذاكرة مع حفظ دوري لحالته بدلاً من صف لكل رسالة
+    Migration(9, 'rate_limit_state', sqlite=[
+        '''CREATE TABLE IF NOT EXISTS rate_limit_state (
+            task_id INTEGER PRIMARY KEY,
+            timestamps TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        'DROP TABLE IF EXISTS rate_limit_tracking',
+    ], postgresql=[
+        '''CREATE TABLE IF NOT EXISTS rate_limit_state (
+            task_id INTEGER PRIMARY KEY,
+            timestamps TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        'DROP TABLE IF EXISTS rate_limit_tracking',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+# نفس التعريف يعمل على SQLite و PostgreSQL
+_CREATE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+_RECORD_VERSION = {
+    'sqlite': 'INSERT OR IGNORE INTO schema_migrations (version, name) VALUES (?, ?)',
+    'postgresql': 'INSERT INTO schema_migrations (version, name) VALUES (%s, %s) ON CONFLICT (version) DO NOTHING',
+}
+
+
+def _missing_table_errors(dialect: str) -> Tuple[type, ...]:
+    if dialect == 'postgresql':
+        import psycopg2
+        return (psycopg2.ProgrammingError,)
+    return (sqlite3.OperationalError,)
+
+
+class MigrationRunner:
+    """Applies pending migrations to a SQLite or PostgreSQL database"""
+
+    def __init__(self, db, dialect: str, migrations: List[Migration] = None):
+        if dialect not in _RECORD_VERSION:
+            raise ValueError(f"نوع قاعدة بيانات غير مدعوم للترحيل: {dialect}")
+        self.db = db
+        self.dialect = dialect
+        self.migrations = sorted(migrations or MIGRATIONS, key=lambda m: m.version)
+
+    @property
+    def latest_version(self) -> int:
+        return self.migrations[-1].version if self.migrations else 0
+
+    def current_version(self) -> int:
+        """Get the highest applied version (0 when schema_migrations does not exist yet)"""
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT MAX(version) FROM schema_migrations')
+                row = cursor.fetchone()
+                return (row[0] if row else 0) or 0
+        except _missing_table_errors(self.dialect):
+            return 0
+
+    def pending(self, current: int = None) -> List[Migration]:
+        current = self.current_version() if current is None else current
+        return [m for m in self.migrations if m.version > current]
+
+    def run(self) -> int:
+        """Apply every pending migration in order; returns how many were applied"""
+        current = self.current_version()
+        if current >= self.latest_version:
+            logger.info(f"✅ مخطط {self.dialect} محدث (الإصدار {current}) - لا توجد ترحيلات")
+            return 0
+
+        self._ensure_table()
+        applied = 0
+        for migration in self.pending(current):
+            step = migration.step_for(self.dialect)
+            if step is not None:
+                logger.info(f"🔄 تطبيق الترحيل {migration.version}: {migration.name} ({self.dialect})")
+                self._apply(step)
+            self._record(migration)
+            applied += 1
+
+        logger.info(f"✅ تم تطبيق {applied} ترحيل - مخطط {self.dialect} الآن في الإصدار {self.latest_version}")
+        return applied
+
+    def _apply(self, step: MigrationStep):
+        if isinstance(step, str):
+            getattr(self.db, step)()
+        elif callable(step):
+            step(self.db)
+        else:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                for statement in step:
+                    cursor.execute(statement)
+
+    def _ensure_table(self):
+        with self.db.get_connection() as conn:
+            conn.cursor().execute(_CREATE_TABLE)
+
+    def _record(self, migration: Migration):
+        with self.db.get_connection() as conn:
+            conn.cursor().execute(_RECORD_VERSION[self.dialect], (migration.version, migration.name))
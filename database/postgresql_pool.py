@@ -0,0 +1,185 @@
+"""
+PostgreSQL Connection Pools - تجمعات اتصالات PostgreSQL
+A psycopg2 ThreadedConnectionPool for the sync API and one asyncpg pool per
+event loop for the async hot path, both with health checks.
+
+Environment:
+    POSTGRES_POOL_MIN                  minimum pooled connections (default 1)
+    POSTGRES_POOL_MAX                  maximum pooled connections (default 10)
+    POSTGRES_POOL_TIMEOUT              seconds to wait for a free connection (default 30)
+    POSTGRES_POOL_HEALTHCHECK_INTERVAL ping connections idle longer than this (default 30)
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+
+import psycopg2
+import psycopg2.pool
+import psycopg2.extensions
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+class PooledConnection:
+    """A pooled psycopg2 connection that goes back to the pool instead of closing
+
+    Works both as ``with db.get_connection() as conn`` (commit or rollback,
+    then release) and as a plain connection whose close() releases it.
+    """
+
+    def __init__(self, pool: 'PostgreSQLConnectionPool', conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if not self._conn.closed:
+                if exc_type is None:
+                    self._conn.commit()
+                else:
+                    self._conn.rollback()
+        finally:
+            self.close()
+        return False
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class PostgreSQLConnectionPool:
+    """Bounded, health-checked psycopg2 pool with blocking acquire"""
+
+    def __init__(self, dsn: str, min_size: int = None, max_size: int = None,
+                 timeout: float = None, healthcheck_interval: float = None):
+        self.dsn = dsn
+        self.min_size = min_size if min_size is not None else _env_int('POSTGRES_POOL_MIN', 1)
+        self.max_size = max(self.min_size, max_size if max_size is not None else _env_int('POSTGRES_POOL_MAX', 10))
+        self.timeout = timeout if timeout is not None else _env_int('POSTGRES_POOL_TIMEOUT', 30)
+        self.healthcheck_interval = (healthcheck_interval if healthcheck_interval is not None
+                                     else _env_int('POSTGRES_POOL_HEALTHCHECK_INTERVAL', 30))
+
+        self._pool = psycopg2.pool.ThreadedConnectionPool(self.min_size, self.max_size, dsn)
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._last_used: Dict[int, float] = {}
+        logger.info(f"✅ تم إنشاء تجمع اتصالات PostgreSQL (min={self.min_size}, max={self.max_size})")
+
+    def get_connection(self) -> PooledConnection:
+        """Borrow a connection, waiting up to timeout for a free slot"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise psycopg2.pool.PoolError(f"لا يوجد اتصال متاح في التجمع خلال {self.timeout} ثانية")
+        try:
+            conn = self._pool.getconn()
+            if not self._is_healthy(conn):
+                self._pool.putconn(conn, close=True)
+                self._last_used.pop(id(conn), None)
+                conn = self._pool.getconn()
+            return PooledConnection(self, conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        idle = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        if idle < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ اتصال PostgreSQL غير صالح - سيتم استبداله: {e}")
+            return False
+
+    def release(self, conn):
+        """Return a connection to the pool"""
+        try:
+            broken = bool(conn.closed)
+            if not broken and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=broken)
+            if broken:
+                self._last_used.pop(id(conn), None)
+        except Exception as e:
+            logger.warning(f"تحذير في إعادة الاتصال إلى التجمع: {e}")
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        self._pool.closeall()
+        self._last_used.clear()
+
+
+class AsyncPostgreSQLPools:
+    """One asyncpg pool per event loop (the bot and userbot run separate loops)"""
+
+    def __init__(self, dsn: str, min_size: int = None, max_size: int = None):
+        self.dsn = dsn
+        self.min_size = min_size if min_size is not None else _env_int('POSTGRES_POOL_MIN', 1)
+        self.max_size = max(self.min_size, max_size if max_size is not None else _env_int('POSTGRES_POOL_MAX', 10))
+        self.healthcheck_interval = _env_int('POSTGRES_POOL_HEALTHCHECK_INTERVAL', 30)
+        self._pools: Dict[int, asyncpg.Pool] = {}
+        self._lock = threading.Lock()
+
+    async def get_pool(self) -> asyncpg.Pool:
+        loop = asyncio.get_running_loop()
+        key = id(loop)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = await asyncpg.create_pool(
+                self.dsn,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                max_inactive_connection_lifetime=max(self.healthcheck_interval * 10, 60),
+            )
+            with self._lock:
+                existing = self._pools.setdefault(key, pool)
+            if existing is not pool:
+                await pool.close()
+                return existing
+            logger.info(f"✅ تم إنشاء تجمع asyncpg (min={self.min_size}, max={self.max_size})")
+        return pool
+
+    async def health_check(self) -> bool:
+        try:
+            pool = await self.get_pool()
+            async with pool.acquire() as conn:
+                return await conn.fetchval('SELECT 1') == 1
+        except Exception as e:
+            logger.error(f"❌ فشل فحص صحة تجمع asyncpg: {e}")
+            return False
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            pool: Optional[asyncpg.Pool] = self._pools.pop(id(loop), None)
+        if pool is not None:
+            await pool.close()
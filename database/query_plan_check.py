@@ -0,0 +1,103 @@
+"""
+Query Plan Self-Check - فحص خطط الاستعلامات الساخنة في SQLite
+Runs EXPLAIN QUERY PLAN on the queries the userbot issues for every incoming
+message and reports any that fall back to a full table scan.
+
+Usage:
+    python -m database.query_plan_check
+"""
+import sys
+import logging
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# الاستعلامات التي يُنفذها UserBot لكل رسالة (نفس نص الاستعلام في database.py)
+HOT_QUERIES = {
+    'get_active_tasks': (
+        'SELECT id, task_name, source_chat_id, source_chat_name, target_chat_id, target_chat_name, forward_mode '
+        'FROM tasks WHERE user_id = ? AND is_active = TRUE',
+        (1,)),
+    'get_task_sources': (
+        'SELECT id, chat_id, chat_name FROM task_sources WHERE task_id = ? ORDER BY created_at',
+        (1,)),
+    'get_task_targets': (
+        'SELECT id, chat_id, chat_name FROM task_targets WHERE task_id = ? ORDER BY created_at',
+        (1,)),
+    'get_message_mappings_by_source': (
+        'SELECT id, target_chat_id, target_message_id FROM message_mappings '
+        'WHERE task_id = ? AND source_chat_id = ? AND source_message_id = ?',
+        (1, '-100', 1)),
+    'get_word_filter_entries': (
+        'SELECT id, word_or_phrase, is_case_sensitive, COALESCE(is_whole_word, 0) AS is_whole_word '
+        'FROM word_filter_entries WHERE filter_id = ? ORDER BY word_or_phrase',
+        (1,)),
+    'get_text_replacements': (
+        'SELECT id, find_text, replace_text, is_case_sensitive, is_whole_word FROM text_replacement_entries '
+        'WHERE replacement_id = ? ORDER BY find_text',
+        (1,)),
+    'get_admin_filters_by_source': (
+        'SELECT admin_user_id, admin_username, admin_first_name, is_allowed, source_chat_id, admin_signature '
+        'FROM task_admin_filters WHERE task_id = ? AND source_chat_id = ? ORDER BY admin_first_name, admin_username',
+        (1, '-100')),
+    'get_inline_buttons': (
+        'SELECT id, task_id, button_text, button_url, row_position, col_position FROM task_inline_buttons '
+        'WHERE task_id = ? ORDER BY row_position, col_position',
+        (1,)),
+    'get_audio_template_settings': (
+        'SELECT * FROM task_audio_template_settings WHERE task_id = ?',
+        (1,)),
+    'check_duplicate_message': (
+        "SELECT COUNT(*) as count FROM forwarded_messages_log "
+        "WHERE task_id = ? AND message_hash = ? AND datetime(forwarded_at) > datetime('now', '-24 hours')",
+        (1, '')),
+    'get_pending_message_by_source': (
+        "SELECT * FROM pending_messages WHERE task_id = ? AND source_chat_id = ? AND source_message_id = ? "
+        "AND status = 'pending'",
+        (1, '-100', 1)),
+}
+
+
+def _is_full_scan(detail: str) -> bool:
+    # "SCAN tasks" مسح كامل، بينما "SCAN t USING INDEX ..." يستخدم فهرساً
+    detail = detail.upper()
+    return detail.startswith('SCAN ') and ' USING ' not in detail
+
+
+def check_query_plans(db) -> List[Dict]:
+    """Explain every hot query and return one report entry per query"""
+    report = []
+    conn = db.get_connection()
+    for name, (sql, params) in HOT_QUERIES.items():
+        try:
+            rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+            details = [row[3] for row in rows]
+            scans = [d for d in details if _is_full_scan(d)]
+            report.append({'query': name, 'plan': details, 'full_scans': scans, 'error': None})
+        except Exception as e:
+            report.append({'query': name, 'plan': [], 'full_scans': [], 'error': str(e)})
+    return report
+
+
+def main() -> int:
+    from .database import Database
+
+    logging.basicConfig(level=logging.WARNING)
+    report = check_query_plans(Database())
+    problems = 0
+    for entry in report:
+        if entry['error']:
+            problems += 1
+            print(f"❌ {entry['query']}: {entry['error']}")
+        elif entry['full_scans']:
+            problems += 1
+            print(f"⚠️ {entry['query']}: مسح كامل للجدول -> {'; '.join(entry['full_scans'])}")
+        else:
+            print(f"✅ {entry['query']}: {'; '.join(entry['plan'])}")
+
+    print(f"\n{len(report) - problems}/{len(report)} استعلام يستخدم الفهارس")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+SQLite Connection Pool - اتصالات SQLite دائمة لكل خيط
+Keeps one persistent connection per thread instead of opening a new one for
+every query, with optional WAL journaling and a checkpoint policy.
+
+Environment:
+    SQLITE_JOURNAL_MODE            'delete' (default) or 'wal'
+    SQLITE_WAL_AUTOCHECKPOINT      pages before SQLite auto-checkpoints (default 1000)
+    SQLITE_WAL_CHECKPOINT_INTERVAL seconds between TRUNCATE checkpoints (default 300, 0 = off)
+"""
+import os
+import sqlite3
+import logging
+import threading
+import time
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteConnectionPool:
+    """Thread-aware pool holding one persistent connection per thread"""
+
+    def __init__(self, db_path: str, busy_timeout: int = 120):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.journal_mode = os.getenv('SQLITE_JOURNAL_MODE', 'delete').strip().lower() or 'delete'
+        if self.journal_mode not in ('delete', 'wal'):
+            logger.warning(f"⚠️ وضع journal غير مدعوم: {self.journal_mode} - استخدام DELETE")
+            self.journal_mode = 'delete'
+        self.wal_autocheckpoint = int(os.getenv('SQLITE_WAL_AUTOCHECKPOINT', '1000'))
+        self.checkpoint_interval = int(os.getenv('SQLITE_WAL_CHECKPOINT_INTERVAL', '300'))
+
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._last_checkpoint = time.monotonic()
+
+    @property
+    def wal_enabled(self) -> bool:
+        return self.journal_mode == 'wal'
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            try:
+                conn.total_changes  # raises ProgrammingError if a caller closed it
+            except sqlite3.ProgrammingError:
+                self._forget(conn)
+                conn = None
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        if self.wal_enabled and self.checkpoint_interval > 0:
+            self._maybe_checkpoint(conn)
+        return conn
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA journal_mode={self.journal_mode.upper()}')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={self.busy_timeout * 1000}')
+        conn.execute('PRAGMA foreign_keys=ON')
+        conn.execute('PRAGMA temp_store=memory')
+        conn.execute('PRAGMA cache_size=2000')
+        if self.wal_enabled:
+            conn.execute(f'PRAGMA wal_autocheckpoint={self.wal_autocheckpoint}')
+
+        # التأكد من أن قاعدة البيانات قابلة للكتابة
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('ROLLBACK')
+
+        logger.debug(f"✅ اتصال SQLite جديد للخيط {threading.current_thread().name} (journal={self.journal_mode})")
+        return conn
+
+    def _forget(self, conn: sqlite3.Connection):
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        self._local.conn = None
+
+    def _maybe_checkpoint(self, conn: sqlite3.Connection):
+        now = time.monotonic()
+        if now - self._last_checkpoint < self.checkpoint_interval:
+            return
+        with self._lock:
+            if now - self._last_checkpoint < self.checkpoint_interval:
+                return
+            self._last_checkpoint = now
+        self.checkpoint(conn, mode='TRUNCATE')
+
+    def checkpoint(self, conn: sqlite3.Connection = None, mode: str = 'PASSIVE'):
+        """Run a WAL checkpoint; a no-op when WAL is not enabled"""
+        if not self.wal_enabled:
+            return None
+        mode = mode.upper()
+        if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+            raise ValueError(f"وضع checkpoint غير صالح: {mode}")
+        try:
+            conn = conn or self.get_connection()
+            result = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+            logger.debug(f"🧹 WAL checkpoint ({mode}): {tuple(result) if result else None}")
+            return result
+        except sqlite3.OperationalError as e:
+            logger.warning(f"تحذير في WAL checkpoint: {e}")
+            return None
+
+    def close_all(self):
+        """Close every pooled connection (on shutdown)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
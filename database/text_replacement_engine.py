@@ -0,0 +1,57 @@
+"""
+Text Replacement Engine - محرك الاستبدال النصي المُجمّع
+Compiles a task's replacement rules into one regular expression with a group
+per rule, so a message is rewritten in a single scan instead of one re.sub
+per rule.
+"""
+import re
+import logging
+from typing import Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _expand_template(replace_text: str) -> str:
+    # re.sub يعالج الهروب في نص الاستبدال (مثل \n) - نحافظ على نفس السلوك
+    return re.sub('', replace_text, '', count=1)
+
+
+class ReplacementProgram:
+    """Precompiled replacement rules of one task
+
+    At each position the longest matching rule wins, and replaced text is not
+    scanned again, so rules no longer cascade into each other.
+    """
+
+    def __init__(self, rules: Iterable[Tuple[str, str, bool, bool]]):
+        # rules: (find_text, replace_text, is_case_sensitive, is_whole_word)
+        alternatives: List[str] = []
+        self._replacements: List[str] = []
+        ordered = sorted((rule for rule in rules if rule[0]), key=lambda rule: len(rule[0]), reverse=True)
+        for find_text, replace_text, is_case_sensitive, is_whole_word in ordered:
+            replace_text = replace_text or ''
+            if is_whole_word or not is_case_sensitive:
+                try:
+                    replace_text = _expand_template(replace_text)
+                except re.error as e:
+                    logger.warning(f"تخطي استبدال غير صالح '{find_text}': {e}")
+                    continue
+            pattern = re.escape(find_text)
+            if is_whole_word:
+                pattern = r'\b' + pattern + r'\b'
+            if not is_case_sensitive:
+                pattern = '(?i:' + pattern + ')'
+            alternatives.append('(' + pattern + ')')
+            self._replacements.append(replace_text)
+
+        self.size = len(self._replacements)
+        self._pattern = re.compile('|'.join(alternatives)) if alternatives else None
+
+    def __bool__(self) -> bool:
+        return self._pattern is not None
+
+    def apply(self, text: str) -> Tuple[str, int]:
+        """Rewrite text in one pass; returns (new_text, number_of_substitutions)"""
+        if self._pattern is None or not text:
+            return text, 0
+        return self._pattern.subn(lambda match: self._replacements[match.lastindex - 1], text)
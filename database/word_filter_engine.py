@@ -0,0 +1,88 @@
+"""
+Word Filter Engine - محرك فلاتر الكلمات المُجمّع
+Compiles a task's whitelist/blacklist into at most four regular expressions
+(substring / whole word, case sensitive / insensitive), each built from a
+prefix trie so thousands of phrases are matched in one scan of the text.
+"""
+import re
+from typing import Iterable, List, Optional, Tuple
+
+
+def build_literal_pattern(words: Iterable[str]) -> str:
+    """Build a regex alternation of literal words, factored by common prefixes"""
+    trie: dict = {}
+    for word in words:
+        if not word:
+            continue
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return _trie_to_pattern(trie)
+
+
+def _trie_to_pattern(node: dict) -> str:
+    is_end = '' in node
+    branches = [re.escape(char) + _trie_to_pattern(child)
+                for char, child in sorted(node.items()) if char != '']
+    if not branches:
+        return ''
+    if len(branches) == 1 and not is_end:
+        return branches[0]
+    pattern = '(?:' + '|'.join(branches) + ')'
+    return pattern + '?' if is_end else pattern
+
+
+class WordMatcher:
+    """Matches a message against one filter list in a single pass per rule kind"""
+
+    def __init__(self, entries: Iterable[Tuple[str, bool, bool]]):
+        # entries: (word_or_phrase, is_case_sensitive, is_whole_word)
+        groups = {(True, False): [], (False, False): [], (True, True): [], (False, True): []}
+        for word, is_case_sensitive, is_whole_word in entries:
+            if not word:
+                continue
+            key = (bool(is_case_sensitive), bool(is_whole_word))
+            # المطابقة غير الحساسة للحالة كجزء من النص تتم على النص بأحرف صغيرة
+            groups[key].append(word if key[0] or key[1] else word.lower())
+
+        self.size = sum(len(words) for words in groups.values())
+        self._substring = re.compile(build_literal_pattern(groups[(True, False)])) if groups[(True, False)] else None
+        self._substring_lower = re.compile(build_literal_pattern(groups[(False, False)])) if groups[(False, False)] else None
+        self._whole = (re.compile(r'\b(?:' + build_literal_pattern(groups[(True, True)]) + r')\b')
+                       if groups[(True, True)] else None)
+        self._whole_nocase = (re.compile(r'\b(?:' + build_literal_pattern(groups[(False, True)]) + r')\b', re.IGNORECASE)
+                              if groups[(False, True)] else None)
+
+    def __bool__(self) -> bool:
+        return self.size > 0
+
+    def search(self, text: str) -> Optional[str]:
+        """Return the first matched word/phrase, or None"""
+        for pattern in (self._whole, self._whole_nocase, self._substring):
+            if pattern is not None:
+                match = pattern.search(text)
+                if match:
+                    return match.group(0)
+        if self._substring_lower is not None:
+            match = self._substring_lower.search(text.lower())
+            if match:
+                return match.group(0)
+        return None
+
+
+class CompiledWordFilter:
+    """Compiled whitelist and blacklist of one task (None when a list is disabled)"""
+
+    def __init__(self, whitelist: Optional[WordMatcher], blacklist: Optional[WordMatcher]):
+        self.whitelist = whitelist
+        self.blacklist = blacklist
+
+    @classmethod
+    def from_rows(cls, settings: dict, whitelist_rows: List[tuple], blacklist_rows: List[tuple]) -> 'CompiledWordFilter':
+        """Build from get_task_word_filter_settings() and get_filter_words() rows"""
+        def matcher(filter_type, rows):
+            if not settings.get(filter_type, {}).get('enabled'):
+                return None
+            return WordMatcher((row[2], row[3], row[4] if len(row) > 4 else False) for row in rows)
+        return cls(matcher('whitelist', whitelist_rows), matcher('blacklist', blacklist_rows))
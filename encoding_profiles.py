@@ -0,0 +1,184 @@
+"""
+ملفات الترميز - Encoding Profiles
+محرك واحد يختار إعدادات ترميز الفيديو (preset، CRF، عدد الخيوط) لكل مسارات العلامة المائية والضغط
+
+الاختيار يعتمد على دقة الفيديو ومدته وعدد الأنوية المتاحة لكل عملية ffmpeg وميزانية زمنية للمهمة:
+يُختار أبطأ preset (أفضل ضغط) ضمن حدود ملف المهمة يُتوقع أن ينتهي داخل الميزانية. تقدير السرعة
+يبدأ من جدول نسبي لسرعات x264 ثم يُصحَّح من زمن الترميزات الفعلية، فيتكيف مع أي جهاز دون ضبط يدوي.
+
+ملفات الترميز (قابلة للاختيار لكل مهمة عبر encoding_profile في إعدادات العلامة المائية):
+    fast      أقل زمن ممكن (نصف مدة الفيديو)
+    balanced  الافتراضي - قريب من مدة الفيديو
+    quality   جودة أعلى بزمن أطول
+    compact   أصغر حجم للملف
+
+الإعدادات: ENCODER_REFERENCE_MPIXELS (سرعة ultrafast التقديرية لكل نواة بالميغابكسل/ثانية)
+"""
+import os
+import math
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from ffmpeg_runner import ffmpeg_runner
+
+logger = logging.getLogger(__name__)
+
+PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow')
+
+# سرعة كل preset نسبةً إلى ultrafast (تقريبية لـ libx264؛ فرق الأجهزة يصححه القياس)
+PRESET_SPEED = {
+    'ultrafast': 1.0,
+    'superfast': 0.8,
+    'veryfast': 0.55,
+    'faster': 0.42,
+    'fast': 0.33,
+    'medium': 0.26,
+    'slow': 0.16,
+    'slower': 0.08,
+    'veryslow': 0.04,
+}
+
+
+@dataclass(frozen=True)
+class EncodingProfile:
+    """حدود ملف ترميز: نطاق preset المسموح وCRF الأساسي والميزانية الزمنية نسبةً لمدة الفيديو"""
+    name: str
+    label: str
+    crf: int
+    fastest: str
+    slowest: str
+    budget_ratio: float
+    min_budget: float
+
+
+PROFILES: Dict[str, EncodingProfile] = {
+    'fast': EncodingProfile('fast', '⚡ سريع', 24, 'ultrafast', 'veryfast', 0.5, 10),
+    'balanced': EncodingProfile('balanced', '⚖️ متوازن', 23, 'superfast', 'medium', 1.0, 20),
+    'quality': EncodingProfile('quality', '💎 جودة عالية', 19, 'veryfast', 'slow', 3.0, 60),
+    'compact': EncodingProfile('compact', '📦 حجم أصغر', 28, 'faster', 'veryslow', 6.0, 120),
+}
+DEFAULT_PROFILE = 'balanced'
+
+
+@dataclass
+class EncodingPlan:
+    """الإعدادات المختارة لترميز واحد"""
+    profile: str
+    preset: str
+    crf: int
+    threads: int
+    estimated_seconds: float
+    budget_seconds: float
+
+    def x264_args(self) -> List[str]:
+        return ['-c:v', 'libx264', '-preset', self.preset, '-crf', str(self.crf)]
+
+    def thread_args(self) -> List[str]:
+        return ['-threads', str(self.threads)]
+
+
+def _video_shape(info: Any):
+    """(العرض، الارتفاع، الإطارات/ثانية، المدة) من MediaInfo أو قاموس get_video_info القديم"""
+    if isinstance(info, dict):
+        get = info.get
+    else:
+        def get(name, default=None):
+            return getattr(info, name, default)
+    width = int(get('width', 0) or 0) or 1280
+    height = int(get('height', 0) or 0) or 720
+    fps = float(get('fps', 0) or 0) or 30.0
+    duration = float(get('duration', 0) or 0)
+    return width, height, fps, duration
+
+
+def profile_name_for(settings: Optional[dict]) -> str:
+    """ملف الترميز المختار في إعدادات المهمة (quality_mode='preserve' القديم يعني quality)"""
+    settings = settings or {}
+    name = settings.get('encoding_profile')
+    if name in PROFILES:
+        return name
+    if settings.get('quality_mode') == 'preserve':
+        return 'quality'
+    return DEFAULT_PROFILE
+
+
+class EncodingProfileEngine:
+    """يختار preset/CRF/الخيوط ضمن ميزانية زمنية ويتعلم سرعة الجهاز من الترميزات السابقة"""
+
+    def __init__(self, cores: Optional[int] = None, reference_mpixels: Optional[float] = None):
+        self.cores = cores or os.cpu_count() or 2
+        self.reference_mpixels = reference_mpixels or float(os.getenv('ENCODER_REFERENCE_MPIXELS', '40'))
+        # نسبة السرعة الفعلية إلى التقديرية (متوسط متحرك)
+        self.calibration = 1.0
+        self._lock = threading.Lock()
+        self.stats_counters = {'plans': 0, 'recorded': 0, 'over_budget': 0}
+
+    def threads_for(self, height: int) -> int:
+        """حصة عادلة من الأنوية لكل عملية ffmpeg متزامنة، دون خيوط زائدة للدقات الصغيرة"""
+        share = max(1, self.cores // max(1, ffmpeg_runner.max_jobs))
+        return max(1, min(share, math.ceil(height / 180)))
+
+    def estimate_seconds(self, info: Any, preset: str, threads: int) -> float:
+        width, height, fps, duration = _video_shape(info)
+        pixels = width * height * fps * duration
+        # الخيوط لا تتناسب خطياً مع السرعة
+        throughput = self.reference_mpixels * 1e6 * PRESET_SPEED[preset] * (threads ** 0.85) * self.calibration
+        return pixels / throughput if throughput > 0 else 0.0
+
+    def plan(self, info: Any, profile: Optional[str] = None, latency_budget: Optional[float] = None,
+             settings: Optional[dict] = None) -> EncodingPlan:
+        """إعدادات الترميز لفيديو (القيم الصريحة crf/preset/threads في الإعدادات لها الأولوية)"""
+        settings = settings or {}
+        spec = PROFILES.get(profile or profile_name_for(settings), PROFILES[DEFAULT_PROFILE])
+        width, height, fps, duration = _video_shape(info)
+        budget = float(latency_budget or settings.get('latency_budget') or 0) or max(
+            spec.min_budget, duration * spec.budget_ratio)
+        threads = int(settings.get('threads') or 0) or self.threads_for(height)
+
+        ladder = PRESETS[PRESETS.index(spec.fastest):PRESETS.index(spec.slowest) + 1]
+        preset = ladder[0]
+        # المدة المجهولة (فشل الفحص) تجعل التقدير صفراً لكل preset - يبقى الأسرع بدل الأبطأ
+        for candidate in reversed(ladder if duration > 0 else ()):
+            if self.estimate_seconds(info, candidate, threads) <= budget:
+                preset = candidate
+                break
+        if settings.get('preset') in PRESET_SPEED:
+            preset = settings['preset']
+
+        # الدقات الصغيرة تُظهر التشوه أكثر، و4K يتحمل CRF أعلى
+        crf = spec.crf + (1 if height >= 2160 else -1 if height <= 480 else 0)
+        if settings.get('crf') is not None:
+            crf = int(settings['crf'])
+
+        estimated = self.estimate_seconds(info, preset, threads)
+        with self._lock:
+            self.stats_counters['plans'] += 1
+        logger.debug(f"🎛️ ملف الترميز {spec.name}: {width}x{height} {duration:.0f}s → "
+                     f"preset={preset} crf={crf} threads={threads} (تقدير {estimated:.1f}s من {budget:.0f}s)")
+        return EncodingPlan(spec.name, preset, crf, threads, estimated, budget)
+
+    def record(self, plan: EncodingPlan, elapsed: float):
+        """تصحيح تقدير السرعة من زمن ترميز فعلي"""
+        if elapsed <= 0.5 or plan.estimated_seconds <= 0:
+            return
+        ratio = plan.estimated_seconds / elapsed
+        with self._lock:
+            # خطوة جزئية في المقياس اللوغاريتمي: قياس شاذ واحد لا يقلب التقدير
+            self.calibration = min(20.0, max(0.05, self.calibration * ratio ** 0.3))
+            self.stats_counters['recorded'] += 1
+            if elapsed > plan.budget_seconds:
+                self.stats_counters['over_budget'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'cores': self.cores,
+                'calibration': round(self.calibration, 3),
+                **self.stats_counters,
+            }
+
+
+# محرك عالمي مشترك (المعايرة تتراكم من كل المسارات)
+encoding_engine = EncodingProfileEngine()
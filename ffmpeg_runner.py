@@ -0,0 +1,380 @@
+"""
+مشغّل FFmpeg/FFprobe - FFmpeg Runner
+نقطة واحدة لتشغيل ffmpeg وffprobe بدلاً من subprocess.run المتفرقة
+
+- asyncio.create_subprocess_exec للمستدعين غير المتزامنين، وPopen للدوال المتزامنة التي تعمل في خيوط العمّال
+- مهلة لكل أمر: العملية تُقتل عند تجاوزها بدلاً من أن تبقى معلّقة وتستهلك المعالج
+- حد أقصى لعدد عمليات ffmpeg المتزامنة في البرنامج كله (FFMPEG_MAX_JOBS)، مشترك بين المسارين
+- كل عملية تُسجَّل باسم المهمة الحالية (ffmpeg_job) فيمكن إيقاف عمليات مهمة عند حذفها أو تعطيلها
+- قراءة التقدّم من "-progress pipe:1" (الوقت المعالج، السرعة، الإطارات)
+"""
+import os
+import time
+import signal
+import asyncio
+import logging
+import threading
+import subprocess
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# المهمة التي تعمل الأوامر لصالحها (تنتقل تلقائياً إلى المهام الفرعية وخيوط عمّال الوسائط)
+current_job_key: contextvars.ContextVar[Optional[Hashable]] = contextvars.ContextVar('ffmpeg_job_key', default=None)
+
+
+@contextmanager
+def ffmpeg_job(key: Hashable):
+    """تسجيل كل أوامر ffmpeg داخل هذا النطاق باسم key (عادةً رقم المهمة)"""
+    token = current_job_key.set(key)
+    try:
+        yield
+    finally:
+        current_job_key.reset(token)
+
+
+def parse_progress_block(lines: List[str]) -> Dict[str, Any]:
+    """تحويل كتلة key=value من -progress إلى قاموس بقيم رقمية حيث أمكن"""
+    progress: Dict[str, Any] = {}
+    for line in lines:
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            continue
+        value = value.strip()
+        if key in ('out_time_us', 'out_time_ms', 'total_size', 'frame'):
+            try:
+                progress[key] = int(value)
+            except ValueError:
+                pass
+        elif key in ('fps', 'bitrate', 'speed'):
+            try:
+                progress[key] = float(value.rstrip('x').replace('kbits/s', ''))
+            except ValueError:
+                pass
+        else:
+            progress[key] = value
+    # out_time_ms في ffmpeg بالميكروثانية رغم اسمه
+    micros = progress.get('out_time_us', progress.get('out_time_ms'))
+    if isinstance(micros, int):
+        progress['out_time'] = micros / 1_000_000
+    return progress
+
+
+class _JobSlots:
+    """عدّاد فتحات مشترك بين الخيوط وحلقات الأحداث بترتيب وصول عادل"""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.active = 0
+        self._lock = threading.Lock()
+        self._waiters: deque = deque()
+
+    def acquire_blocking(self):
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        event.wait()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove((loop, future))
+                    return_slot = False
+                except ValueError:
+                    # أُعطيت الفتحة: إن وصلت قبل الإلغاء نعيدها، وإلا يعيدها _hand_over
+                    return_slot = future.done() and not future.cancelled()
+            if return_slot:
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                if loop.is_closed():
+                    continue
+                loop.call_soon_threadsafe(self._hand_over, future)
+                return
+            self.active -= 1
+
+    def _hand_over(self, future: asyncio.Future):
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+
+class FFmpegJob:
+    """عملية ffmpeg/ffprobe قيد التشغيل"""
+
+    __slots__ = ('key', 'command', 'process', 'started', 'progress', 'cancelled')
+
+    def __init__(self, key: Optional[Hashable], command: List[str], process):
+        self.key = key
+        self.command = command
+        self.process = process
+        self.started = time.monotonic()
+        self.progress: Dict[str, Any] = {}
+        self.cancelled = False
+
+    def kill(self):
+        try:
+            if self.process.returncode is None:
+                self.process.kill()
+        except ProcessLookupError:
+            pass
+        except Exception as e:
+            logger.debug(f"تعذر إيقاف عملية ffmpeg: {e}")
+
+
+class FFmpegRunner:
+    """تشغيل ffmpeg/ffprobe بمهلات وحد تزامن وإمكانية إيقاف عمليات مهمة محددة"""
+
+    def __init__(self, max_jobs: Optional[int] = None):
+        limit = max_jobs or int(os.getenv('FFMPEG_MAX_JOBS', 0)) or max(1, (os.cpu_count() or 2) // 2)
+        self._slots = _JobSlots(limit)
+        self._jobs: List[FFmpegJob] = []
+        self._jobs_lock = threading.Lock()
+        # key -> وقت الإيقاف، حتى لا تبدأ أوامر المهمة التي كانت تنتظر فتحة
+        self._cancelled_at: Dict[Hashable, float] = {}
+        self.stats_counters = {'started': 0, 'completed': 0, 'failed': 0, 'timeouts': 0, 'cancelled': 0}
+
+    @property
+    def max_jobs(self) -> int:
+        return self._slots.limit
+
+    # ----- async API -----
+
+    async def run(self, cmd: List[str], timeout: Optional[float] = None, text: bool = True,
+                  on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                  key: Optional[Hashable] = None, progress: bool = False) -> subprocess.CompletedProcess:
+        """
+        تشغيل أمر وانتظار انتهائه دون حجب حلقة الأحداث
+        يرفع subprocess.TimeoutExpired عند تجاوز المهلة (بعد قتل العملية)
+        إذا أُلغيت المهمة عبر cancel تكون returncode سالبة
+        progress/on_progress: إضافة -progress pipe:1 وتحديث تقدّم العملية (لا يُستخدم مع إخراج إلى stdout)
+        """
+        key = current_job_key.get() if key is None else key
+        limited = self._is_ffmpeg(cmd)
+        track_progress = limited and (progress or on_progress is not None)
+        if track_progress:
+            cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+
+        requested = time.monotonic()
+        if limited:
+            await self._slots.acquire()
+        job = None
+        try:
+            if self._cancelled_since(key, requested):
+                return subprocess.CompletedProcess(cmd, -signal.SIGKILL, '' if text else b'', '' if text else b'')
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            )
+            job = self._register(key, cmd, process)
+            stdout_task = asyncio.ensure_future(
+                self._read_progress(process.stdout, job, on_progress) if track_progress else process.stdout.read()
+            )
+            stderr_task = asyncio.ensure_future(process.stderr.read())
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                job.kill()
+                await process.wait()
+                self.stats_counters['timeouts'] += 1
+                logger.warning(f"⏱️ تجاوز {cmd[0]} المهلة ({timeout}s) وتم إيقافه")
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            except asyncio.CancelledError:
+                # المستدعي أُلغي - لا نترك ffmpeg يعمل بلا مالك
+                job.kill()
+                raise
+            finally:
+                stdout, stderr = await self._collect(stdout_task, stderr_task)
+            return self._completed(job, cmd, stdout, stderr, text)
+        finally:
+            if job is not None:
+                self._unregister(job)
+            if limited:
+                self._slots.release()
+
+    async def probe(self, path: str, timeout: float = 30) -> Optional[Dict]:
+        """ffprobe بصيغة JSON؛ يرجع None عند الفشل"""
+        import json
+        cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', path]
+        try:
+            result = await self.run(cmd, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return None
+        if result.returncode != 0:
+            return None
+        try:
+            return json.loads(result.stdout)
+        except ValueError:
+            return None
+
+    # ----- sync API (worker threads) -----
+
+    def run_sync(self, cmd: List[str], timeout: Optional[float] = None, text: bool = True,
+                 check: bool = False, key: Optional[Hashable] = None) -> subprocess.CompletedProcess:
+        """بديل subprocess.run(capture_output=True) للدوال المتزامنة: نفس المهلة والحد والإيقاف"""
+        key = current_job_key.get() if key is None else key
+        limited = self._is_ffmpeg(cmd)
+        requested = time.monotonic()
+        if limited:
+            self._slots.acquire_blocking()
+        job = None
+        try:
+            if self._cancelled_since(key, requested):
+                return subprocess.CompletedProcess(cmd, -signal.SIGKILL, '' if text else b'', '' if text else b'')
+            process = subprocess.Popen(
+                cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=text,
+            )
+            job = self._register(key, cmd, process)
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                self.stats_counters['timeouts'] += 1
+                logger.warning(f"⏱️ تجاوز {cmd[0]} المهلة ({timeout}s) وتم إيقافه")
+                raise
+            result = self._completed(job, cmd, stdout, stderr, None)
+            if check:
+                result.check_returncode()
+            return result
+        finally:
+            if job is not None:
+                self._unregister(job)
+            if limited:
+                self._slots.release()
+
+    # ----- control -----
+
+    def cancel(self, key: Hashable) -> int:
+        """إيقاف كل عمليات المهمة key (الجارية والمنتظرة)؛ يرجع عدد العمليات الجارية التي أُوقفت"""
+        now = time.monotonic()
+        with self._jobs_lock:
+            jobs = [job for job in self._jobs if job.key == key]
+            self._cancelled_at = {k: t for k, t in self._cancelled_at.items() if now - t < 3600}
+            self._cancelled_at[key] = now
+        for job in jobs:
+            job.cancelled = True
+            job.kill()
+        if jobs:
+            self.stats_counters['cancelled'] += len(jobs)
+            logger.info(f"🛑 تم إيقاف {len(jobs)} عملية ffmpeg للمهمة {key}")
+        return len(jobs)
+
+    def active_jobs(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._jobs_lock:
+            return [
+                {
+                    'key': job.key,
+                    'program': os.path.basename(job.command[0]),
+                    'elapsed': now - job.started,
+                    'progress': dict(job.progress),
+                }
+                for job in self._jobs
+            ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'max_jobs': self._slots.limit,
+            'running_ffmpeg': self._slots.active,
+            'waiting_ffmpeg': self._slots.waiting,
+            'jobs': self.active_jobs(),
+            **self.stats_counters,
+        }
+
+    # ----- internals -----
+
+    def _cancelled_since(self, key: Optional[Hashable], requested: float) -> bool:
+        if key is None:
+            return False
+        with self._jobs_lock:
+            cancelled_at = self._cancelled_at.get(key)
+        return cancelled_at is not None and cancelled_at >= requested
+
+    @staticmethod
+    def _is_ffmpeg(cmd: List[str]) -> bool:
+        return os.path.basename(cmd[0]).split('.')[0] == 'ffmpeg'
+
+    def _register(self, key, cmd, process) -> FFmpegJob:
+        job = FFmpegJob(key, cmd, process)
+        with self._jobs_lock:
+            self._jobs.append(job)
+        self.stats_counters['started'] += 1
+        return job
+
+    def _unregister(self, job: FFmpegJob):
+        with self._jobs_lock:
+            try:
+                self._jobs.remove(job)
+            except ValueError:
+                pass
+
+    def _completed(self, job: FFmpegJob, cmd, stdout, stderr, text) -> subprocess.CompletedProcess:
+        if text:
+            stdout = stdout.decode('utf-8', 'replace') if isinstance(stdout, bytes) else stdout
+            stderr = stderr.decode('utf-8', 'replace') if isinstance(stderr, bytes) else stderr
+        returncode = job.process.returncode
+        if job.cancelled:
+            returncode = -signal.SIGKILL if returncode in (None, 0) else returncode
+        elif returncode == 0:
+            self.stats_counters['completed'] += 1
+        else:
+            self.stats_counters['failed'] += 1
+        return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+    @staticmethod
+    async def _collect(stdout_task: asyncio.Future, stderr_task: asyncio.Future):
+        results = await asyncio.gather(stdout_task, stderr_task, return_exceptions=True)
+        return tuple(b'' if isinstance(result, BaseException) else result for result in results)
+
+    @staticmethod
+    async def _read_progress(stream, job: FFmpegJob, on_progress) -> bytes:
+        block: List[str] = []
+        while True:
+            line = await stream.readline()
+            if not line:
+                return b''
+            decoded = line.decode('utf-8', 'replace')
+            block.append(decoded)
+            if decoded.startswith('progress='):
+                job.progress = {**job.progress, **parse_progress_block(block)}
+                block = []
+                if on_progress is None:
+                    continue
+                try:
+                    on_progress(job.progress)
+                except Exception as e:
+                    logger.debug(f"خطأ في معالج تقدم ffmpeg: {e}")
+
+
+# مشغّل عالمي مشترك
+ffmpeg_runner = FFmpegRunner()
@@ -0,0 +1,156 @@
+"""
+رسم العلامة المائية على الصور - Image Watermark Worker
+نقاط الدخول الحسابية التي تعمل داخل عمليات الوسائط (media_worker_pool.run_cpu).
+
+الوحدة بلا آثار جانبية عند الاستيراد (PIL وذاكرة طبقات العلامة المائية فقط): عملية
+الوسائط تستوردها لفك الدالة المرسلة إليها، فلا يجوز أن يسحب استيرادها البوت أو
+اليوزربوت أو قاعدة البيانات. الطبقات والمواقع نفسها يستخدمها مسار الفيديو لملف PNG.
+"""
+import io
+import logging
+from typing import Optional, Tuple
+
+from PIL import Image, ImageDraw
+
+from watermark_overlay_cache import watermark_overlays, overlay_key, load_font, load_watermark_source
+
+logger = logging.getLogger(__name__)
+
+
+def text_overlay_spec(text: str, font_size: int, color: str, opacity: int, image_size: Tuple[int, int]):
+    key = overlay_key('ultra_text', image_size, text, font_size, color, opacity)
+    return key, lambda: render_text_overlay(text, font_size, color, opacity, image_size)
+
+
+def image_overlay_spec(watermark_settings: dict, base_size: Tuple[int, int]):
+    image_path = watermark_settings['watermark_image_path']
+    size_percentage = int(watermark_settings.get('size_percentage', 20))
+    opacity = int(watermark_settings.get('opacity', 70))
+    key = overlay_key('ultra_image', base_size, image_path, size_percentage, opacity)
+    return key, lambda: render_image_overlay(image_path, size_percentage, opacity, base_size)
+
+
+def render_image_overlay(image_path: str, size_percentage: int, opacity: int,
+                         base_size: Tuple[int, int]) -> Optional[Image.Image]:
+    """تحميل صورة العلامة، تحجيمها نسبةً إلى الهدف، وتطبيق الشفافية"""
+    wm_img = load_watermark_source(image_path)
+    if wm_img is None:
+        return None
+    base_w, base_h = base_size
+    wm_w, wm_h = wm_img.size
+    aspect = wm_w / wm_h if wm_h else 1
+    target_area = max(1, int(base_w * base_h * (max(1, size_percentage) / 100.0)))
+    new_h = int((target_area / aspect) ** 0.5)
+    new_w = int(new_h * aspect)
+    new_w = max(20, min(new_w, base_w - 10))
+    new_h = max(20, min(new_h, base_h - 10))
+    if (new_w, new_h) != wm_img.size:
+        wm_img = wm_img.resize((new_w, new_h), Image.Resampling.LANCZOS)
+    if 0 <= opacity < 100:
+        alpha = wm_img.split()[-1]
+        alpha = alpha.point(lambda p: int(p * opacity / 100))
+        wm_img.putalpha(alpha)
+    return wm_img
+
+
+def render_text_overlay(text: str, font_size: int, color: str, opacity: int,
+                        image_size: Tuple[int, int]) -> Optional[Image.Image]:
+    try:
+        img_width, img_height = image_size
+        calculated_font_size = max(font_size, img_width // 20)
+        font = load_font(calculated_font_size)
+        # احسب حجم النص على لوحة مؤقتة
+        tmp_img = Image.new('RGBA', (1, 1), (0, 0, 0, 0))
+        tmp_draw = ImageDraw.Draw(tmp_img)
+        bbox = tmp_draw.textbbox((0, 0), text, font=font)
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+        # أنشئ صورة العلامة المائية بحجم النص فقط
+        watermark_img = Image.new('RGBA', (text_width, text_height), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(watermark_img)
+        alpha = int(255 * opacity / 100)
+        draw.text((0, 0), text, font=font, fill=color + hex(alpha)[2:].zfill(2))
+        return watermark_img
+
+    except Exception as e:
+        logger.error(f"خطأ في إنشاء العلامة المائية النصية: {e}")
+        return None
+
+
+def text_overlay(text: str, font_size: int, color: str, opacity: int,
+                 image_size: Tuple[int, int]) -> Optional[Image.Image]:
+    """إنشاء علامة مائية نصية بسرعة قصوى (مرة واحدة لكل دقة - النتيجة للقراءة فقط)"""
+    return watermark_overlays.overlay(*text_overlay_spec(text, font_size, color, opacity, image_size))
+
+
+def calculate_position(base_size: Tuple[int, int], watermark_size: Tuple[int, int], position: str) -> Tuple[int, int]:
+    """حساب موقع العلامة المائية بسرعة"""
+    base_width, base_height = base_size
+    watermark_width, watermark_height = watermark_size
+
+    margin = min(base_width, base_height) // 20
+
+    position_map = {
+        'top_left': (margin, margin),
+        'top_right': (base_width - watermark_width - margin, margin),
+        'top': ((base_width - watermark_width) // 2, margin),
+        'bottom_left': (margin, base_height - watermark_height - margin),
+        'bottom_right': (base_width - watermark_width - margin, base_height - watermark_height - margin),
+        'bottom': ((base_width - watermark_width) // 2, base_height - watermark_height - margin),
+        'center': ((base_width - watermark_width) // 2, (base_height - watermark_height) // 2)
+    }
+
+    return position_map.get(position, position_map['bottom_right'])
+
+
+def render_image_watermark(image_bytes: bytes, watermark_settings: dict) -> bytes:
+    """تطبيق العلامة المائية على صورة (نقطة دخول عمليات الوسائط، قابلة للـ pickle)"""
+    try:
+        # تحميل الصورة
+        image = Image.open(io.BytesIO(image_bytes))
+
+        # تحويل إلى RGB إذا لزم الأمر
+        if image.mode not in ['RGB', 'RGBA']:
+            image = image.convert('RGB')
+
+        # إنشاء العلامة المائية
+        if watermark_settings['watermark_type'] == 'text' and watermark_settings.get('watermark_text'):
+            watermark = text_overlay(
+                watermark_settings['watermark_text'],
+                watermark_settings.get('font_size', 32),
+                watermark_settings.get('text_color', '#FFFFFF'),
+                watermark_settings.get('opacity', 70),
+                image.size
+            )
+
+            if watermark:
+                # تطبيق العلامة المائية
+                if image.mode == 'RGBA':
+                    image.paste(watermark, (0, 0), watermark)
+                else:
+                    image = image.convert('RGBA')
+                    image.paste(watermark, (0, 0), watermark)
+                    image = image.convert('RGB')
+        elif watermark_settings['watermark_type'] == 'image' and watermark_settings.get('watermark_image_path'):
+            try:
+                wm_img = watermark_overlays.overlay(*image_overlay_spec(watermark_settings, image.size))
+                if wm_img is None:
+                    raise ValueError("تعذر تحضير صورة العلامة")
+                # Paste at chosen position
+                pos = calculate_position(image.size, wm_img.size, watermark_settings.get('position', 'bottom_right'))
+                if image.mode != 'RGBA':
+                    image = image.convert('RGBA')
+                image.paste(wm_img, pos, wm_img)
+                image = image.convert('RGB')
+            except Exception as _e:
+                logger.warning(f"فشل تطبيق علامة صورة على صورة: {_e}")
+
+        # حفظ الصورة محسنة
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=85, optimize=True, progressive=True)
+
+        return output.getvalue()
+
+    except Exception as e:
+        logger.error(f"خطأ في معالجة الصورة: {e}")
+        return image_bytes
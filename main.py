@@ -12,24 +12,10 @@ import re
 import os
 import asyncio
 import logging
-from dotenv import load_dotenv
-from bot_package.bot_simple import run_simple_bot
-from userbot_service.userbot import userbot_instance, start_userbot_service, stop_userbot_service
-from bot_package.config import BOT_TOKEN, API_ID, API_HASH
-
-# Load environment variables from .env file
-load_dotenv()
-
-# CRITICAL FIX: Run database fix before anything else
-try:
-    import subprocess
-    result = subprocess.run(['python', 'auto_fix_databases.py'], capture_output=True, text=True, timeout=30)
-    if result.returncode == 0:
-        print("🔧 تم إصلاح قواعد البيانات بنجاح")
-    else:
-        print(f"⚠️ تحذير في إصلاح قواعد البيانات: {result.stderr}")
-except Exception as e:
-    print(f"⚠️ لا يمكن تشغيل إصلاح قواعد البيانات: {e}")
+
+# Importing this module must stay free of side effects: media worker processes
+# (forkserver/spawn) import the startup script again as __mp_main__. The .env,
+# the database fix and the bot/userbot imports all happen in main().
 
 # Set up logging
 logging.basicConfig(
@@ -61,6 +47,7 @@ class TelegramBotSystem:
                 if retry_count > 1:
                     logger.info(f"🔄 إعادة تشغيل بوت التحكم (المحاولة {retry_count})")
                 
+                from bot_package.bot_simple import run_simple_bot
                 bot_instance = await run_simple_bot()
                 if bot_instance:
                     logger.info("✅ بوت التحكم جاهز ومعزول عن UserBot")
@@ -174,6 +161,8 @@ class TelegramBotSystem:
         """Start userbot service in async context with complete isolation from control bot"""
         logger.info("👤 بدء تشغيل خدمة UserBot...")
         
+        from userbot_service.userbot import userbot_instance, start_userbot_service, stop_userbot_service
+
         # Set thread as daemon to ensure main bot continues if this fails
         import threading
         current_thread = threading.current_thread()
@@ -327,8 +316,8 @@ class TelegramBotSystem:
     async def check_and_cleanup_invalid_sessions(self):
         """فحص وتنظيف الجلسات المعطلة"""
         try:
-            from database.database import Database
-            db = Database()
+            from database import DatabaseFactory
+            db = DatabaseFactory.get_shared_sqlite_database()
             
             logger.info("🔍 فحص صحة الجلسات المحفوظة...")
             
@@ -381,6 +370,7 @@ class TelegramBotSystem:
 
     def print_startup_info(self):
         """Print startup information"""
+        from bot_package.config import BOT_TOKEN
         bot_username = BOT_TOKEN.split(':')[0] if BOT_TOKEN and ':' in BOT_TOKEN else 'غير محدد'
 
         print("\n" + "="*70)
@@ -423,11 +413,11 @@ class TelegramBotSystem:
         try:
             import glob
             import os
-            from database.database import Database
+            from database import DatabaseFactory
             
             # Clean up database first
             logger.info("🧹 تنظيف قاعدة البيانات من الجلسات المعطلة...")
-            db = Database()
+            db = DatabaseFactory.get_shared_sqlite_database()
             deleted_db_sessions = db.cleanup_broken_sessions()
             
             # Find all .session files
@@ -456,6 +446,7 @@ class TelegramBotSystem:
 
         # Stop userbot if running
         try:
+            from userbot_service.userbot import userbot_instance
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             loop.run_until_complete(userbot_instance.stop_all())
@@ -501,6 +492,22 @@ def main():
     """Main function"""
     global bot_system
 
+    # Load environment variables from .env file
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    # CRITICAL FIX: Run database fix before anything else (in-process, no extra interpreter)
+    try:
+        from auto_fix_databases import fix_all_databases
+        fix_all_databases()
+        print("🔧 تم إصلاح قواعد البيانات بنجاح")
+    except Exception as e:
+        print(f"⚠️ لا يمكن تشغيل إصلاح قواعد البيانات: {e}")
+
+    # Import the services once here, before their threads start and import them locally
+    import bot_package.bot_simple  # noqa: F401
+    import userbot_service.userbot  # noqa: F401
+
     logger.info("🚀 بدء تشغيل نظام بوت تليجرام...")
 
     # Check environment variables
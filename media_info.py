@@ -0,0 +1,223 @@
+"""
+معلومات الوسائط - Media Info
+فحص واحد بـ ffprobe لكل ملف تتشاركه مراحل العلامة المائية والضغط والإرسال
+
+نتيجة الفحص تُحفظ حسب هوية الملف على القرص مع حجمه ووقت تعديله، فأي مرحلة لاحقة تطلب
+معلومات الملف نفسه تأخذها من الذاكرة بدلاً من تشغيل ffprobe من جديد. المراحل التي
+تنتج ملفاً جديداً (مثل ترميز العلامة المائية) تسجّل معلوماته مباشرة عبر remember_media_info
+مع الصورة المصغّرة المستخرجة أثناء الترميز نفسه.
+"""
+import os
+import json
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Optional, Tuple
+
+from ffmpeg_runner import ffmpeg_runner
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_rate(rate: Optional[str]) -> float:
+    try:
+        if rate and '/' in rate:
+            num, den = rate.split('/', 1)
+            return float(num) / float(den) if float(den) else 0.0
+        return float(rate or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _to_int(value: Any) -> int:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+@dataclass
+class MediaInfo:
+    """خصائص ملف وسائط من فحص ffprobe واحد"""
+    width: int = 0
+    height: int = 0
+    duration: float = 0.0
+    fps: float = 0.0
+    bitrate: int = 0
+    size: int = 0
+    video_codec: Optional[str] = None
+    audio_codec: Optional[str] = None
+    thumbnail: Optional[bytes] = None
+
+    @property
+    def has_video(self) -> bool:
+        return self.video_codec is not None
+
+    @property
+    def has_audio(self) -> bool:
+        return self.audio_codec is not None
+
+    @property
+    def size_mb(self) -> float:
+        return self.size / (1024 * 1024)
+
+    @classmethod
+    def from_probe(cls, data: Dict[str, Any], size: int = 0) -> 'MediaInfo':
+        video = next((s for s in data.get('streams', []) if s.get('codec_type') == 'video'), None)
+        audio = next((s for s in data.get('streams', []) if s.get('codec_type') == 'audio'), None)
+        format_info = data.get('format', {})
+        # المدة من format أدق، ومن stream كبديل
+        duration = _to_float(format_info.get('duration')) or _to_float((video or {}).get('duration'))
+        size = size or _to_int(format_info.get('size'))
+        bitrate = _to_int(format_info.get('bit_rate'))
+        if not bitrate and size and duration:
+            bitrate = int(size * 8 / duration)
+        return cls(
+            width=_to_int((video or {}).get('width')),
+            height=_to_int((video or {}).get('height')),
+            duration=duration,
+            fps=_parse_rate((video or {}).get('r_frame_rate')) or (30.0 if video else 0.0),
+            bitrate=bitrate,
+            size=size,
+            video_codec=video.get('codec_name', 'unknown') if video else None,
+            audio_codec=audio.get('codec_name', 'unknown') if audio else None,
+        )
+
+    def derive(self, **changes) -> 'MediaInfo':
+        """نسخة لملف ناتج عن هذا الملف (نفس الأبعاد والمدة عادةً)"""
+        return replace(self, **changes)
+
+    def as_video_info(self) -> Dict[str, Any]:
+        """الصيغة القديمة لـ WatermarkProcessor.get_video_info"""
+        return {
+            'width': self.width,
+            'height': self.height,
+            'fps': self.fps,
+            'duration': self.duration,
+            'bitrate': self.bitrate,
+            'size_mb': self.size_mb,
+            'codec': self.video_codec or 'unknown',
+        }
+
+
+class MediaInfoCache:
+    """معلومات الملفات المفحوصة حسب هوية الملف على القرص (تشمل الروابط الصلبة والنقل)
+
+    المفتاح (الجهاز، رقم inode) والتحقق بالحجم ووقت التعديل، فإذا تغيّر الملف
+    (مثل إعادة كتابة الوسوم) تسقط معلوماته تلقائياً.
+    """
+
+    def __init__(self, max_items: int = 512):
+        self.max_items = max_items
+        self._entries: 'OrderedDict[Tuple[int, int], Tuple[Tuple[int, int], MediaInfo]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counters = {'hits': 0, 'probes': 0, 'remembered': 0}
+
+    @staticmethod
+    def _identity(path: str) -> Optional[Tuple[Tuple[int, int], Tuple[int, int]]]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_dev, stat.st_ino), (stat.st_size, stat.st_mtime_ns)
+
+    def get(self, path: str) -> Optional[MediaInfo]:
+        identity = self._identity(path)
+        if identity is None:
+            return None
+        key, signature = identity
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != signature:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.stats_counters['hits'] += 1
+            return entry[1]
+
+    def put(self, path: str, info: MediaInfo):
+        identity = self._identity(path)
+        if identity is None:
+            return
+        key, signature = identity
+        with self._lock:
+            self._entries[key] = (signature, info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'items': len(self._entries), **self.stats_counters}
+
+
+media_info_cache = MediaInfoCache()
+
+PROBE_TIMEOUT = 30
+
+
+def _probe_command(path: str):
+    return ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', path]
+
+
+def _parse_probe_result(path: str, result: subprocess.CompletedProcess) -> Optional[MediaInfo]:
+    if result.returncode != 0:
+        return None
+    try:
+        data = json.loads(result.stdout)
+    except ValueError:
+        return None
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    info = MediaInfo.from_probe(data, size)
+    media_info_cache.put(path, info)
+    return info
+
+
+def probe_media_info_sync(path: str) -> Optional[MediaInfo]:
+    """معلومات الملف (من الذاكرة أو بفحص ffprobe واحد)؛ None عند الفشل"""
+    cached = media_info_cache.get(path)
+    if cached is not None:
+        return cached
+    media_info_cache.stats_counters['probes'] += 1
+    try:
+        result = ffmpeg_runner.run_sync(_probe_command(path), timeout=PROBE_TIMEOUT)
+    except (subprocess.TimeoutExpired, OSError) as e:
+        logger.warning(f"فشل فحص الوسائط بـ ffprobe: {e}")
+        return None
+    return _parse_probe_result(path, result)
+
+
+async def probe_media_info(path: str) -> Optional[MediaInfo]:
+    """النسخة غير المتزامنة من probe_media_info_sync"""
+    cached = media_info_cache.get(path)
+    if cached is not None:
+        return cached
+    media_info_cache.stats_counters['probes'] += 1
+    try:
+        result = await ffmpeg_runner.run(_probe_command(path), timeout=PROBE_TIMEOUT)
+    except (subprocess.TimeoutExpired, OSError) as e:
+        logger.warning(f"فشل فحص الوسائط بـ ffprobe: {e}")
+        return None
+    return _parse_probe_result(path, result)
+
+
+def remember_media_info(path: str, info: MediaInfo):
+    """تسجيل معلومات ملف أنتجته مرحلة معالجة حتى لا يُفحص من جديد"""
+    media_info_cache.put(path, info)
+    media_info_cache.stats_counters['remembered'] += 1
+
+
+def cached_media_info(path: str) -> Optional[MediaInfo]:
+    """معلومات الملف إن كانت معروفة مسبقاً، دون تشغيل ffprobe"""
+    return media_info_cache.get(path)
@@ -0,0 +1,165 @@
+"""
+مجمّع عمّال الوسائط - Media Worker Pool
+يشغّل كل عمليات الوسائط الحاجبة (PIL، ffmpeg/ffprobe، mutagen) خارج حلقة الأحداث
+
+- عمليات منفصلة (ProcessPoolExecutor) للعمل الحسابي الثقيل في بايثون مثل رسم العلامة المائية على الصور
+- خيوط (ThreadPoolExecutor) لتنسيق العمليات الخارجية مثل ffmpeg التي تعمل أصلاً في عملية مستقلة
+- مسارات أولوية: "fast" للعمليات القصيرة (صور، فحص، صور مصغّرة) و"heavy" لترميز الفيديو ودمج الصوت،
+  ولكل مسار حد تزامن مستقل فلا يحجب فيديو كبير معالجة الصور والرسائل الأخرى
+- ضغط عكسي: الطلبات التي تتجاوز حد المسار تنتظر دورها بدلاً من تكديس العمل في المنفذ
+
+الإعدادات (متغيرات البيئة):
+    MEDIA_WORKER_PROCESSES   عدد العمليات (الافتراضي: عدد الأنوية - 1، بحد أقصى 4)
+    MEDIA_FAST_LANE_LIMIT    أقصى عدد مهام متزامنة في المسار السريع
+    MEDIA_HEAVY_LANE_LIMIT   أقصى عدد مهام متزامنة في المسار الثقيل
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import weakref
+import functools
+import contextvars
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+FAST = 'fast'
+HEAVY = 'heavy'
+
+# الوحدات التي يستوردها خادم العمليات مسبقاً بدلاً من __main__ الافتراضي: نقاط دخول run_cpu فقط،
+# وهي بلا آثار جانبية عند الاستيراد. كل عملية عاملة تستورد سكربت التشغيل أيضاً باسم __mp_main__
+# (في forkserver وspawn)، لذلك يبقى كل ما يشغّل البوت واليوزربوت في main.py داخل main()
+WORKER_MODULES = ['image_watermark_worker']
+
+
+def _default_processes() -> int:
+    return max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+class MediaWorkerPool:
+    """مجمّع مشترك لعمّال الوسائط بمسارات أولوية وحدود تزامن"""
+
+    def __init__(self, processes: Optional[int] = None,
+                 fast_limit: Optional[int] = None, heavy_limit: Optional[int] = None):
+        self.processes = processes or int(os.getenv('MEDIA_WORKER_PROCESSES', 0)) or _default_processes()
+        self.limits: Dict[str, int] = {
+            FAST: fast_limit or int(os.getenv('MEDIA_FAST_LANE_LIMIT', 0)) or self.processes * 2,
+            HEAVY: heavy_limit or int(os.getenv('MEDIA_HEAVY_LANE_LIMIT', 0)) or max(1, self.processes - 1),
+        }
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # حدود التزامن لكل حلقة أحداث (البوت واليوزربوت يعملان في حلقات مختلفة)
+        self._semaphores: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]' = weakref.WeakKeyDictionary()
+        self.stats_counters = {
+            lane: {'submitted': 0, 'completed': 0, 'failed': 0, 'waiting': 0, 'running': 0, 'busy_time': 0.0}
+            for lane in self.limits
+        }
+
+    # ----- executors -----
+
+    def _threads(self) -> ThreadPoolExecutor:
+        if self._thread_pool is None:
+            with self._lock:
+                if self._thread_pool is None:
+                    self._thread_pool = ThreadPoolExecutor(
+                        max_workers=sum(self.limits.values()), thread_name_prefix='media-worker'
+                    )
+        return self._thread_pool
+
+    def _processes(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            with self._lock:
+                if self._process_pool is None:
+                    # forkserver/spawn: لا يجوز fork لعملية متعددة الخيوط (Telethon + البوت)
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                    if context.get_start_method() == 'forkserver':
+                        context.set_forkserver_preload(WORKER_MODULES)
+                    self._process_pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+                    logger.info(f"⚙️ تم تشغيل {self.processes} عملية لمعالجة الوسائط")
+        return self._process_pool
+
+    def _lane_semaphore(self, lane: str) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        lanes = self._semaphores.get(loop)
+        if lanes is None:
+            lanes = {name: asyncio.Semaphore(limit) for name, limit in self.limits.items()}
+            self._semaphores[loop] = lanes
+        return lanes[lane]
+
+    # ----- public API -----
+
+    async def run(self, func: Callable, *args, lane: str = FAST) -> Any:
+        """تشغيل دالة حاجبة (عمليات خارجية/قرص) في خيط عامل ضمن مسار الأولوية"""
+        # نقل السياق (مثل المهمة الحالية لعمليات ffmpeg) إلى الخيط العامل
+        context_run = functools.partial(contextvars.copy_context().run, func)
+        return await self._submit(lane, self._threads(), context_run, args)
+
+    async def run_cpu(self, func: Callable, *args, lane: str = FAST) -> Any:
+        """تشغيل دالة حسابية في عملية منفصلة (يجب أن تكون الدالة ومعاملاتها قابلة للـ pickle)"""
+        try:
+            pool = self._processes()
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر تشغيل عمليات الوسائط، استخدام الخيوط: {e}")
+            return await self.run(func, *args, lane=lane)
+        try:
+            return await self._submit(lane, pool, func, args)
+        except BrokenProcessPool:
+            logger.error("❌ توقفت إحدى عمليات الوسائط - إعادة إنشاء المجمّع وتنفيذ المهمة في خيط")
+            with self._lock:
+                if self._process_pool is pool:
+                    self._process_pool = None
+            pool.shutdown(wait=False)
+            return await self.run(func, *args, lane=lane)
+
+    async def _submit(self, lane: str, executor, func: Callable, args: tuple) -> Any:
+        if lane not in self.limits:
+            raise ValueError(f"مسار غير معروف: {lane}")
+        counters = self.stats_counters[lane]
+        counters['submitted'] += 1
+        counters['waiting'] += 1
+        semaphore = self._lane_semaphore(lane)
+        try:
+            # الضغط العكسي: الانتظار هنا حتى يتوفر مكان في المسار
+            await semaphore.acquire()
+        finally:
+            counters['waiting'] -= 1
+        counters['running'] += 1
+        started = time.monotonic()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+            counters['completed'] += 1
+            return result
+        except Exception:
+            counters['failed'] += 1
+            raise
+        finally:
+            counters['running'] -= 1
+            counters['busy_time'] += time.monotonic() - started
+            semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'processes': self.processes,
+            'limits': dict(self.limits),
+            'lanes': {lane: dict(counters) for lane, counters in self.stats_counters.items()},
+        }
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=wait)
+                self._process_pool = None
+            if self._thread_pool is not None:
+                self._thread_pool.shutdown(wait=wait)
+                self._thread_pool = None
+
+
+# مجمّع عالمي مشترك
+media_pool = MediaWorkerPool()
@@ -4,11 +4,16 @@
 ويضيف سمات خاصة للصوت لضمان إرساله كملف موسيقى وليس مستند.
 """
 import io
+import os
 import logging
 import tempfile
 from typing import Union, Optional, Tuple
 from PIL import Image
 
+from media_worker_pool import media_pool, FAST
+from ffmpeg_runner import ffmpeg_runner
+from media_info import probe_media_info_sync
+
 logger = logging.getLogger(__name__)
 
 def _is_audio_filename(name: str) -> bool:
@@ -18,61 +23,82 @@ def _is_audio_filename(name: str) -> bool:
     except Exception:
         return False
 
-def _extract_audio_tags_from_bytes(audio_bytes: bytes, filename: str) -> Tuple[Optional[str], Optional[str], Optional[int]]:
-    """استخراج العنوان والمؤدي والمدة من بايتات ملف صوتي باستخدام mutagen"""
+def _is_file_path(file_data) -> bool:
+    """هل البيانات مسار ملف موجود على القرص (وليست bytes أو كائن Telethon)"""
+    return isinstance(file_data, (str, os.PathLike)) and os.path.isfile(file_data)
+
+def _write_temp_file(data: bytes, filename: str, default_ext: str) -> str:
+    """كتابة البايتات في ملف مؤقت (للدوال التي تحتاج مساراً على القرص)"""
+    suffix = "." + filename.split(".")[-1] if filename and "." in filename else default_ext
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    try:
+        temp_file.write(data)
+    finally:
+        temp_file.close()
+    return temp_file.name
+
+def _remove_temp_file(path: str):
+    try:
+        os.unlink(path)
+    except Exception:
+        pass
+
+def _extract_audio_tags(audio_path: str) -> Tuple[Optional[str], Optional[str], Optional[int]]:
+    """استخراج العنوان والمؤدي والمدة من ملف صوتي على القرص باستخدام mutagen"""
     title = None
     artist = None
     duration = None
     try:
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=("." + filename.split(".")[-1] if "." in filename else ".mp3"))
-        temp_file.write(audio_bytes)
-        temp_file.close()
-        try:
-            from mutagen import File
-            audio = File(temp_file.name)
-            if audio is not None:
-                try:
-                    if hasattr(audio, 'info') and hasattr(audio.info, 'length'):
-                        duration = int(audio.info.length)
-                except Exception:
-                    duration = None
-                try:
-                    tags = getattr(audio, 'tags', None)
-                    if tags:
-                        if hasattr(tags, 'getall'):
-                            try:
-                                t = tags.getall('TIT2')
-                                if t:
-                                    title = str(t[0].text[0]) if hasattr(t[0], 'text') and t[0].text else None
-                            except Exception:
-                                pass
-                            try:
-                                a = tags.getall('TPE1')
-                                if a:
-                                    artist = str(a[0].text[0]) if hasattr(a[0], 'text') and a[0].text else None
-                            except Exception:
-                                pass
-                        elif hasattr(tags, 'get'):
-                            try:
-                                title = (tags.get('title') or [None])[0]
-                            except Exception:
-                                pass
-                            try:
-                                artist = (tags.get('artist') or [None])[0]
-                            except Exception:
-                                pass
-                except Exception:
-                    pass
-        finally:
+        from mutagen import File
+        audio = File(audio_path)
+        if audio is not None:
+            try:
+                if hasattr(audio, 'info') and hasattr(audio.info, 'length'):
+                    duration = int(audio.info.length)
+            except Exception:
+                duration = None
             try:
-                import os
-                os.unlink(temp_file.name)
+                tags = getattr(audio, 'tags', None)
+                if tags:
+                    if hasattr(tags, 'getall'):
+                        try:
+                            t = tags.getall('TIT2')
+                            if t:
+                                title = str(t[0].text[0]) if hasattr(t[0], 'text') and t[0].text else None
+                        except Exception:
+                            pass
+                        try:
+                            a = tags.getall('TPE1')
+                            if a:
+                                artist = str(a[0].text[0]) if hasattr(a[0], 'text') and a[0].text else None
+                        except Exception:
+                            pass
+                    elif hasattr(tags, 'get'):
+                        try:
+                            title = (tags.get('title') or [None])[0]
+                        except Exception:
+                            pass
+                        try:
+                            artist = (tags.get('artist') or [None])[0]
+                        except Exception:
+                            pass
             except Exception:
                 pass
     except Exception:
         pass
     return title, artist, duration
 
+def _extract_audio_tags_from_bytes(audio_bytes: bytes, filename: str) -> Tuple[Optional[str], Optional[str], Optional[int]]:
+    """استخراج العنوان والمؤدي والمدة من بايتات ملف صوتي باستخدام mutagen"""
+    try:
+        temp_path = _write_temp_file(audio_bytes, filename, ".mp3")
+    except Exception:
+        return None, None, None
+    try:
+        return _extract_audio_tags(temp_path)
+    finally:
+        _remove_temp_file(temp_path)
+
 def _is_video_filename(name: str) -> bool:
     """فحص إذا كان اسم الملف يدل على فيديو"""
     try:
@@ -81,49 +107,29 @@ def _is_video_filename(name: str) -> bool:
     except Exception:
         return False
 
-def _extract_video_info_from_bytes(video_bytes: bytes, filename: str) -> Tuple[Optional[int], Optional[int], Optional[int], Optional[bytes]]:
-    """استخراج معلومات الفيديو الشامل: العرض، الارتفاع، المدة، والمعاينة"""
+def _extract_video_info(video_path: str) -> Tuple[Optional[int], Optional[int], Optional[int], Optional[bytes]]:
+    """استخراج معلومات الفيديو الشامل من ملف على القرص: العرض، الارتفاع، المدة، والمعاينة"""
     width = None
     height = None
     duration = None
     thumbnail = None
     
     try:
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=("." + filename.split(".")[-1] if "." in filename else ".mp4"))
-        temp_file.write(video_bytes)
-        temp_file.close()
-        
         try:
-            # أولاً: محاولة استخدام ffmpeg لاستخراج معلومات شاملة
-            import subprocess
-            import json
-            
-            # استخراج معلومات الفيديو مع format info للحصول على المدة الدقيقة
-            cmd = [
-                'ffprobe', '-v', 'quiet', '-print_format', 'json', 
-                '-show_format', '-show_streams', temp_file.name
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
+            # فحص واحد مشترك مع مرحلة العلامة المائية (لا يُعاد ffprobe لملف فُحص من قبل)
+            info = probe_media_info_sync(video_path)
+            if info is None:
+                raise RuntimeError("تعذر فحص الفيديو بـ ffprobe")
+            if info.has_video:
+                width = info.width
+                height = info.height
+            duration = info.duration or None
+            thumbnail = info.thumbnail
                 
-                # الحصول على معلومات stream الفيديو
-                video_stream = next((stream for stream in data['streams'] if stream['codec_type'] == 'video'), None)
-                if video_stream:
-                    width = int(video_stream.get('width', 0))
-                    height = int(video_stream.get('height', 0))
-                    # محاولة الحصول على المدة من stream
-                    stream_duration = video_stream.get('duration')
-                    if stream_duration:
-                        duration = float(stream_duration)
+            logger.info(f"🎬 معلومات الفيديو: {width}x{height}, مدة: {duration}s")
                 
-                # الحصول على المدة من format info (أكثر دقة)
-                if 'format' in data and 'duration' in data['format']:
-                    duration = float(data['format']['duration'])
-                    
-                logger.info(f"🎬 معلومات الفيديو: {width}x{height}, مدة: {duration}s")
-                    
+            # المعاينة المستخرجة أثناء ترميز العلامة المائية تغني عن تشغيل ffmpeg من جديد
+            if thumbnail is None:
                 # استخراج معاينة باستخدام ffmpeg
                 try:
                     thumb_temp = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
@@ -132,20 +138,19 @@ def _extract_video_info_from_bytes(video_bytes: bytes, filename: str) -> Tuple[O
                     # أخذ screenshot من منتصف الفيديو للحصول على معاينة أفضل
                     midpoint = max(1, duration / 2) if duration else 1
                     cmd_thumb = [
-                        'ffmpeg', '-y', '-i', temp_file.name, 
+                        'ffmpeg', '-y', '-i', video_path, 
                         '-ss', str(midpoint), '-vframes', '1', 
                         '-vf', 'scale=320:240:force_original_aspect_ratio=decrease',
                         '-f', 'mjpeg', '-q:v', '2',  # جودة عالية للمعاينة
                         thumb_temp.name
                     ]
                     
-                    result_thumb = subprocess.run(cmd_thumb, capture_output=True, timeout=30)
+                    result_thumb = ffmpeg_runner.run_sync(cmd_thumb, timeout=30, text=False)
                     if result_thumb.returncode == 0:
                         with open(thumb_temp.name, 'rb') as f:
                             thumbnail = f.read()
                         logger.info("✅ تم إنشاء معاينة الفيديو بنجاح")
                             
-                    import os
                     os.unlink(thumb_temp.name)
                 except Exception as e:
                     logger.warning(f"فشل في إنشاء معاينة الفيديو: {e}")
@@ -156,7 +161,7 @@ def _extract_video_info_from_bytes(video_bytes: bytes, filename: str) -> Tuple[O
             # خطة بديلة: استخدام OpenCV
             try:
                 import cv2
-                cap = cv2.VideoCapture(temp_file.name)
+                cap = cv2.VideoCapture(video_path)
                 if cap.isOpened():
                     fps = cap.get(cv2.CAP_PROP_FPS)
                     frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
@@ -171,81 +176,267 @@ def _extract_video_info_from_bytes(video_bytes: bytes, filename: str) -> Tuple[O
             except Exception as cv_error:
                 logger.warning(f"فشل في استخدام OpenCV: {cv_error}")
                 
-        finally:
-            try:
-                import os
-                os.unlink(temp_file.name)
-            except Exception:
-                pass
-                
     except Exception as e:
         logger.warning(f"خطأ في معالجة الفيديو: {e}")
     
     return width, height, int(duration) if duration else None, thumbnail
 
+def _extract_video_info_from_bytes(video_bytes: bytes, filename: str) -> Tuple[Optional[int], Optional[int], Optional[int], Optional[bytes]]:
+    """استخراج معلومات الفيديو الشامل: العرض، الارتفاع، المدة، والمعاينة"""
+    try:
+        temp_path = _write_temp_file(video_bytes, filename, ".mp4")
+    except Exception as e:
+        logger.warning(f"خطأ في معالجة الفيديو: {e}")
+        return None, None, None, None
+    try:
+        return _extract_video_info(temp_path)
+    finally:
+        _remove_temp_file(temp_path)
+
 
 
-def _extract_audio_cover_thumbnail(audio_bytes: bytes) -> Optional[bytes]:
-    """استخراج صورة غلاف كصورة مصغّرة (JPEG) من ملف صوتي بايتات إن أمكن"""
+def _extract_audio_cover(audio_path: str) -> Optional[bytes]:
+    """استخراج صورة غلاف كصورة مصغّرة (JPEG) من ملف صوتي على القرص إن أمكن"""
     try:
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-        temp_file.write(audio_bytes)
-        temp_file.close()
         cover_data = None
         try:
-            try:
-                from mutagen import File
-                from mutagen.id3 import ID3
-                from mutagen.id3._frames import APIC
-                audio = File(temp_file.name)
-            except ImportError:
-                return None
-            if isinstance(audio, ID3) or hasattr(audio, 'tags'):
-                tags = audio if isinstance(audio, ID3) else getattr(audio, 'tags', None)
-                if tags:
-                    # البحث عن APIC (صورة غلاف)
-                    pics = []
-                    try:
-                        pics = tags.getall('APIC') if hasattr(tags, 'getall') else []
-                    except Exception:
-                        apic = tags.get('APIC:') if hasattr(tags, 'get') else None
-                        pics = [apic] if apic else []
-                    for pic in pics:
-                        if pic and hasattr(pic, 'data') and pic.data:
-                            cover_data = pic.data
-                            break
-            if not cover_data:
-                return None
-            # تحويل الصورة إلى JPEG مصغّر مناسب كـ thumb
-            try:
-                img = Image.open(io.BytesIO(cover_data))
-                img = img.convert('RGB')
-                img.thumbnail((320, 320))
-                out = io.BytesIO()
-                img.save(out, format='JPEG', quality=85)
-                out.seek(0)
-                return out.getvalue()
-            except Exception:
-                return cover_data
-        finally:
-            try:
-                import os
-                os.unlink(temp_file.name)
-            except Exception:
-                pass
+            from mutagen import File
+            from mutagen.id3 import ID3
+            audio = File(audio_path)
+        except ImportError:
+            return None
+        if isinstance(audio, ID3) or hasattr(audio, 'tags'):
+            tags = audio if isinstance(audio, ID3) else getattr(audio, 'tags', None)
+            if tags:
+                # البحث عن APIC (صورة غلاف)
+                pics = []
+                try:
+                    pics = tags.getall('APIC') if hasattr(tags, 'getall') else []
+                except Exception:
+                    apic = tags.get('APIC:') if hasattr(tags, 'get') else None
+                    pics = [apic] if apic else []
+                for pic in pics:
+                    if pic and hasattr(pic, 'data') and pic.data:
+                        cover_data = pic.data
+                        break
+        if not cover_data:
+            return None
+        # تحويل الصورة إلى JPEG مصغّر مناسب كـ thumb
+        try:
+            img = Image.open(io.BytesIO(cover_data))
+            img = img.convert('RGB')
+            img.thumbnail((320, 320))
+            out = io.BytesIO()
+            img.save(out, format='JPEG', quality=85)
+            out.seek(0)
+            return out.getvalue()
+        except Exception:
+            return cover_data
     except Exception:
         return None
 
+def _extract_audio_cover_thumbnail(audio_bytes: bytes) -> Optional[bytes]:
+    """استخراج صورة غلاف كصورة مصغّرة (JPEG) من ملف صوتي بايتات إن أمكن"""
+    try:
+        temp_path = _write_temp_file(audio_bytes, "", ".mp3")
+    except Exception:
+        return None
+    try:
+        return _extract_audio_cover(temp_path)
+    finally:
+        _remove_temp_file(temp_path)
+
+def _add_audio_attributes(audio_path: str, filename: str, kwargs: dict):
+    """إضافة سمات الصوت والصورة المصغّرة لضمان ظهور الملف كصوت مع معاينة"""
+    try:
+        from telethon.tl.types import DocumentAttributeAudio, DocumentAttributeFilename
+        title, artist, duration = _extract_audio_tags(audio_path)
+        attributes = list(kwargs.pop('attributes', []) or [])
+        attributes.append(DocumentAttributeAudio(
+            duration=duration or 0,
+            title=title or None,
+            performer=artist or None,
+        ))
+        # تأكيد اسم الملف كسِمة ضمن الوثيقة
+        attributes.append(DocumentAttributeFilename(file_name=filename))
+        kwargs['attributes'] = attributes
+        kwargs.setdefault('force_document', False)
+        # محاولة استخراج صورة الغلاف لتكون صورة مصغّرة للملف الصوتي
+        if not kwargs.get('thumb'):
+            try:
+                cover_thumb = _extract_audio_cover(audio_path)
+                if cover_thumb:
+                    kwargs['thumb'] = cover_thumb
+                    logger.info("🖼️ تم تعيين صورة مصغّرة للملف الصوتي من صورة الغلاف")
+            except Exception as e_thumb:
+                logger.warning(f"⚠️ تعذر استخراج صورة مصغّرة للملف الصوتي: {e_thumb}")
+        logger.info(f"🎵 إضافة سمات صوتية: title='{title}', artist='{artist}', duration={duration}")
+    except Exception as e_attr:
+        logger.warning(f"⚠️ تعذر إضافة سمات الصوت: {e_attr}")
+
+def _add_video_attributes(video_path: str, filename: str, kwargs: dict):
+    """CRITICAL FIX: Video handling with proper duration and dimensions"""
+    try:
+        from telethon.tl.types import DocumentAttributeVideo, DocumentAttributeFilename
+        attributes = list(kwargs.pop("attributes", []) or [])
+        
+        # Try to get actual video info (returns width, height, duration, thumbnail)
+        width, height, duration, thumbnail = _extract_video_info(video_path)
+        
+        # استخدام الصورة المصغرة إذا كانت متوفرة
+        if thumbnail and not kwargs.get('thumb'):
+            kwargs['thumb'] = thumbnail
+            logger.info("🖼️ تم إضافة معاينة الفيديو المستخرجة")
+        
+        # تأكد من القيم الصحيحة للأبعاد والمدة
+        video_duration = max(1, int(duration)) if duration and duration > 0 else 1
+        video_width = max(320, int(width)) if width and width > 0 else 640
+        video_height = max(240, int(height)) if height and height > 0 else 480
+        
+        attributes.append(DocumentAttributeVideo(
+            duration=video_duration,
+            w=video_width, 
+            h=video_height,
+            round_message=False,
+            supports_streaming=True
+        ))
+        attributes.append(DocumentAttributeFilename(file_name=filename))
+        kwargs["attributes"] = attributes
+        kwargs["force_document"] = False  # CRITICAL: إجبار الإرسال كفيديو وليس ملف
+        kwargs.setdefault("parse_mode", None)  # إزالة parse_mode للفيديوهات
+        logger.info(f"🎬 إضافة سمات فيديو للملف: {filename} (مدة: {video_duration}s, أبعاد: {video_width}x{video_height}, معاينة: {'✅' if thumbnail else '❌'})")
+    except Exception as e_attr:
+        logger.warning(f"⚠️ تعذر إضافة سمات الفيديو: {e_attr}")
+
+def _add_media_attributes(media_path: str, filename: str, kwargs: dict):
+    """إضافة سمات الصوت/الفيديو حسب اسم الملف من ملف على القرص"""
+    if _is_audio_filename(filename):
+        _add_audio_attributes(media_path, filename, kwargs)
+    elif filename and filename.lower().endswith((".mp4", ".avi", ".mov", ".mkv", ".webm", ".m4v")):
+        _add_video_attributes(media_path, filename, kwargs)
+
+def _collect_media_attributes(file_data: Union[bytes, str], filename: str, kwargs: dict):
+    """استخراج السمات من مسار أو bytes (عبر ملف مؤقت واحد) - تعمل في عامل الوسائط لأنها تشغّل ffprobe/ffmpeg"""
+    if _is_file_path(file_data):
+        _add_media_attributes(os.fspath(file_data), filename, kwargs)
+        return
+    try:
+        temp_path = _write_temp_file(file_data, filename, ".bin")
+    except Exception as e_tmp:
+        logger.warning(f"⚠️ تعذر إنشاء ملف مؤقت لاستخراج السمات: {e_tmp}")
+        return
+    try:
+        _add_media_attributes(temp_path, filename, kwargs)
+    finally:
+        _remove_temp_file(temp_path)
+
+def _needs_media_attributes(filename: str) -> bool:
+    return bool(filename) and (
+        _is_audio_filename(filename)
+        or filename.lower().endswith((".mp4", ".avi", ".mov", ".mkv", ".webm", ".m4v"))
+    )
+
+class PreparedMedia:
+    """ملف مرفوع مرة واحدة مع سماته وصورته المصغّرة - يُرسل لعدة أهداف دون إعادة الرفع
+
+    file يبدأ كمعرّف الرفع (InputFile/InputFileBig)، وبعد أول إرسال ناجح يُستبدل
+    بالوثيقة/الصورة الموجودة على الخادم فتُرسل بقية الأهداف كوسائط جاهزة.
+    """
+
+    __slots__ = ('file', 'filename', 'media_kwargs', 'on_server', 'sends')
+
+    def __init__(self, file, filename: str, media_kwargs: dict):
+        self.file = file
+        self.filename = filename
+        self.media_kwargs = media_kwargs
+        self.on_server = False
+        self.sends = 0
+
 class TelethonFileSender:
     """مساعد لإرسال الملفات مع أسماء صحيحة"""
+
+    # خيارات تخص الملف نفسه (وليس الرسالة) - تُحسب مرة واحدة عند الرفع
+    MEDIA_KWARGS = ('attributes', 'thumb', 'force_document', 'mime_type', 'supports_streaming')
+
+    @staticmethod
+    async def prepare_media(client, file_data: Union[bytes, str], filename: str, **kwargs) -> PreparedMedia:
+        """
+        رفع الملف مرة واحدة عبر client.upload_file مع تجهيز السمات والصورة المصغّرة
+        النتيجة تُمرر إلى send_prepared لكل هدف
+        """
+        media_kwargs = {key: kwargs[key] for key in TelethonFileSender.MEDIA_KWARGS if key in kwargs}
+        from_disk = _is_file_path(file_data)
+
+        if _needs_media_attributes(filename):
+            await media_pool.run(_collect_media_attributes, file_data, filename, media_kwargs, lane=FAST)
+        else:
+            from telethon.tl.types import DocumentAttributeFilename
+            attributes = list(media_kwargs.pop('attributes', []) or [])
+            attributes.append(DocumentAttributeFilename(file_name=filename))
+            media_kwargs['attributes'] = attributes
+
+        # الصورة المصغّرة تُرفع مرة واحدة أيضاً (وإلا يعيد Telethon رفعها مع كل إرسال)
+        thumb = media_kwargs.get('thumb')
+        if isinstance(thumb, (bytes, bytearray)):
+            media_kwargs['thumb'] = await client.upload_file(bytes(thumb), file_name='thumb.jpg')
+
+        if from_disk:
+            upload_source = os.fspath(file_data)
+        else:
+            upload_source = io.BytesIO(file_data)
+            upload_source.name = filename
+        file_handle = await client.upload_file(upload_source, file_name=filename)
+        logger.info(f"📤 تم رفع الملف مرة واحدة لكل الأهداف: {filename}")
+        return PreparedMedia(file_handle, filename, media_kwargs)
+
+    @staticmethod
+    async def send_prepared(client, entity, prepared: PreparedMedia, **kwargs):
+        """إرسال ملف مرفوع مسبقاً إلى هدف دون إعادة رفعه"""
+        if prepared.on_server:
+            # الوثيقة على الخادم تحمل سماتها وصورتها المصغّرة
+            send_kwargs = {}
+        else:
+            send_kwargs = dict(prepared.media_kwargs)
+        # الخيارات الخاصة بالملف محسومة عند الرفع؛ الخيارات الخاصة بالرسالة من المستدعي
+        for key, value in kwargs.items():
+            if key not in TelethonFileSender.MEDIA_KWARGS:
+                send_kwargs[key] = value
+        result = await client.send_file(entity, prepared.file, **send_kwargs)
+        prepared.sends += 1
+
+        if not prepared.on_server:
+            message = result[0] if isinstance(result, list) else result
+            media = getattr(message, 'media', None)
+            server_media = getattr(media, 'document', None) or getattr(media, 'photo', None)
+            if server_media is not None:
+                prepared.file = server_media
+                prepared.on_server = True
+        return result
     
     @staticmethod
-    async def send_file_with_name(client, entity, file_data: Union[bytes, any], filename: str, **kwargs):
+    async def send_file_with_name(client, entity, file_data: Union[bytes, str, any], filename: str, **kwargs):
         """
         إرسال ملف مع اسم مخصص
         يحل مشكلة Telethon مع البيانات الخام والأسماء المخصصة
+        يقبل bytes أو مسار ملف على القرص (يُرفع من القرص مباشرة دون تحميله في الذاكرة)
         """
         try:
+            # مسار ملف على القرص: استخراج السمات من الملف نفسه والرفع منه مباشرة
+            if _is_file_path(file_data):
+                file_path = os.fspath(file_data)
+                logger.info(f"📤 إرسال ملف من القرص مع اسم: {filename}")
+                logger.info(f"📊 حجم الملف: {os.path.getsize(file_path)} bytes")
+                if _needs_media_attributes(filename):
+                    await media_pool.run(_collect_media_attributes, file_path, filename, kwargs, lane=FAST)
+                else:
+                    from telethon.tl.types import DocumentAttributeFilename
+                    attributes = list(kwargs.pop('attributes', []) or [])
+                    attributes.append(DocumentAttributeFilename(file_name=filename))
+                    kwargs['attributes'] = attributes
+                result = await client.send_file(entity, file_path, **kwargs)
+                logger.info(f"✅ تم إرسال الملف {filename} بنجاح من القرص")
+                return result
+
             # إذا كانت البيانات هي bytes، استخدم BytesIO مع name attribute
             if isinstance(file_data, bytes):
                 logger.info(f"📤 إرسال ملف bytes مع اسم: {filename}")
@@ -257,72 +448,9 @@ class TelethonFileSender:
                 
                 logger.info(f"🔧 تم إنشاء BytesIO stream مع الاسم: {file_stream.name}")
                 
-                # إضافة سمات الصوت والصورة المصغّرة إن لزم لضمان ظهور الملف كصوت مع معاينة
-                if _is_audio_filename(filename):
-                    try:
-                        from telethon.tl.types import DocumentAttributeAudio, DocumentAttributeFilename
-                        title, artist, duration = _extract_audio_tags_from_bytes(file_data, filename)
-                        attributes = list(kwargs.pop('attributes', []) or [])
-                        attributes.append(DocumentAttributeAudio(
-                            duration=duration or 0,
-                            title=title or None,
-                            performer=artist or None,
-                        ))
-                        # تأكيد اسم الملف كسِمة ضمن الوثيقة
-                        attributes.append(DocumentAttributeFilename(file_name=filename))
-                        kwargs['attributes'] = attributes
-                        kwargs.setdefault('force_document', False)
-                        # محاولة استخراج صورة الغلاف لتكون صورة مصغّرة للملف الصوتي
-                        if not kwargs.get('thumb'):
-                            try:
-                                cover_thumb = _extract_audio_cover_thumbnail(file_data)
-                                if cover_thumb:
-                                    kwargs['thumb'] = cover_thumb
-                                    logger.info("🖼️ تم تعيين صورة مصغّرة للملف الصوتي من صورة الغلاف")
-                            except Exception as e_thumb:
-                                logger.warning(f"⚠️ تعذر استخراج صورة مصغّرة للملف الصوتي: {e_thumb}")
-                        logger.info(f"🎵 إضافة سمات صوتية: title='{title}', artist='{artist}', duration={duration}")
-                    except Exception as e_attr:
-                        logger.warning(f"⚠️ تعذر إضافة سمات الصوت: {e_attr}")
-
-
-                # CRITICAL FIX: Video handling with proper duration and dimensions
-                elif filename and filename.lower().endswith((".mp4", ".avi", ".mov", ".mkv", ".webm", ".m4v")):
-                    try:
-                        from telethon.tl.types import DocumentAttributeVideo, DocumentAttributeFilename
-                        attributes = list(kwargs.pop("attributes", []) or [])
-                        
-                        # Try to get actual video info (returns width, height, duration, thumbnail)
-                        video_info = _extract_video_info_from_bytes(file_data, filename)
-                        if isinstance(video_info, tuple) and len(video_info) >= 4:
-                            width, height, duration, thumbnail = video_info
-                        else:
-                            width, height, duration, thumbnail = None, None, None, None
-                        
-                        # استخدام الصورة المصغرة إذا كانت متوفرة
-                        if thumbnail and not kwargs.get('thumb'):
-                            kwargs['thumb'] = thumbnail
-                            logger.info("🖼️ تم إضافة معاينة الفيديو المستخرجة")
-                        
-                        # تأكد من القيم الصحيحة للأبعاد والمدة
-                        video_duration = max(1, int(duration)) if duration and duration > 0 else 1
-                        video_width = max(320, int(width)) if width and width > 0 else 640
-                        video_height = max(240, int(height)) if height and height > 0 else 480
-                        
-                        attributes.append(DocumentAttributeVideo(
-                            duration=video_duration,
-                            w=video_width, 
-                            h=video_height,
-                            round_message=False,
-                            supports_streaming=True
-                        ))
-                        attributes.append(DocumentAttributeFilename(file_name=filename))
-                        kwargs["attributes"] = attributes
-                        kwargs["force_document"] = False  # CRITICAL: إجبار الإرسال كفيديو وليس ملف
-                        kwargs.setdefault("parse_mode", None)  # إزالة parse_mode للفيديوهات
-                        logger.info(f"🎬 إضافة سمات فيديو للملف: {filename} (مدة: {video_duration}s, أبعاد: {video_width}x{video_height}, معاينة: {'✅' if thumbnail else '❌'})")
-                    except Exception as e_attr:
-                        logger.warning(f"⚠️ تعذر إضافة سمات الفيديو: {e_attr}")
+                # إضافة سمات الصوت/الفيديو إن لزم - كتابة البايتات مرة واحدة فقط لكل الاستخراجات
+                if _needs_media_attributes(filename):
+                    await media_pool.run(_collect_media_attributes, file_data, filename, kwargs, lane=FAST)
                 # إرسال الملف مع stream
                 result = await client.send_file(entity, file_stream, **kwargs)
                 logger.info(f"✅ تم إرسال الملف {filename} بنجاح باستخدام BytesIO")
@@ -338,10 +466,10 @@ class TelethonFileSender:
             logger.error(f"❌ تفاصيل الخطأ: {traceback.format_exc()}")
             # في حالة الخطأ، جرب upload_file أولاً
             try:
-                if isinstance(file_data, bytes):
+                if isinstance(file_data, bytes) or _is_file_path(file_data):
                     logger.info("🔄 محاولة بديلة باستخدام upload_file")
                     file_handle = await client.upload_file(
-                        file=io.BytesIO(file_data),
+                        file=io.BytesIO(file_data) if isinstance(file_data, bytes) else os.fspath(file_data),
                         file_name=filename
                     )
                     return await client.send_file(entity, file_handle, **kwargs)
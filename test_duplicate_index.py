@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Test script for the duplicate filter index (MinHash LSH recall, perceptual hash lookup, expiry)
+"""
+
+import sys
+import os
+import random
+import importlib.util
+
+# Add the project root to Python path
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+# Load the module directly: importing the userbot_service package requires telethon
+_spec = importlib.util.spec_from_file_location('duplicate_index', os.path.join(ROOT, 'userbot_service', 'duplicate_index.py'))
+duplicate_index = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(duplicate_index)
+
+DuplicateIndex = duplicate_index.DuplicateIndex
+jaccard = duplicate_index.jaccard
+text_tokens = duplicate_index.text_tokens
+
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95)
+
+
+def _rows(texts, timestamp=1000):
+    return [{'id': i + 1, 'message_text': text, 'media_hash': '', 'timestamp': timestamp}
+            for i, text in enumerate(texts)]
+
+
+def test_band_recall_at_threshold():
+    """Pairs whose Jaccard is right at the threshold share an LSH band with TARGET_RECALL"""
+    random.seed(5)
+    for threshold in THRESHOLDS:
+        bands = duplicate_index.lsh_bands(threshold)
+        hits = 0
+        trials = 1000
+        for trial in range(trials):
+            size = random.randint(10, 60)
+            shared = next(s for s in range(size + 1) if s / (2 * size - s) >= threshold)
+            common = [f't{trial}s{i}' for i in range(shared)]
+            first = text_tokens(' '.join(common + [f't{trial}a{i}' for i in range(size - shared)]))
+            second = text_tokens(' '.join(common + [f't{trial}b{i}' for i in range(size - shared)]))
+            keys1 = DuplicateIndex._band_keys(duplicate_index.minhash_signature(first), bands)
+            keys2 = DuplicateIndex._band_keys(duplicate_index.minhash_signature(second), bands)
+            hits += any(key1 == key2 for key1, key2 in zip(keys1, keys2))
+        recall = hits / trials
+        # 1000 trials: a true recall of 0.99 stays above 0.98 with a wide margin
+        assert recall >= duplicate_index.TARGET_RECALL - 0.01, (threshold, bands, recall)
+    print("✅ استدعاء LSH عند حد التشابه مطابق للهدف")
+
+
+def test_matches_brute_force():
+    """Index lookups agree with brute-force Jaccard on near-duplicate texts"""
+    random.seed(3)
+    vocabulary = [f'w{i}' for i in range(3000)]
+    stored = [random.sample(vocabulary, random.randint(8, 40)) for _ in range(300)]
+    rows = _rows(' '.join(words) for words in stored)
+    stored_tokens = [text_tokens(row['message_text']) for row in rows]
+    for threshold in THRESHOLDS:
+        index = DuplicateIndex()
+        found = expected = 0
+        for _ in range(400):
+            words = list(random.choice(stored))
+            for _ in range(random.randint(0, len(words) // 3)):
+                words[random.randrange(len(words))] = random.choice(vocabulary)
+            text = ' '.join(words)
+            best = max(jaccard(text_tokens(text), tokens) for tokens in stored_tokens)
+            match = index.find(1, text, '', threshold, 0, True, False, lambda cutoff: rows)
+            if best >= threshold:
+                expected += 1
+                if match is not None and abs(match.similarity - best) < 1e-9:
+                    found += 1
+            else:
+                assert match is None, (threshold, text)
+        assert expected and found / expected >= duplicate_index.TARGET_RECALL, (threshold, found, expected)
+    print("✅ نتائج الفهرس مطابقة للمقارنة الكاملة")
+
+
+def test_expiry_and_touch():
+    """Entries leave with the time window; touch() keeps a matched entry for another window"""
+    loads = []
+
+    def loader(cutoff):
+        loads.append(cutoff)
+        return _rows(['alpha beta gamma', 'delta epsilon zeta', 'eta theta iota'], timestamp=100)
+
+    index = DuplicateIndex()
+    assert index.find(1, 'alpha beta gamma', '', 0.8, 50, True, False, loader) is not None
+    index.touch(1, 2, 300)
+    index.add(1, 4, 'kappa lambda mu', '', 250)
+
+    # Window now starts after the warm-up rows, except the touched one
+    assert index.find(1, 'alpha beta gamma', '', 0.8, 200, True, False, loader) is None
+    assert index.find(1, 'eta theta iota', '', 0.8, 200, True, False, loader) is None
+    assert index.find(1, 'delta epsilon zeta', '', 0.8, 200, True, False, loader).row_id == 2
+    assert index.find(1, 'kappa lambda mu', '', 0.8, 200, True, False, loader).row_id == 4
+    assert index.stats()['entries'] == 2
+
+    # The old heap item of the touched entry is skipped, the new one expires it
+    assert index.find(1, 'delta epsilon zeta', '', 0.8, 260, True, False, loader).row_id == 2
+    assert index.find(1, 'kappa lambda mu', '', 0.8, 260, True, False, loader) is None
+    assert index.find(1, 'delta epsilon zeta', '', 0.8, 300, True, False, loader) is None
+    assert index.stats()['entries'] == 0
+    assert loads == [50], loads
+    print("✅ انتهاء صلاحية الفهرس وtouch يعملان بشكل صحيح")
+
+
+def test_invalidate_and_window_growth():
+    """invalidate_task() and a wider window both warm the index again from the store"""
+    loads = []
+
+    def loader(cutoff):
+        loads.append(cutoff)
+        return _rows(['one two three four'], timestamp=500)
+
+    index = DuplicateIndex()
+    assert index.find(7, 'one two three four', '', 0.9, 400, True, False, loader) is not None
+    index.add(7, None, 'five six seven eight', '', 600)
+    assert index.find(7, 'five six seven eight', '', 0.9, 400, True, False, loader) is not None
+    index.invalidate_task(7)
+    assert index.find(7, 'five six seven eight', '', 0.9, 400, True, False, loader) is None
+    assert index.find(7, 'one two three four', '', 0.9, 300, True, False, loader) is not None
+    assert loads == [400, 400, 300], loads
+    print("✅ إبطال الفهرس وتوسيع النافذة يعيدان التحميل")
+
+
+def test_phash_chunk_lookup():
+    """Chunk buckets find every stored hash within the Hamming limit and nothing beyond it"""
+    random.seed(9)
+    limit = duplicate_index.PHASH_MAX_DISTANCE
+    stored = [random.getrandbits(64) for _ in range(500)]
+    rows = [{'id': i + 1, 'message_text': '', 'media_hash': f'doc{i}', 'timestamp': 1000,
+             'media_phash': duplicate_index.format_phash(value)} for i, value in enumerate(stored)]
+    index = DuplicateIndex()
+    for trial in range(2000):
+        row = random.randrange(len(stored))
+        distance = trial % (duplicate_index.PHASH_CHUNKS + 2)
+        query = stored[row]
+        for bit in random.sample(range(64), distance):
+            query ^= 1 << bit
+        best = min(duplicate_index.hamming(query, value) for value in stored)
+        match = index.find(1, '', 'new-doc', 0.8, 0, False, True, lambda cutoff: rows, media_phash=query)
+        if best <= limit:
+            assert match is not None and match.phash_distance == best, (distance, best, match)
+        else:
+            assert match is None, (distance, best, match)
+
+    # Expired entries leave the chunk buckets too; only the late entry remains
+    index.add(1, 9999, '', 'late-doc', 2000, media_phash=stored[0] ^ 1)
+    match = index.find(1, '', 'x', 0.8, 1500, False, True, lambda cutoff: rows, media_phash=stored[0])
+    assert match is not None and match.row_id == 9999 and match.phash_distance == 1
+    assert sum(len(bucket) for bucket in index._tasks[1].phashes) == duplicate_index.PHASH_CHUNKS
+    print("✅ البحث بالبصمة الإدراكية يجد كل البصمات ضمن الحد فقط")
+
+
+if __name__ == "__main__":
+    print("🔍 اختبار فهرس فلتر التكرار...")
+    test_band_recall_at_threshold()
+    test_matches_brute_force()
+    test_expiry_and_touch()
+    test_invalidate_and_window_growth()
+    test_phash_chunk_lookup()
+    print("✅ انتهى اختبار فهرس فلتر التكرار")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Test script for the per-account target fan-out (ordering per target chat, concurrency cap)
+"""
+
+import sys
+import os
+import random
+import asyncio
+import importlib.util
+from collections import defaultdict
+
+# Add the project root to Python path
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+# Load the module directly: importing the userbot_service package requires telethon
+_spec = importlib.util.spec_from_file_location('fan_out', os.path.join(ROOT, 'userbot_service', 'fan_out.py'))
+fan_out = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(fan_out)
+
+TargetFanOut = fan_out.TargetFanOut
+
+
+class FakeSender:
+    """إرسال وهمي غير متزامن يسجل الترتيب والتوازي لكل حساب"""
+
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        self.delivered = defaultdict(list)   # (account, target) -> [message, ...]
+        self.running = defaultdict(int)
+        self.peak = defaultdict(int)
+
+    def delivery(self, account, target, message, fail=False):
+        async def deliver():
+            self.running[account] += 1
+            self.peak[account] = max(self.peak[account], self.running[account])
+            try:
+                await asyncio.sleep(self.rng.uniform(0, 0.004))
+                if fail:
+                    raise RuntimeError('send failed')
+                self.delivered[(account, target)].append(message)
+                return (target, message)
+            finally:
+                self.running[account] -= 1
+        return target, deliver
+
+
+def test_fifo_per_account_and_target():
+    """Concurrent dispatches reach each target chat in the order they were dispatched"""
+    async def run():
+        fan = TargetFanOut(max_concurrency=4)
+        sender = FakeSender(seed=1)
+        targets = [f'chat{i}' for i in range(6)]
+        dispatched = defaultdict(list)
+        calls = []
+        for message in range(40):
+            account = f'acc{message % 2}'
+            chosen = random.Random(message).sample(targets, random.randint(1, len(targets)))
+            for target in chosen:
+                dispatched[(account, target)].append(message)
+            calls.append(fan.dispatch(account, [sender.delivery(account, target, message) for target in chosen],
+                                      sequential=(message % 5 == 0)))
+        results = await asyncio.gather(*calls)
+        return fan, sender, dispatched, results
+
+    fan, sender, dispatched, results = asyncio.run(run())
+    assert dict(sender.delivered) == dict(dispatched), "ordering per (account, target) broken"
+    # Results come back in the order of the deliveries passed in
+    for result in results:
+        assert all(item is not None for item in result)
+    assert fan.stats()['queued_targets'] == 0 and fan.stats()['running'] == 0
+    print("✅ الرسائل تصل لكل هدف بترتيب إرسالها")
+
+
+def test_concurrency_cap_per_account():
+    """The per-account semaphore never lets more than max_concurrency deliveries run at once"""
+    async def run():
+        fan = TargetFanOut(max_concurrency=3)
+        sender = FakeSender(seed=2)
+        calls = []
+        for message in range(10):
+            for account in ('acc0', 'acc1'):
+                calls.append(fan.dispatch(account, [sender.delivery(account, f'chat{i}', message)
+                                                    for i in range(12)]))
+        await asyncio.gather(*calls)
+        return fan, sender
+
+    fan, sender = asyncio.run(run())
+    assert sender.peak['acc0'] == 3 and sender.peak['acc1'] == 3, dict(sender.peak)
+    # Each account has its own cap, so both run side by side
+    assert fan.stats()['peak_parallel'] == 6, fan.stats()
+    assert fan.stats()['deliveries'] == 240
+    print("✅ حد التوازي لكل حساب محترم")
+
+
+def test_failure_keeps_order_going():
+    """A failed delivery returns None and does not block later messages to the same target"""
+    async def run():
+        fan = TargetFanOut(max_concurrency=2)
+        sender = FakeSender(seed=3)
+        first = fan.dispatch('acc', [sender.delivery('acc', 'chat', 1, fail=True),
+                                     sender.delivery('acc', 'other', 1)])
+        second = fan.dispatch('acc', [sender.delivery('acc', 'chat', 2)])
+        return fan, sender, await asyncio.gather(first, second)
+
+    fan, sender, (first, second) = asyncio.run(run())
+    assert first == [None, ('other', 1)] and second == [('chat', 2)], (first, second)
+    assert sender.delivered[('acc', 'chat')] == [2]
+    assert fan.stats()['failed'] == 1 and fan.stats()['queued_targets'] == 0
+    print("✅ فشل إرسال لا يوقف الرسائل التالية")
+
+
+if __name__ == "__main__":
+    print("🔍 اختبار توزيع الرسائل على الأهداف...")
+    test_fifo_per_account_and_target()
+    test_concurrency_cap_per_account()
+    test_failure_keeps_order_going()
+    print("✅ انتهى اختبار توزيع الرسائل على الأهداف")
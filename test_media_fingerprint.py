@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test script for the perceptual media hash (dHash) used by the duplicate filter
+"""
+
+import io
+import sys
+import os
+import random
+import importlib.util
+
+from PIL import Image, ImageDraw
+
+# Add the project root to Python path
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+
+def _load(name):
+    # Load the module directly: importing the userbot_service package requires telethon
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, 'userbot_service', f'{name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+media_fingerprint = _load('media_fingerprint')
+duplicate_index = _load('duplicate_index')
+
+MAX_DISTANCE = duplicate_index.PHASH_MAX_DISTANCE
+
+
+def make_picture(seed: int, size=(640, 480)) -> Image.Image:
+    """صورة اصطناعية: تدرج لوني مع أشكال عشوائية"""
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(4, 9)):
+        x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+        x1, y1 = x0 + rng.randint(40, 300), y0 + rng.randint(40, 250)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+        else:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+    return image
+
+
+def jpeg(image: Image.Image, quality: int, size=None) -> bytes:
+    if size is not None:
+        image = image.resize(size, Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def reupload(image: Image.Image, quality: int, size=None) -> Image.Image:
+    """نسخة أعادت قناة أخرى رفعها: ضغط JPEG جديد وربما دقة أخرى"""
+    return Image.open(io.BytesIO(jpeg(image, quality, size))).convert('RGB')
+
+
+# (الجودة، الدقة) لنسخ معاد رفعها
+REUPLOADS = ((40, None), (60, (480, 360)), (70, (1280, 960)), (85, (320, 240)))
+
+
+def _thumb_distances(thumb_size, thumb_quality, seeds=range(60)):
+    """مسافات بصمة الصورة المصغّرة بين الأصل وكل نسخة معاد رفعها (كما يقارنها الفلتر)"""
+    distances = []
+    for seed in seeds:
+        picture = make_picture(seed)
+        original = media_fingerprint.dhash(jpeg(reupload(picture, 95), thumb_quality, thumb_size))
+        assert original is not None
+        for quality, size in REUPLOADS:
+            variant = media_fingerprint.dhash(jpeg(reupload(picture, quality, size), thumb_quality, thumb_size))
+            distances.append(duplicate_index.hamming(original, variant))
+    return distances
+
+
+def test_recompressed_and_rescaled_stay_close():
+    """Recompressed or rescaled re-uploads keep their thumbnail hash within the duplicate threshold"""
+    # الصور المصغّرة التي تُنزَّل من الخادم (90px وأكبر): كلها ضمن الحد
+    for thumb_size, thumb_quality in (((90, 68), 80), ((320, 240), 87)):
+        distances = _thumb_distances(thumb_size, thumb_quality)
+        assert max(distances) <= MAX_DISTANCE, (thumb_size, max(distances))
+
+    # الصورة المصغّرة المضمّنة (~40px بجودة منخفضة) أكثر ضجيجاً: الغالبية العظمى ضمن الحد
+    distances = _thumb_distances((40, 30), 30)
+    within = sum(distance <= MAX_DISTANCE for distance in distances) / len(distances)
+    assert within >= 0.95, within
+    print(f"✅ النسخ المعاد ضغطها أو تحجيمها ضمن حد التشابه ({within:.0%} للصور المضمّنة)")
+
+
+def test_different_pictures_are_apart():
+    """Unrelated pictures are (almost always) farther apart than the threshold"""
+    hashes = [media_fingerprint.dhash(jpeg(make_picture(1000 + seed), 90)) for seed in range(60)]
+    pairs = close = 0
+    for i in range(len(hashes)):
+        for j in range(i + 1, len(hashes)):
+            pairs += 1
+            close += duplicate_index.hamming(hashes[i], hashes[j]) <= MAX_DISTANCE
+    assert close / pairs < 0.01, (close, pairs)
+    print(f"✅ الصور المختلفة متباعدة ({close} زوج قريب من {pairs})")
+
+
+def test_low_contrast_has_no_hash():
+    """Solid colours and near-flat frames return None instead of a meaningless hash"""
+    assert media_fingerprint.dhash(jpeg(Image.new('RGB', (320, 240), (0, 0, 0)), 90)) is None
+    assert media_fingerprint.dhash(jpeg(Image.new('RGB', (320, 240), (200, 30, 90)), 90)) is None
+    rng = random.Random(1)
+    flat = Image.new('L', (160, 120))
+    flat.putdata([120 + rng.randint(-2, 2) for _ in range(160 * 120)])
+    assert media_fingerprint.dhash(jpeg(flat.convert('RGB'), 90)) is None
+    print("✅ الصور منخفضة التباين بلا بصمة")
+
+
+if __name__ == "__main__":
+    print("🔍 اختبار البصمة الإدراكية للوسائط...")
+    test_recompressed_and_rescaled_stay_close()
+    test_different_pictures_are_apart()
+    test_low_contrast_has_no_hash()
+    print("✅ انتهى اختبار البصمة الإدراكية للوسائط")
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Test script for the per-account send scheduler (pacing, priorities, ordering, flood waits)
+"""
+
+import sys
+import os
+import time
+import random
+import asyncio
+import threading
+import importlib.util
+
+from telethon.errors import FloodWaitError, SlowModeWaitError
+
+# Add the project root to Python path
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+# Load the module directly: the userbot_service package pulls in the whole service
+_spec = importlib.util.spec_from_file_location('send_scheduler', os.path.join(ROOT, 'userbot_service', 'send_scheduler.py'))
+send_scheduler = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(send_scheduler)
+
+SendScheduler = send_scheduler.SendScheduler
+ScheduledClient = send_scheduler.ScheduledClient
+LIVE, RECURRING, EDIT = send_scheduler.LIVE, send_scheduler.RECURRING, send_scheduler.EDIT
+
+
+class FakeClient:
+    """عميل وهمي: يسجل كل إرسال ويرفع أخطاء الفيضان المبرمجة مسبقاً"""
+
+    def __init__(self, latency=0.0, seed=0):
+        self.sent = []          # (chat, text, time)
+        self.errors = {}        # text -> [exception, ...] raised on the next attempts
+        self.in_flight = {}
+        self.max_in_flight = {}
+        self.latency = latency
+        self.rng = random.Random(seed)
+
+    async def send_message(self, entity, text):
+        self.in_flight[entity] = self.in_flight.get(entity, 0) + 1
+        self.max_in_flight[entity] = max(self.max_in_flight.get(entity, 0), self.in_flight[entity])
+        try:
+            if self.latency:
+                await asyncio.sleep(self.rng.uniform(0, self.latency))
+            pending = self.errors.get(text)
+            if pending:
+                raise pending.pop(0)
+            self.sent.append((entity, text, time.monotonic()))
+            return text
+        finally:
+            self.in_flight[entity] -= 1
+
+    async def get_me(self):
+        return 'me'
+
+
+def _scheduler(**kwargs):
+    settings = dict(global_rate=1000, global_burst=1000, chat_rate=1000, chat_burst=1000)
+    settings.update(kwargs)
+    return SendScheduler('test', **settings)
+
+
+def test_token_bucket_pacing():
+    """Bursts are spread out at the chat rate and at the global rate once their burst is used"""
+    async def run():
+        client = FakeClient()
+        scheduler = _scheduler(chat_rate=20, chat_burst=2)
+        view = ScheduledClient(client, scheduler, LIVE)
+        await asyncio.gather(*(view.send_message(1, f'm{i}') for i in range(6)))
+        chat_times = [sent[2] for sent in client.sent]
+
+        client.sent.clear()
+        scheduler = _scheduler(global_rate=20, global_burst=2)
+        view = ScheduledClient(client, scheduler, LIVE)
+        await asyncio.gather(*(view.send_message(chat, 'm') for chat in range(6)))
+        global_times = [sent[2] for sent in client.sent]
+        await scheduler.close()
+        return chat_times, global_times
+
+    for times in asyncio.run(run()):
+        gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+        # The first two use the burst, the rest wait 1/20 s for a token each
+        # (a late wake-up leaves a fraction of a token, so single gaps may come a little early)
+        assert gaps[0] < 0.03, gaps
+        assert all(gap >= 0.03 for gap in gaps[1:]), gaps
+        assert times[-1] - times[0] >= 4 / 20 - 0.01, gaps
+    print("✅ دلو الرموز يوزع الإرسال على المعدل المحدد")
+
+
+def test_priority_order():
+    """Queued live forwards go before recurring posts, which go before edits"""
+    async def run():
+        client = FakeClient()
+        # One token at a time: the sends are all queued before the worker takes the first one
+        scheduler = _scheduler(global_rate=50, global_burst=1)
+        calls = []
+        for i, priority in enumerate([EDIT, RECURRING, LIVE] * 4):
+            view = ScheduledClient(client, scheduler, priority)
+            calls.append(view.send_message(i, f'{priority}:{i}'))
+        await asyncio.gather(*calls)
+        await scheduler.close()
+        return [int(sent[1].split(':')[0]) for sent in client.sent]
+
+    order = asyncio.run(run())
+    assert order == sorted(order) and order[0] == LIVE and order[-1] == EDIT, order
+    print("✅ أولوية التوجيه المباشر ثم المنشورات المتكررة ثم التعديلات")
+
+
+def test_fifo_per_chat():
+    """Sends to one chat run one at a time and in submission order, whatever their latency"""
+    async def run():
+        client = FakeClient(latency=0.005, seed=4)
+        scheduler = _scheduler()
+        view = ScheduledClient(client, scheduler, LIVE)
+        expected = {chat: [] for chat in range(4)}
+        calls = []
+        for i in range(60):
+            chat = random.Random(i).randrange(4)
+            expected[chat].append(f'm{i}')
+            calls.append(view.send_message(chat, f'm{i}'))
+        await asyncio.gather(*calls)
+        await scheduler.close()
+        return client, expected
+
+    client, expected = asyncio.run(run())
+    for chat, texts in expected.items():
+        assert [sent[1] for sent in client.sent if sent[0] == chat] == texts, chat
+    assert max(client.max_in_flight.values()) == 1, client.max_in_flight
+    print("✅ الرسائل لكل محادثة بالترتيب وواحدة في كل مرة")
+
+
+def test_flood_wait_pauses_and_retries():
+    """FloodWaitError pauses the whole account, then the same send is retried before later ones"""
+    async def run():
+        client = FakeClient()
+        client.errors['first'] = [FloodWaitError(request=None, capture=0)]
+        scheduler = _scheduler()
+        view = ScheduledClient(client, scheduler, LIVE)
+        started = time.monotonic()
+        first = asyncio.ensure_future(view.send_message(1, 'first'))
+        await asyncio.sleep(0.05)
+        results = await asyncio.gather(first, view.send_message(1, 'second'), view.send_message(2, 'other'))
+        stats = scheduler.stats()
+        await scheduler.close()
+        return client, started, results, stats
+
+    client, started, results, stats = asyncio.run(run())
+    assert results == ['first', 'second', 'other'], results
+    assert [sent[1] for sent in client.sent if sent[0] == 1] == ['first', 'second']
+    # A flood wait of 0 s still pauses for 1 s plus the 1 s margin, for every chat
+    assert all(sent[2] - started >= 1.9 for sent in client.sent), [sent[2] - started for sent in client.sent]
+    assert stats['flood_waits'] == 1 and stats['retries'] == 1 and stats['sent'] == 3, stats
+    print("✅ FloodWait يوقف الحساب ثم يعيد المحاولة بنفس الترتيب")
+
+
+def test_slow_mode_pauses_only_its_chat():
+    """SlowModeWaitError holds back its own chat while other chats keep sending"""
+    async def run():
+        client = FakeClient()
+        client.errors['slow'] = [SlowModeWaitError(request=None, capture=0)]
+        scheduler = _scheduler()
+        view = ScheduledClient(client, scheduler, LIVE)
+        started = time.monotonic()
+        slow = asyncio.ensure_future(view.send_message(1, 'slow'))
+        await asyncio.sleep(0.05)
+        await view.send_message(2, 'fast')
+        fast_done = time.monotonic() - started
+        await slow
+        await scheduler.close()
+        return client, started, fast_done
+
+    client, started, fast_done = asyncio.run(run())
+    assert fast_done < 1, fast_done
+    assert [sent[1] for sent in client.sent] == ['fast', 'slow']
+    assert client.sent[1][2] - started >= 1.9
+    print("✅ الوضع البطيء يوقف محادثته فقط")
+
+
+def test_gives_up_on_long_flood_wait():
+    """A flood wait longer than max_flood_wait fails the send instead of pausing the account"""
+    async def run():
+        client = FakeClient()
+        client.errors['doomed'] = [FloodWaitError(request=None, capture=5000)]
+        scheduler = _scheduler(max_flood_wait=900)
+        try:
+            await ScheduledClient(client, scheduler, LIVE).send_message(1, 'doomed')
+        except FloodWaitError as e:
+            error = e
+        else:
+            error = None
+        stats = scheduler.stats()
+        await scheduler.close()
+        return error, stats
+
+    error, stats = asyncio.run(run())
+    assert error is not None and error.seconds == 5000
+    assert stats['failed'] == 1 and stats['retries'] == 0 and stats['paused_for'] == 0, stats
+    print("✅ التخلي عن الإرسال عند انتظار أطول من الحد")
+
+
+def test_idle_chats_are_pruned():
+    """Buckets of idle chats and past slow mode pauses do not pile up"""
+    async def run():
+        original = send_scheduler.PRUNE_INTERVAL
+        send_scheduler.PRUNE_INTERVAL = 0.0
+        try:
+            client = FakeClient()
+            scheduler = _scheduler(chat_rate=100, chat_burst=1)
+            view = ScheduledClient(client, scheduler, LIVE)
+            await asyncio.gather(*(view.send_message(chat, 'm') for chat in range(200)))
+            scheduler._chat_paused_until[5] = time.monotonic() - 1
+            await asyncio.sleep(0.05)  # every bucket is full again
+            await view.send_message(1000, 'm')
+            chats = scheduler.stats()['chats']
+            paused = dict(scheduler._chat_paused_until)
+            await scheduler.close()
+            return chats, paused
+        finally:
+            send_scheduler.PRUNE_INTERVAL = original
+
+    chats, paused = asyncio.run(run())
+    assert chats <= 1 and not paused, (chats, paused)
+    print("✅ تنظيف دلاء المحادثات الخاملة")
+
+
+def test_other_methods_bypass_the_queue():
+    """Methods that do not send (get_me, ...) go straight to the client"""
+    client = FakeClient()
+    view = ScheduledClient(client, _scheduler(), LIVE)
+    assert view.client is client
+    assert asyncio.run(view.get_me()) == 'me'
+    print("✅ الدوال غير المرسلة لا تمر عبر الطابور")
+
+
+def test_close_from_another_loop():
+    """close() on a new loop (as at shutdown) stops the worker and fails queued sends in their own loop"""
+    client = FakeClient()
+    scheduler = _scheduler(global_rate=0.01, global_burst=1)
+    view = ScheduledClient(client, scheduler, LIVE)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        first = asyncio.run_coroutine_threadsafe(view.send_message(1, 'first'), loop)
+        assert first.result(timeout=5) == 'first'
+        # No token left for 100 s: this one stays queued
+        queued = asyncio.run_coroutine_threadsafe(view.send_message(2, 'queued'), loop)
+        time.sleep(0.05)
+        worker = scheduler._worker
+
+        asyncio.run(scheduler.close())
+        try:
+            queued.result(timeout=5)
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError("queued send was not failed")
+        time.sleep(0.05)
+        assert worker.cancelled() and not scheduler._queue
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        loop.close()
+    assert [sent[1] for sent in client.sent] == ['first']
+    print("✅ إغلاق الجدولة من حلقة أخرى يوقف العامل ويُفشل الطابور")
+
+
+if __name__ == "__main__":
+    print("🔍 اختبار جدولة الإرسال...")
+    test_token_bucket_pacing()
+    test_priority_order()
+    test_fifo_per_chat()
+    test_flood_wait_pauses_and_retries()
+    test_slow_mode_pauses_only_its_chat()
+    test_gives_up_on_long_flood_wait()
+    test_idle_chats_are_pruned()
+    test_other_methods_bypass_the_queue()
+    test_close_from_another_loop()
+    print("✅ انتهى اختبار جدولة الإرسال")
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the text cleaning plan matches the old apply_text_cleaning
+"""
+
+import sys
+import os
+import random
+import itertools
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from text_cleaning_benchmark import TextCleaningPlan, legacy_clean, build_caption
+
+FLAGS = ('remove_links', 'remove_emojis', 'remove_hashtags', 'remove_phone_numbers',
+         'remove_empty_lines', 'remove_lines_with_keywords')
+KEYWORDS = ['promo', 'اشترك', 'Sub']
+
+# Fragments that overlap between steps when glued together without spaces
+FRAGMENTS = [
+    'mt.me/x', 't.me/chan', 'www.a.co', 'https://x.io/p?q=1', '<https://a.b>', 'site.com/path',
+    '[text](https://l.ink)', '<a href="https://h.co">[md](u)</a>', '([])', '[()]', '( )',
+    '😀', '#tag', '#😀abc', 'abc😀#x', '🔥#عاجل',
+    '2025 123-456-7890', '+966 55 123 4567', '(123) 456-7890', '12345678901', '2025',
+    'promo code', 'اشترك الآن', 'sub', 'كلمة', 'word', ' ', '  ', '\t', '\n', '\n\n', '.', '/',
+]
+
+
+def test_sample_caption():
+    """The benchmark caption gives the same result with every combination of steps"""
+    caption = build_caption()
+    for values in itertools.product((False, True), repeat=len(FLAGS)):
+        settings = dict(zip(FLAGS, values))
+        assert TextCleaningPlan(settings, KEYWORDS).apply(caption) == legacy_clean(caption, settings, KEYWORDS), settings
+    print("✅ نتائج التعليق النموذجي مطابقة لكل تركيبة إعدادات")
+
+
+def test_matches_legacy_on_overlapping_fragments():
+    """Random texts glued from overlapping fragments, all steps enabled or random steps"""
+    random.seed(11)
+    for i in range(3000):
+        settings = {flag: (i % 2 == 0) or random.random() < 0.5 for flag in FLAGS}
+        text = ''.join(random.choice(FRAGMENTS) for _ in range(random.randint(1, 12)))
+        expected = legacy_clean(text, settings, KEYWORDS)
+        assert TextCleaningPlan(settings, KEYWORDS).apply(text) == expected, (settings, text)
+    print("✅ نتائج التنظيف مطابقة للتنفيذ القديم عند تداخل الأنماط")
+
+
+if __name__ == "__main__":
+    print("🔍 اختبار خطة تنظيف النصوص...")
+    test_sample_caption()
+    test_matches_legacy_on_overlapping_fragments()
+    print("✅ انتهى اختبار خطة تنظيف النصوص")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test script for the compiled text replacement program and its result memo
+"""
+
+import re
+import sys
+import os
+import random
+import tempfile
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database.text_replacement_engine import ReplacementProgram
+
+
+def legacy_replace(rules, text):
+    """The per-rule loop previously used by apply_text_replacements"""
+    for find_text, replace_text, is_case_sensitive, is_whole_word in rules:
+        if is_whole_word:
+            flags = 0 if is_case_sensitive else re.IGNORECASE
+            text = re.sub(r'\b' + re.escape(find_text) + r'\b', replace_text, text, flags=flags)
+        elif is_case_sensitive:
+            text = text.replace(find_text, replace_text)
+        else:
+            text = re.sub(re.escape(find_text), replace_text, text, flags=re.IGNORECASE)
+    return text
+
+
+def test_matches_legacy_without_overlaps():
+    """Rules that cannot overlap or feed each other give the same text as the old loop"""
+    random.seed(13)
+    # Every find text is q...z: no rule is inside another or overlaps one, and replacements have no q/z
+    words = ['q' + ''.join(random.choice('abcdeعرب') for _ in range(random.randint(1, 4))) + 'z'
+             for _ in range(40)]
+    separators = ['', ' ', '  ', '.', '-', '\n', 'ـ', 'x', '7']
+    for _ in range(3000):
+        finds = random.sample(words, random.randint(1, 6))
+        if len({find.lower() for find in finds}) != len(finds):
+            continue
+        rules = [(find, str(random.randint(0, 999)) + random.choice(['', 'w', 'ي']),
+                  random.random() < 0.5, random.random() < 0.5) for find in finds]
+        parts = []
+        for _ in range(random.randint(0, 10)):
+            token = random.choice(finds) if random.random() < 0.6 else random.choice(words)
+            if random.random() < 0.2:
+                token = token.swapcase()
+            parts.append(token + random.choice(separators))
+        text = ''.join(parts)
+        assert ReplacementProgram(rules).apply(text)[0] == legacy_replace(rules, text), (rules, text)
+    print("✅ نتائج الاستبدال المُجمّع مطابقة للحلقة القديمة عند عدم التداخل")
+
+
+def test_overlapping_rules_single_pass():
+    """Longest rule wins at a position and replaced text is not scanned again"""
+    program = ReplacementProgram([('ab', '1', True, False), ('abc', '2', True, False)])
+    assert program.apply('abc ab') == ('2 1', 2)
+    assert legacy_replace([('ab', '1', True, False), ('abc', '2', True, False)], 'abc ab') == '1c 1'
+
+    # No cascading: a→b then b→c used to turn "ab" into "cc"
+    program = ReplacementProgram([('a', 'b', True, False), ('b', 'c', True, False)])
+    assert program.apply('ab') == ('bc', 2)
+
+    # A longer whole-word rule does not hide a shorter one elsewhere
+    program = ReplacementProgram([('new', 'N', False, True), ('new york', 'NY', False, False)])
+    assert program.apply('New York is new') == ('NY is N', 2)
+    print("✅ القواعد المتداخلة تُطبّق في مرور واحد (الأطول أولاً)")
+
+
+def test_invalid_template_is_skipped():
+    """A replacement template that re.sub rejects (e.g. \\1) is skipped instead of raising"""
+    program = ReplacementProgram([('x', r'\1', False, False), ('y', '2', True, False), ('', 'empty', True, False)])
+    assert program.size == 1
+    assert program.apply('xy') == ('x2', 1)
+    # Case-sensitive plain rules were never templates
+    assert ReplacementProgram([('x', r'\1', True, False)]).apply('x') == (r'\1', 1)
+    # Escapes still expand for regex-based rules, as with the old re.sub
+    assert ReplacementProgram([('x', r'a\nb', False, False)]).apply('x') == ('a\nb', 1)
+    assert not ReplacementProgram([])
+    print("✅ قوالب الاستبدال غير الصالحة تُتخطّى")
+
+
+def test_memo_dropped_on_rule_change():
+    """A memoized (task_id, version, text) result is dropped when the task's rules change"""
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['SQLITE_DB_PATH'] = os.path.join(directory, 'replacements.db')
+        try:
+            from database.database import Database
+            db = Database()
+        finally:
+            del os.environ['SQLITE_DB_PATH']
+        task_id = db.create_task(1, '-1001', 'source', '-1002', 'target')
+        other_id = db.create_task(1, '-1003', 'source', '-1004', 'target')
+        db.add_text_replacement(task_id, 'ab', '1', True)
+        db.add_text_replacement(other_id, 'ab', '9', True)
+
+        old_key = (task_id, db._replacement_programs.version(task_id), 'abc ab')
+        assert db.apply_text_replacements(task_id, 'abc ab') == '1c 1'
+        assert db.apply_text_replacements(other_id, 'abc ab') == '9c 9'
+        assert db._replacement_results.get(old_key) == '1c 1'
+
+        db.add_text_replacement(task_id, 'abc', '2', True)
+        assert db._replacement_results.get(old_key) is None
+        assert db.apply_text_replacements(task_id, 'abc ab') == '2 1'
+        # The other task's memoized result stays
+        other_key = (other_id, db._replacement_programs.version(other_id), 'abc ab')
+        assert db._replacement_results.get(other_key) == '9c 9'
+
+        db.set_text_replacement_enabled(task_id, False)
+        assert db.apply_text_replacements(task_id, 'abc ab') == 'abc ab'
+    print("✅ نتائج الاستبدال المحفوظة تُحذف عند تعديل القواعد")
+
+
+if __name__ == "__main__":
+    print("🔍 اختبار محرك الاستبدال النصي...")
+    test_matches_legacy_without_overlaps()
+    test_overlapping_rules_single_pass()
+    test_invalid_template_is_skipped()
+    test_memo_dropped_on_rule_change()
+    print("✅ انتهى اختبار محرك الاستبدال النصي")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the compiled word filter matches the old per-word checks
+"""
+
+import re
+import sys
+import os
+import random
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database.word_filter_engine import WordMatcher, build_literal_pattern
+
+
+def legacy_match(entries, text):
+    """The per-word loop previously used by is_message_allowed_by_word_filter"""
+    text_lower = text.lower()
+    for word, is_case_sensitive, is_whole_word in entries:
+        if is_whole_word:
+            flags = 0 if is_case_sensitive else re.IGNORECASE
+            if re.search(r'\b' + re.escape(word) + r'\b', text, flags=flags):
+                return True
+        elif is_case_sensitive:
+            if word in text:
+                return True
+        elif word.lower() in text_lower:
+            return True
+    return False
+
+
+def test_literal_pattern():
+    """Test the prefix-trie alternation"""
+    pattern = re.compile(build_literal_pattern(['spam', 'spa', 'sp.m', 'عاجل']))
+    assert pattern.fullmatch('spam')
+    assert pattern.fullmatch('spa')
+    assert pattern.fullmatch('sp.m')
+    assert pattern.fullmatch('عاجل')
+    assert not pattern.fullmatch('spxm')
+    print("✅ نمط الكلمات المُجمّع يعمل بشكل صحيح")
+
+
+def test_matches_legacy_semantics():
+    """Compare against the legacy loop on random word lists and messages"""
+    random.seed(7)
+    alphabet = 'abAB c.-ـعربي'
+    for _ in range(3000):
+        entries = [
+            (''.join(random.choice(alphabet) for _ in range(random.randint(1, 4))),
+             random.random() < 0.5, random.random() < 0.5)
+            for _ in range(random.randint(1, 6))
+        ]
+        text = ''.join(random.choice(alphabet) for _ in range(random.randint(0, 30)))
+        assert (WordMatcher(entries).search(text) is not None) == legacy_match(entries, text), (entries, text)
+    print("✅ نتائج الفلتر المُجمّع مطابقة للفحص القديم")
+
+
+if __name__ == "__main__":
+    print("🔍 اختبار محرك فلاتر الكلمات...")
+    test_literal_pattern()
+    test_matches_legacy_semantics()
+    print("✅ انتهى اختبار محرك فلاتر الكلمات")
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+قياس سرعة تنظيف النصوص - مقارنة الخطة المُجمّعة مع التنفيذ القديم
+Microbenchmark for the per-message cost of text cleaning on long captions.
+
+Usage:
+    python text_cleaning_benchmark.py [iterations]
+"""
+
+import re
+import sys
+import os
+import time
+import importlib.util
+
+# إضافة المسار للوحدات
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+# تحميل الوحدة مباشرة: استيراد حزمة userbot_service يتطلب telethon
+_spec = importlib.util.spec_from_file_location('text_cleaning', os.path.join(ROOT, 'userbot_service', 'text_cleaning.py'))
+text_cleaning = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(text_cleaning)
+TextCleaningPlan = text_cleaning.TextCleaningPlan
+
+SETTINGS = {
+    'remove_links': True,
+    'remove_emojis': True,
+    'remove_hashtags': True,
+    'remove_phone_numbers': True,
+    'remove_empty_lines': True,
+    'remove_lines_with_keywords': True,
+}
+KEYWORDS = ['اشترك', 'subscribe', 'للإعلان', 'promo code', 'تابعونا'] + [f'كلمة{i}' for i in range(50)]
+
+
+def build_caption(lines: int = 60) -> str:
+    """تعليق طويل يشبه منشورات القنوات"""
+    samples = [
+        '🔥 خبر عاجل: ارتفاع الأسعار في الأسواق اليوم 📈',
+        'التفاصيل الكاملة هنا https://example.com/news/12345?ref=channel',
+        'تابعونا على t.me/example_channel للمزيد',
+        '',
+        'للتواصل: +966 55 123 4567 أو (123) 456-7890',
+        '#اخبار #اقتصاد #عاجل',
+        'Read more at [our site](https://example.org/article) and www.example.net',
+        '   مسافات    زائدة   في   السطر   ',
+        '',
+        '',
+        'سنة 2025 ليست رقم هاتف',
+    ]
+    return '\n'.join(samples[i % len(samples)] for i in range(lines))
+
+
+def legacy_clean(message_text: str, settings: dict, keywords: list) -> str:
+    """التنفيذ السابق لـ apply_text_cleaning (للمقارنة فقط)"""
+    cleaned_text = message_text
+    if settings.get('remove_links', False):
+        cleaned_text = re.sub(r'\[([^\]]+)\]\s*\(([^)]*)\)', r'\1', cleaned_text)
+        cleaned_text = re.sub(r'<a\s+href=[\'\"][^\'\"]+[\'\"]\s*>(.*?)</a>', r'\1', cleaned_text, flags=re.IGNORECASE | re.DOTALL)
+        cleaned_text = re.sub(r'<https?://[^>]+>', '', cleaned_text)
+        cleaned_text = re.sub(r'https?://[^\s]+', '', cleaned_text)
+        cleaned_text = re.sub(r't\.me/[^\s]+', '', cleaned_text)
+        cleaned_text = re.sub(r'www\.[^\s]+', '', cleaned_text)
+        cleaned_text = re.sub(r'\b[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.([a-zA-Z]{2,6}\.?)+(/[^\s]*)?', '', cleaned_text)
+        cleaned_text = re.sub(r'\[\s*\]', '', cleaned_text)
+        cleaned_text = re.sub(r'\(\s*\)', '', cleaned_text)
+    if settings.get('remove_emojis', False):
+        emoji_pattern = re.compile(
+            "["
+            "\U0001F600-\U0001F64F"
+            "\U0001F300-\U0001F5FF"
+            "\U0001F680-\U0001F6FF"
+            "\U0001F1E0-\U0001F1FF"
+            "\U00002700-\U000027BF"
+            "\U0001f926-\U0001f937"
+            "\U00010000-\U0010ffff"
+            "\u2640-\u2642"
+            "\u2600-\u2B55"
+            "\u200d"
+            "\u23cf"
+            "\u23e9-\u23f3"
+            "\u23f8-\u23f9"
+            "\u3030"
+            "]+",
+            flags=re.UNICODE
+        )
+        cleaned_text = emoji_pattern.sub('', cleaned_text)
+    if settings.get('remove_hashtags', False):
+        cleaned_text = re.sub(r'#\w+', '', cleaned_text)
+    if settings.get('remove_phone_numbers', False):
+        for pattern in [
+            r'\+\d{1,4}[-.\s]?\(?\d{1,4}\)?[-.\s]?\d{1,4}[-.\s]?\d{4,9}',
+            r'\b\d{3}[-.\s]\d{3}[-.\s]\d{4}\b',
+            r'\b\d{4}[-.\s]\d{3}[-.\s]\d{3}\b',
+            r'\b\d{2}[-.\s]\d{4}[-.\s]\d{4}\b',
+            r'\b\d{10,15}\b',
+            r'\(\d{3}\)\s?\d{3}[-.\s]?\d{4}',
+        ]:
+            cleaned_text = re.sub(pattern, '', cleaned_text)
+    if settings.get('remove_lines_with_keywords', False) and keywords:
+        cleaned_text = '\n'.join(
+            line for line in cleaned_text.split('\n')
+            if not any(keyword.lower() in line.lower() for keyword in keywords)
+        )
+    cleaned_text = '\n'.join(re.sub(r'[ \t]+', ' ', line.strip()) for line in cleaned_text.split('\n'))
+    if settings.get('remove_empty_lines', False):
+        lines = cleaned_text.split('\n')
+        cleaned_text = '\n'.join(
+            line for i, line in enumerate(lines)
+            if line.strip() or (0 < i < len(lines) - 1 and lines[i - 1].strip() and lines[i + 1].strip())
+        )
+    return cleaned_text
+
+
+def bench(label: str, func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    per_message = (time.perf_counter() - start) / iterations * 1e6
+    print(f"  {label:<22} {per_message:10.1f} µs/رسالة")
+    return per_message
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    caption = build_caption()
+    plan = TextCleaningPlan(SETTINGS, KEYWORDS)
+
+    same = plan.apply(caption) == legacy_clean(caption, SETTINGS, KEYWORDS)
+    print(f"🧪 تعليق بطول {len(caption)} حرف، {iterations} تكرار - النتائج متطابقة: {'✅' if same else '❌'}")
+
+    old = bench('التنفيذ القديم', lambda: legacy_clean(caption, SETTINGS, KEYWORDS), iterations)
+    new = bench('الخطة المُجمّعة', lambda: plan.apply(caption), iterations)
+    print(f"⚡ التسريع: {old / new:.1f}x")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""
+Duplicate Index - فهرس التشابه لفلتر التكرار
+Per-task in-memory MinHash LSH index over the messages of the duplicate
+filter window. A new message is compared only against the stored messages
+that share at least one LSH band with it (plus exact media hash matches),
+instead of against every message in the window; candidates are then
+verified with the same word-set Jaccard similarity the filter always used.
+
+Media is matched by exact photo/document id and, when the task enables it, by
+a 64-bit perceptual hash (see media_fingerprint) within a Hamming distance.
+The perceptual hashes are split into 8 chunks of 8 bits; two hashes within
+distance 7 must agree on at least one chunk, so only entries sharing a chunk
+are compared.
+
+The index is warmed once per task from message_duplicates (which stays the
+persistent, incrementally written store) and entries expire with the task's
+time window.
+"""
+import os
+import time
+import heapq
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_SIZE = 128
+_VALUE_BITS = 57
+_VALUE_MASK = (1 << _VALUE_BITS) - 1
+_EMPTY = 1 << 64
+
+# Probability that a pair at exactly the threshold becomes a candidate
+TARGET_RECALL = 0.99
+
+PHASH_BITS = 64
+PHASH_CHUNKS = 8
+_CHUNK_BITS = PHASH_BITS // PHASH_CHUNKS
+_CHUNK_MASK = (1 << _CHUNK_BITS) - 1
+# Chunk lookup finds every hash within PHASH_CHUNKS - 1 bits (pigeonhole)
+PHASH_MAX_DISTANCE = min(PHASH_CHUNKS - 1, max(0, int(os.getenv('DUPLICATE_PHASH_DISTANCE', '6'))))
+
+
+def text_tokens(text: str) -> FrozenSet[str]:
+    """Word set used for similarity (same normalisation as the original filter)"""
+    return frozenset((text or '').lower().split())
+
+
+def jaccard(tokens1: FrozenSet[str], tokens2: FrozenSet[str]) -> float:
+    if not tokens1 or not tokens2:
+        return 0.0
+    intersection = len(tokens1 & tokens2)
+    return intersection / (len(tokens1) + len(tokens2) - intersection)
+
+
+def minhash_signature(tokens: Iterable[str], size: int = SIGNATURE_SIZE) -> Tuple[int, ...]:
+    """One-permutation MinHash with rotation densification (one hash per token)"""
+    bins = [_EMPTY] * size
+    for token in tokens:
+        value = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+        slot = value % size
+        value = (value // size) & _VALUE_MASK
+        if value < bins[slot]:
+            bins[slot] = value
+    if all(value == _EMPTY for value in bins):
+        return ()
+    # Empty bins borrow the next non-empty bin to the right, tagged with the distance
+    for index in range(size):
+        if bins[index] != _EMPTY:
+            continue
+        distance = 1
+        while bins[(index + distance) % size] == _EMPTY or bins[(index + distance) % size] > _VALUE_MASK:
+            distance += 1
+        bins[index] = bins[(index + distance) % size] | (distance << _VALUE_BITS)
+    return tuple(bins)
+
+
+def hamming(hash1: int, hash2: int) -> int:
+    return bin(hash1 ^ hash2).count('1')
+
+
+def format_phash(value: Optional[int]) -> str:
+    """Storage form of a perceptual hash in message_duplicates.media_phash"""
+    return f"{value:016x}" if value is not None else ""
+
+
+def parse_phash(text: Optional[str]) -> Optional[int]:
+    try:
+        return int(text, 16) if text else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _phash_chunks(value: int) -> List[int]:
+    return [(value >> (chunk * _CHUNK_BITS)) & _CHUNK_MASK for chunk in range(PHASH_CHUNKS)]
+
+
+def lsh_bands(threshold: float, size: int = SIGNATURE_SIZE) -> Tuple[int, int]:
+    """(bands, rows) with the most rows per band that still finds pairs at threshold with TARGET_RECALL"""
+    threshold = min(max(threshold, 0.05), 1.0)
+    best = (size, 1)
+    for rows in range(1, size + 1):
+        bands = size // rows
+        if bands < 1:
+            break
+        recall = 1 - (1 - threshold ** rows) ** bands
+        if recall < TARGET_RECALL:
+            break
+        best = (bands, rows)
+    return best
+
+
+@dataclass
+class _Entry:
+    row_id: Optional[int]
+    tokens: FrozenSet[str]
+    media_hash: str
+    timestamp: int
+    signature: Tuple[int, ...] = ()
+    phash: Optional[int] = None
+
+
+@dataclass
+class DuplicateMatch:
+    row_id: Optional[int]
+    similarity: float
+    media_match: bool
+    phash_distance: Optional[int] = None
+
+
+@dataclass
+class _TaskIndex:
+    loaded_since: int
+    bands: Tuple[int, int] = (0, 0)
+    entries: Dict[int, _Entry] = field(default_factory=dict)
+    buckets: List[Dict[Tuple[int, ...], Set[int]]] = field(default_factory=list)
+    media: Dict[str, Set[int]] = field(default_factory=dict)
+    phashes: List[Dict[int, Set[int]]] = field(default_factory=lambda: [{} for _ in range(PHASH_CHUNKS)])
+    expiry: List[Tuple[int, int]] = field(default_factory=list)
+
+
+class DuplicateIndex:
+    """MinHash LSH + media-hash + perceptual-hash index per task, expired by the task's time window"""
+
+    def __init__(self):
+        self._tasks: Dict[int, _TaskIndex] = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.stats_counters = {'lookups': 0, 'candidates': 0, 'duplicates': 0, 'phash_duplicates': 0,
+                               'added': 0, 'expired': 0, 'warmups': 0}
+
+    # ----- public API -----
+
+    def find(self, task_id: int, text: str, media_hash: str, threshold: float, cutoff: int,
+             check_text: bool, check_media: bool,
+             loader: Callable[[int], List[dict]],
+             media_phash: Optional[int] = None,
+             max_distance: int = PHASH_MAX_DISTANCE) -> Optional[DuplicateMatch]:
+        """Best stored message at or above threshold (or with the same or a similar media), None if unique"""
+        tokens = text_tokens(text) if check_text else frozenset()
+        with self._lock:
+            index = self._task(task_id, cutoff, loader)
+            self._expire(index, cutoff)
+            self._ensure_bands(index, threshold)
+            self.stats_counters['lookups'] += 1
+
+            if check_media and media_hash:
+                for entry_id in index.media.get(media_hash, ()):
+                    entry = index.entries[entry_id]
+                    self.stats_counters['duplicates'] += 1
+                    return DuplicateMatch(entry.row_id, jaccard(tokens, entry.tokens), True)
+
+            if check_media and media_phash is not None:
+                match = self._nearest_phash(index, media_phash, min(max_distance, PHASH_CHUNKS - 1))
+                if match is not None:
+                    entry_id, distance = match
+                    entry = index.entries[entry_id]
+                    self.stats_counters['phash_duplicates'] += 1
+                    self.stats_counters['duplicates'] += 1
+                    return DuplicateMatch(entry.row_id, jaccard(tokens, entry.tokens), True, distance)
+
+            if not tokens:
+                return None
+            candidates: Set[int] = set()
+            for band, key in enumerate(self._band_keys(minhash_signature(tokens), index.bands)):
+                candidates.update(index.buckets[band].get(key, ()))
+            self.stats_counters['candidates'] += len(candidates)
+            best: Optional[DuplicateMatch] = None
+            for entry_id in candidates:
+                entry = index.entries[entry_id]
+                similarity = jaccard(tokens, entry.tokens)
+                if similarity >= threshold and (best is None or similarity > best.similarity):
+                    best = DuplicateMatch(entry.row_id, similarity, False)
+            if best is not None:
+                self.stats_counters['duplicates'] += 1
+            logger.debug(f"🔍 فهرس التكرار للمهمة {task_id}: {len(candidates)} مرشح من {len(index.entries)} رسالة")
+            return best
+
+    def add(self, task_id: int, row_id: Optional[int], text: str, media_hash: str, timestamp: int,
+            media_phash: Optional[int] = None):
+        with self._lock:
+            index = self._tasks.get(task_id)
+            if index is not None:
+                self._insert(index, row_id, text, media_hash, timestamp, media_phash)
+                self.stats_counters['added'] += 1
+
+    def touch(self, task_id: int, row_id: Optional[int], timestamp: int):
+        """A stored message matched again: keep it alive for another window"""
+        with self._lock:
+            index = self._tasks.get(task_id)
+            entry = index.entries.get(row_id) if index is not None and row_id is not None else None
+            if entry is not None:
+                entry.timestamp = timestamp
+                heapq.heappush(index.expiry, (timestamp, row_id))
+
+    def invalidate_task(self, task_id: int):
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'tasks': len(self._tasks),
+                'entries': sum(len(index.entries) for index in self._tasks.values()),
+                **self.stats_counters,
+            }
+
+    # ----- internals (lock held) -----
+
+    def _task(self, task_id: int, cutoff: int, loader: Callable[[int], List[dict]]) -> _TaskIndex:
+        index = self._tasks.get(task_id)
+        if index is not None and index.loaded_since <= cutoff:
+            return index
+        # First use, or the window grew beyond what was loaded: warm from the persistent store
+        index = _TaskIndex(loaded_since=cutoff)
+        rows = loader(cutoff) or []
+        for row in rows:
+            timestamp = row.get('timestamp')
+            if not isinstance(timestamp, int):
+                timestamp = int(time.time())
+            self._insert(index, row.get('id'), row.get('message_text') or '', row.get('media_hash') or '', timestamp,
+                         parse_phash(row.get('media_phash')), index_bands=False)
+        self._tasks[task_id] = index
+        self.stats_counters['warmups'] += 1
+        logger.info(f"📚 تم تحميل {len(index.entries)} رسالة في فهرس التكرار للمهمة {task_id}")
+        return index
+
+    def _insert(self, index: _TaskIndex, row_id: Optional[int], text: str, media_hash: str, timestamp: int,
+                media_phash: Optional[int] = None, index_bands: bool = True):
+        if row_id is None:
+            self._next_id -= 1
+            entry_id = self._next_id
+        else:
+            entry_id = row_id
+        tokens = text_tokens(text)
+        entry = _Entry(row_id, tokens, media_hash, timestamp, minhash_signature(tokens) if tokens else (), media_phash)
+        index.entries[entry_id] = entry
+        heapq.heappush(index.expiry, (timestamp, entry_id))
+        if media_hash:
+            index.media.setdefault(media_hash, set()).add(entry_id)
+        if media_phash is not None:
+            for chunk, key in enumerate(_phash_chunks(media_phash)):
+                index.phashes[chunk].setdefault(key, set()).add(entry_id)
+        if index_bands and index.buckets and entry.signature:
+            for band, key in enumerate(self._band_keys(entry.signature, index.bands)):
+                index.buckets[band].setdefault(key, set()).add(entry_id)
+
+    @staticmethod
+    def _nearest_phash(index: _TaskIndex, media_phash: int, max_distance: int) -> Optional[Tuple[int, int]]:
+        """(entry id, distance) of the closest stored perceptual hash within max_distance"""
+        candidates: Set[int] = set()
+        for chunk, key in enumerate(_phash_chunks(media_phash)):
+            candidates.update(index.phashes[chunk].get(key, ()))
+        best: Optional[Tuple[int, int]] = None
+        for entry_id in candidates:
+            distance = hamming(media_phash, index.entries[entry_id].phash)
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (entry_id, distance)
+        return best
+
+    def _ensure_bands(self, index: _TaskIndex, threshold: float):
+        bands = lsh_bands(threshold)
+        if bands == index.bands and index.buckets:
+            return
+        # Threshold changed (or first lookup): re-band the stored signatures
+        index.bands = bands
+        index.buckets = [{} for _ in range(bands[0])]
+        for entry_id, entry in index.entries.items():
+            if entry.signature:
+                for band, key in enumerate(self._band_keys(entry.signature, bands)):
+                    index.buckets[band].setdefault(key, set()).add(entry_id)
+
+    @staticmethod
+    def _band_keys(signature: Tuple[int, ...], bands: Tuple[int, int]):
+        if not signature:
+            return []
+        count, rows = bands
+        return [signature[band * rows:(band + 1) * rows] for band in range(count)]
+
+    def _expire(self, index: _TaskIndex, cutoff: int):
+        while index.expiry and index.expiry[0][0] <= cutoff:
+            timestamp, entry_id = heapq.heappop(index.expiry)
+            entry = index.entries.get(entry_id)
+            if entry is None or entry.timestamp != timestamp:
+                continue  # touched later (a newer heap item exists) or already removed
+            del index.entries[entry_id]
+            if entry.media_hash:
+                ids = index.media.get(entry.media_hash)
+                if ids is not None:
+                    ids.discard(entry_id)
+                    if not ids:
+                        del index.media[entry.media_hash]
+            if entry.phash is not None:
+                for chunk, key in enumerate(_phash_chunks(entry.phash)):
+                    ids = index.phashes[chunk].get(key)
+                    if ids is not None:
+                        ids.discard(entry_id)
+                        if not ids:
+                            del index.phashes[chunk][key]
+            if entry.signature and index.buckets:
+                for band, key in enumerate(self._band_keys(entry.signature, index.bands)):
+                    ids = index.buckets[band].get(key)
+                    if ids is not None:
+                        ids.discard(entry_id)
+                        if not ids:
+                            del index.buckets[band][key]
+            self.stats_counters['expired'] += 1
+        index.loaded_since = max(index.loaded_since, cutoff)
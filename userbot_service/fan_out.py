@@ -0,0 +1,89 @@
+"""
+Target Fan-Out - توزيع الرسالة على الأهداف بالتوازي
+Delivers one message to all of its target chats concurrently, with a cap on
+concurrent deliveries per Telegram account. Deliveries to the same target
+chat run in the order they were dispatched, so consecutive messages (or two
+tasks sharing a target) never overtake each other in that chat.
+
+Settings: FANOUT_MAX_CONCURRENCY
+"""
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+Delivery = Tuple[str, Callable[[], Awaitable[Any]]]
+
+
+class TargetFanOut:
+    """Concurrent per-target delivery, bounded per account and ordered per target chat"""
+
+    def __init__(self, max_concurrency: Optional[int] = None):
+        self.max_concurrency = max_concurrency or int(os.getenv('FANOUT_MAX_CONCURRENCY', '8'))
+        self._semaphores: Dict[Hashable, asyncio.Semaphore] = {}
+        # Last delivery dispatched to each (account, target chat); the next one waits for it
+        self._tails: Dict[Tuple[Hashable, str], asyncio.Future] = {}
+        self._running = 0
+        self.stats_counters = {'dispatches': 0, 'deliveries': 0, 'failed': 0, 'peak_parallel': 0}
+
+    async def dispatch(self, account: Hashable, deliveries: Sequence[Delivery],
+                       sequential: bool = False) -> List[Any]:
+        """Run every (target, deliver) pair and return their results in the given order
+
+        sequential=True delivers one target after another (e.g. when a sending
+        interval between targets is configured), still in order per target chat.
+        """
+        loop = asyncio.get_running_loop()
+        # Take each target's place in line before the first await
+        slots = []
+        for target, deliver in deliveries:
+            key = (account, target)
+            previous = self._tails.get(key)
+            done = loop.create_future()
+            self._tails[key] = done
+            slots.append((key, previous, done, deliver))
+        self.stats_counters['dispatches'] += 1
+
+        if sequential:
+            return [await self._deliver(account, *slot) for slot in slots]
+        return list(await asyncio.gather(*(self._deliver(account, *slot) for slot in slots)))
+
+    def stats(self) -> dict:
+        return {
+            'max_concurrency': self.max_concurrency,
+            'running': self._running,
+            'queued_targets': len(self._tails),
+            **self.stats_counters,
+        }
+
+    def _semaphore(self, account: Hashable) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(account)
+        if semaphore is None:
+            semaphore = self._semaphores[account] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def _deliver(self, account: Hashable, key: Tuple[Hashable, str], previous: Optional[asyncio.Future],
+                       done: asyncio.Future, deliver: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            async with self._semaphore(account):
+                self._running += 1
+                self.stats_counters['peak_parallel'] = max(self.stats_counters['peak_parallel'], self._running)
+                try:
+                    result = await deliver()
+                    self.stats_counters['deliveries'] += 1
+                    return result
+                finally:
+                    self._running -= 1
+        except Exception as e:
+            self.stats_counters['failed'] += 1
+            logger.error(f"❌ فشل الإرسال إلى الهدف {key[1]}: {e}")
+            return None
+        finally:
+            if not done.done():
+                done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
@@ -0,0 +1,151 @@
+"""
+Media Cache - ذاكرة مؤقتة محدودة للوسائط المعالجة
+LRU cache with an item limit and a TTL, used for the userbot's
+processed-media, per-message download and uploaded-file caches, with
+hit/miss/eviction counters for monitoring.
+
+Values are small references (spool file paths, uploaded file handles): the
+media itself lives on disk and its lifetime belongs to the media spool, so
+the cache bounds entries, not bytes.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class BoundedMediaCache:
+    """Thread-safe LRU keyed cache bounded by items and age"""
+
+    def __init__(self, name: str, max_items: int = 1000, ttl: Optional[float] = None):
+        self.name = name
+        self.max_items = max_items
+        self.ttl = ttl
+
+        # key -> (value, expires_at)
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, Optional[float]]]' = OrderedDict()
+        self._lock = threading.RLock()
+        self.stats_counters: Dict[str, int] = {
+            'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0,
+        }
+
+    # ----- dict-like interface -----
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats_counters['misses'] += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.stats_counters['expirations'] += 1
+                self.stats_counters['misses'] += 1
+                return default
+            self._entries.move_to_end(key)
+            self.stats_counters['hits'] += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+            self._enforce_limits()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self.stats_counters['expirations'] += 1
+                return default
+            return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            expires_at = entry[1]
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.stats_counters['expirations'] += 1
+                return False
+            return True
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.set(key, value)
+
+    def __delitem__(self, key: Hashable):
+        with self._lock:
+            del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        with self._lock:
+            return [(key, entry[0]) for key, entry in self._entries.items()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # ----- maintenance -----
+
+    def purge_expired(self) -> int:
+        """Drop every expired entry; returns how many were removed"""
+        with self._lock:
+            removed = self._drop_expired()
+            self.stats_counters['expirations'] += removed
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats_counters['hits'] + self.stats_counters['misses']
+            return {
+                'name': self.name,
+                'items': len(self._entries),
+                'max_items': self.max_items,
+                'hit_rate': (self.stats_counters['hits'] / lookups * 100) if lookups else 0.0,
+                **self.stats_counters,
+            }
+
+    # ----- internals (lock held) -----
+
+    def _drop_expired(self) -> int:
+        now = time.monotonic()
+        expired = [key for key, (_, expires_at) in self._entries.items()
+                   if expires_at is not None and expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        return len(expired)
+
+    def _enforce_limits(self):
+        if len(self._entries) <= self.max_items:
+            return
+        # العناصر المنتهية أولاً، ثم الأقدم استخداماً حتى العودة للحد
+        self.stats_counters['expirations'] += self._drop_expired()
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+            self.stats_counters['evictions'] += 1
@@ -0,0 +1,95 @@
+"""
+البصمة الإدراكية للوسائط - Media Fingerprint
+بصمة فرق (dHash) من 64 بت لصورة أو فيديو تُحسب من أصغر صورة مصغّرة يحتفظ بها تيليجرام أصلاً.
+نفس الصورة إذا أعادت رفعها قناة أخرى أو أعاد تيليجرام ضغطها تحصل على معرف صورة/وثيقة جديد
+لكن بصورة مصغّرة شبه مطابقة، فيرفضها فلتر التكرار بمسافة Hamming قبل تنزيل أي شيء أو تطبيق العلامة المائية.
+
+تُستخدم الصورة المصغّرة المضمّنة في الرسالة نفسها إن وُجدت، وإلا تُجلب أصغر صورة مصغّرة
+من الخادم (بضعة كيلوبايت). صورة الفيديو المصغّرة هي الإطار الذي اختاره تيليجرام عند الرفع.
+
+dhash لا يحتاج إلا PIL (وحدات telethon تُستورد داخل الدوال التي تقرأ الرسائل).
+"""
+import io
+import logging
+from typing import List, Optional
+
+from media_worker_pool import media_pool
+
+logger = logging.getLogger(__name__)
+
+HASH_WIDTH = 8
+HASH_HEIGHT = 8
+HASH_BITS = HASH_WIDTH * HASH_HEIGHT
+
+# الصور شبه المتجانسة (لون واحد، إطار أسود) لا تقول شيئاً عن المحتوى
+MIN_CONTRAST = 8
+
+
+def dhash(image_bytes: bytes) -> Optional[int]:
+    """بصمة الفرق: بت لكل زوج بكسلات متجاورين أفقياً في صورة رمادية 9x8"""
+    from PIL import Image
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        # فك ترميز JPEG بدقة مصغّرة مباشرة
+        image.draft('L', (HASH_WIDTH * 4, HASH_HEIGHT * 4))
+        gray = image.convert('L').resize((HASH_WIDTH + 1, HASH_HEIGHT), Image.BILINEAR)
+    pixels = list(gray.tobytes())
+    if max(pixels) - min(pixels) < MIN_CONTRAST:
+        return None
+    value = 0
+    for row in range(HASH_HEIGHT):
+        offset = row * (HASH_WIDTH + 1)
+        for col in range(HASH_WIDTH):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def _media_thumbs(media) -> List:
+    """أحجام الصور المصغّرة لصورة، أو لوثيقة فيديو/صورة متحركة/صورة"""
+    from telethon.tl import types
+    photo = getattr(media, 'photo', None)
+    if isinstance(photo, types.Photo):
+        return list(photo.sizes or [])
+    document = getattr(media, 'document', None)
+    if isinstance(document, types.Document):
+        mime_type = document.mime_type or ''
+        if mime_type.startswith(('video/', 'image/')):
+            return list(document.thumbs or [])
+    return []
+
+
+def _inline_thumb_bytes(sizes: List) -> Optional[bytes]:
+    from telethon import utils
+    from telethon.tl import types
+    for size in sizes:
+        if isinstance(size, types.PhotoStrippedSize):
+            return utils.stripped_photo_to_jpg(size.bytes)
+    for size in sizes:
+        if isinstance(size, types.PhotoCachedSize):
+            return size.bytes
+    return None
+
+
+def _smallest_remote_thumb(sizes: List):
+    from telethon.tl import types
+    remote = [size for size in sizes if isinstance(size, (types.PhotoSize, types.PhotoSizeProgressive))]
+    return min(remote, key=lambda size: size.w * size.h) if remote else None
+
+
+async def media_perceptual_hash(client, message) -> Optional[int]:
+    """بصمة dHash لصورة الرسالة المصغّرة، أو None إذا لم تكن للوسائط صورة مصغّرة صالحة"""
+    sizes = _media_thumbs(getattr(message, 'media', None))
+    if not sizes:
+        return None
+    try:
+        data = _inline_thumb_bytes(sizes)
+        if data is None:
+            thumb = _smallest_remote_thumb(sizes)
+            if thumb is None:
+                return None
+            data = await client.download_media(message, file=bytes, thumb=thumb)
+        if not data:
+            return None
+        return await media_pool.run(dhash, data)
+    except Exception as e:
+        logger.warning(f"⚠️ تعذر حساب البصمة الإدراكية للوسائط: {e}")
+        return None
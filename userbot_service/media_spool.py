@@ -0,0 +1,115 @@
+"""
+Media Spool - مجلد مؤقت لتنزيل الوسائط على القرص بدلاً من الذاكرة
+Media is downloaded straight to a file under the spool directory and the
+file path is handed from stage to stage (watermark, audio tags, upload), so a
+large video is never held in memory or rewritten to another temp file.
+"""
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _default_spool_dir() -> str:
+    explicit = os.getenv('MEDIA_SPOOL_DIR')
+    if explicit and explicit.strip():
+        return explicit.strip()
+    data_dir = os.getenv('DATA_DIR', '/app/data')
+    return os.path.join(data_dir.strip() or '.', 'media_spool')
+
+
+class MediaSpool:
+    """Directory of per-message media files, removed after use or when stale"""
+
+    def __init__(self, directory: Optional[str] = None, max_age: Optional[int] = None):
+        self.directory = directory or _default_spool_dir()
+        self.max_age = max_age if max_age is not None else int(os.getenv('MEDIA_SPOOL_MAX_AGE', '3600'))
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def ensure_dir(self) -> str:
+        """Create the spool directory (or its temp fallback) and return it"""
+        if self._ready:
+            return self.directory
+        with self._lock:
+            if not self._ready:
+                try:
+                    os.makedirs(self.directory, exist_ok=True)
+                except Exception as e:
+                    # مجلد البيانات غير قابل للكتابة - استخدام مجلد النظام المؤقت
+                    import tempfile
+                    fallback = os.path.join(tempfile.gettempdir(), 'media_spool')
+                    logger.warning(f"⚠️ تعذر إنشاء مجلد الوسائط المؤقت {self.directory}: {e} - استخدام {fallback}")
+                    self.directory = fallback
+                    os.makedirs(self.directory, exist_ok=True)
+                self._ready = True
+                self.sweep()
+        return self.directory
+
+    def new_path(self, file_name: str = '') -> str:
+        """Unique path inside the spool keeping the extension of file_name"""
+        extension = os.path.splitext(file_name)[1].lower() if file_name else ''
+        return os.path.join(self.ensure_dir(), uuid.uuid4().hex + extension)
+
+    async def download(self, message, file_name: str = '') -> Optional[str]:
+        """Download a message's media into the spool; returns the file path or None"""
+        path = self.new_path(file_name)
+        try:
+            result = await message.download_media(file=path)
+        except Exception as e:
+            logger.error(f"❌ فشل تنزيل الوسائط إلى {path}: {e}")
+            self.discard(path)
+            return None
+        if not result or not os.path.exists(result) or os.path.getsize(result) == 0:
+            self.discard(result or path)
+            return None
+        return result
+
+    def discard(self, *paths: Optional[str]):
+        """Remove spool files; paths outside the spool are left alone"""
+        root = os.path.abspath(self.directory)
+        for path in paths:
+            if not path or not isinstance(path, str):
+                continue
+            if os.path.dirname(os.path.abspath(path)) != root:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.debug(f"تعذر حذف ملف الوسائط المؤقت {path}: {e}")
+
+    def sweep(self, max_age: Optional[int] = None) -> int:
+        """Delete spool files older than max_age seconds (left over after crashes)"""
+        max_age = self.max_age if max_age is None else max_age
+        cutoff = time.time() - max_age
+        removed = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.unlink(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.debug(f"تعذر تنظيف {entry.path}: {e}")
+        if removed:
+            logger.info(f"🧹 تم حذف {removed} ملف وسائط مؤقت قديم من {self.directory}")
+        return removed
+
+
+media_spool = MediaSpool()
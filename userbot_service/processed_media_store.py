@@ -0,0 +1,185 @@
+"""
+Processed Media Store - مخزن الوسائط المعالجة حسب هوية المحتوى
+Keeps processed media files on disk keyed by the Telegram document/photo id
+and a hash of the processing settings. The same file reposted in another
+source chat (a new message, a new file_reference, the same document id) is
+then served from the store without being downloaded or processed again.
+
+File names on disk are sanitized; the original name sent to Telegram is kept
+in a small sidecar file next to each entry so it survives restarts.
+"""
+import os
+import re
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_UNSAFE_NAME_CHARS = re.compile(r'[^\w.\-]+', re.UNICODE)
+
+
+def media_content_id(media) -> Optional[Tuple[str, int]]:
+    """Stable identity of a message's media, independent of access hash and file_reference"""
+    document = getattr(media, 'document', None)
+    if document is not None and getattr(document, 'id', None):
+        return ('document', document.id)
+    photo = getattr(media, 'photo', None)
+    if photo is not None and getattr(photo, 'id', None):
+        return ('photo', photo.id)
+    return None
+
+
+class ProcessedMediaStore:
+    """Disk-backed LRU of processed media files bounded by bytes and age"""
+
+    SEPARATOR = '__'
+    NAME_SUFFIX = '.name'
+
+    def __init__(self, directory: str, max_bytes: int, ttl: Optional[float] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key digest -> (path, file_name, size)
+        self._index: 'OrderedDict[str, Tuple[str, str, int]]' = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.stats_counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    @staticmethod
+    def digest(key: Hashable) -> str:
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def get(self, key: Hashable) -> Optional[Tuple[str, str]]:
+        """(path, file_name) of the processed media for key, or None"""
+        digest = self.digest(key)
+        with self._lock:
+            self._load_index()
+            entry = self._index.get(digest)
+            if entry is not None and self._expired(entry[0]):
+                self._drop(digest)
+                entry = None
+            if entry is None or not os.path.exists(entry[0]):
+                if entry is not None:
+                    self._drop(digest)
+                self.stats_counters['misses'] += 1
+                return None
+            self._index.move_to_end(digest)
+            self.stats_counters['hits'] += 1
+            return entry[0], entry[1]
+
+    def put(self, key: Hashable, source_path: str, file_name: str) -> Optional[str]:
+        """Store a processed file (hard link when possible, copy otherwise)"""
+        digest = self.digest(key)
+        safe_name = _UNSAFE_NAME_CHARS.sub('_', file_name or 'media')[:120]
+        target = os.path.join(self.directory, f"{digest}{self.SEPARATOR}{safe_name}")
+        try:
+            size = os.path.getsize(source_path)
+        except OSError:
+            return None
+        if size > self.max_bytes:
+            return None
+        with self._lock:
+            self._load_index()
+            if digest in self._index:
+                self._drop(digest)
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                try:
+                    os.link(source_path, target)
+                except OSError:
+                    shutil.copyfile(source_path, target)
+                with open(self._name_path(digest), 'w', encoding='utf-8') as f:
+                    f.write(file_name or '')
+            except Exception as e:
+                logger.warning(f"⚠️ تعذر حفظ الوسائط المعالجة في المخزن: {e}")
+                return None
+            self._index[digest] = (target, file_name, size)
+            self._total_bytes += size
+            self.stats_counters['stores'] += 1
+            while self._total_bytes > self.max_bytes and len(self._index) > 1:
+                self._drop(next(iter(self._index)))
+                self.stats_counters['evictions'] += 1
+            return target
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'items': len(self._index), 'bytes': self._total_bytes, **self.stats_counters}
+
+    # ----- internals (lock held) -----
+
+    def _expired(self, path: str) -> bool:
+        if not self.ttl:
+            return False
+        try:
+            return os.path.getmtime(path) + self.ttl <= time.time()
+        except OSError:
+            return True
+
+    def _name_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest + self.NAME_SUFFIX)
+
+    def _drop(self, digest: str):
+        path, _, size = self._index.pop(digest)
+        self._total_bytes -= size
+        for stale in (path, self._name_path(digest)):
+            try:
+                os.unlink(stale)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.debug(f"تعذر حذف ملف المخزن {stale}: {e}")
+
+    def _original_name(self, digest: str, fallback: str) -> str:
+        try:
+            with open(self._name_path(digest), 'r', encoding='utf-8') as f:
+                return f.read() or fallback
+        except OSError:
+            return fallback
+
+    def _load_index(self):
+        """Rebuild the index from files left by a previous run (oldest first)"""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            entries = sorted(os.scandir(self.directory), key=lambda entry: entry.stat().st_mtime)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر قراءة مخزن الوسائط المعالجة {self.directory}: {e}")
+            return
+        name_files = {}
+        for entry in entries:
+            if entry.name.endswith(self.NAME_SUFFIX):
+                name_files[entry.name[:-len(self.NAME_SUFFIX)]] = entry.path
+                continue
+            digest, sep, safe_name = entry.name.partition(self.SEPARATOR)
+            if not sep or not entry.is_file():
+                continue
+            if self._expired(entry.path):
+                for stale in (entry.path, self._name_path(digest)):
+                    try:
+                        os.unlink(stale)
+                    except OSError:
+                        pass
+                continue
+            size = entry.stat().st_size
+            self._index[digest] = (entry.path, self._original_name(digest, safe_name), size)
+            self._total_bytes += size
+        # أسماء بلا ملف (حُذف الملف خارج المخزن)
+        for digest, path in name_files.items():
+            if digest not in self._index:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        while self._total_bytes > self.max_bytes and self._index:
+            self._drop(next(iter(self._index)))
+        if self._index:
+            logger.info(f"📦 تم تحميل {len(self._index)} ملف من مخزن الوسائط المعالجة")
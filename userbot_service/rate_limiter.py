@@ -0,0 +1,120 @@
+"""
+Rate Limiter - حد معدل الرسائل لكل مهمة في الذاكرة
+Sliding-log limiter per task: the send times inside the task's window are kept
+in memory, so "at most N messages in T seconds" is answered without a query
+and without writing a row per forwarded message.
+
+The logs are checkpointed to the database every few seconds (only the tasks
+that changed since the last checkpoint) and restored on the first check after
+a restart, so limits survive restarts.
+
+Settings: RATE_LIMIT_CHECKPOINT_SECONDS
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _TaskLog:
+    period: float = 0.0
+    stamps: Deque[float] = field(default_factory=deque)
+
+    def prune(self, now: float):
+        cutoff = now - self.period
+        while self.stamps and self.stamps[0] <= cutoff:
+            self.stamps.popleft()
+
+
+class TaskRateLimiter:
+    """At most `limit` messages per `period` seconds for each task"""
+
+    def __init__(self, loader: Callable[[], Dict[int, List[float]]],
+                 saver: Callable[[Dict[int, List[float]]], None],
+                 checkpoint_interval: Optional[float] = None):
+        self._loader = loader
+        self._saver = saver
+        self.checkpoint_interval = checkpoint_interval or float(os.getenv('RATE_LIMIT_CHECKPOINT_SECONDS', '30'))
+        self._logs: Dict[int, _TaskLog] = {}
+        self._dirty: Set[int] = set()
+        self._loaded = False
+        self._checkpointed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.stats_counters = {'allowed': 0, 'limited': 0, 'checkpoints': 0}
+
+    def try_acquire(self, task_id: int, limit: int, period: float, now: Optional[float] = None) -> bool:
+        """Record one message for the task if it is still under its limit"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._ensure_loaded()
+            log = self._logs.setdefault(task_id, _TaskLog())
+            log.period = period
+            log.prune(now)
+            if len(log.stamps) >= limit:
+                self.stats_counters['limited'] += 1
+                return False
+            log.stamps.append(now)
+            self._dirty.add(task_id)
+            self.stats_counters['allowed'] += 1
+            return True
+
+    def maybe_checkpoint(self):
+        """Checkpoint if the interval has elapsed since the last one"""
+        if time.monotonic() - self._checkpointed_at >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Save the logs of the tasks that changed (an empty log removes the task's row)"""
+        now = time.time()
+        with self._lock:
+            self._checkpointed_at = time.monotonic()
+            if not self._dirty:
+                return
+            states = {}
+            for task_id in self._dirty:
+                log = self._logs.get(task_id)
+                if log is None:
+                    states[task_id] = []
+                    continue
+                log.prune(now)
+                states[task_id] = list(log.stamps)
+                if not log.stamps:
+                    del self._logs[task_id]
+            self._dirty.clear()
+        try:
+            self._saver(states)
+            self.stats_counters['checkpoints'] += 1
+        except Exception as e:
+            logger.error(f"خطأ في حفظ حالة حد المعدل: {e}")
+            with self._lock:
+                self._dirty.update(states)
+
+    def forget_task(self, task_id: int):
+        with self._lock:
+            if self._logs.pop(task_id, None) is not None:
+                self._dirty.add(task_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'tasks': len(self._logs), 'dirty': len(self._dirty), **self.stats_counters}
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            states = self._loader() or {}
+        except Exception as e:
+            logger.error(f"خطأ في تحميل حالة حد المعدل: {e}")
+            return
+        for task_id, stamps in states.items():
+            # The period is unknown until the task's next check, which prunes the log
+            self._logs[task_id] = _TaskLog(stamps=deque(sorted(stamps)))
+        if states:
+            logger.info(f"⏱️ تم استعادة حالة حد المعدل لـ {len(states)} مهمة")
@@ -0,0 +1,324 @@
+"""
+Send Scheduler - جدولة الإرسال لكل حساب تيليجرام
+Every outgoing send/forward/edit/delete/pin of one Telegram account goes
+through a single queue:
+
+- priority classes: live forwards first, then recurring posts, then edits
+  (button edits, edit/delete sync)
+- token buckets for the account (global rate) and for each target chat, so
+  bursts are spread out instead of triggering flood bans
+- one request in flight per chat, so messages to a chat keep their order
+- FloodWaitError pauses the whole account for the requested time and the
+  request is retried; SlowModeWaitError pauses only that chat
+- metrics: queue depth and wait time per priority class, flood waits
+
+Settings: SEND_GLOBAL_RATE, SEND_GLOBAL_BURST, SEND_CHAT_RATE, SEND_CHAT_BURST,
+SEND_FLOOD_RETRIES, SEND_MAX_FLOOD_WAIT
+"""
+import os
+import time
+import bisect
+import asyncio
+import logging
+import itertools
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from telethon import utils
+from telethon.errors import FloodWaitError, SlowModeWaitError
+
+logger = logging.getLogger(__name__)
+
+LIVE = 0
+RECURRING = 1
+EDIT = 2
+PRIORITY_NAMES = {LIVE: 'live', RECURRING: 'recurring', EDIT: 'edit'}
+
+# Methods of TelegramClient that send to (or change messages in) a chat
+SCHEDULED_METHODS = frozenset((
+    'send_message', 'send_file', 'forward_messages', 'edit_message',
+    'delete_messages', 'pin_message', 'unpin_message',
+))
+
+# How often idle chat buckets and past chat pauses are dropped
+PRUNE_INTERVAL = 60.0
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `burst` saved"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+    def wait_time(self, now: float) -> float:
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    chat: Hashable = field(compare=False)
+    func: Callable = field(compare=False)
+    args: Tuple = field(compare=False)
+    kwargs: Dict = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued: float = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+def chat_key(entity) -> Hashable:
+    """Same key for an entity object, a peer and a numeric id of one chat"""
+    try:
+        return utils.get_peer_id(entity)
+    except Exception:
+        return str(entity)
+
+
+class SendScheduler:
+    """Outbound queue of one Telegram account"""
+
+    def __init__(self, name: Hashable,
+                 global_rate: Optional[float] = None, global_burst: Optional[float] = None,
+                 chat_rate: Optional[float] = None, chat_burst: Optional[float] = None,
+                 flood_retries: Optional[int] = None, max_flood_wait: Optional[float] = None):
+        self.name = name
+        self.chat_rate = chat_rate or float(os.getenv('SEND_CHAT_RATE', '1'))
+        self.chat_burst = chat_burst or float(os.getenv('SEND_CHAT_BURST', '3'))
+        self.flood_retries = flood_retries if flood_retries is not None else int(os.getenv('SEND_FLOOD_RETRIES', '3'))
+        self.max_flood_wait = max_flood_wait or float(os.getenv('SEND_MAX_FLOOD_WAIT', '900'))
+        self._global = TokenBucket(global_rate or float(os.getenv('SEND_GLOBAL_RATE', '20')),
+                                   global_burst or float(os.getenv('SEND_GLOBAL_BURST', '20')))
+        self._chats: Dict[Hashable, TokenBucket] = {}
+        self._chat_paused_until: Dict[Hashable, float] = {}
+        self._paused_until = 0.0
+        self._pruned_at = time.monotonic()
+        self._queue: List[_Job] = []
+        self._in_flight: set = set()
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._running: set = set()  # sends started by the worker (strong references)
+        self.stats_counters = {'sent': 0, 'failed': 0, 'flood_waits': 0, 'flood_seconds': 0, 'retries': 0}
+        self._waits = {priority: {'count': 0, 'total': 0.0, 'max': 0.0} for priority in PRIORITY_NAMES}
+
+    # ----- public API -----
+
+    async def submit(self, priority: int, chat: Hashable, func: Callable, *args, **kwargs) -> Any:
+        """Queue func(*args, **kwargs) for the chat and return its result once sent"""
+        loop = asyncio.get_running_loop()
+        self._ensure_worker(loop)
+        job = _Job(priority, next(self._seq), chat, func, args, kwargs, loop.create_future(), time.monotonic())
+        bisect.insort(self._queue, job)
+        self._wakeup.set()
+        return await job.future
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for job in self._queue:
+            depth[PRIORITY_NAMES.get(job.priority, str(job.priority))] += 1
+        waits = {
+            PRIORITY_NAMES[priority]: {
+                'count': wait['count'],
+                'avg': round(wait['total'] / wait['count'], 3) if wait['count'] else 0.0,
+                'max': round(wait['max'], 3),
+            }
+            for priority, wait in self._waits.items()
+        }
+        return {
+            'queue_depth': depth,
+            'in_flight': len(self._in_flight),
+            'chats': len(self._chats),
+            'wait_seconds': waits,
+            'paused_for': round(max(0.0, self._paused_until - now), 1),
+            **self.stats_counters,
+        }
+
+    async def close(self):
+        """Stop the worker and fail whatever is still queued
+
+        May be called from another event loop (shutdown runs stop_all on a new
+        loop): the worker and the queued futures are then stopped in their own
+        loop's thread, without waiting for it.
+        """
+        worker, self._worker = self._worker, None
+        owner = worker.get_loop() if worker is not None else None
+        if owner is None or owner is asyncio.get_running_loop():
+            self._abort(worker)
+            if worker is not None:
+                try:
+                    await worker
+                except asyncio.CancelledError:
+                    pass
+        elif not owner.is_closed():
+            owner.call_soon_threadsafe(self._abort, worker)
+        else:
+            self._queue.clear()
+
+    def _abort(self, worker: Optional[asyncio.Task]):
+        """Cancel the worker and fail the queued sends (in the worker's loop)"""
+        if worker is not None:
+            worker.cancel()
+        error = ConnectionError(f"تم إيقاف جدولة الإرسال للحساب {self.name}")
+        for job in self._queue:
+            if not job.future.done():
+                job.future.set_exception(error)
+        self._queue.clear()
+
+    # ----- worker -----
+
+    def _ensure_worker(self, loop: asyncio.AbstractEventLoop):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            if now < self._paused_until:
+                await self._sleep(self._paused_until - now)
+                continue
+            job, delay = self._next_ready(now)
+            if job is None:
+                await self._sleep(delay)
+                continue
+            self._queue.remove(job)
+            if job.future.done():
+                continue  # the caller was cancelled while waiting
+            self._global.take()
+            self._chat_bucket(job.chat).take()
+            self._in_flight.add(job.chat)
+            task = asyncio.ensure_future(self._execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    def _next_ready(self, now: float) -> Tuple[Optional[_Job], Optional[float]]:
+        """Highest priority job whose chat is free and has a token (else the time to wait, None = until woken)"""
+        if now - self._pruned_at >= PRUNE_INTERVAL:
+            self._prune(now)
+        global_wait = self._global.wait_time(now)
+        if global_wait > 0 and self._queue:
+            return None, global_wait
+        delay: Optional[float] = None
+        for job in self._queue:
+            if job.chat in self._in_flight:
+                continue
+            wait = max(self._chat_bucket(job.chat).wait_time(now), self._chat_paused_until.get(job.chat, 0.0) - now)
+            if wait <= 0:
+                return job, None
+            delay = wait if delay is None else min(delay, wait)
+        return None, delay
+
+    def _prune(self, now: float):
+        """Forget chats with nothing queued or in flight whose bucket is full again, and past chat pauses"""
+        self._pruned_at = now
+        busy = self._in_flight.union(job.chat for job in self._queue)
+        for chat in [chat for chat, bucket in self._chats.items() if chat not in busy and bucket.is_full(now)]:
+            del self._chats[chat]
+        for chat in [chat for chat, until in self._chat_paused_until.items() if until <= now]:
+            del self._chat_paused_until[chat]
+
+    async def _sleep(self, delay: Optional[float]):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def _chat_bucket(self, chat: Hashable) -> TokenBucket:
+        bucket = self._chats.get(chat)
+        if bucket is None:
+            bucket = self._chats[chat] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _execute(self, job: _Job):
+        started = time.monotonic()
+        try:
+            result = await job.func(*job.args, **job.kwargs)
+        except (FloodWaitError, SlowModeWaitError) as e:
+            self._on_flood(job, e)
+        except Exception as e:
+            self.stats_counters['failed'] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.stats_counters['sent'] += 1
+            self._record_wait(job, started)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._in_flight.discard(job.chat)
+            self._wakeup.set()
+
+    def _on_flood(self, job: _Job, error: Exception):
+        seconds = getattr(error, 'seconds', 0) or 1
+        self.stats_counters['flood_waits'] += 1
+        self.stats_counters['flood_seconds'] += seconds
+        job.attempts += 1
+        if job.attempts > self.flood_retries or seconds > self.max_flood_wait:
+            logger.error(f"❌ انتظار الفيضان {seconds} ثانية للحساب {self.name} - تم التخلي عن الإرسال بعد {job.attempts} محاولة")
+            self.stats_counters['failed'] += 1
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+        resume_at = time.monotonic() + seconds + 1
+        if isinstance(error, SlowModeWaitError):
+            self._chat_paused_until[job.chat] = max(self._chat_paused_until.get(job.chat, 0.0), resume_at)
+            logger.warning(f"🐢 وضع بطيء في المحادثة {job.chat}: إعادة المحاولة بعد {seconds} ثانية")
+        else:
+            self._paused_until = max(self._paused_until, resume_at)
+            logger.warning(f"⏳ FloodWait للحساب {self.name}: إيقاف الإرسال {seconds} ثانية ثم إعادة المحاولة "
+                           f"({job.attempts}/{self.flood_retries})")
+        self.stats_counters['retries'] += 1
+        bisect.insort(self._queue, job)
+
+    def _record_wait(self, job: _Job, started: float):
+        wait = self._waits.setdefault(job.priority, {'count': 0, 'total': 0.0, 'max': 0.0})
+        waited = started - job.enqueued
+        wait['count'] += 1
+        wait['total'] += waited
+        wait['max'] = max(wait['max'], waited)
+
+
+class ScheduledClient:
+    """TelegramClient view whose sending methods go through a SendScheduler at one priority
+
+    Everything else (get_entity, upload_file, raw requests...) goes straight to the client.
+    """
+
+    def __init__(self, client, scheduler: SendScheduler, priority: int):
+        self._client = client
+        self._scheduler = scheduler
+        self._priority = priority
+
+    @property
+    def client(self):
+        return self._client
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if name not in SCHEDULED_METHODS:
+            return attr
+
+        async def scheduled(entity, *args, **kwargs):
+            return await self._scheduler.submit(self._priority, chat_key(entity), attr, entity, *args, **kwargs)
+        return scheduled
+
+    def __call__(self, *args, **kwargs):
+        return self._client(*args, **kwargs)
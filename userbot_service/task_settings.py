@@ -0,0 +1,133 @@
+"""
+Task Settings Snapshot - ذاكرة مؤقتة لإعدادات المهام داخل العملية
+Holds per-task settings in memory so the forwarding path does not hit the
+database for every incoming message. The control bot invalidates a task (or
+all tasks of a user) whenever settings are edited.
+"""
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# اسم القسم -> دالة قاعدة البيانات التي تحمله
+SETTINGS_LOADERS = {
+    'watermark': 'get_watermark_settings',
+    'audio_metadata': 'get_audio_metadata_settings',
+    'audio_template': 'get_audio_template_settings',
+    'audio_tag_cleaning': 'get_audio_tag_cleaning_settings',
+    'forwarding': 'get_forwarding_settings',
+    'message': 'get_message_settings',
+    'text_cleaning': 'get_text_cleaning_settings',
+    'text_cleaning_keywords': 'get_text_cleaning_keywords',
+    'translation': 'get_translation_settings',
+    'text_formatting': 'get_text_formatting_settings',
+    'working_hours': 'get_working_hours',
+    'day_filters': 'get_day_filters',
+    'rate_limit': 'get_rate_limit_settings',
+    'duplicate': 'get_duplicate_settings',
+    'language_filters': 'get_language_filters',
+    'media_filters': 'get_task_media_filters',
+    'advanced_filters': 'get_advanced_filters_settings',
+    'forwarded_filter': 'get_forwarded_message_filter_setting',
+    'inline_button_filter': 'get_inline_button_filter_setting',
+    'character_limit': 'get_character_limit_settings',
+    'forwarding_delay': 'get_forwarding_delay_settings',
+    'sending_interval': 'get_sending_interval_settings',
+}
+
+_MISSING = object()
+
+
+class TaskSettingsSnapshot:
+    """In-memory copy of one task's settings
+
+    Each section is read from the database the first time it is requested and
+    then served from memory until the snapshot is replaced by the cache.
+    """
+
+    def __init__(self, db, task_id: int, version: tuple):
+        self.db = db
+        self.task_id = task_id
+        self.version = version
+        self._sections: Dict[str, Any] = {}
+        self._derived: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, section: str, default: Any = None) -> Any:
+        """Get a settings section, loading it on first access"""
+        value = self._sections.get(section, _MISSING)
+        if value is _MISSING:
+            with self._lock:
+                value = self._sections.get(section, _MISSING)
+                if value is _MISSING:
+                    value = self._load(section)
+                    self._sections[section] = value
+        return default if value is None else value
+
+    def derive(self, name: str, factory: Callable[['TaskSettingsSnapshot'], Any]) -> Any:
+        """Build an object from this snapshot once (e.g. a compiled plan) and reuse it
+
+        The object lives as long as the snapshot, so it is rebuilt automatically
+        after the task's settings are invalidated.
+        """
+        value = self._derived.get(name, _MISSING)
+        if value is _MISSING:
+            value = factory(self)
+            with self._lock:
+                value = self._derived.setdefault(name, value)
+        return value
+
+    def _load(self, section: str) -> Any:
+        loader_name = SETTINGS_LOADERS.get(section)
+        if not loader_name:
+            raise KeyError(f"قسم إعدادات غير معروف: {section}")
+        loader = getattr(self.db, loader_name, None)
+        if loader is None:
+            return None
+        try:
+            return loader(self.task_id)
+        except Exception as e:
+            logger.error(f"خطأ في تحميل إعدادات {section} للمهمة {self.task_id}: {e}")
+            return None
+
+
+class TaskSettingsCache:
+    """Versioned store of TaskSettingsSnapshot objects
+
+    invalidate() bumps a per-task version (or a global generation), so a
+    snapshot loaded before an edit is never served after it, even when the
+    edit happens on the bot thread while the userbot thread is reading.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._snapshots: Dict[int, TaskSettingsSnapshot] = {}
+        self._versions: Dict[int, int] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, task_id: int) -> TaskSettingsSnapshot:
+        """Get the current snapshot for a task, loading a fresh one if stale"""
+        with self._lock:
+            version = (self._generation, self._versions.get(task_id, 0))
+            snapshot = self._snapshots.get(task_id)
+            if snapshot is None or snapshot.version != version:
+                snapshot = TaskSettingsSnapshot(self.db, task_id, version)
+                self._snapshots[task_id] = snapshot
+            return snapshot
+
+    def invalidate(self, task_id: Optional[int] = None):
+        """Invalidate one task, or every task when task_id is None"""
+        with self._lock:
+            if task_id is None:
+                self._generation += 1
+                self._snapshots.clear()
+            else:
+                self._versions[task_id] = self._versions.get(task_id, 0) + 1
+                self._snapshots.pop(task_id, None)
+
+    def invalidate_many(self, task_ids: Iterable[int]):
+        """Invalidate several tasks at once"""
+        for task_id in set(task_ids):
+            self.invalidate(task_id)
@@ -0,0 +1,127 @@
+"""
+Text Cleaning Plan - خطة تنظيف النصوص المُجمّعة لكل مهمة
+Module-level compiled patterns plus a per-task plan built once from the
+task's settings. Patterns that can overlap (links, brackets, emojis and
+hashtags, phones) keep their original order as separate passes, because one
+alternation takes the leftmost match and changes the result. Custom keywords
+become one combined regex, phone passes sit behind a cheap digit guard.
+"""
+import re
+from typing import Iterable, List, Optional
+
+from database.word_filter_engine import build_literal_pattern
+
+# 1. الروابط: روابط Markdown/HTML المخفية (مع الحفاظ على النص الظاهر) ثم الروابط الصريحة
+# الترتيب مهم: "mt.me/x" يطابقه نمط النطاق أولاً في بديل واحد، بينما التمرير المرتب يحذف "t.me/x" أولاً
+LINK_TEXT_PATTERNS = (
+    re.compile(r'\[([^\]]+)\]\s*\([^)]*\)'),
+    re.compile(r'<a\s+href=[\'\"][^\'\"]+[\'\"]\s*>(.*?)</a>', re.IGNORECASE | re.DOTALL),
+)
+LINK_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    r'<https?://[^>]+>',
+    r'https?://[^\s]+',
+    r't\.me/[^\s]+',
+    r'www\.[^\s]+',
+    r'\b[a-zA-Z0-9](?:[a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.(?:[a-zA-Z]{2,6}\.?)+(?:/[^\s]*)?',
+    r'\[\s*\]',
+    r'\(\s*\)',
+))
+
+# 2. الايموجيات
+EMOJI_PATTERN = (
+    "["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "\U00002700-\U000027BF"  # dingbats
+    "\U0001f926-\U0001f937"  # supplemental symbols
+    "\U00010000-\U0010ffff"  # supplemental characters
+    "\u2640-\u2642"          # gender symbols
+    "\u2600-\u2B55"          # misc symbols
+    "\u200d"                 # zero width joiner
+    "\u23cf"                 # various symbols
+    "\u23e9-\u23f3"          # symbol range
+    "\u23f8-\u23f9"          # symbol range
+    "\u3030"                 # wavy dash
+    "]+"
+)
+
+# 3. الهاشتاقات
+HASHTAG_PATTERN = r'#\w+'
+
+# 4. أرقام الهواتف (تتجنب السنوات مثل 2025)
+# الترتيب مهم: "2025 123-456-7890" يجب أن يُحذف منه الرقم الأمريكي قبل تجربة الأنماط الأخرى،
+# لذلك تبقى تمريرات منفصلة بدلاً من بديل واحد (الذي يختار المطابقة الأبعد يساراً)
+PHONE_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    r'\+\d{1,4}[-.\s]?\(?\d{1,4}\)?[-.\s]?\d{1,4}[-.\s]?\d{4,9}',  # International with +
+    r'\b\d{3}[-.\s]\d{3}[-.\s]\d{4}\b',  # US format with separators
+    r'\b\d{4}[-.\s]\d{3}[-.\s]\d{3}\b',  # Some international with separators
+    r'\b\d{2}[-.\s]\d{4}[-.\s]\d{4}\b',  # Another format with separators
+    r'\b\d{10,15}\b',  # Long sequences of digits (10-15 digits) likely phone numbers
+    r'\(\d{3}\)\s?\d{3}[-.\s]?\d{4}',  # Format like (123) 456-7890
+))
+# كل الأنماط أعلاه تحتاج 4 أرقام متتالية على الأقل - فحص سريع قبل التمريرات
+PHONE_GUARD = re.compile(r'\d{4}')
+
+INLINE_WHITESPACE = re.compile(r'[ \t]+')
+
+
+EMOJIS = re.compile(EMOJI_PATTERN)
+HASHTAGS = re.compile(HASHTAG_PATTERN)
+
+
+class TextCleaningPlan:
+    """Compiled cleaning steps of one task, built from its text_cleaning settings"""
+
+    def __init__(self, settings: dict, keywords: Optional[Iterable[str]] = None):
+        self.remove_links = bool(settings.get('remove_links', False))
+        self.remove_empty_lines = bool(settings.get('remove_empty_lines', False))
+
+        # الايموجيات قبل الهاشتاقات: "#😀abc" يصبح "#abc" ثم يُحذف
+        self._symbols: List['re.Pattern'] = []
+        if settings.get('remove_emojis', False):
+            self._symbols.append(EMOJIS)
+        if settings.get('remove_hashtags', False):
+            self._symbols.append(HASHTAGS)
+        self.remove_phone_numbers = bool(settings.get('remove_phone_numbers', False))
+
+        self._keywords = None
+        if settings.get('remove_lines_with_keywords', False):
+            lowered = [keyword.lower() for keyword in (keywords or []) if keyword]
+            if lowered:
+                self._keywords = re.compile(build_literal_pattern(lowered))
+
+    def apply(self, text: str) -> str:
+        if not text:
+            return text
+
+        if self.remove_links:
+            # الروابط المخفية أولاً حتى يبقى نصها الظاهر، ثم الروابط الصريحة والأقواس الفارغة
+            for pattern in LINK_TEXT_PATTERNS:
+                text = pattern.sub(r'\1', text)
+            for pattern in LINK_PATTERNS:
+                text = pattern.sub('', text)
+        for pattern in self._symbols:
+            text = pattern.sub('', text)
+        if self.remove_phone_numbers and PHONE_GUARD.search(text):
+            for pattern in PHONE_PATTERNS:
+                text = pattern.sub('', text)
+
+        # حذف أسطر الكلمات المحددة
+        if self._keywords is not None:
+            keywords = self._keywords
+            text = '\n'.join(line for line in text.split('\n') if not keywords.search(line.lower()))
+
+        # تنظيف المسافات الزائدة داخل الأسطر مع الحفاظ على بنية الأسطر
+        lines = [line.strip() for line in INLINE_WHITESPACE.sub(' ', text).split('\n')]
+
+        if self.remove_empty_lines:
+            # الإبقاء على السطر الفارغ فقط إذا كان بين سطرين بهما محتوى
+            last = len(lines) - 1
+            lines = [
+                line for i, line in enumerate(lines)
+                if line or (0 < i < last and lines[i - 1] and lines[i + 1])
+            ]
+
+        return '\n'.join(lines)
@@ -17,7 +17,8 @@ Main Improvements:
 import logging
 import asyncio
 import re
-from typing import Dict, List, Optional, Tuple
+import functools
+from typing import Any, Dict, List, Optional, Tuple
 from telethon import TelegramClient, events
 from telethon.errors import SessionPasswordNeededError, AuthKeyUnregisteredError
 from telethon.sessions import StringSession
@@ -31,6 +32,21 @@ from watermark_processor_optimized import optimized_processor
 from watermark_processor_ultra_optimized import ultra_optimized_processor
 from ffmpeg_installer import ffmpeg_installer
 from audio_processor import AudioProcessor
+from media_worker_pool import media_pool, HEAVY
+from ffmpeg_runner import ffmpeg_runner, ffmpeg_job
+from media_info import media_info_cache
+from watermark_overlay_cache import watermark_overlays
+from encoding_profiles import encoding_engine
+from .task_settings import TaskSettingsCache, TaskSettingsSnapshot
+from .text_cleaning import TextCleaningPlan
+from .media_spool import media_spool
+from .media_cache import BoundedMediaCache
+from .processed_media_store import ProcessedMediaStore, media_content_id
+from .duplicate_index import DuplicateIndex, format_phash
+from .media_fingerprint import media_perceptual_hash
+from .rate_limiter import TaskRateLimiter
+from .fan_out import TargetFanOut
+from .send_scheduler import SendScheduler, ScheduledClient, LIVE, RECURRING, EDIT
 import tempfile
 import os
 
@@ -111,11 +127,13 @@ class UserbotService:
         
         self.clients: Dict[int, TelegramClient] = {}  # user_id -> client
         self.user_tasks: Dict[int, List[Dict]] = {}   # user_id -> tasks
+        self.user_task_routes: Dict[int, Dict[str, List[Dict]]] = {}  # user_id -> source chat id -> tasks
         self.user_locks: Dict[int, asyncio.Lock] = {}  # user_id -> lock for thread safety
         self.running = True
         self.album_collectors: Dict[int, AlbumCollector] = {}  # user_id -> collector
         self.watermark_processor = WatermarkProcessor()  # معالج العلامة المائية
         self.audio_processor = AudioProcessor()  # معالج الوسوم الصوتية
+        self.task_settings = TaskSettingsCache(self.db)  # إعدادات المهام في الذاكرة
         
         # التحقق من FFmpeg عند بدء البوت
         self._check_ffmpeg_on_startup()
@@ -140,9 +158,38 @@ class UserbotService:
             logger.info("⚠️ سيتم استخدام المعالجة المتزامنة للوسائط")
         
         # CRITICAL FIX: Initialize global cache systems for media processing optimization
-        self.global_processed_media_cache = {}  # Cache for processed media to prevent re-upload
-        self._current_media_cache = {}  # Temporary cache for download optimization per message
-        self.uploaded_file_cache = {}  # CRITICAL: Cache for uploaded file handles to prevent re-upload
+        # Bounded LRU caches (items + TTL) so media-heavy channels cannot grow memory without limit;
+        # they hold spool paths and upload handles, the files themselves belong to the media spool
+        cache_ttl = int(os.getenv('MEDIA_CACHE_TTL', '3600'))
+        self.global_processed_media_cache = BoundedMediaCache(  # Cache for processed media to prevent re-upload
+            'processed_media', max_items=int(os.getenv('MEDIA_CACHE_MAX_ITEMS', '500')), ttl=cache_ttl,
+        )
+        self._current_media_cache = BoundedMediaCache(  # Temporary cache for download optimization per message
+            'current_media', max_items=200, ttl=600,
+        )
+        self.uploaded_file_cache = BoundedMediaCache(  # CRITICAL: Cache for uploaded file handles to prevent re-upload
+            'uploaded_files', max_items=int(os.getenv('UPLOADED_FILE_CACHE_MAX_ITEMS', '2000')), ttl=cache_ttl,
+        )
+        self._upload_locks: Dict[tuple, list] = {}  # cache key -> [lock, users]: one upload per artifact even with concurrent targets
+        # Processed media by (document/photo id, settings hash) - shared across messages and source chats
+        self.processed_media_store = ProcessedMediaStore(
+            # ensure_dir() first: the spool may fall back to the system temp directory
+            os.getenv('PROCESSED_MEDIA_DIR') or os.path.join(os.path.dirname(media_spool.ensure_dir()), 'processed_media'),
+            max_bytes=int(os.getenv('PROCESSED_MEDIA_STORE_MB', '2048')) * 1024 * 1024,
+            ttl=int(os.getenv('PROCESSED_MEDIA_STORE_TTL', '86400')),
+        )
+        # Duplicate filter: MinHash LSH index per task over the messages of its time window
+        self.duplicate_index = DuplicateIndex()
+        self._duplicate_pruned_at: Dict[int, float] = {}  # task_id -> last message_duplicates cleanup
+        # Rate limit filter: sliding log per task in memory, checkpointed to the database periodically
+        self.rate_limiter = TaskRateLimiter(
+            loader=lambda: self.db.load_rate_limit_state(),
+            saver=lambda states: self.db.save_rate_limit_state(states),
+        )
+        self.target_fan_out = TargetFanOut()  # concurrent delivery to the targets of a message, per account cap
+        # Outbound queue per Telegram account (user_id, or 'bot'): priorities, rate limits, FloodWait retry
+        self.send_schedulers: Dict[Any, SendScheduler] = {}
+        self._scheduled_clients: Dict[tuple, ScheduledClient] = {}  # (account, priority) -> client view
         self.session_health_status: Dict[int, bool] = {}  # user_id -> health status
         self.session_locks: Dict[int, bool] = {}  # user_id -> is_locked (prevent multiple usage)
         self.max_reconnect_attempts = 3
@@ -376,6 +423,9 @@ class UserbotService:
                     if user_id in self.user_tasks:
                         del self.user_tasks[user_id]
                     
+                    if user_id in self.user_task_routes:
+                        del self.user_task_routes[user_id]
+                    
                     if user_id in self.album_collectors:
                         del self.album_collectors[user_id]
                     
@@ -392,14 +442,14 @@ class UserbotService:
                         pass
                     del self.clients[user_id]
                 
-                for attr in ['user_tasks', 'album_collectors', 'session_health_status']:
+                for attr in ['user_tasks', 'user_task_routes', 'album_collectors', 'session_health_status']:
                     if hasattr(self, attr) and user_id in getattr(self, attr):
-                        delattr(self, attr)[user_id]
+                        del getattr(self, attr)[user_id]
 
         except Exception as e:
             logger.error(f"خطأ في إيقاف جلسة المستخدم {user_id}: {e}")
             # Force cleanup on error
-            for attr in ['clients', 'user_tasks', 'album_collectors', 'session_health_status', 'session_locks']:
+            for attr in ['clients', 'user_tasks', 'user_task_routes', 'album_collectors', 'session_health_status', 'session_locks']:
                 if hasattr(self, attr) and user_id in getattr(self, attr):
                     try:
                         del getattr(self, attr)[user_id]
@@ -426,6 +476,9 @@ class UserbotService:
         while self.running:
             try:
                 await asyncio.sleep(30)  # Check every 30 seconds
+
+                # Save the rate limiter state off the event loop (not in the message path)
+                await asyncio.get_running_loop().run_in_executor(None, self.rate_limiter.maybe_checkpoint)
                 
                 if not self.clients:
                     continue
@@ -493,125 +546,27 @@ class UserbotService:
                 'error': str(e)
             }
 
+    @staticmethod
+    def _build_text_cleaning_plan(snapshot: TaskSettingsSnapshot) -> Optional[TextCleaningPlan]:
+        """Compile the text cleaning steps enabled for a task"""
+        settings = snapshot.get('text_cleaning', {})
+        if not settings:
+            return None
+        keywords = snapshot.get('text_cleaning_keywords', []) if settings.get('remove_lines_with_keywords') else []
+        return TextCleaningPlan(settings, keywords)
+
     def apply_text_cleaning(self, message_text: str, task_id: int) -> str:
         """Apply text cleaning based on task settings"""
         if not message_text:
             return message_text
 
         try:
-            # Get text cleaning settings for this task
-            settings = self.db.get_text_cleaning_settings(task_id)
-            if not settings:
+            # Get the compiled cleaning plan for this task (rebuilt when settings change)
+            plan = self.get_task_settings(task_id).derive('text_cleaning_plan', self._build_text_cleaning_plan)
+            if plan is None:
                 return message_text
 
-            cleaned_text = message_text
-
-            # 1. Remove links
-            if settings.get('remove_links', False):
-                # Remove Markdown/HTML hidden links first (preserve visible text)
-                cleaned_text = re.sub(r'\[([^\]]+)\]\s*\(([^)]*)\)', r'\1', cleaned_text)
-                cleaned_text = re.sub(r'<a\s+href=[\'\"][^\'\"]+[\'\"]\s*>(.*?)</a>', r'\1', cleaned_text, flags=re.IGNORECASE|re.DOTALL)
-                # Remove angle-bracket autolinks like <https://example.com>
-                cleaned_text = re.sub(r'<https?://[^>]+>', '', cleaned_text)
-                # Then remove plain URLs and domains
-                cleaned_text = re.sub(r'https?://[^\s]+', '', cleaned_text)
-                cleaned_text = re.sub(r't\.me/[^\s]+', '', cleaned_text)
-                cleaned_text = re.sub(r'www\.[^\s]+', '', cleaned_text)
-                cleaned_text = re.sub(r'\b[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.([a-zA-Z]{2,6}\.?)+(/[^\s]*)?', '', cleaned_text)
-                # Cleanup any leftover empty brackets
-                cleaned_text = re.sub(r'\[\s*\]', '', cleaned_text)
-                cleaned_text = re.sub(r'\(\s*\)', '', cleaned_text)
-                logger.debug(f"🧹 تم حذف الروابط من المهمة {task_id}")
-
-            # 2. Remove emojis
-            if settings.get('remove_emojis', False):
-                # Remove emojis using Unicode ranges
-                emoji_pattern = re.compile(
-                    "["
-                    "\U0001F600-\U0001F64F"  # emoticons
-                    "\U0001F300-\U0001F5FF"  # symbols & pictographs
-                    "\U0001F680-\U0001F6FF"  # transport & map symbols
-                    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
-                    "\U00002700-\U000027BF"  # dingbats
-                    "\U0001f926-\U0001f937"  # supplemental symbols
-                    "\U00010000-\U0010ffff"  # supplemental characters
-                    "\u2640-\u2642"          # gender symbols
-                    "\u2600-\u2B55"          # misc symbols
-                    "\u200d"                 # zero width joiner
-                    "\u23cf"                 # various symbols
-                    "\u23e9-\u23f3"          # symbol range
-                    "\u23f8-\u23f9"          # symbol range
-                    "\u3030"                 # wavy dash
-                    "]+",
-                    flags=re.UNICODE
-                )
-                cleaned_text = emoji_pattern.sub('', cleaned_text)
-                logger.debug(f"🧹 تم حذف الايموجيات من المهمة {task_id}")
-
-            # 3. Remove hashtags
-            if settings.get('remove_hashtags', False):
-                # Remove hashtags (# followed by word characters)
-                cleaned_text = re.sub(r'#\w+', '', cleaned_text)
-                logger.debug(f"🧹 تم حذف الهاشتاقات من المهمة {task_id}")
-
-            # 4. Remove phone numbers (improved patterns to avoid years like 2025)
-            if settings.get('remove_phone_numbers', False):
-                # Remove various phone number formats (more specific patterns)
-                phone_patterns = [
-                    r'\+\d{1,4}[-.\s]?\(?\d{1,4}\)?[-.\s]?\d{1,4}[-.\s]?\d{4,9}',  # International with +
-                    r'\b\d{3}[-.\s]\d{3}[-.\s]\d{4}\b',  # US format with separators
-                    r'\b\d{4}[-.\s]\d{3}[-.\s]\d{3}\b',  # Some international with separators
-                    r'\b\d{2}[-.\s]\d{4}[-.\s]\d{4}\b',  # Another format with separators
-                    r'\b\d{10,15}\b',  # Long sequences of digits (10-15 digits) likely phone numbers
-                    r'\(\d{3}\)\s?\d{3}[-.\s]?\d{4}',  # Format like (123) 456-7890
-                ]
-                for pattern in phone_patterns:
-                    cleaned_text = re.sub(pattern, '', cleaned_text)
-                logger.debug(f"🧹 تم حذف أرقام الهواتف من المهمة {task_id}")
-
-            # 5. Remove lines with specific keywords
-            if settings.get('remove_lines_with_keywords', False):
-                keywords = self.db.get_text_cleaning_keywords(task_id)
-                if keywords:
-                    lines = cleaned_text.split('\n')
-                    filtered_lines = []
-                    for line in lines:
-                        should_remove = False
-                        for keyword in keywords:
-                            if keyword.lower() in line.lower():
-                                should_remove = True
-                                break
-                        if not should_remove:
-                            filtered_lines.append(line)
-                    cleaned_text = '\n'.join(filtered_lines)
-                    logger.debug(f"🧹 تم حذف الأسطر التي تحتوي على الكلمات المحددة من المهمة {task_id}")
-
-            # Clean up extra whitespace within lines first
-            lines = cleaned_text.split('\n')
-            cleaned_lines = []
-            for line in lines:
-                # Clean whitespace within each line but preserve the line structure
-                cleaned_line = re.sub(r'[ \t]+', ' ', line.strip())
-                cleaned_lines.append(cleaned_line)
-            cleaned_text = '\n'.join(cleaned_lines)
-
-            # 6. Remove empty lines AFTER all other cleaning operations
-            if settings.get('remove_empty_lines', False):
-                # Split by lines and filter empty ones while preserving structure
-                lines = cleaned_text.split('\n')
-                filtered_lines = []
-
-                for i, line in enumerate(lines):
-                    if line.strip():  # Line has content
-                        filtered_lines.append(line)
-                    else:  # Empty line
-                        # Only keep empty line if it's between two content lines
-                        if (i > 0 and i < len(lines) - 1 and
-                            lines[i-1].strip() and lines[i+1].strip()):
-                            filtered_lines.append('')
-
-                cleaned_text = '\n'.join(filtered_lines)
-                logger.debug(f"🧹 تم حذف الأسطر الفارغة الزائدة من المهمة {task_id} (في النهاية)")
+            cleaned_text = plan.apply(message_text)
 
             if cleaned_text != message_text:
                 logger.info(f"🧹 تم تنظيف النص للمهمة {task_id} - الطول الأصلي: {len(message_text)}, بعد التنظيف: {len(cleaned_text)}")
@@ -626,6 +581,13 @@ class UserbotService:
 
         @client.on(events.NewMessage())
         async def message_handler(event):
+            # Reject non-monitored chats in O(1) before touching the event any further
+            source_chat_id = event.chat_id
+            tasks = self._get_routed_tasks(user_id, source_chat_id)
+            if not tasks:
+                return  # Not a source chat for this user - silent return
+
+            spooled_files: List[str] = []  # ملفات الوسائط المؤقتة لهذه الرسالة (تُحذف بعد الإرسال)
             try:
                 # Ensure session is still healthy for this user
                 if not self.session_health_status.get(user_id, False):
@@ -637,72 +599,42 @@ class UserbotService:
                     logger.warning(f"⚠️ تجاهل الرسالة - العميل لا ينتمي للمستخدم {user_id}")
                     return
 
-                # Use lock to prevent concurrent processing for this user
-                if user_id not in self.user_locks:
-                    self.user_locks[user_id] = asyncio.Lock()
-
-                async with self.user_locks[user_id]:
-                    # Get user tasks for this specific user (the owner of this client)
-                    tasks = self.user_tasks.get(user_id, [])
-                    
-                    # Get source chat ID first
-                    source_chat_id = event.chat_id
-                    
-                    # Check if this chat is a source in any task for this user
-                    is_monitored_source = any(str(task['source_chat_id']) == str(source_chat_id) for task in tasks)
-                    
-                    # Only log if this is a monitored source chat
-                    if is_monitored_source:
-                        logger.info(f"📥 رسالة من مصدر مراقب: {source_chat_id} (المستخدم {user_id})")
-                        if event.text:
-                            logger.info(f"📝 المحتوى: {event.text[:100]}...")
-                    else:
-                        # Silent processing for non-monitored chats - no logging
-                        pass
-
-                # Get source chat ID and username first
-                source_username = getattr(event.chat, 'username', None)
-
-                if not tasks:
-                    return  # No tasks for this user - silent return
+                logger.info(f"📥 رسالة من مصدر مراقب: {source_chat_id} (المستخدم {user_id})")
+                if event.text:
+                    logger.info(f"📝 المحتوى: {event.text[:100]}...")
 
                 # Check media filters first
                 message_media_type = self.get_message_media_type(event.message)
-                has_text_caption = bool(event.message.text)  # Check if message has text/caption
 
                 # Find matching tasks for this source chat
                 matching_tasks = []
+                source_chat_id_str = str(source_chat_id)
 
                 for task in tasks:
-                    task_source_id = str(task['source_chat_id'])
                     task_name = task.get('task_name', f"مهمة {task['id']}")
                     task_id = task.get('id')
 
-                    # Convert both IDs to string and compare
-                    source_chat_id_str = str(source_chat_id)
-                    if task_source_id == source_chat_id_str:
+                    # Check admin filter
+                    admin_allowed = await self.is_admin_allowed_by_signature(task_id, event.message, source_chat_id_str)
 
-                        # Check admin filter
-                        admin_allowed = await self.is_admin_allowed_by_signature(task_id, event.message, source_chat_id_str)
+                    # Check media filter
+                    media_allowed = self.is_media_allowed(task_id, message_media_type)
 
-                        # Check media filter
-                        media_allowed = self.is_media_allowed(task_id, message_media_type)
+                    # Check word filters
+                    message_text = event.message.text or ""
+                    word_filter_allowed = self.is_message_allowed_by_word_filter(task_id, message_text)
 
-                        # Check word filters
-                        message_text = event.message.text or ""
-                        word_filter_allowed = self.is_message_allowed_by_word_filter(task_id, message_text)
-
-                        # Determine if message is allowed
-                        if message_media_type == 'text':
-                            is_message_allowed = admin_allowed and self.is_media_allowed(task_id, 'text') and word_filter_allowed
-                        else:
-                            is_message_allowed = admin_allowed and media_allowed and word_filter_allowed
+                    # Determine if message is allowed
+                    if message_media_type == 'text':
+                        is_message_allowed = admin_allowed and self.is_media_allowed(task_id, 'text') and word_filter_allowed
+                    else:
+                        is_message_allowed = admin_allowed and media_allowed and word_filter_allowed
 
-                        if is_message_allowed:
-                            matching_tasks.append(task)
-                            logger.info(f"✅ {task_name}: رسالة مقبولة")
-                        else:
-                            logger.info(f"🚫 {task_name}: رسالة مرفوضة بواسطة الفلاتر")
+                    if is_message_allowed:
+                        matching_tasks.append(task)
+                        logger.info(f"✅ {task_name}: رسالة مقبولة")
+                    else:
+                        logger.info(f"🚫 {task_name}: رسالة مرفوضة بواسطة الفلاتر")
 
                 if not matching_tasks:
                     return  # No matching tasks - silent return
@@ -748,7 +680,7 @@ class UserbotService:
                     watermark_settings = None
                     try:
                         for _t in matching_tasks:
-                            _wm = self.db.get_watermark_settings(_t['id'])
+                            _wm = self.get_task_settings(_t['id']).get('watermark', {})
                             if _wm and _wm.get('enabled', False):
                                 watermark_enabled_for_any = True
                                 watermark_settings = _wm  # Use first enabled watermark settings
@@ -786,7 +718,7 @@ class UserbotService:
                     if is_audio_message:
                         try:
                             for _t in matching_tasks:
-                                _as = self.db.get_audio_metadata_settings(_t['id'])
+                                _as = self.get_task_settings(_t['id']).get('audio_metadata', {})
                                 if _as and _as.get('enabled', False):
                                     audio_tags_enabled_for_any = True
                                     audio_settings = _as  # Use first enabled audio settings
@@ -799,10 +731,6 @@ class UserbotService:
                             logger.warning(f"⚠️ فشل فحص إعدادات وسوم الصوت: {_e}")
                             audio_tags_enabled_for_any = False
 
-                    # CRITICAL FIX: Initialize global media cache for message-based reuse
-                    if not hasattr(self, 'global_processed_media_cache'):
-                        self.global_processed_media_cache = {}
-                    
                     # Create unique cache key for this message and settings
                     import hashlib
                     message_hash = f"{event.message.id}_{event.chat_id}_{first_task['id']}_watermark"
@@ -813,15 +741,21 @@ class UserbotService:
                             logger.info("🏷️ العلامة المائية مفعلة لأحد المهام → سيتم تطبيقها مرة واحدة وإعادة الاستخدام")
                             
                             # CRITICAL OPTIMIZATION: Check cache before processing
-                            if media_cache_key in self.global_processed_media_cache:
-                                processed_media, processed_filename = self.global_processed_media_cache[media_cache_key]
+                            cached_media = self.global_processed_media_cache.get(media_cache_key)
+                            if cached_media:
+                                processed_media, processed_filename = cached_media
                                 logger.info(f"🎯 استخدام الوسائط المعالجة من التخزين المؤقت: {processed_filename}")
                             else:
                                 # Process media ONLY ONCE and cache for all targets
                                 logger.info("🔧 بدء معالجة الوسائط لأول مرة - سيتم حفظها للاستخدام المتكرر")
-                                processed_media, processed_filename = await self.apply_watermark_to_media(event, first_task['id'])
+                                processed_media, processed_filename = await self._process_media_by_content(
+                                    event, first_task['id'], 'watermark',
+                                    lambda: self.apply_watermark_to_media(event, first_task['id']),
+                                )
                                 
                                 if processed_media and processed_media != event.message.media:
+                                    if isinstance(processed_media, str) and processed_media not in spooled_files:
+                                        spooled_files.append(processed_media)
                                     # Store in global cache for ALL future targets of this message
                                     self.global_processed_media_cache[media_cache_key] = (processed_media, processed_filename)
                                     logger.info(f"✅ تم معالجة الوسائط مرة واحدة وحفظها للاستخدام المتكرر: {processed_filename}")
@@ -837,60 +771,30 @@ class UserbotService:
                             ).hexdigest()
                             
                             # Check audio cache first - CRITICAL OPTIMIZATION
-                            if audio_cache_key in self.global_processed_media_cache:
-                                processed_media, processed_filename = self.global_processed_media_cache[audio_cache_key]
+                            cached_audio = self.global_processed_media_cache.get(audio_cache_key)
+                            if cached_audio:
+                                processed_media, processed_filename = cached_audio
                                 logger.info(f"🎯 استخدام المقطع الصوتي المعالج من التخزين المؤقت: {processed_filename}")
                             else:
                                 # Process audio ONCE and cache for all targets
                                 logger.info("🔧 بدء معالجة المقطع الصوتي لأول مرة - سيتم حفظه للاستخدام المتكرر")
+                                audio_media, audio_filename = await self._process_media_by_content(
+                                    event, first_task['id'], 'audio',
+                                    lambda: self._tag_audio_message(event, first_task['id'], spooled_files),
+                                )
                                 
-                                # تحميل الوسائط واستخراج اسم مناسب - مرة واحدة فقط
-                                if not hasattr(self, '_current_media_cache'):
-                                    self._current_media_cache = {}
-                                
-                                media_cache_key_download = f"{event.message.id}_{event.chat_id}_download"
-                                
-                                if media_cache_key_download in self._current_media_cache:
-                                    media_bytes, file_name, file_ext = self._current_media_cache[media_cache_key_download]
-                                    logger.info("🔄 استخدام الوسائط المحمّلة من التخزين المؤقت")
+                                # Cache the processed audio for reuse across ALL targets
+                                if isinstance(audio_media, str):
+                                    if audio_media not in spooled_files:
+                                        spooled_files.append(audio_media)
+                                    processed_media, processed_filename = audio_media, audio_filename
+                                    self.global_processed_media_cache[audio_cache_key] = (processed_media, processed_filename)
+                                    logger.info(f"✅ تم معالجة المقطع الصوتي مرة واحدة وحفظه للاستخدام المتكرر: {processed_filename}")
+                                elif audio_media is not None:
+                                    # فشل التحميل - إرسال الوسائط الأصلية
+                                    processed_media, processed_filename = audio_media, None
                                 else:
-                                    media_bytes = await event.message.download_media(bytes)
-                                    if not media_bytes:
-                                        logger.warning("⚠️ فشل تحميل الوسائط - سيتم استخدام الوسائط الأصلية")
-                                        processed_media = event.message.media
-                                        processed_filename = None
-                                    else:
-                                        file_name = "media_file"
-                                        file_ext = ""
-                                        if hasattr(event.message.media, 'document') and event.message.media.document:
-                                            doc = event.message.media.document
-                                            if hasattr(doc, 'attributes'):
-                                                for attr in doc.attributes:
-                                                    if hasattr(attr, 'file_name') and attr.file_name:
-                                                        file_name = attr.file_name
-                                                        # Extract file extension
-                                                        if "." in file_name:
-                                                            file_ext = "." + file_name.split(".")[-1]
-                                                        break
-                                                        if '.' in file_name:
-                                                            file_ext = '.' + file_name.split('.')[-1].lower()
-                                                            file_name = file_name.rsplit('.', 1)[0]
-                                                        break
-                                        
-                                        # حفظ البيانات المحمّلة في التخزين المؤقت لهذه الرسالة
-                                        self._current_media_cache[media_cache_key_download] = (media_bytes, file_name, file_ext)
-                                        logger.info("💾 تم حفظ الوسائط المحمّلة في التخزين المؤقت لإعادة الاستخدام")
-                                
-                                if media_bytes:
-                                    full_name = file_name + (file_ext or '')
-                                    processed_media, processed_filename = await self.apply_audio_metadata(event, first_task['id'], media_bytes, full_name)
-                                    
-                                    # Cache the processed audio for reuse across ALL targets
-                                    if processed_media and processed_media != media_bytes:
-                                        self.global_processed_media_cache[audio_cache_key] = (processed_media, processed_filename)
-                                        logger.info(f"✅ تم معالجة المقطع الصوتي مرة واحدة وحفظه للاستخدام المتكرر: {processed_filename}")
-                                    else:
-                                        logger.info("🔄 لم يتم تعديل المقطع الصوتي، استخدام الملف الأصلي")
+                                    logger.info("🔄 لم يتم تعديل المقطع الصوتي، استخدام الملف الأصلي")
 
                         else:
                             # لا علامة مائية ولا وسوم صوتية: لا تنزيل/معالجة - سيتم الإرسال كنسخ خادم إن أمكن
@@ -902,8 +806,11 @@ class UserbotService:
                         processed_media = event.message.media
                         processed_filename = None
 
-                # Forward message to all target chats
-                for i, task in enumerate(matching_tasks):
+                # Outgoing requests go through the account's send queue (FloodWait retry, rate limits)
+                sender = self._scheduled_client(user_id, client, LIVE)
+
+                # Forward message to all target chats (concurrently, in order per target chat)
+                async def deliver_to_target(i, task):
                     try:
                         target_chat_id = str(task['target_chat_id']).strip()
                         task_name = task.get('task_name', f"مهمة {task['id']}")
@@ -916,7 +823,7 @@ class UserbotService:
                         
                         if should_block:
                             logger.info(f"🚫 الرسالة محظورة بواسطة فلاتر متقدمة للمهمة {task_name} - تجاهل هذه المهمة")
-                            continue
+                            return
 
                         # Get task forward mode and forwarding settings
                         forward_mode = task.get('forward_mode', 'forward')
@@ -938,7 +845,7 @@ class UserbotService:
                             group_id = event.message.grouped_id
                             if album_collector.is_album_processed(group_id):
                                 logger.info(f"📸 تجاهل رسالة الألبوم - تم معالجتها بالفعل: {group_id}")
-                                continue
+                                return
                             
                             # Add to album collection
                             album_collector.add_message(event.message, {
@@ -960,7 +867,7 @@ class UserbotService:
                                 self._process_album_delayed(user_id, group_id, client)
                             )
                             
-                            continue  # Skip individual processing
+                            return  # Skip individual processing
 
                         # Parse target chat ID with improved user handling
                         try:
@@ -986,11 +893,11 @@ class UserbotService:
                                             target_entity = target_int  # Use int as entity for direct user messaging
                                         except Exception:
                                             logger.error(f"❌ لا يمكن الوصول للمستخدم {target_int}")
-                                            continue
+                                            return
                                     else:
                                         # For channels/groups, must have access
                                         logger.error(f"❌ يجب الوصول للقناة/المجموعة {target_int}")
-                                        continue
+                                        return
                             
                             # Validate target entity if it's an actual entity object
                             if hasattr(target_entity, 'id'):
@@ -1002,7 +909,7 @@ class UserbotService:
                                 
                         except Exception as entity_error:
                             logger.error(f"❌ لا يمكن معالجة الهدف {target_chat_id}: {entity_error}")
-                            continue
+                            return
 
                         # Get message formatting settings for this task
                         message_settings = self.get_message_settings(task['id'])
@@ -1114,7 +1021,7 @@ class UserbotService:
                         if publishing_mode == 'manual':
                             logger.info(f"⏸️ وضع النشر اليدوي - إرسال الرسالة للمراجعة (المهمة: {task_name})")
                             await self._handle_manual_approval(event.message, task, user_id, client)
-                            continue  # Skip automatic forwarding
+                            return  # Skip automatic forwarding
                         
                         # Apply sending interval before each target (except first)
                         if i > 0:
@@ -1143,10 +1050,10 @@ class UserbotService:
                                 if hasattr(event.message, 'reply_to') and event.message.reply_to and getattr(event.message.reply_to, 'reply_to_msg_id', None):
                                     replied_source_id = event.message.reply_to.reply_to_msg_id
                                     # Look up mapping for the replied message in this task/source chat
-                                    mappings = self.db.get_message_mappings_by_source(task['id'], str(source_chat_id), replied_source_id)
+                                    mappings = await self._db_call('get_message_mappings_by_source', task['id'], str(source_chat_id), replied_source_id)
                                     if not mappings and str(source_chat_id).startswith('-100'):
                                         legacy_chat_id = str(source_chat_id).replace('-100', '')
-                                        mappings = self.db.get_message_mappings_by_source(task['id'], legacy_chat_id, replied_source_id)
+                                        mappings = await self._db_call('get_message_mappings_by_source', task['id'], legacy_chat_id, replied_source_id)
                                     if mappings:
                                         reply_to_msg_id = mappings[0]['target_message_id']
                         except Exception as map_err:
@@ -1157,7 +1064,7 @@ class UserbotService:
                             # وضع التوجيه - إرسال الرسالة كما هي مع رأس التوجيه
                             logger.info("🔀 استخدام وضع التوجيه - إرسال الرسالة مع رأس التوجيه")
                             try:
-                                forwarded_msg = await client.forward_messages(
+                                forwarded_msg = await sender.forward_messages(
                                     target_entity,
                                     event.message,
                                     silent=forwarding_settings['silent_notifications']
@@ -1168,14 +1075,14 @@ class UserbotService:
                                 if forwarded_msg:
                                     msg_id = forwarded_msg[0].id if isinstance(forwarded_msg, list) else forwarded_msg.id
                                     await self.apply_post_forwarding_settings(
-                                        client, target_entity, msg_id, forwarding_settings, task['id'],
+                                        sender, target_entity, msg_id, forwarding_settings, task['id'],
                                         inline_buttons=inline_buttons,
                                         has_original_buttons=bool(original_reply_markup)
                                     )
                                     
                                     # Save message mapping for sync functionality
                                     try:
-                                        self.db.save_message_mapping(
+                                        await self._db_call('save_message_mapping',
                                             task_id=task['id'],
                                             source_chat_id=str(source_chat_id),
                                             source_message_id=event.message.id,
@@ -1191,7 +1098,7 @@ class UserbotService:
                         elif final_send_mode == 'copy':
                             # Optimization: use server-side copy when no modifications are required
                             try:
-                                text_cleaning_settings = self.db.get_text_cleaning_settings(task['id'])
+                                text_cleaning_settings = self.get_task_settings(task['id']).get('text_cleaning', {})
                             except Exception:
                                 text_cleaning_settings = {}
                             remove_caption_flag = bool(text_cleaning_settings.get('remove_caption', False))
@@ -1225,7 +1132,7 @@ class UserbotService:
                                         "force_document": False  # Ensure videos display with preview and duration
                                     }
                                     
-                                    forwarded_msg = await client.send_file(
+                                    forwarded_msg = await sender.send_file(
                                         target_entity,
                                         file=event.message.media,
                                         **server_copy_kwargs
@@ -1235,10 +1142,10 @@ class UserbotService:
                                     if forwarded_msg:
                                         msg_id = forwarded_msg[0].id if isinstance(forwarded_msg, list) else forwarded_msg.id
                                         await self.apply_post_forwarding_settings(
-                                            client, target_entity, msg_id, forwarding_settings, task['id']
+                                            sender, target_entity, msg_id, forwarding_settings, task['id']
                                         )
                                         try:
-                                            self.db.save_message_mapping(
+                                            await self._db_call('save_message_mapping',
                                                 task_id=task['id'],
                                                 source_chat_id=str(source_chat_id),
                                                 source_message_id=event.message.id,
@@ -1254,7 +1161,7 @@ class UserbotService:
                                         # nothing to send
                                         forwarded_msg = None
                                     else:
-                                        forwarded_msg = await client.send_message(
+                                        forwarded_msg = await sender.send_message(
                                             target_entity,
                                             message_text,
                                             link_preview=forwarding_settings['link_preview_enabled'],
@@ -1268,10 +1175,10 @@ class UserbotService:
                                     if forwarded_msg:
                                         msg_id = forwarded_msg.id
                                         await self.apply_post_forwarding_settings(
-                                            client, target_entity, msg_id, forwarding_settings, task['id']
+                                            sender, target_entity, msg_id, forwarding_settings, task['id']
                                         )
                                         try:
-                                            self.db.save_message_mapping(
+                                            await self._db_call('save_message_mapping',
                                                 task_id=task['id'],
                                                 source_chat_id=str(source_chat_id),
                                                 source_message_id=event.message.id,
@@ -1286,14 +1193,14 @@ class UserbotService:
                                     logger.info(f"🔄 استخدام وضع النسخ بسبب التنسيق المطبق")
 
                                 # إذا كان لدينا ملف صوتي مُعالج كبايتات، أرسله مباشرة لتفادي أي التباس كرسالة نصية
-                                if isinstance(processed_media, (bytes, bytearray)) and ((processed_filename and processed_filename.lower().endswith(('.mp3', '.m4a', '.aac', '.ogg', '.wav', '.flac', '.wma', '.opus'))) or True):
+                                if isinstance(processed_media, (bytes, bytearray, str)) and ((processed_filename and processed_filename.lower().endswith(('.mp3', '.m4a', '.aac', '.ogg', '.wav', '.flac', '.wma', '.opus'))) or True):
                                     try:
                                         audio_filename = processed_filename or "audio.mp3"
                                         logger.info(f"🎵 إرسال الملف الصوتي المعالج بالرفع المباشر: {audio_filename}")
                                         
                                         # CRITICAL FIX: Upload once and reuse file handle
                                         forwarded_msg = await self._send_processed_media_optimized(
-                                            client, target_entity, processed_media, audio_filename,
+                                            sender, target_entity, processed_media, audio_filename,
                                             caption=final_text, 
                                             silent=forwarding_settings['silent_notifications'],
                                             parse_mode='HTML' if final_text else None,
@@ -1305,12 +1212,12 @@ class UserbotService:
                                         if forwarded_msg:
                                             msg_id = forwarded_msg[0].id if isinstance(forwarded_msg, list) else forwarded_msg.id
                                             await self.apply_post_forwarding_settings(
-                                                client, target_entity, msg_id, forwarding_settings, task['id'],
+                                                sender, target_entity, msg_id, forwarding_settings, task['id'],
                                                 inline_buttons=inline_buttons,
                                                 has_original_buttons=bool(original_reply_markup)
                                             )
                                             try:
-                                                self.db.save_message_mapping(
+                                                await self._db_call('save_message_mapping',
                                                     task_id=task['id'],
                                                     source_chat_id=str(source_chat_id),
                                                     source_message_id=event.message.id,
@@ -1331,7 +1238,7 @@ class UserbotService:
                                         # Web page - send as text message with link preview
                                         logger.info("🌐 إرسال صفحة ويب كنص مع معاينة الرابط")
                                         message_text = final_text or event.message.text or "رسالة"
-                                        forwarded_msg = await client.send_message(
+                                        forwarded_msg = await sender.send_message(
                                             target_entity,
                                             message_text,
                                             link_preview=forwarding_settings["link_preview_enabled"],
@@ -1345,7 +1252,7 @@ class UserbotService:
                                         if forwarded_msg:
                                             msg_id = forwarded_msg.id
                                             await self.apply_post_forwarding_settings(
-                                                client, target_entity, msg_id, forwarding_settings, task['id'],
+                                                sender, target_entity, msg_id, forwarding_settings, task['id'],
                                                 inline_buttons=inline_buttons,
                                                 has_original_buttons=bool(original_reply_markup)
                                             )
@@ -1353,20 +1260,20 @@ class UserbotService:
                                         # Regular media - send with caption using send_file
                                         logger.info("📁 إرسال وسائط مع الكابشن")
                                         caption_text = final_text
-                                        text_cleaning_settings = self.db.get_text_cleaning_settings(task["id"])
+                                        text_cleaning_settings = self.get_task_settings(task["id"]).get('text_cleaning', {})
                                         if text_cleaning_settings and text_cleaning_settings.get("remove_caption", False):
                                             caption_text = None
                                         
                                         # CRITICAL FIX: Use processed media if available, otherwise original media
                                         media_to_send = processed_media if processed_media else event.message.media
                                         
-                                        if isinstance(processed_media, (bytes, bytearray)) and processed_filename:
+                                        if isinstance(processed_media, (bytes, bytearray, str)) and processed_filename:
                                             # Send processed media with proper filename
                                             logger.info(f"🎵 إرسال الوسائط المعالجة (مُحسّنة مرة واحدة): {processed_filename}")
                                             
                                             # CRITICAL FIX: Upload once and reuse file handle
                                             forwarded_msg = await self._send_processed_media_optimized(
-                                                client, target_entity, processed_media, processed_filename,
+                                                sender, target_entity, processed_media, processed_filename,
                                                 caption=caption_text,
                                                 silent=forwarding_settings["silent_notifications"],
                                                 parse_mode="HTML" if caption_text else None,
@@ -1386,7 +1293,7 @@ class UserbotService:
                                                 "force_document": False  # Critical: ensure videos show as videos
                                             }
                                             
-                                            forwarded_msg = await client.send_file(
+                                            forwarded_msg = await sender.send_file(
                                                 target_entity,
                                                 file=media_to_send,
                                                 **video_kwargs
@@ -1396,12 +1303,12 @@ class UserbotService:
                                             if forwarded_msg:
                                                 msg_id = forwarded_msg[0].id if isinstance(forwarded_msg, list) else forwarded_msg.id
                                                 await self.apply_post_forwarding_settings(
-                                                    client, target_entity, msg_id, forwarding_settings, task['id'],
+                                                    sender, target_entity, msg_id, forwarding_settings, task['id'],
                                                     inline_buttons=inline_buttons,
                                                     has_original_buttons=bool(original_reply_markup)
                                                 )
                                                 try:
-                                                    self.db.save_message_mapping(
+                                                    await self._db_call('save_message_mapping',
                                                         task_id=task['id'],
                                                         source_chat_id=str(source_chat_id),
                                                         source_message_id=event.message.id,
@@ -1414,7 +1321,7 @@ class UserbotService:
                                     # Regular media message with caption handling
                                     # Check if caption should be removed
                                     caption_text = final_text
-                                    text_cleaning_settings = self.db.get_text_cleaning_settings(task['id'])
+                                    text_cleaning_settings = self.get_task_settings(task['id']).get('text_cleaning', {})
                                     if text_cleaning_settings and text_cleaning_settings.get('remove_caption', False):
                                         caption_text = None
                                         logger.info(f"🗑️ تم حذف التسمية التوضيحية للمهمة {task['id']}")
@@ -1429,13 +1336,13 @@ class UserbotService:
                                         
                                         # ===== CRITICAL FIX: استخدام الوسائط المعالجة مسبقاً =====
                                         # استخدام الوسائط التي تم معالجتها مرة واحدة بدلاً من معالجتها لكل هدف
-                                        if isinstance(processed_media, (bytes, bytearray)) and processed_filename:
+                                        if isinstance(processed_media, (bytes, bytearray, str)) and processed_filename:
                                             # Use the pre-processed media - CRITICAL OPTIMIZATION
                                             logger.info(f"🎯 استخدام الوسائط المُعالجة مسبقاً (محسّن): {processed_filename}")
                                             
                                             # CRITICAL FIX: Upload once and reuse file handle  
                                             forwarded_msg = await self._send_processed_media_optimized(
-                                                client, target_entity, processed_media, processed_filename,
+                                                sender, target_entity, processed_media, processed_filename,
                                                 caption=caption_text,
                                                 silent=forwarding_settings['silent_notifications'],
                                                 parse_mode='HTML' if caption_text else None,
@@ -1447,12 +1354,12 @@ class UserbotService:
                                             if forwarded_msg:
                                                 msg_id = forwarded_msg[0].id if isinstance(forwarded_msg, list) else forwarded_msg.id
                                                 await self.apply_post_forwarding_settings(
-                                                    client, target_entity, msg_id, forwarding_settings, task['id'],
+                                                    sender, target_entity, msg_id, forwarding_settings, task['id'],
                                                     inline_buttons=inline_buttons,
                                                     has_original_buttons=bool(original_reply_markup)
                                                 )
                                                 try:
-                                                    self.db.save_message_mapping(
+                                                    await self._db_call('save_message_mapping',
                                                         task_id=task['id'],
                                                         source_chat_id=str(source_chat_id),
                                                         source_message_id=event.message.id,
@@ -1465,7 +1372,7 @@ class UserbotService:
                                             # Use original media if no processing was done
                                             if event.message.media:
                                                 logger.info("📁 استخدام الوسائط الأصلية (بدون معالجة)")
-                                                forwarded_msg = await client.send_file(
+                                                forwarded_msg = await sender.send_file(
                                                     target_entity,
                                                     file=event.message.media,
                                                     caption=caption_text,
@@ -1476,7 +1383,7 @@ class UserbotService:
                                             else:
                                                 # No media - send as text message
                                                 logger.info("📝 لا توجد وسائط - إرسال كرسالة نصية")
-                                                forwarded_msg = await client.send_message(
+                                                forwarded_msg = await sender.send_message(
                                                     target_entity,
                                                     caption_text or "رسالة",
                                                     link_preview=forwarding_settings['link_preview_enabled'],
@@ -1490,12 +1397,12 @@ class UserbotService:
                                             if forwarded_msg:
                                                 msg_id = forwarded_msg[0].id if isinstance(forwarded_msg, list) else forwarded_msg.id
                                                 await self.apply_post_forwarding_settings(
-                                                    client, target_entity, msg_id, forwarding_settings, task['id'],
+                                                    sender, target_entity, msg_id, forwarding_settings, task['id'],
                                                     inline_buttons=inline_buttons,
                                                     has_original_buttons=bool(original_reply_markup)
                                                 )
                                                 try:
-                                                    self.db.save_message_mapping(
+                                                    await self._db_call('save_message_mapping',
                                                         task_id=task['id'],
                                                         source_chat_id=str(source_chat_id),
                                                         source_message_id=event.message.id,
@@ -1509,13 +1416,13 @@ class UserbotService:
                                         logger.info(f"📸 إبقاء الألبوم مجمع للمهمة {task['id']} (وضع النسخ)")
                                         
                                         # ===== استخدام الوسائط المعالجة مسبقاً =====
-                                        if isinstance(processed_media, (bytes, bytearray)) and processed_filename:
+                                        if isinstance(processed_media, (bytes, bytearray, str)) and processed_filename:
                                             # Use the pre-processed media with file handle optimization
                                             logger.info(f"🎯 استخدام الوسائط المُعالجة مسبقاً (محسّن): {processed_filename}")
                                             
                                             # CRITICAL FIX: Upload once and reuse file handle
                                             forwarded_msg = await self._send_processed_media_optimized(
-                                                client, target_entity, processed_media, processed_filename,
+                                                sender, target_entity, processed_media, processed_filename,
                                                 caption=caption_text,
                                                 silent=forwarding_settings['silent_notifications'],
                                                 parse_mode='HTML' if caption_text else None,
@@ -1527,12 +1434,12 @@ class UserbotService:
                                             if forwarded_msg:
                                                 msg_id = forwarded_msg[0].id if isinstance(forwarded_msg, list) else forwarded_msg.id
                                                 await self.apply_post_forwarding_settings(
-                                                    client, target_entity, msg_id, forwarding_settings, task['id'],
+                                                    sender, target_entity, msg_id, forwarding_settings, task['id'],
                                                     inline_buttons=inline_buttons,
                                                     has_original_buttons=bool(original_reply_markup)
                                                 )
                                                 try:
-                                                    self.db.save_message_mapping(
+                                                    await self._db_call('save_message_mapping',
                                                         task_id=task['id'],
                                                         source_chat_id=str(source_chat_id),
                                                         source_message_id=event.message.id,
@@ -1545,7 +1452,7 @@ class UserbotService:
                                             # Use original media if no processing was done
                                             if event.message.media:
                                                 logger.info("📁 استخدام الوسائط الأصلية (بدون معالجة)")
-                                                forwarded_msg = await client.send_file(
+                                                forwarded_msg = await sender.send_file(
                                                     target_entity,
                                                     file=event.message.media,
                                                     caption=caption_text,
@@ -1556,7 +1463,7 @@ class UserbotService:
                                             else:
                                                 # No media - send as text message
                                                 logger.info("📝 لا توجد وسائط - إرسال كرسالة نصية")
-                                                forwarded_msg = await client.send_message(
+                                                forwarded_msg = await sender.send_message(
                                                     target_entity,
                                                     caption_text or "رسالة",
                                                     link_preview=forwarding_settings['link_preview_enabled'],
@@ -1570,12 +1477,12 @@ class UserbotService:
                                             if forwarded_msg:
                                                 msg_id = forwarded_msg[0].id if isinstance(forwarded_msg, list) else forwarded_msg.id
                                                 await self.apply_post_forwarding_settings(
-                                                    client, target_entity, msg_id, forwarding_settings, task['id'],
+                                                    sender, target_entity, msg_id, forwarding_settings, task['id'],
                                                     inline_buttons=inline_buttons,
                                                     has_original_buttons=bool(original_reply_markup)
                                                 )
                                                 try:
-                                                    self.db.save_message_mapping(
+                                                    await self._db_call('save_message_mapping',
                                                         task_id=task['id'],
                                                         source_chat_id=str(source_chat_id),
                                                         source_message_id=event.message.id,
@@ -1593,7 +1500,7 @@ class UserbotService:
                                 if not message_text:
                                     # If truly empty, skip sending text
                                     message_text = ""
-                                forwarded_msg = await client.send_message(
+                                forwarded_msg = await sender.send_message(
                                     target_entity,
                                     message_text,
                                     link_preview=forwarding_settings['link_preview_enabled'],
@@ -1607,12 +1514,12 @@ class UserbotService:
                                 if forwarded_msg:
                                     msg_id = forwarded_msg.id
                                     await self.apply_post_forwarding_settings(
-                                        client, target_entity, msg_id, forwarding_settings, task['id'],
+                                        sender, target_entity, msg_id, forwarding_settings, task['id'],
                                         inline_buttons=inline_buttons,
                                         has_original_buttons=bool(original_reply_markup)
                                     )
                                     try:
-                                        self.db.save_message_mapping(
+                                        await self._db_call('save_message_mapping',
                                             task_id=task['id'],
                                             source_chat_id=str(source_chat_id),
                                             source_message_id=event.message.id,
@@ -1623,7 +1530,7 @@ class UserbotService:
                                         logger.debug(f"فشل حفظ التطابق (text send): {mapping_error}")
                             else:
                                 # Fallback to forward for other types
-                                forwarded_msg = await client.forward_messages(
+                                forwarded_msg = await sender.forward_messages(
                                     target_entity,
                                     event.message,
                                     silent=forwarding_settings['silent_notifications']
@@ -1633,7 +1540,7 @@ class UserbotService:
                                 if forwarded_msg:
                                     msg_id = forwarded_msg[0].id if isinstance(forwarded_msg, list) else forwarded_msg.id
                                     await self.apply_post_forwarding_settings(
-                                        client, target_entity, msg_id, forwarding_settings, task['id'],
+                                        sender, target_entity, msg_id, forwarding_settings, task['id'],
                                         inline_buttons=inline_buttons,
                                         has_original_buttons=False
                                     )
@@ -1659,30 +1566,38 @@ class UserbotService:
                         else:
                             logger.error(f"🚫 خطأ غير معروف: {error_str}")
 
+                sequential = any(self._sending_interval_enabled(task['id']) for task in matching_tasks[1:])
+                await self.target_fan_out.dispatch(
+                    user_id,
+                    [(str(task['target_chat_id']).strip(), functools.partial(deliver_to_target, i, task))
+                     for i, task in enumerate(matching_tasks)],
+                    sequential=sequential,  # a sending interval between targets keeps them one after another
+                )
+
             except Exception as e:
                 logger.error(f"خطأ في معالج الرسائل للمستخدم {user_id}: {e}")
             finally:
-                # تنظيف التخزين المؤقت المحلي بعد معالجة كل رسالة
-                if hasattr(self, '_current_media_cache'):
-                    self._current_media_cache.clear()
-                    logger.info("🗑️ تم تنظيف التخزين المؤقت المحلي للوسائط")
+                # حذف ملفات الوسائط المؤقتة بعد إرسالها لكل الأهداف
+                if spooled_files:
+                    self._release_spooled_media(spooled_files)
+                # تنظيف التخزين المؤقت المحلي لهذه الرسالة فقط (لا يمس رسائل أخرى قيد المعالجة)
+                self._current_media_cache.pop(f"{event.message.id}_{event.chat_id}_download", None)
 
         @client.on(events.MessageEdited)
         async def message_edit_handler(event):
             """Handle message edit synchronization"""
             try:
                 source_chat_id = event.chat_id
-                source_message_id = event.message.id
-
-                logger.info(f"🔄 تم تعديل رسالة: Chat={source_chat_id}, Message={source_message_id}")
 
                 # Get tasks that match this source chat
-                tasks = self.user_tasks.get(user_id, [])
-                matching_tasks = [task for task in tasks if str(task['source_chat_id']) == str(source_chat_id)]
+                matching_tasks = self._get_routed_tasks(user_id, source_chat_id)
 
                 if not matching_tasks:
                     return
 
+                source_message_id = event.message.id
+                logger.info(f"🔄 تم تعديل رسالة: Chat={source_chat_id}, Message={source_message_id}")
+
                 # Check sync settings for each matching task
                 for task in matching_tasks:
                     task_id = task['id']
@@ -1696,11 +1611,11 @@ class UserbotService:
                     # Find all target messages that were forwarded from this source message
                     # Convert chat_id to both possible formats to handle legacy data
                     legacy_chat_id = str(source_chat_id).replace('-100', '') if str(source_chat_id).startswith('-100') else str(source_chat_id)
-                    message_mappings = self.db.get_message_mappings_by_source(task_id, str(source_chat_id), source_message_id)
+                    message_mappings = await self._db_call('get_message_mappings_by_source', task_id, str(source_chat_id), source_message_id)
                     
                     # If no mappings found with full format, try legacy format
                     if not message_mappings and str(source_chat_id).startswith('-100'):
-                        message_mappings = self.db.get_message_mappings_by_source(task_id, legacy_chat_id, source_message_id)
+                        message_mappings = await self._db_call('get_message_mappings_by_source', task_id, legacy_chat_id, source_message_id)
 
                     for mapping in message_mappings:
                         target_chat_id = mapping['target_chat_id']
@@ -1713,7 +1628,7 @@ class UserbotService:
                             # Process the edited text
                             edited_text = event.message.text or event.message.message or ""
                             try:
-                                formatting_settings = self.db.get_text_formatting_settings(task_id)
+                                formatting_settings = self.get_task_settings(task_id).get('text_formatting', {})
                                 if formatting_settings and formatting_settings.get('text_formatting_enabled', False):
                                     processed_text = self.apply_text_formatting(task_id, edited_text)
                                 else:
@@ -1756,7 +1671,7 @@ class UserbotService:
                                 processed_text_to_send = processed_text
                                 # Use HTML parse mode only if there is HTML markup
                                 parse_mode_edit = 'HTML' if ('<' in processed_text_to_send and '>' in processed_text_to_send) else None
-                            await client.edit_message(
+                            await self._scheduled_client(user_id, client, EDIT).edit_message(
                                 target_entity_resolved,
                                 target_message_id,
                                 processed_text_to_send,
@@ -1798,15 +1713,14 @@ class UserbotService:
                 source_chat_id = event.chat_id
                 deleted_ids = event.deleted_ids
 
-                logger.info(f"🗑️ تم حذف رسائل: Chat={source_chat_id}, IDs={deleted_ids}")
-
                 # Get tasks that match this source chat
-                tasks = self.user_tasks.get(user_id, [])
-                matching_tasks = [task for task in tasks if str(task['source_chat_id']) == str(source_chat_id)]
+                matching_tasks = self._get_routed_tasks(user_id, source_chat_id)
 
                 if not matching_tasks:
                     return
 
+                logger.info(f"🗑️ تم حذف رسائل: Chat={source_chat_id}, IDs={deleted_ids}")
+
                 # Check sync settings for each matching task and deleted message
                 for task in matching_tasks:
                     task_id = task['id']
@@ -1821,11 +1735,11 @@ class UserbotService:
                         # Find all target messages that were forwarded from this source message
                         # Convert chat_id to both possible formats to handle legacy data
                         legacy_chat_id = str(source_chat_id).replace('-100', '') if str(source_chat_id).startswith('-100') else str(source_chat_id)
-                        message_mappings = self.db.get_message_mappings_by_source(task_id, str(source_chat_id), source_message_id)
+                        message_mappings = await self._db_call('get_message_mappings_by_source', task_id, str(source_chat_id), source_message_id)
                         
                         # If no mappings found with full format, try legacy format
                         if not message_mappings and str(source_chat_id).startswith('-100'):
-                            message_mappings = self.db.get_message_mappings_by_source(task_id, legacy_chat_id, source_message_id)
+                            message_mappings = await self._db_call('get_message_mappings_by_source', task_id, legacy_chat_id, source_message_id)
 
                         for mapping in message_mappings:
                             target_chat_id = mapping['target_chat_id']
@@ -1836,12 +1750,12 @@ class UserbotService:
                                 target_entity = await client.get_entity(int(target_chat_id))
 
                                 # Delete the target message
-                                await client.delete_messages(target_entity, target_message_id)
+                                await self._scheduled_client(user_id, client, EDIT).delete_messages(target_entity, target_message_id)
 
                                 logger.info(f"✅ تم حذف الرسالة المتزامنة: {target_chat_id}:{target_message_id}")
 
                                 # Remove the mapping from database since message is deleted
-                                self.db.delete_message_mapping(mapping['id'])
+                                await self._db_call('delete_message_mapping', mapping['id'])
 
                             except Exception as sync_error:
                                 logger.error(f"❌ فشل في مزامنة حذف الرسالة: {sync_error}")
@@ -1879,8 +1793,7 @@ class UserbotService:
                 if not (is_pin or is_unpin):
                     return
 
-                tasks = self.user_tasks.get(user_id, [])
-                matching_tasks = [task for task in tasks if str(task['source_chat_id']) == str(source_chat_id)]
+                matching_tasks = self._get_routed_tasks(user_id, source_chat_id)
                 if not matching_tasks:
                     return
 
@@ -1893,10 +1806,10 @@ class UserbotService:
                     # Map pinned source message to target message id, if available
                     target_reply_id = None
                     if replied_msg_id:
-                        mappings = self.db.get_message_mappings_by_source(task_id, str(source_chat_id), replied_msg_id)
+                        mappings = await self._db_call('get_message_mappings_by_source', task_id, str(source_chat_id), replied_msg_id)
                         if not mappings and str(source_chat_id).startswith('-100'):
                             legacy_chat_id = str(source_chat_id).replace('-100', '')
-                            mappings = self.db.get_message_mappings_by_source(task_id, legacy_chat_id, replied_msg_id)
+                            mappings = await self._db_call('get_message_mappings_by_source', task_id, legacy_chat_id, replied_msg_id)
                         if mappings:
                             target_reply_id = mappings[0]['target_message_id']
 
@@ -1907,18 +1820,18 @@ class UserbotService:
                         if is_pin:
                             if target_reply_id:
                                 try:
-                                    await client.pin_message(target_entity, target_reply_id, notify=not forwarding_settings.get('silent_notifications', False))
+                                    await self._scheduled_client(user_id, client, EDIT).pin_message(target_entity, target_reply_id, notify=not forwarding_settings.get('silent_notifications', False))
                                 except Exception:
                                     # Fallback: pin latest message if specific message not found
-                                    await client.pin_message(target_entity)
+                                    await self._scheduled_client(user_id, client, EDIT).pin_message(target_entity)
                             else:
-                                await client.pin_message(target_entity)
+                                await self._scheduled_client(user_id, client, EDIT).pin_message(target_entity)
                         elif is_unpin:
                             try:
                                 if target_reply_id:
-                                    await client.unpin_message(target_entity, target_reply_id)
+                                    await self._scheduled_client(user_id, client, EDIT).unpin_message(target_entity, target_reply_id)
                                 else:
-                                    await client.unpin_message(target_entity)
+                                    await self._scheduled_client(user_id, client, EDIT).unpin_message(target_entity)
                             except Exception as unpin_err:
                                 logger.debug(f"تعذر إلغاء التثبيت: {unpin_err}")
                     except Exception as pin_sync_err:
@@ -1930,7 +1843,18 @@ class UserbotService:
         """Refresh user tasks from database"""
         try:
             tasks = self.db.get_active_user_tasks(user_id)
+            previous_tasks = self.user_tasks.get(user_id) or []
             self.user_tasks[user_id] = tasks
+            self.user_task_routes[user_id] = self._build_task_routes(tasks)
+            self.task_settings.invalidate_many(task['id'] for task in previous_tasks + tasks)
+
+            # إيقاف عمليات ffmpeg الخاصة بالمهام المحذوفة أو المعطلة
+            active_ids = {task['id'] for task in tasks}
+            for task in previous_tasks:
+                if task['id'] not in active_ids:
+                    ffmpeg_runner.cancel(task['id'])
+                    self.duplicate_index.invalidate_task(task['id'])
+                    self.rate_limiter.forget_task(task['id'])
 
             # Log detailed task information
             logger.info(f"🔄 تم تحديث {len(tasks)} مهمة للمستخدم {user_id}")
@@ -1956,6 +1880,56 @@ class UserbotService:
             logger.error(f"خطأ في refresh_user_tasks للمستخدم {user_id}: {e}")
             return []
 
+    async def _db_call(self, method_name: str, *args, **kwargs):
+        """Call a database method, preferring its async mirror when the backend has one"""
+        async_method = getattr(self.db, f"async_{method_name}", None)
+        if async_method is not None:
+            return await async_method(*args, **kwargs)
+        return getattr(self.db, method_name)(*args, **kwargs)
+
+    def get_task_settings(self, task_id: int) -> TaskSettingsSnapshot:
+        """Get the in-memory settings snapshot for a task"""
+        return self.task_settings.get(task_id)
+
+    def invalidate_task_settings(self, task_id: Optional[int] = None, user_id: Optional[int] = None):
+        """Drop cached task settings after they were edited
+
+        Called by the control bot. With user_id, every loaded task of that user
+        is invalidated; with neither argument, all snapshots are dropped.
+        """
+        if task_id is not None:
+            self.task_settings.invalidate(task_id)
+        elif user_id is not None:
+            self.task_settings.invalidate_many(task['id'] for task in self.user_tasks.get(user_id) or [])
+        else:
+            self.task_settings.invalidate()
+
+    @staticmethod
+    def _build_task_routes(tasks: List[Dict]) -> Dict[str, List[Dict]]:
+        """Build a source chat id -> tasks routing index
+
+        Legacy sources stored without the -100 prefix are indexed under both
+        forms so they match the marked chat id Telethon reports for channels.
+        """
+        routes: Dict[str, List[Dict]] = defaultdict(list)
+        for task in tasks:
+            source_id = str(task.get('source_chat_id') or '').strip()
+            if not source_id:
+                continue
+            keys = [source_id]
+            if source_id.isdigit():
+                keys.append(f"-100{source_id}")
+            for key in keys:
+                routes[key].append(task)
+        return dict(routes)
+
+    def _get_routed_tasks(self, user_id: int, chat_id) -> List[Dict]:
+        """Get tasks whose source is the given chat using the routing index"""
+        routes = self.user_task_routes.get(user_id)
+        if not routes:
+            return []
+        return routes.get(str(chat_id), [])
+
     async def _recurring_posts_loop(self):
         """Background loop to process recurring posts for all connected users"""
         logger.info("🔁 بدء حلقة المنشورات المتكررة")
@@ -2038,6 +2012,8 @@ class UserbotService:
                 except Exception:
                     inline_buttons = None
 
+            sender = self._scheduled_client(user_id, client, RECURRING)
+
             # Get all targets
             targets = self.db.get_task_targets(task_id)
             if not targets:
@@ -2056,7 +2032,7 @@ class UserbotService:
                         delivery = self.db.get_recurring_delivery(post['id'], str(target_chat_id))
                         if delivery and delivery.get('last_message_id'):
                             try:
-                                await client.delete_messages(target_entity, delivery['last_message_id'])
+                                await sender.delete_messages(target_entity, delivery['last_message_id'])
                             except Exception as del_err:
                                 logger.debug(f"فشل حذف الرسالة السابقة: {del_err}")
 
@@ -2082,11 +2058,11 @@ class UserbotService:
 
                     sent = None
                     if final_send_mode == 'forward' and not (message.media and hasattr(message.media, 'webpage') and message.media.webpage):
-                        sent = await client.forward_messages(target_entity, message, silent=forwarding_settings.get('silent_notifications', False))
+                        sent = await sender.forward_messages(target_entity, message, silent=forwarding_settings.get('silent_notifications', False))
                         msg_id = sent[0].id if isinstance(sent, list) else sent.id
                     else:
                         if message.media:
-                            sent = await client.send_file(
+                            sent = await sender.send_file(
                                 target_entity,
                                 file=message.media,
                                 caption=final_text or None,
@@ -2097,7 +2073,7 @@ class UserbotService:
                             )
                             msg_id = sent[0].id if isinstance(sent, list) else sent.id
                         else:
-                            sent = await client.send_message(
+                            sent = await sender.send_message(
                                 target_entity,
                                 final_text or (message.text or ""),
                                 silent=forwarding_settings.get('silent_notifications', False),
@@ -2107,7 +2083,7 @@ class UserbotService:
 
                     # Post-forward actions (pin/delete/inline buttons via bot)
                     await self.apply_post_forwarding_settings(
-                        client, target_entity, msg_id, forwarding_settings, task_id,
+                        sender, target_entity, msg_id, forwarding_settings, task_id,
                         inline_buttons=inline_buttons,
                         has_original_buttons=has_original_buttons
                     )
@@ -2183,9 +2159,7 @@ class UserbotService:
     def is_media_allowed(self, task_id, media_type):
         """Check if media type is allowed for this task"""
         try:
-            from database.database import Database
-            db = Database()
-            filters = db.get_task_media_filters(task_id)
+            filters = self.get_task_settings(task_id).get('media_filters', {})
 
             # Default is allowed if no filter is set
             is_allowed = filters.get(media_type, True)
@@ -2198,8 +2172,8 @@ class UserbotService:
     async def is_admin_allowed_by_signature(self, task_id: int, message, source_chat_id: str) -> bool:
         """Check if admin is allowed based on message post_author signature"""
         try:
-            from database.database import Database
-            db = Database()
+            from database import DatabaseFactory
+            db = DatabaseFactory.get_shared_sqlite_database()
             
             # Check if admin filter is enabled for this task
             admin_filter_enabled = db.is_advanced_filter_enabled(task_id, 'admin')
@@ -2254,8 +2228,8 @@ class UserbotService:
     async def is_admin_allowed(self, task_id, sender_id):
         """Check if message sender is allowed by admin filters using new logic"""
         try:
-            from database.database import Database
-            db = Database()
+            from database import DatabaseFactory
+            db = DatabaseFactory.get_shared_sqlite_database()
 
             logger.info(f"👮‍♂️ [ADMIN FILTER] فحص المهمة: {task_id}, المرسل: {sender_id}")
 
@@ -2289,8 +2263,8 @@ class UserbotService:
     def is_message_allowed_by_word_filter(self, task_id, message_text):
         """Check if message is allowed by word filters"""
         try:
-            from database.database import Database
-            db = Database()
+            from database import DatabaseFactory
+            db = DatabaseFactory.get_shared_sqlite_database()
             is_allowed = db.is_message_allowed_by_word_filter(task_id, message_text)
             logger.info(f"🔍 فحص فلتر الكلمات: المهمة {task_id}, مسموح: {is_allowed}")
             return is_allowed
@@ -2301,8 +2275,8 @@ class UserbotService:
     def apply_text_replacements(self, task_id, message_text):
         """Apply text replacements to message text"""
         try:
-            from database.database import Database
-            db = Database()
+            from database import DatabaseFactory
+            db = DatabaseFactory.get_shared_sqlite_database()
             modified_text = db.apply_text_replacements(task_id, message_text)
             return modified_text
         except Exception as e:
@@ -2315,7 +2289,7 @@ class UserbotService:
 
         try:
             # Get translation settings for this task
-            settings = self.db.get_translation_settings(task_id)
+            settings = self.get_task_settings(task_id).get('translation', {})
             
             if not settings or not settings.get('enabled', False):
                 return message_text
@@ -2366,6 +2340,8 @@ class UserbotService:
             album_collector.mark_album_processed(group_id)
             logger.info(f"📸 معالجة ألبوم مجمع: {len(album_data)} رسائل (المجموعة: {group_id})")
             
+            sender = self._scheduled_client(user_id, client, LIVE)
+
             # Group by target to send albums together per target
             targets = {}
             for item in album_data:
@@ -2404,7 +2380,7 @@ class UserbotService:
                     )
                     
                     # Check if caption should be removed
-                    text_cleaning_settings = self.db.get_text_cleaning_settings(task['id'])
+                    text_cleaning_settings = self.get_task_settings(task['id']).get('text_cleaning', {})
                     if text_cleaning_settings and text_cleaning_settings.get('remove_caption', False):
                         final_text = None
                         logger.info(f"🗑️ تم حذف التسمية التوضيحية للألبوم {task['id']}")
@@ -2416,7 +2392,7 @@ class UserbotService:
                     
                     # Send as single album
                     if final_text:
-                        forwarded_msg = await client.send_file(
+                        forwarded_msg = await sender.send_file(
                             target_entity,
                             file=media_files,
                             caption=final_text,
@@ -2425,7 +2401,7 @@ class UserbotService:
                             force_document=False
                         )
                     else:
-                        forwarded_msg = await client.send_file(
+                        forwarded_msg = await sender.send_file(
                             target_entity,
                             file=media_files,
                             silent=task_info['forwarding_settings']['silent_notifications'],
@@ -2439,7 +2415,7 @@ class UserbotService:
                         # For albums, take the first message ID
                         msg_id = forwarded_msg[0].id if isinstance(forwarded_msg, list) else forwarded_msg.id
                         await self.apply_post_forwarding_settings(
-                            client, target_chat, msg_id, task_info['forwarding_settings'], task['id']
+                            sender, target_chat, msg_id, task_info['forwarding_settings'], task['id']
                         )
                     
                     # Save message mappings for all items
@@ -2448,7 +2424,7 @@ class UserbotService:
                             if i < len(forwarded_msg):
                                 msg_id = forwarded_msg[i].id
                                 try:
-                                    self.db.save_message_mapping(
+                                    await self._db_call('save_message_mapping',
                                         task_id=task['id'],
                                         source_chat_id=str(item['message'].peer_id.channel_id if hasattr(item['message'].peer_id, 'channel_id') else item['message'].chat_id),
                                         source_message_id=item['message'].id,
@@ -2473,9 +2449,9 @@ class UserbotService:
     def get_message_settings(self, task_id: int) -> dict:
         """Get message formatting settings for a task"""
         try:
-            from database.database import Database
-            db = Database()
-            settings = db.get_message_settings(task_id)
+            settings = self.get_task_settings(task_id).get('message')
+            if settings is None:
+                raise ValueError("لا توجد إعدادات رسالة")
             logger.info(f"🔧 إعدادات الرسالة للمهمة {task_id}: أزرار إنلاين={settings.get('inline_buttons_enabled', False)}")
             return settings
         except Exception as e:
@@ -2491,9 +2467,9 @@ class UserbotService:
     def get_forwarding_settings(self, task_id: int) -> dict:
         """Get forwarding settings for a task"""
         try:
-            from database.database import Database
-            db = Database()
-            settings = db.get_forwarding_settings(task_id)
+            settings = self.get_task_settings(task_id).get('forwarding')
+            if settings is None:
+                raise ValueError("لا توجد إعدادات توجيه")
             logger.info(f"🔧 إعدادات التوجيه للمهمة {task_id}: معاينة الرابط={settings.get('link_preview_enabled', True)}, تثبيت={settings.get('pin_message_enabled', False)}")
             return settings
         except Exception as e:
@@ -2506,6 +2482,93 @@ class UserbotService:
                 'auto_delete_time': 3600
             }
 
+    def _media_settings_hash(self, task_id: int) -> str:
+        """Hash of every setting that changes how a task processes media"""
+        def build(snapshot: TaskSettingsSnapshot) -> str:
+            import json
+            import hashlib
+            sections = {
+                name: snapshot.get(name, {})
+                for name in ('watermark', 'audio_metadata', 'audio_template', 'audio_tag_cleaning',
+                             'text_cleaning', 'text_cleaning_keywords')
+            }
+            # الملفات المرجعية (صورة العلامة، الغلاف، المقاطع) قد تُستبدل بنفس المسار
+            files = {}
+            for section in (sections['watermark'], sections['audio_metadata']):
+                for key in ('watermark_image_path', 'album_art_path', 'intro_audio_path', 'outro_audio_path'):
+                    path = section.get(key) if isinstance(section, dict) else None
+                    if path and os.path.exists(path):
+                        files[path] = os.path.getmtime(path)
+            payload = json.dumps([sections, files], sort_keys=True, default=str)
+            return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+        return self.get_task_settings(task_id).derive('media_settings_hash', build)
+
+    async def _process_media_by_content(self, event, task_id: int, stage: str, process):
+        """
+        Run a media processing step at most once per (document/photo id, settings)
+        
+        يُفحص مخزن المحتوى قبل أي تنزيل: نفس الملف المعاد نشره في محادثة أخرى
+        يُعاد استخدامه مباشرة. process يرجع (مسار الملف المعالج أو الوسائط الأصلية، اسم الملف)
+        """
+        content_id = media_content_id(event.message.media)
+        key = (stage, content_id, self._media_settings_hash(task_id)) if content_id else None
+        if key is not None:
+            stored = self.processed_media_store.get(key)
+            if stored:
+                store_path, stored_name = stored
+                # ربط الملف في المجلد المؤقت حتى لا يؤثر حذفه من المخزن على إرسال جارٍ
+                spool_path = media_spool.new_path(stored_name)
+                try:
+                    os.link(store_path, spool_path)
+                except OSError:
+                    spool_path = store_path
+                logger.info(f"🎯 إعادة استخدام الوسائط المعالجة من مخزن المحتوى دون تنزيل: {stored_name}")
+                return spool_path, stored_name
+
+        # أوامر ffmpeg داخل المعالجة تُسجَّل باسم المهمة حتى تُوقف عند حذفها أو تعطيلها
+        with ffmpeg_job(task_id):
+            processed_media, processed_filename = await process()
+        if key is not None and isinstance(processed_media, str):
+            self.processed_media_store.put(key, processed_media, processed_filename)
+        return processed_media, processed_filename
+
+    async def _tag_audio_message(self, event, task_id: int, spooled_files: List[str]):
+        """Download an audio message once and apply the task's audio tags to it"""
+        # تحميل الوسائط واستخراج اسم مناسب - مرة واحدة فقط
+        media_cache_key_download = f"{event.message.id}_{event.chat_id}_download"
+        
+        cached_download = self._current_media_cache.get(media_cache_key_download)
+        if cached_download:
+            media_path, file_name, file_ext = cached_download
+            logger.info("🔄 استخدام الوسائط المحمّلة من التخزين المؤقت")
+        else:
+            file_name = "media_file"
+            file_ext = ""
+            if hasattr(event.message.media, 'document') and event.message.media.document:
+                doc = event.message.media.document
+                if hasattr(doc, 'attributes'):
+                    for attr in doc.attributes:
+                        if hasattr(attr, 'file_name') and attr.file_name:
+                            file_name = attr.file_name
+                            # Extract file extension
+                            if '.' in file_name:
+                                file_ext = '.' + file_name.split('.')[-1].lower()
+                                file_name = file_name.rsplit('.', 1)[0]
+                            break
+
+            # تنزيل الوسائط مباشرة إلى ملف على القرص بدلاً من الذاكرة
+            media_path = await media_spool.download(event.message, file_name + file_ext)
+            if not media_path:
+                logger.warning("⚠️ فشل تحميل الوسائط - سيتم استخدام الوسائط الأصلية")
+                return event.message.media, None
+            spooled_files.append(media_path)
+            # حفظ مسار الملف المحمّل في التخزين المؤقت لهذه الرسالة
+            self._current_media_cache[media_cache_key_download] = (media_path, file_name, file_ext)
+            logger.info("💾 تم حفظ الوسائط المحمّلة في التخزين المؤقت لإعادة الاستخدام")
+
+        full_name = file_name + (file_ext or '')
+        return await self.apply_audio_metadata(event, task_id, media_path, full_name)
+
     async def apply_watermark_to_media(self, event, task_id: int):
         """
         Apply watermark to media if enabled for the task - محسن لمعالجة الوسائط مرة واحدة
@@ -2522,9 +2585,10 @@ class UserbotService:
         - Enhanced video processing and compression
         - Send videos in MP4 format
         """
+        source_path = watermarked_path = None
         try:
             # Get watermark settings
-            watermark_settings = self.db.get_watermark_settings(task_id)
+            watermark_settings = self.get_task_settings(task_id).get('watermark', {})
             logger.info(f"🏷️ فحص إعدادات العلامة المائية للمهمة {task_id}: {watermark_settings}")
 
             # Check if message has media
@@ -2552,12 +2616,6 @@ class UserbotService:
 
             logger.info(f"🏷️ نوع الوسائط للمهمة {task_id}: صورة={is_photo}, فيديو={is_video}, مستند={is_document}")
 
-            # Download media bytes always (we need them for audio processing regardless of watermark settings)
-            media_bytes = await event.message.download_media(bytes)
-            if not media_bytes:
-                logger.warning(f"فشل في تحميل الوسائط للمهمة {task_id}")
-                return event.message.media, None
-
             # Derive filename and extension
             file_name = "media_file"
             file_extension = ""
@@ -2626,6 +2684,12 @@ class UserbotService:
             full_file_name = file_name + file_extension
             logger.info(f"🏷️ تجهيز الوسائط باسم {full_file_name} للمهمة {task_id}")
 
+            # Download media to disk always (we need it for audio processing regardless of watermark settings)
+            source_path = await media_spool.download(event.message, full_file_name)
+            if not source_path:
+                logger.warning(f"فشل في تحميل الوسائط للمهمة {task_id}")
+                return event.message.media, None
+
             # Decide whether to apply watermark (but do not early return if disabled)
             apply_wm = watermark_settings.get('enabled', False)
             if is_photo and not watermark_settings.get('apply_to_photos', True):
@@ -2637,62 +2701,73 @@ class UserbotService:
                 apply_wm = False
 
             # Process watermark optionally
-            watermarked_media = None
             if apply_wm:
                 logger.info(f"🏷️ تطبيق العلامة المائية على {full_file_name} للمهمة {task_id}")
                 # CRITICAL FIX: Process media ONCE for all targets to prevent multiple uploads
-                # استخدام المعالج المحسن للغاية للسرعة القصوى
+                # استخدام المعالج المحسن للغاية للسرعة القصوى - يعمل على الملف مباشرة
+                output_path = media_spool.new_path(full_file_name)
                 try:
-                    watermarked_media = await ultra_optimized_processor.process_media_ultra_fast(
-                        media_bytes,
+                    if await ultra_optimized_processor.process_media_file_ultra_fast(
+                        source_path,
                         full_file_name,
                         watermark_settings,
                         task_id,
-                    )
+                        output_path,
+                    ):
+                        watermarked_path = output_path
                     logger.info(f"🚀 تم استخدام المعالج المحسن للغاية: {full_file_name}")
                 except Exception as e:
                     logger.warning(f"فشل في المعالج المحسن للغاية، استخدام المعالج المحسن: {e}")
+                    with open(source_path, 'rb') as f:
+                        media_bytes = f.read()
                     try:
-                        watermarked_media = optimized_processor.process_media_once_for_all_targets_fast(
+                        watermarked_media = await media_pool.run(
+                            optimized_processor.process_media_once_for_all_targets_fast,
                             media_bytes,
                             full_file_name,
                             watermark_settings,
                             task_id,
+                            lane=HEAVY,
                         )
                     except Exception as e2:
                         logger.warning(f"فشل في المعالج المحسن، استخدام المعالج الأصلي: {e2}")
-                        watermarked_media = self.watermark_processor.process_media_once_for_all_targets(
+                        watermarked_media = await media_pool.run(
+                            self.watermark_processor.process_media_once_for_all_targets,
                             media_bytes,
                             full_file_name,
                             watermark_settings,
                             task_id,
+                            lane=HEAVY,
                         )
+                    if watermarked_media and watermarked_media != media_bytes:
+                        with open(output_path, 'wb') as f:
+                            f.write(watermarked_media)
+                        watermarked_path = output_path
+                if not watermarked_path:
+                    media_spool.discard(output_path)
             else:
                 logger.info(f"🏷️ العلامة المائية معطلة أو غير منطبقة - سيتم الانتقال مباشرة لمعالجة الصوت (إن وجد)")
 
-            # Always apply audio metadata processing next (using watermarked bytes if available)
-            base_bytes = watermarked_media if (watermarked_media and watermarked_media != media_bytes) else media_bytes
-            final_media, final_filename = await self.apply_audio_metadata(event, task_id, base_bytes, full_file_name)
+            # Always apply audio metadata processing next (using the watermarked file if available)
+            base_path = watermarked_path or source_path
+            audio_path, final_filename = await self.apply_audio_metadata(event, task_id, base_path, full_file_name)
 
-            # Determine if any processing actually happened to avoid forcing copy for unchanged media
-            media_changed = False
-            try:
-                if watermarked_media and watermarked_media != media_bytes:
-                    media_changed = True
-                elif isinstance(final_media, (bytes, bytearray)) and final_media != base_bytes:
-                    media_changed = True
-            except Exception:
-                media_changed = True  # Be safe
+            # Only keep the final file; drop intermediate spool files
+            final_path = audio_path or watermarked_path
+            media_spool.discard(*(path for path in (source_path, watermarked_path) if path != final_path))
 
-            if media_changed:
+            if final_path:
+                if not audio_path:
+                    final_filename = full_file_name
                 logger.info(f"📁 اسم الملف المُرجع (بعد المعالجة): {final_filename}")
-                return final_media, final_filename
+                return final_path, final_filename
             else:
                 logger.info("🔄 لم يحدث أي تغيير فعلي على الوسائط - سيتم استخدام الوسائط الأصلية")
                 return event.message.media, None
                 
         except Exception as e:
             logger.error(f"خطأ في تطبيق العلامة المائية: {e}")
+            media_spool.discard(source_path, watermarked_path)
             return event.message.media, None
     
     async def get_watermark_performance_stats(self) -> Dict:
@@ -2704,12 +2779,58 @@ class UserbotService:
                 'status': 'active',
                 'ffmpeg_available': ultra_optimized_processor.ffmpeg_available,
                 'cache_efficiency': f"{stats.get('cache_hit_rate', 0):.1f}%",
-                'avg_processing_time': f"{stats.get('avg_processing_time', 0):.2f}s"
+                'avg_processing_time': f"{stats.get('avg_processing_time', 0):.2f}s",
+                'media_caches': self.get_media_cache_stats(),
+                'send_schedulers': self.get_send_scheduler_stats(),
+                'media_workers': media_pool.stats(),
+                'ffmpeg_jobs': ffmpeg_runner.stats(),
+                'media_info': media_info_cache.stats(),
+                'watermark_overlays': watermark_overlays.stats(),
+                'encoding': encoding_engine.stats(),
             }
         except Exception as e:
             logger.error(f"خطأ في الحصول على إحصائيات الأداء: {e}")
             return {'status': 'error', 'message': str(e)}
     
+    def get_media_cache_stats(self) -> Dict:
+        """إحصائيات ذاكرات الوسائط المؤقتة (الحجم، الإصابات، الإخلاءات)"""
+        try:
+            stats = {
+                cache.name: cache.stats()
+                for cache in (self.global_processed_media_cache, self._current_media_cache, self.uploaded_file_cache)
+            }
+            stats['processed_media_store'] = self.processed_media_store.stats()
+            return stats
+        except Exception as e:
+            logger.error(f"خطأ في الحصول على إحصائيات ذاكرة الوسائط: {e}")
+            return {}
+
+    def _scheduled_client(self, account, client: TelegramClient, priority: int) -> ScheduledClient:
+        """Client view whose sends go through the account's send scheduler at the given priority"""
+        scheduler = self.send_schedulers.get(account)
+        if scheduler is None:
+            scheduler = self.send_schedulers[account] = SendScheduler(account)
+        # Reuse the same view so caches keyed by the client object keep hitting
+        view = self._scheduled_clients.get((account, priority))
+        if view is None or view.client is not client:
+            view = self._scheduled_clients[(account, priority)] = ScheduledClient(client, scheduler, priority)
+        return view
+
+    async def _close_send_scheduler(self, account):
+        scheduler = self.send_schedulers.pop(account, None)
+        for key in [key for key in self._scheduled_clients if key[0] == account]:
+            del self._scheduled_clients[key]
+        if scheduler is not None:
+            await scheduler.close()
+
+    def get_send_scheduler_stats(self) -> Dict:
+        """إحصائيات جدولة الإرسال لكل حساب (طول الطوابير، زمن الانتظار، انتظار الفيضان)"""
+        try:
+            return {str(account): scheduler.stats() for account, scheduler in self.send_schedulers.items()}
+        except Exception as e:
+            logger.error(f"خطأ في الحصول على إحصائيات جدولة الإرسال: {e}")
+            return {}
+
     async def check_and_install_ffmpeg(self) -> Dict:
         """التحقق من FFmpeg وتثبيته تلقائياً إذا لزم الأمر"""
         try:
@@ -2748,10 +2869,13 @@ class UserbotService:
                 'message': f"خطأ في التحقق من FFmpeg: {e}",
                 'ffmpeg_available': False
             }
-    async def apply_audio_metadata(self, event, task_id: int, media_bytes: bytes, file_name: str):
+    async def apply_audio_metadata(self, event, task_id: int, media_path: str, file_name: str):
         """
         Apply audio metadata processing if enabled for the task
         
+        يعمل على ملف الوسائط المؤقت مباشرة ويرجع (مسار الملف المعالج، اسم الملف)،
+        أو (None, اسم الملف) إذا لم تتم أي معالجة
+        
         الميزات:
         - تعديل جميع أنواع الوسوم الصوتية (ID3v2)
         - قوالب جاهزة للاستخدام
@@ -2761,16 +2885,16 @@ class UserbotService:
         """
         try:
             # Load audio metadata settings from database
-            audio_settings = self.db.get_audio_metadata_settings(task_id)
+            audio_settings = self.get_task_settings(task_id).get('audio_metadata', {})
             
             if not audio_settings.get('enabled', False):
                 logger.info(f"🎵 الوسوم الصوتية معطلة للمهمة {task_id}")
-                return media_bytes, file_name
+                return None, file_name
             
             # Check if this is an audio file
             is_audio = False
             
-            # Check by file extension first (more reliable when we have media_bytes)
+            # Check by file extension first (more reliable when we have the downloaded file)
             if file_name.lower().endswith(('.mp3', '.m4a', '.aac', '.ogg', '.wav', '.flac', '.wma', '.opus')):
                 is_audio = True
                 logger.info(f"🎵 تم تحديد الملف كملف صوتي بواسطة الامتداد: {file_name}")
@@ -2783,12 +2907,12 @@ class UserbotService:
             
             if not is_audio:
                 logger.debug(f"🎵 تخطي الملف - ليس ملف صوتي للمهمة {task_id}")
-                return media_bytes, file_name
+                return None, file_name
             
             logger.info(f"🎵 بدء معالجة الوسوم الصوتية للملف {file_name} في المهمة {task_id}")
             
             # Get template settings from the new system
-            template_settings = self.db.get_audio_template_settings(task_id)
+            template_settings = self.get_task_settings(task_id).get('audio_template', {})
             
             # Convert template settings to metadata template format
             metadata_template = {
@@ -2816,7 +2940,7 @@ class UserbotService:
 
             # تطبيق تنظيف النصوص على الوسوم إذا كان مفعّلًا لهذه المهمة
             try:
-                tag_cleaning = self.db.get_audio_tag_cleaning_settings(task_id)
+                tag_cleaning = self.get_task_settings(task_id).get('audio_tag_cleaning', {})
             except Exception:
                 tag_cleaning = {'enabled': False}
 
@@ -2856,19 +2980,23 @@ class UserbotService:
                     effective_template['lyrics'] = '\n'.join(cleaned_lines)
 
             # CRITICAL FIX: Process audio ONCE for all targets to prevent multiple uploads
-            processed_audio = self.audio_processor.process_audio_once_for_all_targets(
-                media_bytes,
-                file_name,
-                effective_template,
-                album_art_path=album_art_path,
-                apply_art_to_all=bool(audio_settings.get('apply_art_to_all', False)),
-                audio_intro_path=intro_path,
-                audio_outro_path=outro_path,
-                intro_position=intro_position,
-                task_id=task_id
+            # تُعدَّل الوسوم في الملف نفسه على القرص دون نسخه إلى الذاكرة
+            # mutagen ودمج المقاطع عبر ffmpeg حاجبان - يعملان في المسار الثقيل لعمّال الوسائط
+            processed_audio = await media_pool.run(
+                functools.partial(
+                    self.audio_processor.process_audio_file,
+                    media_path,
+                    effective_template,
+                    album_art_path=album_art_path,
+                    apply_art_to_all=bool(audio_settings.get('apply_art_to_all', False)),
+                    audio_intro_path=intro_path,
+                    audio_outro_path=outro_path,
+                    intro_position=intro_position,
+                ),
+                lane=HEAVY,
             )
             
-            if processed_audio and processed_audio != media_bytes:
+            if processed_audio:
                 logger.info(f"✅ تم معالجة الوسوم الصوتية للملف {file_name} في المهمة {task_id}")
                 # Update filename to MP3 if conversion was done
                 if file_name.lower().endswith(('.m4a', '.aac', '.ogg', '.wav', '.flac', '.wma', '.opus')):
@@ -2878,75 +3006,86 @@ class UserbotService:
                 return processed_audio, file_name
             else:
                 logger.debug(f"🔄 لم يتم معالجة الوسوم الصوتية للملف {file_name} في المهمة {task_id}")
-                return media_bytes, file_name
+                return None, file_name
                 
         except Exception as e:
             logger.error(f"خطأ في معالجة الوسوم الصوتية: {e}")
-            return media_bytes, file_name
+            return None, file_name
 
-    async def _send_processed_media_optimized(self, client, target_entity, media_bytes, filename, task=None, event=None, **kwargs):
-        """
-        CRITICAL OPTIMIZATION: Upload processed media once and reuse file handle for all targets
-        This prevents redundant uploads and dramatically improves performance
+    def _release_spooled_media(self, paths: List[str]):
+        """حذف ملفات الوسائط المؤقتة لرسالة بعد إرسالها لكل الأهداف"""
+        released = set(paths)
+        try:
+            for key, value in list(self.global_processed_media_cache.items()):
+                if isinstance(value, tuple) and value and value[0] in released:
+                    self.global_processed_media_cache.pop(key, None)
+        except Exception as e:
+            logger.debug(f"تعذر تنظيف ذاكرة الوسائط المعالجة: {e}")
+        media_spool.discard(*released)
+
+    async def _send_processed_media_optimized(self, client, target_entity, media, filename, task=None, event=None, **kwargs):
         """
-        import hashlib
-        import io
+        CRITICAL OPTIMIZATION: Upload processed media once and reuse it for all targets
         
-        # Create unique cache key for this media
-        media_hash = hashlib.md5(media_bytes).hexdigest()
-        cache_key = f"{media_hash}_{filename}"
-        
-        # Check if file already uploaded
-        if cache_key in self.uploaded_file_cache:
-            file_handle = self.uploaded_file_cache[cache_key]
-            logger.info(f"🎯 استخدام معرف الملف المرفوع مسبقاً (محسّن): {filename}")
-            
-            # Send using cached file handle - NO RE-UPLOAD
-            return await client.send_file(target_entity, file_handle, **kwargs)
+        الملف يُرفع مرة واحدة عبر client.upload_file مع سماته وصورته المصغّرة، ثم يُرسل
+        لكل الأهداف وكل المهام من نفس الرفع (وبعد أول إرسال كوثيقة موجودة على الخادم).
+        media: مسار الملف المعالج على القرص أو bytes
+        """
+        from send_file_helper import TelethonFileSender
+
+        # CRITICAL FIX: Force video files to be sent as video, not document
+        if filename and filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v')):
+            kwargs["force_document"] = False  # إجبار الإرسال كفيديو
+            # الإبقاء على HTML فقط إذا كان هناك تنسيق ضروري (مثل <tg-spoiler>)
+            caption_text = kwargs.get('caption') or ''
+            has_html_markup = ('<' in caption_text and '>' in caption_text)
+            if 'parse_mode' in kwargs and not has_html_markup:
+                # لا حاجة لـ parse_mode عند عدم وجود HTML
+                del kwargs['parse_mode']
+
+        # الملفات المرفوعة تخص حساب العميل الذي رفعها - المفتاح يشمل العميل الفعلي
+        # (وليس واجهة ScheduledClient الخاصة بكل أولوية) حتى تتشارك كل المهام نفس الرفع
+        account_client = getattr(client, 'client', client)
+        if isinstance(media, str):
+            # ملفات القرص المؤقتة فريدة لكل معالجة - المسار يكفي دون تجزئة المحتوى
+            cache_key = (id(account_client), media, filename)
         else:
-            # First time upload: upload and cache file handle
-            logger.info(f"📤 رفع الملف لأول مرة وحفظ المعرف للأهداف التالية: {filename}")
-            
-            # Upload file and get handle for reuse
-            try:
-                from send_file_helper import TelethonFileSender
-                
-                # Use TelethonFileSender to upload with proper attributes but cache result
-                # CRITICAL FIX: Force video files to be sent as video, not document
-                if filename and filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v')):
-                    kwargs["force_document"] = False  # إجبار الإرسال كفيديو
-                    # الإبقاء على HTML فقط إذا كان هناك تنسيق ضروري (مثل <tg-spoiler>)
-                    try:
-                        caption_text = kwargs.get('caption') or ''
-                    except Exception:
-                        caption_text = ''
-                    has_html_markup = ('<' in caption_text and '>' in caption_text)
-                    if 'parse_mode' in kwargs and not has_html_markup:
-                        # لا حاجة لـ parse_mode عند عدم وجود HTML
-                        del kwargs['parse_mode']
-                
-                result = await TelethonFileSender.send_file_with_name(
-                    client, target_entity, media_bytes, filename, **kwargs
-                )
-                
-                # Try to extract file handle from the sent message for caching
+            import hashlib
+            cache_key = (id(account_client), hashlib.md5(media).hexdigest(), filename)
+
+        try:
+            prepared = self.uploaded_file_cache.get(cache_key)
+            if prepared is None:
+                # رفع واحد فقط حتى لو طلبته عدة أهداف في نفس الوقت
+                upload_lock = self._upload_locks.get(cache_key)
+                if upload_lock is None:
+                    upload_lock = self._upload_locks[cache_key] = [asyncio.Lock(), 0]
+                upload_lock[1] += 1
                 try:
-                    if hasattr(result, 'media') and hasattr(result.media, 'document'):
-                        file_handle = result.media.document
-                        self.uploaded_file_cache[cache_key] = file_handle
-                        logger.info(f"✅ تم حفظ معرف الملف للاستخدام المتكرر: {filename}")
-                except Exception as cache_err:
-                    logger.warning(f"⚠️ لم يتم حفظ معرف الملف: {cache_err}")
-                
-                return result
-                
-            except Exception as e:
-                logger.error(f"❌ فشل في رفع الملف المُحسّن: {e}")
-                # Fallback to normal method
-                from send_file_helper import TelethonFileSender
-                return await TelethonFileSender.send_file_with_name(
-                    client, target_entity, media_bytes, filename, **kwargs
-                )
+                    async with upload_lock[0]:
+                        prepared = self.uploaded_file_cache.get(cache_key)
+                        if prepared is None:
+                            logger.info(f"📤 رفع الملف لأول مرة وحفظ المعرف للأهداف التالية: {filename}")
+                            prepared = await TelethonFileSender.prepare_media(client, media, filename, **kwargs)
+                            self.uploaded_file_cache[cache_key] = prepared
+                finally:
+                    # القفل يبقى ما دام هناك من ينتظره، حتى لا يبدأ رفع ثانٍ بقفل جديد بعد فشل الأول
+                    upload_lock[1] -= 1
+                    if upload_lock[1] == 0 and self._upload_locks.get(cache_key) is upload_lock:
+                        del self._upload_locks[cache_key]
+            else:
+                logger.info(f"🎯 استخدام معرف الملف المرفوع مسبقاً (محسّن): {filename}")
+
+            # Send using the prepared upload - NO RE-UPLOAD
+            return await TelethonFileSender.send_prepared(client, target_entity, prepared, **kwargs)
+
+        except Exception as e:
+            logger.error(f"❌ فشل في إرسال الملف المرفوع مسبقاً: {e}")
+            self.uploaded_file_cache.pop(cache_key, None)
+            # Fallback to normal method
+            return await TelethonFileSender.send_file_with_name(
+                client, target_entity, media, filename, **kwargs
+            )
 
     def apply_message_formatting(self, text: str, settings: dict, is_media: bool) -> str:
         """Apply header and footer formatting to message text with scope control"""
@@ -2984,10 +3123,10 @@ class UserbotService:
     def build_inline_buttons(self, task_id: int):
         """Build inline buttons for a task"""
         try:
-            from database.database import Database
+            from database import DatabaseFactory
             from telethon import Button
 
-            db = Database()
+            db = DatabaseFactory.get_shared_sqlite_database()
             buttons_data = db.get_inline_buttons(task_id)
 
             logger.info(f"🔍 فحص أزرار إنلاين للمهمة {task_id}: تم العثور على {len(buttons_data) if buttons_data else 0} زر")
@@ -3157,7 +3296,7 @@ class UserbotService:
     async def _apply_forwarding_delay(self, task_id: int):
         """Apply forwarding delay before sending message"""
         try:
-            settings = self.db.get_forwarding_delay_settings(task_id)
+            settings = self.get_task_settings(task_id).get('forwarding_delay', {})
             if not settings or not settings.get('enabled', False):
                 return
 
@@ -3172,10 +3311,14 @@ class UserbotService:
         except Exception as e:
             logger.error(f"خطأ في تطبيق تأخير التوجيه: {e}")
 
+    def _sending_interval_enabled(self, task_id: int) -> bool:
+        settings = self.get_task_settings(task_id).get('sending_interval', {})
+        return bool(settings and settings.get('enabled', False) and settings.get('interval_seconds', 0) > 0)
+
     async def _apply_sending_interval(self, task_id: int):
         """Apply sending interval between messages to different targets"""
         try:
-            settings = self.db.get_sending_interval_settings(task_id)
+            settings = self.get_task_settings(task_id).get('sending_interval', {})
             if not settings or not settings.get('enabled', False):
                 return
 
@@ -3196,7 +3339,7 @@ class UserbotService:
         """
         try:
             # Get advanced filter settings
-            advanced_settings = self.db.get_advanced_filters_settings(task_id)
+            advanced_settings = self.get_task_settings(task_id).get('advanced_filters', {})
             
             should_block = False
             should_remove_buttons = False  
@@ -3204,7 +3347,7 @@ class UserbotService:
             
             # Check forwarded message filter
             if advanced_settings.get('forwarded_message_filter_enabled', False):
-                forwarded_setting = self.db.get_forwarded_message_filter_setting(task_id)
+                forwarded_setting = self.get_task_settings(task_id).get('forwarded_filter')
                 
                 # Check if message is forwarded
                 is_forwarded = (hasattr(message, 'forward') and message.forward is not None)
@@ -3220,7 +3363,7 @@ class UserbotService:
             # Check inline button filter 
             if not should_block:
                 inline_button_filter_enabled = advanced_settings.get('inline_button_filter_enabled', False)
-                inline_button_setting = self.db.get_inline_button_filter_setting(task_id)
+                inline_button_setting = self.get_task_settings(task_id).get('inline_button_filter')
                 
                 logger.debug(f"🔍 فحص فلتر الأزرار الشفافة: المهمة {task_id}, فلتر مفعل={inline_button_filter_enabled}, إعداد الحظر={inline_button_setting}")
                 
@@ -3689,7 +3832,7 @@ class UserbotService:
                         media = original_msg.media
                     
                     # Edit message with buttons
-                    edited_msg = await bot_client.edit_message(
+                    edited_msg = await self._scheduled_client('bot', bot_client, EDIT).edit_message(
                         target_entity,
                         message_id,
                         message_text,
@@ -3767,7 +3910,7 @@ class UserbotService:
     async def _check_character_limits(self, task_id: int, message_text: str) -> bool:
         """Check if message meets character limit requirements"""
         try:
-            settings = self.db.get_character_limit_settings(task_id)
+            settings = self.get_task_settings(task_id).get('character_limit', {})
             logger.info(f"🔍 إعدادات حد الأحرف للمهمة {task_id}: {settings}")
             
             if not settings or not settings.get('enabled', False):
@@ -3821,7 +3964,7 @@ class UserbotService:
     async def _check_rate_limits(self, task_id: int, user_id: int) -> bool:
         """Check if message meets rate limit requirements"""
         try:
-            settings = self.db.get_rate_limit_settings(task_id)
+            settings = self.get_task_settings(task_id).get('rate_limit', {})
             if not settings or not settings.get('enabled', False):
                 return True
 
@@ -3831,15 +3974,13 @@ class UserbotService:
             if max_messages <= 0 or time_period_seconds <= 0:
                 return True
 
-            # Check if rate limit is exceeded
-            is_rate_limited = self.db.check_rate_limit(task_id)
+            # Check the limit and count this message in one step (in memory)
+            allowed = self.rate_limiter.try_acquire(task_id, max_messages, time_period_seconds)
             
-            if is_rate_limited:
+            if not allowed:
                 logger.info(f"⏰ تم الوصول لحد المعدل: {max_messages} رسالة في {time_period_seconds} ثانية")
                 return False
 
-            # Track this message for rate limiting
-            self.db.track_message_for_rate_limit(task_id)
             logger.debug(f"✅ حد المعدل مقبول: أقل من {max_messages} رسالة في {time_period_seconds} ثانية")
             return True
 
@@ -3855,7 +3996,7 @@ class UserbotService:
             today = datetime.datetime.now().weekday()
             
             # Get day filter settings
-            day_filters = self.db.get_day_filters(task_id)
+            day_filters = self.get_task_settings(task_id).get('day_filters', [])
             if not day_filters:
                 logger.debug(f"📅 لا توجد إعدادات فلتر الأيام للمهمة {task_id}")
                 return False
@@ -4044,8 +4185,8 @@ class UserbotService:
         try:
             import datetime
             
-            # Get working hours configuration - always fetch fresh from database
-            working_hours = self.db.get_working_hours(task_id)
+            # Get working hours configuration from the task settings snapshot
+            working_hours = self.get_task_settings(task_id).get('working_hours')
             if not working_hours:
                 logger.debug(f"⏰ لا توجد إعدادات ساعات العمل للمهمة {task_id}")
                 return False
@@ -4118,7 +4259,7 @@ class UserbotService:
         """Check if message is duplicate based on settings"""
         try:
             # Get duplicate filter settings
-            settings = self.db.get_duplicate_settings(task_id)
+            settings = self.get_task_settings(task_id).get('duplicate', {})
             
             if not settings:
                 logger.debug(f"❌ لا توجد إعدادات فلتر التكرار للمهمة {task_id}")
@@ -4142,7 +4283,7 @@ class UserbotService:
             threshold = settings.get('similarity_threshold', 80) / 100.0
             time_window_hours = settings.get('time_window_hours', 24)
             
-            logger.info(f"🔍 فحص تكرار الرسالة للمهمة {task_id}: مفعل={enabled}, نص={check_text}, وسائط={check_media}, نسبة={threshold*100:.0f}%, نافذة={time_window_hours}ساعة")
+            logger.debug(f"🔍 فحص تكرار الرسالة للمهمة {task_id}: مفعل={enabled}, نص={check_text}, وسائط={check_media}, نسبة={threshold*100:.0f}%, نافذة={time_window_hours}ساعة")
             
             # Get message content to check - fix message.message to message.text
             message_text = message.text or message.message or ""
@@ -4162,55 +4303,54 @@ class UserbotService:
                         media_hash = str(message.media.document.id)
                         message_media = 'document'
             
-            logger.info(f"📝 محتوى الرسالة للفحص: نص='{message_text[:50]}...', وسائط={message_media}, hash={media_hash}")
+            # Perceptual hash from the smallest thumbnail: catches re-uploads and recompressed copies (new media id)
+            media_phash = None
+            if check_media and media_hash and settings.get('check_media_perceptual', False):
+                media_phash = await media_perceptual_hash(message.client, message)
+            
+            logger.debug(f"📝 محتوى الرسالة للفحص: نص='{message_text[:50]}...', وسائط={message_media}, hash={media_hash}, phash={format_phash(media_phash)}")
             
-            # Check for duplicates in database
             import time
             current_time = int(time.time())
             time_window_seconds = time_window_hours * 3600
             cutoff_time = current_time - time_window_seconds
             
-            # Get recent messages from database
-            recent_messages = self.db.get_recent_messages_for_duplicate_check(task_id, cutoff_time)
-            logger.info(f"📊 تم العثور على {len(recent_messages)} رسالة حديثة للمقارنة")
+            # Candidates from the per-task LSH index instead of comparing with every message in the window
+            match = self.duplicate_index.find(
+                task_id, message_text, media_hash or "", threshold, cutoff_time,
+                check_text=check_text, check_media=check_media,
+                loader=lambda cutoff: self.db.get_recent_messages_for_duplicate_check(task_id, cutoff),
+                media_phash=media_phash,
+            )
+            self._prune_duplicate_store(task_id, cutoff_time)
             
-            for stored_msg in recent_messages:
-                is_duplicate = False
-                stored_text = stored_msg.get('message_text', '')
-                stored_media = stored_msg.get('media_hash', '')
-                
-                # Check text similarity if enabled
-                if check_text and message_text and stored_text:
-                    similarity = self._calculate_text_similarity(message_text, stored_text)
-                    logger.info(f"🔍 مقارنة النص: '{message_text}' مع '{stored_text}' - تشابه={similarity*100:.1f}%")
-                    if similarity >= threshold:
-                        logger.warning(f"🔄 نص مكرر وجد! تشابه={similarity*100:.1f}% >= {threshold*100:.0f}%")
-                        is_duplicate = True
-                
-                # Check media similarity if enabled
-                if check_media and media_hash and stored_media:
-                    logger.info(f"🔍 مقارنة الوسائط: '{media_hash}' مع '{stored_media}'")
-                    if media_hash == stored_media:
-                        logger.warning(f"🔄 وسائط مكررة وجدت: {media_hash}")
-                        is_duplicate = True
-                
-                if is_duplicate:
-                    logger.warning(f"🚫 رسالة مكررة - سيتم رفضها!")
-                    # Update stored message timestamp to current time
-                    self.db.update_message_timestamp_for_duplicate(stored_msg['id'], current_time)
-                    return True
+            if match is not None:
+                if match.phash_distance is not None:
+                    logger.warning(f"🔄 وسائط مشابهة وجدت (بصمة إدراكية): {media_hash}, مسافة={match.phash_distance}")
+                elif match.media_match:
+                    logger.warning(f"🔄 وسائط مكررة وجدت: {media_hash}")
+                else:
+                    logger.warning(f"🔄 نص مكرر وجد! تشابه={match.similarity*100:.1f}% >= {threshold*100:.0f}%")
+                logger.warning(f"🚫 رسالة مكررة - سيتم رفضها!")
+                # Update stored message timestamp to current time
+                if match.row_id is not None:
+                    self.db.update_message_timestamp_for_duplicate(match.row_id, current_time)
+                self.duplicate_index.touch(task_id, match.row_id, current_time)
+                return True
             
             # Store this message for future duplicate checks
-            logger.info(f"💾 حفظ الرسالة للمراقبة المستقبلية")
-            self.db.store_message_for_duplicate_check(
+            logger.debug(f"💾 حفظ الرسالة للمراقبة المستقبلية")
+            row_id = self.db.track_message_for_duplicate_check(
                 task_id=task_id,
                 message_text=message_text,
                 media_hash=media_hash or "",
                 media_type=message_media or "",
-                timestamp=current_time
+                timestamp=current_time,
+                media_phash=format_phash(media_phash)
             )
+            self.duplicate_index.add(task_id, row_id, message_text, media_hash or "", current_time, media_phash)
             
-            logger.info(f"✅ رسالة غير مكررة للمهمة {task_id}")
+            logger.debug(f"✅ رسالة غير مكررة للمهمة {task_id}")
             return False
             
         except Exception as e:
@@ -4219,6 +4359,16 @@ class UserbotService:
             logger.error(f"تفاصيل الخطأ: {traceback.format_exc()}")
             return False  # Allow message if check fails
             
+    def _prune_duplicate_store(self, task_id: int, cutoff_time: int):
+        """Delete rows that left the duplicate window (at most once an hour per task)"""
+        now = time.monotonic()
+        if now - self._duplicate_pruned_at.get(task_id, float('-inf')) < 3600:
+            return
+        self._duplicate_pruned_at[task_id] = now
+        removed = self.db.delete_duplicate_messages_before(task_id, cutoff_time)
+        if removed:
+            logger.info(f"🧹 تم حذف {removed} رسالة منتهية من سجل التكرار للمهمة {task_id}")
+
     def _calculate_text_similarity(self, text1: str, text2: str) -> float:
         """Calculate similarity between two texts"""
         try:
@@ -4248,7 +4398,7 @@ class UserbotService:
         """Check if message should be blocked by language filter"""
         try:
             # Get language filter data
-            language_data = self.db.get_language_filters(task_id)
+            language_data = self.get_task_settings(task_id).get('language_filters', {})
             filter_mode = language_data['mode']  # 'allow' or 'block'
             languages = language_data['languages']
             
@@ -4496,6 +4646,11 @@ class UserbotService:
             if user_id in self.user_tasks:
                 del self.user_tasks[user_id]
 
+            if user_id in self.user_task_routes:
+                del self.user_task_routes[user_id]
+
+            await self._close_send_scheduler(user_id)
+
             logger.info(f"تم إيقاف UserBot للمستخدم {user_id}")
 
         except Exception as e:
@@ -4509,10 +4664,14 @@ class UserbotService:
             for user_id in list(self.clients.keys()):
                 await self.stop_user(user_id)
 
+            await self._close_send_scheduler('bot')
             logger.info("تم إيقاف جميع UserBot clients")
 
         except Exception as e:
             logger.error(f"خطأ في إيقاف UserBots: {e}")
+        finally:
+            # حفظ حالة حد المعدل حتى لو فشل إيقاف أحد العملاء
+            self.rate_limiter.checkpoint()
 
     async def get_user_info(self, user_id: int) -> Optional[Dict]:
         """Get user info from userbot"""
@@ -4961,10 +5120,13 @@ class UserbotService:
                 # Clean up data structures
                 if user_id in self.user_tasks:
                     del self.user_tasks[user_id]
+                if user_id in self.user_task_routes:
+                    del self.user_task_routes[user_id]
                 if user_id in self.album_collectors:
                     del self.album_collectors[user_id]
                 if user_id in self.session_health_status:
                     del self.session_health_status[user_id]
+                await self._close_send_scheduler(user_id)
                 
                 # Release session lock
                 if user_id in self.session_locks:
@@ -5097,7 +5259,7 @@ class UserbotService:
                 return message_text
 
             # Get text formatting settings
-            formatting_settings = self.db.get_text_formatting_settings(task_id)
+            formatting_settings = self.get_task_settings(task_id).get('text_formatting', {})
 
             if not formatting_settings or not formatting_settings.get('text_formatting_enabled', False):
                 return message_text
@@ -0,0 +1,301 @@
+"""
+ذاكرة طبقات العلامة المائية - Watermark Overlay Cache
+طبقة العلامة المائية (نص مرسوم أو صورة محجّمة بشفافيتها) تُبنى مرة واحدة لكل
+(بصمة الإعدادات، عرض الهدف، ارتفاع الهدف) ثم يُعاد استخدامها:
+
+- صورة PIL بصيغة RGBA جاهزة للصق على الصور
+- مصفوفة BGRA (OpenCV) جاهزة للدمج مع إطارات الفيديو
+- ملف PNG محفوظ على القرص يُمرَّر إلى ffmpeg كمدخل ثانٍ
+- AlphaBlender: قيم الشفافية والألوان المضروبة مسبقاً لدمج سريع مع إطارات الفيديو في OpenCV
+
+معظم القنوات تنشر بعدد قليل من الدقات القياسية، فتُبنى الطبقة مرة واحدة لكل دقة.
+المفتاح لا يتضمن المهمة: تعديل الإعدادات (أو ملف الصورة) يغيّر البصمة فلا حاجة لإبطال،
+والمهام ذات الإعدادات نفسها تتشارك الطبقة. القديمة تخرج من الذاكرة بترتيب LRU.
+الخطوط وصور العلامة الأصلية تُحمَّل مرة واحدة أيضاً بدلاً من قراءتها من القرص كل مرة.
+
+القيم المرجعة مشتركة: للقراءة فقط (اللصق/الدمج لا يعدّلها).
+
+الإعدادات: WATERMARK_OVERLAY_CACHE_ITEMS، WATERMARK_OVERLAY_DIR
+"""
+import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from PIL import Image, ImageFont
+
+logger = logging.getLogger(__name__)
+
+# الخطوط المجربة بالترتيب قبل الخط الافتراضي
+FONT_CANDIDATES = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+)
+
+OverlayKey = Tuple[str, int, int, str]
+
+
+@lru_cache(maxsize=64)
+def load_font(size: int, candidates: Tuple[str, ...] = FONT_CANDIDATES):
+    """خط TrueType بالحجم المطلوب (يُقرأ من القرص مرة واحدة لكل حجم)"""
+    for path in candidates:
+        try:
+            return ImageFont.truetype(path, size)
+        except Exception:
+            continue
+    font = ImageFont.load_default()
+    try:
+        return font.font_variant(size=size)
+    except Exception:
+        return font
+
+
+@lru_cache(maxsize=16)
+def _load_source_image(path: str, mtime_ns: int) -> Image.Image:
+    image = Image.open(path)
+    image.load()
+    return image.convert('RGBA') if image.mode != 'RGBA' else image
+
+
+def load_watermark_source(path: str) -> Optional[Image.Image]:
+    """صورة العلامة الأصلية بصيغة RGBA (نسخة قابلة للتعديل؛ تُعاد قراءتها إذا تغيّر الملف)"""
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    return _load_source_image(path, mtime_ns).copy()
+
+
+def settings_hash(*parts: Hashable) -> str:
+    """بصمة قصيرة لما يحدد شكل الطبقة (يشمل وقت تعديل ملفات الصور المذكورة)"""
+    material = []
+    for part in parts:
+        material.append(part)
+        if isinstance(part, str) and part and os.path.isfile(part):
+            try:
+                material.append(os.stat(part).st_mtime_ns)
+            except OSError:
+                pass
+    return hashlib.blake2b(repr(material).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def overlay_key(kind: str, size: Tuple[int, int], *parts: Hashable) -> OverlayKey:
+    """(بصمة الإعدادات، العرض، الارتفاع، نوع المعالج) - kind يميّز طرق الرسم المختلفة"""
+    width, height = size
+    return (settings_hash(kind, *parts), int(width), int(height), kind)
+
+
+def _default_overlay_dir() -> str:
+    explicit = os.getenv('WATERMARK_OVERLAY_DIR')
+    if explicit and explicit.strip():
+        return explicit.strip()
+    data_dir = os.getenv('DATA_DIR', '/app/data')
+    return os.path.join(data_dir.strip() or '.', 'watermark_overlays')
+
+
+class WatermarkOverlayCache:
+    """LRU لطبقات العلامة المائية الجاهزة (PIL، مصفوفات OpenCV، ملفات PNG)"""
+
+    def __init__(self, max_items: Optional[int] = None, directory: Optional[str] = None):
+        self.max_items = max_items or int(os.getenv('WATERMARK_OVERLAY_CACHE_ITEMS', '128'))
+        self.directory = directory or _default_overlay_dir()
+        self._overlays: 'OrderedDict[Tuple, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._building: Dict[Tuple, threading.Lock] = {}  # قفل لكل طبقة قيد البناء
+        self._dir_ready = False
+        self.stats_counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    # ----- public API -----
+
+    def overlay(self, key: OverlayKey, builder: Callable[[], Optional[Image.Image]]) -> Optional[Image.Image]:
+        """طبقة RGBA للمفتاح، تُبنى بـ builder عند أول طلب"""
+        return self._get(('image',) + key, builder)
+
+    def array(self, key: OverlayKey, builder: Callable[[], Optional[Image.Image]]):
+        """الطبقة كمصفوفة BGRA لـ OpenCV (للقراءة فقط)"""
+        def build_array():
+            import cv2
+            import numpy as np
+            image = self.overlay(key, builder)
+            if image is None:
+                return None
+            array = cv2.cvtColor(np.array(image), cv2.COLOR_RGBA2BGRA)
+            array.setflags(write=False)
+            return array
+        return self._get(('array',) + key, build_array)
+
+    def blender(self, key: OverlayKey, builder: Callable[[], Optional[Image.Image]]) -> Optional['AlphaBlender']:
+        """دامج جاهز للطبقة (الشفافية والألوان محسوبة مسبقاً) لإطارات BGR"""
+        def build_blender():
+            array = self.array(key, builder)
+            return AlphaBlender(array) if array is not None else None
+        return self._get(('blender',) + key, build_blender)
+
+    def png_path(self, key: OverlayKey, builder: Callable[[], Optional[Image.Image]]) -> Optional[str]:
+        """مسار ملف PNG للطبقة لاستخدامه مع ffmpeg (لا يُحذف بعد الاستخدام)"""
+        def build_png():
+            path = os.path.join(self._ensure_dir(), '{}_{}x{}_{}.png'.format(*key))
+            if os.path.exists(path):
+                # من تشغيل سابق - نفس البصمة تعني نفس المحتوى
+                os.utime(path)
+                return path
+            image = self.overlay(key, builder)
+            if image is None:
+                return None
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            image.save(temp_path, 'PNG')
+            os.replace(temp_path, path)
+            return path
+        path = self._get(('png',) + key, build_png)
+        if path and not os.path.exists(path):
+            # حُذف الملف من القرص - إعادة بنائه
+            with self._lock:
+                self._overlays.pop(('png',) + key, None)
+            path = self._get(('png',) + key, build_png)
+        return path
+
+    def clear(self):
+        with self._lock:
+            for cache_key in list(self._overlays):
+                self._evict(cache_key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats_counters['hits'] + self.stats_counters['misses']
+            return {
+                'items': len(self._overlays),
+                'hit_rate': (self.stats_counters['hits'] / lookups * 100) if lookups else 0.0,
+                **self.stats_counters,
+            }
+
+    # ----- internals -----
+
+    def _lookup(self, cache_key: Tuple) -> Any:
+        """القيمة المخزنة أو None (القفل العام محجوز)"""
+        value = self._overlays.get(cache_key)
+        if value is not None:
+            self._overlays.move_to_end(cache_key)
+            self.stats_counters['hits'] += 1
+        return value
+
+    def _get(self, cache_key: Tuple, builder: Callable[[], Any]) -> Any:
+        with self._lock:
+            value = self._lookup(cache_key)
+            if value is not None:
+                return value
+            key_lock = self._building.setdefault(cache_key, threading.Lock())
+        # البناء تحت قفل الطبقة فقط: طلبات متزامنة لنفس الطبقة لا ترسمها مرتين،
+        # وطلبات الطبقات الأخرى لا تنتظرها
+        with key_lock:
+            with self._lock:
+                value = self._lookup(cache_key)
+                if value is not None:
+                    return value
+                self.stats_counters['misses'] += 1
+            try:
+                value = builder()
+            finally:
+                with self._lock:
+                    if value is not None:
+                        self._overlays[cache_key] = value
+                        while len(self._overlays) > self.max_items:
+                            self._evict(next(iter(self._overlays)))
+                            self.stats_counters['evictions'] += 1
+                    if self._building.get(cache_key) is key_lock:
+                        del self._building[cache_key]
+            return value
+
+    def _evict(self, cache_key: Tuple):
+        # ملفات PNG تبقى على القرص (قد يكون ffmpeg يقرأها الآن) ويحذفها _sweep لاحقاً
+        self._overlays.pop(cache_key, None)
+
+    def _ensure_dir(self) -> str:
+        if not self._dir_ready:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except Exception as e:
+                fallback = os.path.join(tempfile.gettempdir(), 'watermark_overlays')
+                logger.warning(f"⚠️ تعذر إنشاء مجلد طبقات العلامة المائية {self.directory}: {e} - استخدام {fallback}")
+                self.directory = fallback
+                os.makedirs(self.directory, exist_ok=True)
+            self._dir_ready = True
+            self._sweep()
+        return self.directory
+
+    def _sweep(self, max_age: int = 7 * 24 * 3600):
+        """حذف ملفات الطبقات التي لم تُستخدم منذ مدة (من تشغيلات سابقة)"""
+        cutoff = time.time() - max_age
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+
+class AlphaBlender:
+    """دمج طبقة BGRA فوق إطارات BGR بحساب صحيح (uint16) دون نسخ الإطار
+
+    out = (frame * (255 - a) + overlay * a) / 255، والقسمة على 255 بالتقريب الصحيح
+    (x + 128 + ((x + 128) >> 8)) >> 8، وكل القيم تتسع في uint16.
+    الحواف الشفافة بالكامل (حشوة النص) تُقص مسبقاً فلا تُلمس بكسلاتها.
+    """
+
+    def __init__(self, bgra):
+        import numpy as np
+        height, width = bgra.shape[:2]
+        self.size = (width, height)
+        alpha = bgra[:, :, 3] if bgra.ndim == 3 and bgra.shape[2] == 4 else np.full((height, width), 255, np.uint8)
+        rows = np.flatnonzero(alpha.any(axis=1))
+        cols = np.flatnonzero(alpha.any(axis=0))
+        if rows.size == 0:
+            self.offset = (0, 0)
+            self.inverse_alpha = None
+            return
+        top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        self.offset = (int(left), int(top))
+        alpha = alpha[top:bottom, left:right, None].astype(np.uint16)
+        self.inverse_alpha = 255 - alpha
+        # الألوان مضروبة في الشفافية + 128 للتقريب
+        self.premultiplied = bgra[top:bottom, left:right, :3].astype(np.uint16) * alpha + 128
+
+    def scratch(self):
+        """مخازن مؤقتة لاستخدامها مع blend عبر إطارات فيديو واحد"""
+        import numpy as np
+        if self.inverse_alpha is None:
+            return None
+        shape = self.premultiplied.shape
+        return np.empty(shape, np.uint16), np.empty(shape, np.uint16)
+
+    def blend(self, frame, x: int, y: int, scratch=None) -> bool:
+        """دمج الطبقة في frame مباشرة عند (x, y)؛ False إذا خرجت عن حدود الإطار"""
+        import numpy as np
+        width, height = self.size
+        if x < 0 or y < 0 or x + width > frame.shape[1] or y + height > frame.shape[0]:
+            return False
+        if self.inverse_alpha is None:
+            return True
+        buffer, carry = scratch or self.scratch()
+        h, w = self.premultiplied.shape[:2]
+        x, y = x + self.offset[0], y + self.offset[1]
+        roi = frame[y:y + h, x:x + w]
+        np.multiply(roi, self.inverse_alpha, out=buffer, casting='unsafe')
+        buffer += self.premultiplied
+        np.right_shift(buffer, 8, out=carry)
+        buffer += carry
+        buffer >>= 8
+        np.copyto(roi, buffer, casting='unsafe')
+        return True
+
+
+# ذاكرة عالمية مشتركة (كل عملية من عمّال الوسائط لها نسختها في الذاكرة، وملفات PNG مشتركة)
+watermark_overlays = WatermarkOverlayCache()
@@ -27,6 +27,11 @@ import hashlib
 import time
 import shutil
 
+from ffmpeg_runner import ffmpeg_runner
+from media_info import probe_media_info_sync
+from watermark_overlay_cache import watermark_overlays, overlay_key, load_font, load_watermark_source
+from encoding_profiles import encoding_engine
+
 logger = logging.getLogger(__name__)
 
 class WatermarkProcessor:
@@ -165,9 +170,18 @@ class WatermarkProcessor:
         
         return (final_x, final_y)
     
+    def _text_overlay_spec(self, text: str, font_size: int, color: str, opacity: int, image_size: Tuple[int, int]):
+        """مفتاح ودالة بناء طبقة النص في ذاكرة الطبقات"""
+        key = overlay_key('text', image_size, text, font_size, color, opacity)
+        return key, lambda: self._render_text_watermark(text, font_size, color, opacity, image_size)
+    
     def create_text_watermark(self, text: str, font_size: int, color: str, opacity: int, 
                             image_size: Tuple[int, int]) -> Image.Image:
-        """إنشاء علامة مائية نصية محسنة"""
+        """إنشاء علامة مائية نصية محسنة (مرة واحدة لكل دقة - النتيجة للقراءة فقط)"""
+        return watermark_overlays.overlay(*self._text_overlay_spec(text, font_size, color, opacity, image_size))
+    
+    def _render_text_watermark(self, text: str, font_size: int, color: str, opacity: int, 
+                               image_size: Tuple[int, int]) -> Image.Image:
         try:
             # إنشاء صورة شفافة للنص
             img_width, img_height = image_size
@@ -175,24 +189,8 @@ class WatermarkProcessor:
             # حساب حجم الخط بناءً على حجم الصورة
             calculated_font_size = max(font_size, img_width // 25)  # زيادة حجم الخط
             
-            # محاولة استخدام خط عربي إذا أمكن
-            font = None
-            try:
-                # محاولة استخدام خط عربي
-                font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", calculated_font_size)
-            except:
-                try:
-                    # محاولة استخدام خط عربي آخر
-                    font = ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", calculated_font_size)
-                except:
-                    try:
-                        # استخدام الخط الافتراضي
-                        font = ImageFont.load_default()
-                        # تكبير الخط الافتراضي
-                        font = font.font_variant(size=calculated_font_size)
-                    except:
-                        # إنشاء خط بسيط
-                        font = ImageFont.load_default()
+            # الخط يُحمَّل من القرص مرة واحدة لكل حجم (DejaVu ثم Liberation ثم الافتراضي)
+            font = load_font(calculated_font_size)
             
             # إنشاء صورة شفافة
             watermark_img = Image.new('RGBA', (img_width, img_height), (0, 0, 0, 0))
@@ -267,20 +265,30 @@ class WatermarkProcessor:
         
         return (new_width, new_height)
 
+    def _image_overlay_spec(self, image_path: str, size_percentage: int, opacity: int,
+                            base_image_size: Tuple[int, int], position: str = 'bottom_right'):
+        """مفتاح ودالة بناء طبقة الصورة في ذاكرة الطبقات"""
+        key = overlay_key('image', base_image_size, image_path, size_percentage, opacity, position)
+        return key, lambda: self._render_image_watermark(image_path, size_percentage, opacity, base_image_size, position)
+    
     def load_image_watermark(self, image_path: str, size_percentage: int, opacity: int,
                            base_image_size: Tuple[int, int], position: str = 'bottom_right') -> Optional[Image.Image]:
-        """تحميل وتحضير علامة مائية من صورة بحجم ذكي"""
+        """تحميل وتحضير علامة مائية من صورة بحجم ذكي (مرة واحدة لكل دقة - النتيجة للقراءة فقط)"""
+        return watermark_overlays.overlay(
+            *self._image_overlay_spec(image_path, size_percentage, opacity, base_image_size, position)
+        )
+    
+    def _render_image_watermark(self, image_path: str, size_percentage: int, opacity: int,
+                                base_image_size: Tuple[int, int], position: str = 'bottom_right') -> Optional[Image.Image]:
         try:
             if not os.path.exists(image_path):
                 logger.error(f"ملف الصورة غير موجود: {image_path}")
                 return None
             
-            # تحميل الصورة
-            watermark_img = Image.open(image_path)
-            
-            # تحويل إلى RGBA للدعم الشفافية
-            if watermark_img.mode != 'RGBA':
-                watermark_img = watermark_img.convert('RGBA')
+            # تحميل الصورة (RGBA، من الذاكرة إن لم يتغير الملف)
+            watermark_img = load_watermark_source(image_path)
+            if watermark_img is None:
+                return None
             
             # حساب الحجم الذكي
             original_size = watermark_img.size
@@ -393,31 +401,11 @@ class WatermarkProcessor:
     def get_video_info(self, video_path: str) -> Dict[str, Any]:
         """الحصول على معلومات الفيديو باستخدام ffprobe أو OpenCV كبديل"""
         try:
-            # محاولة استخدام ffprobe أولاً
-            cmd = [
-                'ffprobe', '-v', 'quiet', '-print_format', 'json',
-                '-show_format', '-show_streams', video_path
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            info = json.loads(result.stdout)
-            
-            # استخراج المعلومات المهمة
-            video_stream = next((s for s in info['streams'] if s['codec_type'] == 'video'), None)
-            format_info = info['format']
-            
-            if video_stream:
-                return {
-                    'width': int(video_stream.get('width', 0)),
-                    'height': int(video_stream.get('height', 0)),
-                    'fps': eval(video_stream.get('r_frame_rate', '30/1')),
-                    'duration': float(format_info.get('duration', 0)),
-                    'bitrate': int(format_info.get('bit_rate', 0)),
-                    'size_mb': float(format_info.get('size', 0)) / (1024 * 1024),
-                    'codec': video_stream.get('codec_name', 'unknown')
-                }
-            
-            return {}
+            # فحص ffprobe واحد مشترك مع بقية المراحل (النتيجة محفوظة حسب الملف)
+            info = probe_media_info_sync(video_path)
+            if info is None:
+                raise FileNotFoundError("تعذر فحص الفيديو بـ ffprobe")
+            return info.as_video_info() if info.has_video else {}
             
         except (subprocess.CalledProcessError, FileNotFoundError, json.JSONDecodeError) as e:
             logger.warning(f"فشل في استخدام ffprobe: {e}")
@@ -492,11 +480,11 @@ class WatermarkProcessor:
             if self.ffmpeg_available:
                 try:
                     # إعدادات FFmpeg محسنة للضغط الأقصى مع الحفاظ على الجودة
+                    plan = encoding_engine.plan(video_info, 'compact')
                     cmd = [
                         'ffmpeg', '-i', input_path,
-                        '-c:v', 'libx264',  # كودك H.264
-                        '-preset', 'slower',  # ضغط أقصى (slower بدلاً من medium)
-                        '-crf', '28',  # ضغط أقصى مع جودة مقبولة (28 بدلاً من 25)
+                        *plan.x264_args(),
+                        *plan.thread_args(),
                         '-maxrate', f'{int(target_bitrate * 0.6)}',  # تقليل معدل البت بنسبة 40%
                         '-bufsize', f'{target_bitrate}',
                         '-c:a', 'aac',  # كودك الصوت
@@ -513,7 +501,7 @@ class WatermarkProcessor:
                     logger.info(f"🎬 بدء تحسين الفيديو باستخدام FFmpeg: معدل البت المستهدف {target_bitrate/1000:.0f} kbps")
                     
                     # تنفيذ الضغط
-                    result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+                    result = self._run_encode(cmd, plan, timeout=300)
                     
                     if result.returncode == 0:
                         # التحقق من النتيجة
@@ -720,45 +708,36 @@ class WatermarkProcessor:
                 cap.release()
                 return None
             
-            # تحضير العلامة المائية
-            watermark_img = None
+            # تحضير العلامة المائية (الشفافية والألوان المضروبة محسوبة مرة واحدة لكل دقة)
+            watermark_blender = None
             
             if watermark_settings['watermark_type'] == 'text' and watermark_settings.get('watermark_text'):
                 color = watermark_settings.get('text_color', '#FFFFFF')
                 if watermark_settings.get('use_original_color', False):
                     color = '#FFFFFF'  # استخدام اللون الأبيض كافتراضي
                 
-                watermark_pil = self.create_text_watermark(
+                watermark_blender = watermark_overlays.blender(*self._text_overlay_spec(
                     watermark_settings['watermark_text'],
                     watermark_settings.get('font_size', 32),
                     color,
                     watermark_settings.get('opacity', 70),
                     (width, height)
-                )
-                
-                if watermark_pil:
-                    # تحويل PIL إلى OpenCV
-                    watermark_cv = cv2.cvtColor(np.array(watermark_pil), cv2.COLOR_RGBA2BGRA)
-                    watermark_img = watermark_cv
+                ))
                     
             elif watermark_settings['watermark_type'] == 'image' and watermark_settings.get('watermark_image_path'):
-                watermark_pil = self.load_image_watermark(
+                watermark_blender = watermark_overlays.blender(*self._image_overlay_spec(
                     watermark_settings['watermark_image_path'],
                     watermark_settings.get('size_percentage', 20),
                     watermark_settings.get('opacity', 70),
                     (width, height),
                     watermark_settings.get('position', 'bottom_right')
-                )
-                
-                if watermark_pil:
-                    # تحويل PIL إلى OpenCV
-                    watermark_cv = cv2.cvtColor(np.array(watermark_pil), cv2.COLOR_RGBA2BGRA)
-                    watermark_img = watermark_cv
+                ))
             
             # حساب موقع العلامة المائية
             watermark_position = None
-            if watermark_img is not None:
-                watermark_height, watermark_width = watermark_img.shape[:2]
+            blend_scratch = None
+            if watermark_blender is not None:
+                watermark_width, watermark_height = watermark_blender.size
                 offset_x = watermark_settings.get('offset_x', 0)
                 offset_y = watermark_settings.get('offset_y', 0)
                 watermark_position = self.calculate_position(
@@ -768,6 +747,13 @@ class WatermarkProcessor:
                     offset_x, 
                     offset_y
                 )
+                x, y = watermark_position
+                # التأكد من أن العلامة المائية تتناسب مع حدود الإطار
+                if x < 0 or y < 0 or x + watermark_width > width or y + watermark_height > height:
+                    logger.warning("العلامة المائية أكبر من حدود الإطار - لن تُطبق على الفيديو")
+                    watermark_position = None
+                else:
+                    blend_scratch = watermark_blender.scratch()
             
             logger.info(f"🎬 بدء معالجة الفيديو: {total_frames} إطار")
             
@@ -779,28 +765,10 @@ class WatermarkProcessor:
                     break
                 
                 # تطبيق العلامة المائية إذا كانت موجودة
-                if watermark_img is not None and watermark_position is not None:
+                if watermark_position is not None:
                     try:
-                        # إنشاء نسخة من الإطار
-                        frame_with_watermark = frame.copy()
-                        
-                        # تطبيق العلامة المائية
-                        x, y = watermark_position
-                        
-                        # التأكد من أن العلامة المائية تتناسب مع حدود الإطار
-                        if x + watermark_width <= width and y + watermark_height <= height:
-                            # تطبيق العلامة المائية مع الشفافية
-                            if watermark_img.shape[2] == 4:  # RGBA
-                                alpha = watermark_img[:, :, 3] / 255.0
-                                alpha = np.expand_dims(alpha, axis=2)
-                                
-                                # دمج العلامة المائية مع الإطار
-                                for c in range(3):  # BGR
-                                    frame_with_watermark[y:y+watermark_height, x:x+watermark_width, c] = \
-                                        frame_with_watermark[y:y+watermark_height, x:x+watermark_width, c] * (1 - alpha[:, :, 0]) + \
-                                        watermark_img[:, :, c] * alpha[:, :, 0]
-                            
-                            frame = frame_with_watermark
+                        # دمج في منطقة العلامة فقط داخل الإطار نفسه (حساب صحيح دون نسخ الإطار)
+                        watermark_blender.blend(frame, x, y, blend_scratch)
                     except Exception as e:
                         logger.warning(f"فشل في تطبيق العلامة المائية على الإطار {frame_count}: {e}")
                 
@@ -837,7 +805,7 @@ class WatermarkProcessor:
                         final_output
                     ]
                     
-                    result = subprocess.run(cmd, capture_output=True, text=True)
+                    result = ffmpeg_runner.run_sync(cmd, timeout=600)
                     
                     if result.returncode == 0:
                         logger.info("✅ تم دمج الصوت بنجاح")
@@ -946,7 +914,8 @@ class WatermarkProcessor:
                         # الآن نقوم بضغط الفيديو مع الحفاظ على الدقة
                         compressed_path = tempfile.mktemp(suffix='.mp4')
                         
-                        if self.compress_video_preserve_quality(watermarked_path, compressed_path):
+                        if self.compress_video_preserve_quality(watermarked_path, compressed_path,
+                                                                watermark_settings=watermark_settings):
                             logger.info("✅ تم ضغط الفيديو مع الحفاظ على الدقة")
                             final_path = compressed_path
                         else:
@@ -1048,8 +1017,17 @@ class WatermarkProcessor:
             'cleanup_threshold': self.cache_cleanup_threshold
         }
 
-    def compress_video_preserve_quality(self, input_path: str, output_path: str, target_size_mb: float = None) -> bool:
-        """ضغط الفيديو الأقصى مع الحفاظ على الدقة والجودة - مُحسن بالكامل"""
+    def _run_encode(self, cmd: list, plan, timeout: int) -> subprocess.CompletedProcess:
+        """تشغيل ترميز بإعدادات ملف الترميز وتسجيل زمنه لتصحيح تقدير السرعة"""
+        started = time.monotonic()
+        result = ffmpeg_runner.run_sync(cmd, timeout=timeout)
+        if result.returncode == 0:
+            encoding_engine.record(plan, time.monotonic() - started)
+        return result
+
+    def compress_video_preserve_quality(self, input_path: str, output_path: str, target_size_mb: float = None,
+                                        watermark_settings: dict = None) -> bool:
+        """ضغط الفيديو مع الحفاظ على الدقة والجودة (الإعدادات من ملف الترميز المختار للمهمة)"""
         try:
             if not self.ffmpeg_available:
                 logger.warning("FFmpeg غير متوفر، لا يمكن ضغط الفيديو")
@@ -1082,20 +1060,16 @@ class WatermarkProcessor:
                 target_bitrate = max(target_bitrate, 400000)  # حد أدنى 400 kbps
                 logger.info(f"🔄 تحسين كبير: معدل البت {target_bitrate/1000:.0f} kbps (تقليل 70%)")
             
-            # إعدادات FFmpeg للضغط الأقصى مع الحفاظ على الجودة المرئية
+            # preset/CRF/الخيوط من ملف الترميز: زمن متوقع ثابت بدلاً من veryslow على كل الدقات
+            plan = encoding_engine.plan(video_info, settings=watermark_settings)
             cmd = [
                 'ffmpeg', '-y',
                 '-i', input_path,
-                # إعدادات فيديو - ضغط أقصى
-                '-c:v', 'libx264',           # كودك H.264
-                '-preset', 'veryslow',       # أبطأ preset للحصول على أفضل ضغط
-                '-crf', '30',                # ضغط أقصى (30 بدلاً من 25)
+                # إعدادات فيديو
+                *plan.x264_args(),
+                *plan.thread_args(),
                 '-maxrate', f'{target_bitrate}',  # معدل البت الأقصى
                 '-bufsize', f'{target_bitrate}',  # buffer size مطابق
-                '-profile:v', 'baseline',    # ملف H.264 أساسي (أصغر حجم)
-                '-level', '3.1',             # مستوى منخفض للحجم الأصغر
-                '-tune', 'film',             # تحسين للمحتوى المرئي
-                '-g', '15',                  # مجموعة صور أصغر (keyframe كل 15 إطار)
                 # إعدادات صوت - ضغط أقصى
                 '-c:a', 'aac',               # كودك الصوت
                 '-b:a', '48k',               # معدل بت صوت منخفض (48k بدلاً من 96k)
@@ -1103,17 +1077,14 @@ class WatermarkProcessor:
                 # إعدادات إضافية للضغط
                 '-movflags', '+faststart',   # تحسين التشغيل
                 '-pix_fmt', 'yuv420p',       # تنسيق بكسل متوافق
-                '-g', '30',                  # مجموعة صور كل 30 إطار
-                '-keyint_min', '15',         # الحد الأدنى لمجموعة الصور
-                '-sc_threshold', '0',        # تعطيل تبديل المشهد
-                '-tune', 'film',             # تحسين للفيديوهات
                 output_path
             ]
             
-            logger.info(f"🎬 بدء ضغط الفيديو باستخدام FFmpeg: معدل البت {target_bitrate/1000:.0f} kbps")
+            logger.info(f"🎬 بدء ضغط الفيديو باستخدام FFmpeg: معدل البت {target_bitrate/1000:.0f} kbps, "
+                        f"preset {plan.preset}, CRF {plan.crf}")
             
             # تنفيذ الضغط
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)  # timeout 5 دقائق
+            result = self._run_encode(cmd, plan, timeout=300)  # timeout 5 دقائق
             
             if result.returncode == 0:
                 # التحقق من النتيجة
@@ -1130,7 +1101,7 @@ class WatermarkProcessor:
                     if target_size_mb and final_size > target_size_mb * 1.2:  # سماح بزيادة 20%
                         logger.warning(f"⚠️ الحجم النهائي أكبر من المستهدف: {final_size:.2f} MB > {target_size_mb:.2f} MB")
                         # محاولة ضغط إضافي
-                        return self._compress_video_aggressive(input_path, output_path, target_size_mb)
+                        return self._compress_video_aggressive(input_path, output_path, target_size_mb, video_info)
                     
                     return True
                 else:
@@ -1139,7 +1110,7 @@ class WatermarkProcessor:
             else:
                 logger.error(f"فشل في ضغط الفيديو: {result.stderr}")
                 # محاولة استخدام إعدادات أبسط
-                return self._compress_video_simple(input_path, output_path, target_size_mb)
+                return self._compress_video_simple(input_path, output_path, target_size_mb, video_info)
                 
         except subprocess.TimeoutExpired:
             logger.error("انتهت مهلة ضغط الفيديو (5 دقائق)")
@@ -1170,21 +1141,17 @@ class WatermarkProcessor:
             
             logger.info(f"🎯 أقصى ضغط: {original_width}x{original_height}, معدل البت: {target_bitrate/1000:.0f} kbps")
             
-            # إعدادات FFmpeg للحصول على أقصى ضغط ممكن مع الحفاظ على الدقة
+            # إعدادات FFmpeg للحصول على أقصى ضغط ممكن مع الحفاظ على الدقة (ملف الترميز compact)
+            plan = encoding_engine.plan(video_info, 'compact')
             cmd = [
                 'ffmpeg', '-y',
                 '-i', input_path,
                 # إعدادات الفيديو - ضغط أقصى
-                '-c:v', 'libx264',               # كودك H.264
-                '-preset', 'veryslow',           # أبطء إعداد للحصول على أقصى ضغط
-                '-crf', '28',                    # جودة منخفضة للحصول على حجم أصغر
+                *plan.x264_args(),
+                *plan.thread_args(),
                 '-maxrate', f'{target_bitrate}', # معدل بت منخفض جداً
                 '-bufsize', f'{target_bitrate}', # حجم buffer مساوي لمعدل البت
                 '-profile:v', 'high',            # ملف عالي للضغط الأمثل
-                '-level', '4.1',                 # مستوى عالي
-                '-tune', 'film',                 # تحسين للفيديوهات
-                # إعدادات متقدمة لأقصى ضغط
-                '-x264opts', 'ref=5:bframes=16:b-adapt=2:direct=auto:me=umh:merange=24:subme=10:psy-rd=1.0,0.1:deblock=1,1:trellis=2:aq-mode=2:aq-strength=1.0',
                 # إعدادات الصوت - ضغط أقصى
                 '-c:a', 'aac',                   # كودك الصوت
                 '-b:a', '64k',                   # معدل بت صوت منخفض جداً
@@ -1196,7 +1163,6 @@ class WatermarkProcessor:
                 '-g', '15',                      # مجموعة صور صغيرة
                 '-keyint_min', '5',              # الحد الأدنى لمجموعة الصور
                 '-sc_threshold', '0',            # تعطيل تبديل المشهد
-                '-threads', '0',                 # استخدام كل المعالجات
                 output_path
             ]
             
@@ -1210,7 +1176,7 @@ class WatermarkProcessor:
             logger.info("🚀 بدء تطبيق أقصى ضغط للفيديو...")
             
             # تنفيذ الضغط مع وقت أطول
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=900)  # timeout 15 دقيقة
+            result = self._run_encode(cmd, plan, timeout=900)  # timeout 15 دقيقة
             
             if result.returncode == 0:
                 # التحقق من النتيجة
@@ -1246,19 +1212,20 @@ class WatermarkProcessor:
             logger.error(f"خطأ في تطبيق أقصى ضغط: {e}")
             return False
 
-    def _compress_video_aggressive(self, input_path: str, output_path: str, target_size_mb: float) -> bool:
+    def _compress_video_aggressive(self, input_path: str, output_path: str, target_size_mb: float,
+                                   video_info: dict = None) -> bool:
         """ضغط فيديو عدواني للحصول على حجم أصغر"""
         try:
             logger.info("🔥 محاولة ضغط عدواني للفيديو...")
             
-            # إعدادات FFmpeg عدوانية
+            # إعدادات FFmpeg عدوانية (ملف الترميز compact)
+            plan = encoding_engine.plan(video_info or self.get_video_info(input_path), 'compact')
             cmd = [
                 'ffmpeg', '-y',
                 '-i', input_path,
                 # إعدادات فيديو عدوانية
-                '-c:v', 'libx264',
-                '-preset', 'veryslow',       # أبطء للحصول على ضغط أفضل
-                '-crf', '28',                # جودة أقل للحصول على حجم أصغر
+                *plan.x264_args(),
+                *plan.thread_args(),
                 '-maxrate', f'{int(target_size_mb * 8 * 1024 * 1024 / 60)}',  # معدل بت منخفض
                 '-bufsize', f'{int(target_size_mb * 8 * 1024 * 1024 / 30)}',
                 '-profile:v', 'baseline',    # ملف H.264 أساسي (أصغر)
@@ -1274,7 +1241,7 @@ class WatermarkProcessor:
                 output_path
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)  # timeout 10 دقائق
+            result = self._run_encode(cmd, plan, timeout=600)  # timeout 10 دقائق
             
             if result.returncode == 0:
                 final_info = self.get_video_info(output_path)
@@ -1289,24 +1256,25 @@ class WatermarkProcessor:
             logger.error(f"خطأ في الضغط العدواني: {e}")
             return False
     
-    def _compress_video_simple(self, input_path: str, output_path: str, target_size_mb: float = None) -> bool:
+    def _compress_video_simple(self, input_path: str, output_path: str, target_size_mb: float = None,
+                               video_info: dict = None) -> bool:
         """ضغط فيديو بسيط كبديل"""
         try:
             logger.info("🔄 محاولة ضغط بسيط للفيديو...")
             
-            # إعدادات FFmpeg بسيطة
+            # إعدادات FFmpeg بسيطة (ملف الترميز fast للحصول على نتيجة سريعة)
+            plan = encoding_engine.plan(video_info or {}, 'fast')
             cmd = [
                 'ffmpeg', '-y',
                 '-i', input_path,
-                '-c:v', 'libx264',
-                '-preset', 'ultrafast',      # أسرع للحصول على نتيجة سريعة
-                '-crf', '30',                # جودة متوسطة
+                *plan.x264_args(),
+                *plan.thread_args(),
                 '-c:a', 'aac',
                 '-b:a', '128k',
                 output_path
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            result = self._run_encode(cmd, plan, timeout=300)
             
             if result.returncode == 0:
                 logger.info("✅ تم الضغط البسيط بنجاح")
@@ -1346,11 +1314,11 @@ class WatermarkProcessor:
             if self.ffmpeg_available:
                 try:
                     # إعدادات FFmpeg محسنة للضغط الأقصى مع الحفاظ على الجودة
+                    plan = encoding_engine.plan(video_info, 'compact')
                     cmd = [
                         'ffmpeg', '-i', input_path,
-                        '-c:v', 'libx264',  # كودك H.264
-                        '-preset', 'slower',  # ضغط أقصى (slower بدلاً من medium)
-                        '-crf', '28',  # ضغط أقصى مع جودة مقبولة (28 بدلاً من 25)
+                        *plan.x264_args(),
+                        *plan.thread_args(),
                         '-maxrate', f'{int(target_bitrate * 0.6)}',  # تقليل معدل البت بنسبة 40%
                         '-bufsize', f'{target_bitrate}',
                         '-c:a', 'aac',  # كودك الصوت
@@ -1367,7 +1335,7 @@ class WatermarkProcessor:
                     logger.info(f"🎬 بدء تحسين الفيديو باستخدام FFmpeg: معدل البت المستهدف {target_bitrate/1000:.0f} kbps")
                     
                     # تنفيذ الضغط
-                    result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+                    result = self._run_encode(cmd, plan, timeout=300)
                     
                     if result.returncode == 0:
                         # التحقق من النتيجة
@@ -19,6 +19,11 @@ import shutil
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from ffmpeg_runner import ffmpeg_runner
+from media_info import probe_media_info_sync, cached_media_info
+from watermark_overlay_cache import watermark_overlays, overlay_key, load_font, load_watermark_source
+from encoding_profiles import encoding_engine
+
 logger = logging.getLogger(__name__)
 
 class OptimizedWatermarkProcessor:
@@ -36,15 +41,7 @@ class OptimizedWatermarkProcessor:
         # التحقق من توفر FFmpeg
         self.ffmpeg_available = self._check_ffmpeg_availability()
         
-        # إعدادات محسنة للسرعة - أقصى سرعة ممكنة
-        self.fast_video_settings = {
-            'crf': 23,             # افتراضي يحافظ على الجودة
-            'preset': 'veryfast',  # أسرع مع جودة مقبولة
-            'threads': 8,
-            'tune': 'film',
-            'profile': 'high',
-            'level': '4.0'
-        }
+        # إعدادات الترميز (preset/CRF/الخيوط) من encoding_profiles حسب ملف المهمة
         
         logger.info("🚀 تم تهيئة المعالج المحسن للسرعة")
     
@@ -89,18 +86,20 @@ class OptimizedWatermarkProcessor:
             if not watermark_image_path:
                 return None
             
-            # استخدام FFmpeg مع إعدادات محسنة للسرعة
-            cmd = self.build_ffmpeg_command_fast(video_path, watermark_image_path, output_path, watermark_settings)
+            # استخدام FFmpeg مع إعدادات ملف الترميز المختار للمهمة
+            plan = encoding_engine.plan(video_info, settings=watermark_settings)
+            cmd = self.build_ffmpeg_command_fast(video_path, watermark_image_path, output_path, watermark_settings, plan)
             
             logger.info("🚀 بدء المعالجة السريعة - جميع الإطارات مرة واحدة...")
             start_time = time.time()
             
             # تشغيل FFmpeg مع timeout
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)  # 5 دقائق timeout
+            result = ffmpeg_runner.run_sync(cmd, timeout=300)  # 5 دقائق timeout
             
             processing_time = time.time() - start_time
             
             if result.returncode == 0 and os.path.exists(output_path):
+                encoding_engine.record(plan, processing_time)
                 # حساب السرعة
                 frames_per_second = total_frames / processing_time if processing_time > 0 else 0
                 speed_improvement = (total_frames / 100) / processing_time if processing_time > 0 else 0  # مقارنة بـ 100 إطار/ثانية
@@ -109,12 +108,6 @@ class OptimizedWatermarkProcessor:
                 logger.info(f"🎬 السرعة: {frames_per_second:.1f} إطار/ثانية")
                 logger.info(f"🚀 تحسين السرعة: {speed_improvement:.1f}x أسرع من المعالجة الإطارية")
                 
-                # تنظيف الملف المؤقت للعلامة المائية
-                try:
-                    os.remove(watermark_image_path)
-                except:
-                    pass
-                
                 return output_path
             else:
                 logger.error(f"❌ فشل في المعالجة السريعة: {result.stderr}")
@@ -128,49 +121,17 @@ class OptimizedWatermarkProcessor:
             return None
     
     def get_video_info_fast(self, video_path: str) -> Optional[Dict]:
-        """الحصول على معلومات الفيديو بسرعة"""
+        """الحصول على معلومات الفيديو بسرعة (فحص ffprobe مشترك مع بقية المراحل)"""
         try:
-            cmd = [
-                'ffprobe', '-v', 'quiet', '-print_format', 'json',
-                '-show_format', '-show_streams', video_path
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-            if result.returncode != 0:
+            info = probe_media_info_sync(video_path)
+            if info is None or not info.has_video:
                 return None
             
-            info = json.loads(result.stdout)
-            
-            # البحث عن stream الفيديو
-            video_stream = None
-            for stream in info.get('streams', []):
-                if stream.get('codec_type') == 'video':
-                    video_stream = stream
-                    break
-            
-            if not video_stream:
-                return None
-            
-            # استخراج المعلومات
-            width = int(video_stream.get('width', 0))
-            height = int(video_stream.get('height', 0))
-            fps_str = video_stream.get('r_frame_rate', '30/1')
-            
-            # حساب FPS
-            if '/' in fps_str:
-                num, den = map(int, fps_str.split('/'))
-                fps = num / den if den != 0 else 30
-            else:
-                fps = float(fps_str)
-            
-            # الحصول على المدة
-            duration = float(info.get('format', {}).get('duration', 0))
-            
             return {
-                'width': width,
-                'height': height,
-                'fps': fps,
-                'duration': duration
+                'width': info.width,
+                'height': info.height,
+                'fps': info.fps,
+                'duration': info.duration
             }
             
         except Exception as e:
@@ -178,14 +139,11 @@ class OptimizedWatermarkProcessor:
             return None
     
     def create_watermark_image_fast(self, watermark_settings: dict, width: int, height: int) -> Optional[str]:
-        """إنشاء صورة العلامة المائية بسرعة"""
+        """ملف PNG للعلامة المائية بهذه الدقة (يُحفظ مرة واحدة ويُعاد استخدامه - لا يُحذف بعد الترميز)"""
         try:
-            temp_dir = tempfile.gettempdir()
-            watermark_path = os.path.join(temp_dir, f"watermark_{hash(str(watermark_settings))}.png")
-            
             # إنشاء العلامة المائية
             if watermark_settings['watermark_type'] == 'text':
-                watermark_img = self.create_text_watermark_fast(
+                spec = self._text_overlay_spec(
                     watermark_settings['watermark_text'],
                     watermark_settings.get('font_size', 32),
                     watermark_settings.get('text_color', '#FFFFFF'),
@@ -194,33 +152,38 @@ class OptimizedWatermarkProcessor:
                 )
             else:
                 # للصور، استخدام الصورة الأصلية
-                watermark_img = self.load_image_watermark_fast(
+                spec = self._image_overlay_spec(
                     watermark_settings['watermark_image_path'],
                     watermark_settings.get('size_percentage', 20),
                     watermark_settings.get('opacity', 70),
                     (width, height)
                 )
             
-            if watermark_img:
-                watermark_img.save(watermark_path, 'PNG')
-                return watermark_path
-            
-            return None
+            return watermark_overlays.png_path(*spec)
             
         except Exception as e:
             logger.error(f"خطأ في إنشاء صورة العلامة المائية: {e}")
             return None
     
+    def _image_overlay_spec(self, image_path: str, size_percentage: int, opacity: int,
+                            base_image_size: Tuple[int, int]):
+        key = overlay_key('fast_image', base_image_size, image_path, size_percentage, opacity)
+        return key, lambda: self._render_image_watermark_fast(image_path, size_percentage, opacity, base_image_size)
+    
     def load_image_watermark_fast(self, image_path: str, size_percentage: int, opacity: int,
                                   base_image_size: Tuple[int, int]) -> Optional[Image.Image]:
-        """تحميل وتحضير علامة مائية من صورة بسرعة"""
+        """تحميل وتحضير علامة مائية من صورة بسرعة (مرة واحدة لكل دقة - النتيجة للقراءة فقط)"""
+        return watermark_overlays.overlay(*self._image_overlay_spec(image_path, size_percentage, opacity, base_image_size))
+    
+    def _render_image_watermark_fast(self, image_path: str, size_percentage: int, opacity: int,
+                                     base_image_size: Tuple[int, int]) -> Optional[Image.Image]:
         try:
             if not image_path or not os.path.exists(image_path):
                 logger.error(f"ملف صورة العلامة غير موجود: {image_path}")
                 return None
-            watermark_img = Image.open(image_path)
-            if watermark_img.mode != 'RGBA':
-                watermark_img = watermark_img.convert('RGBA')
+            watermark_img = load_watermark_source(image_path)
+            if watermark_img is None:
+                return None
             base_w, base_h = base_image_size
             wm_w, wm_h = watermark_img.size
             aspect = wm_w / wm_h if wm_h else 1
@@ -240,18 +203,22 @@ class OptimizedWatermarkProcessor:
             logger.error(f"خطأ في تحميل صورة العلامة المائية: {e}")
             return None
 
+    def _text_overlay_spec(self, text: str, font_size: int, color: str, opacity: int, image_size: Tuple[int, int]):
+        key = overlay_key('fast_text', image_size, text, font_size, color, opacity)
+        return key, lambda: self._render_text_watermark_fast(text, font_size, color, opacity, image_size)
+    
     def create_text_watermark_fast(self, text: str, font_size: int, color: str, opacity: int, 
                                  image_size: Tuple[int, int]) -> Optional[Image.Image]:
-        """إنشاء علامة مائية نصية بسرعة"""
+        """إنشاء علامة مائية نصية بسرعة (مرة واحدة لكل دقة - النتيجة للقراءة فقط)"""
+        return watermark_overlays.overlay(*self._text_overlay_spec(text, font_size, color, opacity, image_size))
+    
+    def _render_text_watermark_fast(self, text: str, font_size: int, color: str, opacity: int, 
+                                    image_size: Tuple[int, int]) -> Optional[Image.Image]:
         try:
             img_width, img_height = image_size
             # حساب حجم الخط بناءً على عرض الصورة لتوازن الحجم
             calculated_font_size = max(font_size, img_width // 20)
-            try:
-                font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", calculated_font_size)
-            except:
-                font = ImageFont.load_default()
-                font = font.font_variant(size=calculated_font_size)
+            font = load_font(calculated_font_size)
             # حساب حجم النص باستخدام لوحة مؤقتة صغيرة
             tmp_img = Image.new('RGBA', (1, 1), (0, 0, 0, 0))
             tmp_draw = ImageDraw.Draw(tmp_img)
@@ -289,19 +256,12 @@ class OptimizedWatermarkProcessor:
         return position_map.get(position, position_map['bottom_right'])
     
     def build_ffmpeg_command_fast(self, input_path: str, watermark_path: str, output_path: str, 
-                                watermark_settings: dict) -> list:
+                                watermark_settings: dict, plan=None) -> list:
         """بناء أمر FFmpeg محسن للسرعة"""
         
-        # إعدادات محسنة للسرعة (قابلة للتخصيص من الإعدادات)
-        quality_mode = watermark_settings.get('quality_mode')
-        base_crf = self.fast_video_settings['crf']
-        base_preset = self.fast_video_settings['preset']
-        crf = int(watermark_settings.get('crf', 18 if quality_mode == 'preserve' else base_crf))
-        preset = watermark_settings.get('preset', 'slow' if quality_mode == 'preserve' else base_preset)
-        threads = int(watermark_settings.get('threads', self.fast_video_settings['threads']))
-        tune = watermark_settings.get('tune', self.fast_video_settings.get('tune', 'film'))
-        profile = watermark_settings.get('profile', self.fast_video_settings.get('profile', 'high'))
-        level = watermark_settings.get('level', self.fast_video_settings.get('level', '4.0'))
+        # preset/CRF/الخيوط من ملف الترميز (القيم الصريحة في الإعدادات لها الأولوية)
+        if plan is None:
+            plan = encoding_engine.plan(cached_media_info(input_path) or {}, settings=watermark_settings)
         
         # حساب موقع العلامة المائية
         position = watermark_settings.get('position', 'bottom_right')
@@ -311,15 +271,13 @@ class OptimizedWatermarkProcessor:
         # بناء أمر FFmpeg - أقصى سرعة ممكنة مع تصحيح الرايات
         cmd = [
             'ffmpeg', '-y', '-loglevel', 'error',
-            '-threads', str(threads),
+            *plan.thread_args(),
             '-i', input_path,               # الفيديو المدخل
             '-i', watermark_path,           # صورة العلامة المائية
             '-filter_complex', f'[0:v][1:v]overlay={self.get_overlay_position(position, offset_x, offset_y)}:eval=init[v]',
             '-map', '[v]',
             '-map', '0:a?',                 # اجعل الصوت اختيارياً إن وجد
-            '-c:v', 'libx264',              # كودك الفيديو
-            '-preset', preset,              # preset سريع
-            '-crf', str(crf),               # جودة محسنة للسرعة
+            *plan.x264_args(),              # كودك الفيديو و preset و CRF
             '-pix_fmt', 'yuv420p',          # توافق أعلى
             '-movflags', '+faststart',      # تحسين بدء التشغيل
             '-c:a', 'copy',                 # نسخ الصوت بدون إعادة ترميز
@@ -22,6 +22,13 @@ from PIL import Image, ImageDraw, ImageFont, ImageColor
 import cv2
 import numpy as np
 
+from media_worker_pool import media_pool, FAST, HEAVY
+from ffmpeg_runner import ffmpeg_runner
+from media_info import MediaInfo, probe_media_info, remember_media_info, cached_media_info
+from watermark_overlay_cache import watermark_overlays
+from image_watermark_worker import render_image_watermark, text_overlay_spec, image_overlay_spec
+from encoding_profiles import EncodingPlan, encoding_engine
+
 logger = logging.getLogger(__name__)
 
 class UltraOptimizedWatermarkProcessor:
@@ -37,15 +44,7 @@ class UltraOptimizedWatermarkProcessor:
         self.cache_lock = threading.RLock()
         self.cache_stats = {'hits': 0, 'misses': 0, 'size': 0}
         
-        # إعدادات FFmpeg للسرعة القصوى
-        self.ultra_fast_settings = {
-            'crf': 23,              # افتراضي آمن يحافظ على الجودة
-            'preset': 'veryfast',   # سرعة جيدة مع جودة مقبولة
-            'threads': 16,
-            'tune': 'film',         # ضبط يحافظ على التفاصيل
-            'profile': 'high',
-            'level': '4.0',
-        }
+        # إعدادات الترميز (preset/CRF/الخيوط) من encoding_profiles حسب ملف المهمة
         
         # إعدادات الذاكرة المؤقتة
         self.max_cache_size = 100 * 1024 * 1024  # 100 MB
@@ -55,9 +54,6 @@ class UltraOptimizedWatermarkProcessor:
         # التحقق من توفر FFmpeg
         self.ffmpeg_available = self._check_ffmpeg_availability()
         
-        # ThreadPool للعمليات المتوازية
-        self.executor = ThreadPoolExecutor(max_workers=8)
-        
         # إحصائيات الأداء
         self.performance_stats = {
             'total_processed': 0,
@@ -96,8 +92,8 @@ class UltraOptimizedWatermarkProcessor:
     
     def _smart_cache_key(self, media_bytes: bytes, filename: str, watermark_settings: dict, task_id: int) -> str:
         """إنشاء مفتاح ذكي للذاكرة المؤقتة"""
-        # استخدام hash سريع للبيانات
-        content_hash = hashlib.md5(media_bytes[:1024] + media_bytes[-1024:]).hexdigest()  # أول وآخر 1KB فقط
+        # تجزئة المحتوى كاملاً: ملفان يختلفان في المنتصف فقط يجب ألا يتصادما
+        content_hash = hashlib.blake2b(media_bytes, digest_size=16).hexdigest()
         settings_hash = hashlib.md5(json.dumps(watermark_settings, sort_keys=True).encode()).hexdigest()
         return f"{task_id}_{content_hash}_{settings_hash}_{os.path.splitext(filename)[1]}"
     
@@ -164,69 +160,9 @@ class UltraOptimizedWatermarkProcessor:
         return processed_media if processed_media else media_bytes
     
     async def _process_image_ultra_fast(self, image_bytes: bytes, watermark_settings: dict) -> bytes:
-        """معالجة الصور بسرعة قصوى"""
+        """معالجة الصور بسرعة قصوى في عملية منفصلة حتى لا يتوقف حلقة الأحداث أثناء عمل PIL"""
         try:
-            # تحميل الصورة
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            # تحويل إلى RGB إذا لزم الأمر
-            if image.mode not in ['RGB', 'RGBA']:
-                image = image.convert('RGB')
-            
-            # إنشاء العلامة المائية
-            if watermark_settings['watermark_type'] == 'text' and watermark_settings.get('watermark_text'):
-                watermark = self._create_text_watermark_ultra_fast(
-                    watermark_settings['watermark_text'],
-                    watermark_settings.get('font_size', 32),
-                    watermark_settings.get('text_color', '#FFFFFF'),
-                    watermark_settings.get('opacity', 70),
-                    image.size
-                )
-                
-                if watermark:
-                    # تطبيق العلامة المائية
-                    if image.mode == 'RGBA':
-                        image.paste(watermark, (0, 0), watermark)
-                    else:
-                        image = image.convert('RGBA')
-                        image.paste(watermark, (0, 0), watermark)
-                        image = image.convert('RGB')
-            elif watermark_settings['watermark_type'] == 'image' and watermark_settings.get('watermark_image_path'):
-                try:
-                    wm_img = Image.open(watermark_settings['watermark_image_path'])
-                    if wm_img.mode != 'RGBA':
-                        wm_img = wm_img.convert('RGBA')
-                    size_percentage = int(watermark_settings.get('size_percentage', 20))
-                    opacity = int(watermark_settings.get('opacity', 70))
-                    base_w, base_h = image.size
-                    wm_w, wm_h = wm_img.size
-                    aspect = wm_w / wm_h if wm_h else 1
-                    target_area = max(1, int(base_w * base_h * (max(1, size_percentage) / 100.0)))
-                    new_h = int((target_area / aspect) ** 0.5)
-                    new_w = int(new_h * aspect)
-                    new_w = max(20, min(new_w, base_w - 10))
-                    new_h = max(20, min(new_h, base_h - 10))
-                    if (new_w, new_h) != wm_img.size:
-                        wm_img = wm_img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-                    if 0 <= opacity < 100:
-                        alpha = wm_img.split()[-1]
-                        alpha = alpha.point(lambda p: int(p * opacity / 100))
-                        wm_img.putalpha(alpha)
-                    # Paste at chosen position
-                    pos = self._calculate_position_ultra_fast((base_w, base_h), wm_img.size, watermark_settings.get('position','bottom_right'))
-                    if image.mode != 'RGBA':
-                        image = image.convert('RGBA')
-                    image.paste(wm_img, pos, wm_img)
-                    image = image.convert('RGB')
-                except Exception as _e:
-                    logger.warning(f"فشل تطبيق علامة صورة على صورة: {_e}")
-            
-            # حفظ الصورة محسنة
-            output = io.BytesIO()
-            image.save(output, format='JPEG', quality=85, optimize=True, progressive=True)
-            
-            return output.getvalue()
-            
+            return await media_pool.run_cpu(render_image_watermark, image_bytes, watermark_settings, lane=FAST)
         except Exception as e:
             logger.error(f"خطأ في معالجة الصورة: {e}")
             return image_bytes
@@ -248,54 +184,12 @@ class UltraOptimizedWatermarkProcessor:
             temp_output.close()
             
             try:
-                # الحصول على معلومات الفيديو
-                video_info = await self._get_video_info_async(temp_input.name)
-                if not video_info:
-                    return video_bytes
-                
-                # إنشاء العلامة المائية
-                watermark_path = await self._create_watermark_image_async(watermark_settings, video_info['width'], video_info['height'])
-                if not watermark_path:
-                    return video_bytes
-                
-                # معالجة الفيديو بسرعة قصوى
-                # حساب حارس الحجم والمعدل الأصلي
-                original_size = os.path.getsize(temp_input.name)
-                original_bitrate = int(video_info.get('bitrate') or (original_size * 8 / max(video_info.get('duration') or 1, 1)))
-                success = await self._process_video_with_ffmpeg_async(
-                    temp_input.name, watermark_path, temp_output.name, watermark_settings, original_bitrate, original_size
-                )
-                
-                if success and os.path.exists(temp_output.name):
+                if await self._process_video_file_ultra_fast(temp_input.name, temp_output.name, watermark_settings):
                     # قراءة النتيجة
                     with open(temp_output.name, 'rb') as f:
-                        result_bytes = f.read()
-                    
-                    # تنظيف الملفات المؤقتة
-                    os.unlink(temp_input.name)
-                    os.unlink(temp_output.name)
-                    os.unlink(watermark_path)
-                    
-                    return result_bytes
-                else:
-                    # فولبك: محاولة المعالج المحسن
-                    try:
-                        from watermark_processor_optimized import OptimizedWatermarkProcessor
-                        _opt = OptimizedWatermarkProcessor()
-                        out_path = _opt.apply_watermark_to_video_fast(temp_input.name, watermark_settings)
-                        if out_path and os.path.exists(out_path):
-                            with open(out_path, 'rb') as f:
-                                data = f.read()
-                            os.unlink(out_path)
-                            os.unlink(temp_input.name)
-                            os.unlink(watermark_path)
-                            return data
-                    except Exception:
-                        pass
-                    return video_bytes
-                    
-            except Exception as e:
-                logger.error(f"خطأ في معالجة الفيديو: {e}")
+                        return f.read()
+                return video_bytes
+            finally:
                 # تنظيف الملفات المؤقتة
                 for temp_file in [temp_input.name, temp_output.name]:
                     if os.path.exists(temp_file):
@@ -303,113 +197,123 @@ class UltraOptimizedWatermarkProcessor:
                             os.unlink(temp_file)
                         except:
                             pass
-                return video_bytes
                 
         except Exception as e:
             logger.error(f"خطأ في معالجة الفيديو: {e}")
             return video_bytes
-    
-    def _create_text_watermark_ultra_fast(self, text: str, font_size: int, color: str, opacity: int, 
-                                        image_size: Tuple[int, int]) -> Optional[Image.Image]:
-        """إنشاء علامة مائية نصية بسرعة قصوى"""
+
+    async def _process_video_file_ultra_fast(self, input_path: str, output_path: str, watermark_settings: dict) -> bool:
+        """معالجة فيديو على القرص وكتابة النتيجة في output_path دون تحميله في الذاكرة"""
+        thumbnail_path = None
         try:
-            img_width, img_height = image_size
-            calculated_font_size = max(font_size, img_width // 20)
+            if not self.ffmpeg_available:
+                logger.warning("FFmpeg غير متوفر - استخدام الطريقة البطيئة")
+                return False
+            
+            # الحصول على معلومات الفيديو
+            video_info = await self._get_video_info_async(input_path)
+            if not video_info:
+                return False
+            
+            # إنشاء العلامة المائية
+            watermark_path = await self._create_watermark_image_async(watermark_settings, video_info.width, video_info.height)
+            if not watermark_path:
+                return False
+            
+            # معالجة الفيديو بسرعة قصوى
+            # حساب حارس الحجم والمعدل الأصلي
+            original_size = video_info.size or os.path.getsize(input_path)
+            original_bitrate = int(video_info.bitrate or (original_size * 8 / max(video_info.duration or 1, 1)))
+            # الصورة المصغّرة تُستخرج من منتصف الفيديو ضمن أمر الترميز نفسه
+            # (فقط عند معرفة المدة - الإطار الأول غالباً أسود، فيُترك لاستخراج الصورة المصغّرة المعتاد)
+            if video_info.duration:
+                thumbnail_path = output_path + '.thumb.jpg'
+            plan = encoding_engine.plan(video_info, settings=watermark_settings)
+            success = await self._process_video_with_ffmpeg_async(
+                input_path, watermark_path, output_path, watermark_settings, original_bitrate, original_size,
+                thumbnail_path=thumbnail_path, thumbnail_at=video_info.duration / 2, plan=plan,
+            )
+            
+            if success and os.path.exists(output_path):
+                # تسجيل معلومات الناتج (نفس الأبعاد والمدة) حتى لا تفحصه مرحلة الإرسال من جديد
+                # المدة المجهولة تعني معدلاً وصورة مصغّرة غير صالحين - مرحلة الإرسال تفحص الملف بنفسها
+                if video_info.duration:
+                    thumbnail = None
+                    if os.path.exists(thumbnail_path):
+                        with open(thumbnail_path, 'rb') as f:
+                            thumbnail = f.read() or None
+                    output_size = os.path.getsize(output_path)
+                    remember_media_info(output_path, video_info.derive(
+                        size=output_size,
+                        bitrate=int(output_size * 8 / video_info.duration),
+                        video_codec='h264',
+                        thumbnail=thumbnail,
+                    ))
+                return True
+            
+            # فولبك: محاولة المعالج المحسن
             try:
-                font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", calculated_font_size)
-            except:
-                font = ImageFont.load_default()
-                font = font.font_variant(size=calculated_font_size)
-            # احسب حجم النص على لوحة مؤقتة
-            tmp_img = Image.new('RGBA', (1, 1), (0, 0, 0, 0))
-            tmp_draw = ImageDraw.Draw(tmp_img)
-            bbox = tmp_draw.textbbox((0, 0), text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-            # أنشئ صورة العلامة المائية بحجم النص فقط
-            watermark_img = Image.new('RGBA', (text_width, text_height), (0, 0, 0, 0))
-            draw = ImageDraw.Draw(watermark_img)
-            alpha = int(255 * opacity / 100)
-            draw.text((0, 0), text, font=font, fill=color + hex(alpha)[2:].zfill(2))
-            return watermark_img
-         
+                from watermark_processor_optimized import OptimizedWatermarkProcessor
+                _opt = OptimizedWatermarkProcessor()
+                out_path = await media_pool.run(
+                    _opt.apply_watermark_to_video_fast, input_path, watermark_settings, lane=HEAVY
+                )
+                if out_path and os.path.exists(out_path):
+                    shutil.move(out_path, output_path)
+                    return True
+            except Exception:
+                pass
+            return False
+            
         except Exception as e:
-            logger.error(f"خطأ في إنشاء العلامة المائية النصية: {e}")
-            return None
-    
-    def _calculate_position_ultra_fast(self, base_size: Tuple[int, int], watermark_size: Tuple[int, int], position: str) -> Tuple[int, int]:
-        """حساب موقع العلامة المائية بسرعة"""
-        base_width, base_height = base_size
-        watermark_width, watermark_height = watermark_size
+            logger.error(f"خطأ في معالجة الفيديو: {e}")
+            return False
+        finally:
+            # ملف العلامة المائية من ذاكرة الطبقات ويُعاد استخدامه - تُحذف الصورة المصغّرة فقط
+            if thumbnail_path and os.path.exists(thumbnail_path):
+                try:
+                    os.unlink(thumbnail_path)
+                except:
+                    pass
+
+    async def process_media_file_ultra_fast(self, input_path: str, filename: str, watermark_settings: dict,
+                                            task_id: int, output_path: str) -> bool:
+        """
+        معالجة وسائط موجودة على القرص وكتابة النتيجة في output_path
+        ترجع True إذا كُتبت نسخة معالجة، وFalse إذا لم تتغير الوسائط
+        """
+        start_time = time.time()
+        file_ext = os.path.splitext(filename)[1].lower()
+        processed = False
         
-        margin = min(base_width, base_height) // 20
+        if file_ext in self.supported_image_formats:
+            # الصور صغيرة - تُعالج في الذاكرة كما في المسار المعتاد
+            with open(input_path, 'rb') as f:
+                image_bytes = f.read()
+            processed_image = await self._process_image_ultra_fast(image_bytes, watermark_settings)
+            if processed_image and processed_image != image_bytes:
+                with open(output_path, 'wb') as f:
+                    f.write(processed_image)
+                processed = True
+        elif file_ext in self.supported_video_formats:
+            processed = await self._process_video_file_ultra_fast(input_path, output_path, watermark_settings)
         
-        position_map = {
-            'top_left': (margin, margin),
-            'top_right': (base_width - watermark_width - margin, margin),
-            'top': ((base_width - watermark_width) // 2, margin),
-            'bottom_left': (margin, base_height - watermark_height - margin),
-            'bottom_right': (base_width - watermark_width - margin, base_height - watermark_height - margin),
-            'bottom': ((base_width - watermark_width) // 2, base_height - watermark_height - margin),
-            'center': ((base_width - watermark_width) // 2, (base_height - watermark_height) // 2)
-        }
+        # تحديث الإحصائيات
+        processing_time = time.time() - start_time
+        self.performance_stats['total_processed'] += 1
+        self.performance_stats['total_time'] += processing_time
+        self.performance_stats['avg_time'] = self.performance_stats['total_time'] / self.performance_stats['total_processed']
         
-        return position_map.get(position, position_map['bottom_right'])
+        logger.info(f"⚡ معالجة فائقة السرعة من القرص: {filename} في {processing_time:.2f}s")
+        return processed
     
-    async def _get_video_info_async(self, video_path: str) -> Optional[Dict]:
-        """الحصول على معلومات الفيديو بشكل متوازي"""
+    async def _get_video_info_async(self, video_path: str) -> Optional[MediaInfo]:
+        """الحصول على معلومات الفيديو (فحص ffprobe واحد مشترك مع مراحل الضغط والإرسال)"""
         try:
-            cmd = [
-                'ffprobe', '-v', 'quiet', '-print_format', 'json',
-                '-show_format', '-show_streams', video_path
-            ]
-            
-            def run_ffprobe():
-                return subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-            
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(self.executor, run_ffprobe)
-            
-            if result.returncode != 0:
+            info = await probe_media_info(video_path)
+            if info is None or not info.has_video:
                 return None
-            
-            info = json.loads(result.stdout)
-            
-            # البحث عن stream الفيديو
-            video_stream = None
-            for stream in info.get('streams', []):
-                if stream.get('codec_type') == 'video':
-                    video_stream = stream
-                    break
-            
-            if not video_stream:
-                return None
-            
-            # استخراج المعلومات
-            width = int(video_stream.get('width', 0))
-            height = int(video_stream.get('height', 0))
-            fps_str = video_stream.get('r_frame_rate', '30/1')
-            
-            # حساب FPS
-            if '/' in fps_str:
-                num, den = map(int, fps_str.split('/'))
-                fps = num / den if den != 0 else 30
-            else:
-                fps = float(fps_str)
-            
-            # الحصول على المدة ومعدل البت
-            format_info = info.get('format', {})
-            duration = float(format_info.get('duration', 0))
-            bit_rate = int(format_info.get('bit_rate', 0)) if str(format_info.get('bit_rate', '0')).isdigit() else 0
-            
-            return {
-                'width': width,
-                'height': height,
-                'fps': fps,
-                'duration': duration,
-                'bitrate': bit_rate
-            }
-            
+            return info
         except Exception as e:
             logger.error(f"خطأ في الحصول على معلومات الفيديو: {e}")
             return None
@@ -417,68 +321,44 @@ class UltraOptimizedWatermarkProcessor:
     async def _create_watermark_image_async(self, watermark_settings: dict, width: int, height: int) -> Optional[str]:
         """إنشاء صورة العلامة المائية بشكل متوازي"""
         try:
-            temp_dir = tempfile.gettempdir()
-            watermark_path = os.path.join(temp_dir, f"watermark_{hash(str(watermark_settings))}.png")
-            
+            return await media_pool.run(self._create_watermark_image, watermark_settings, width, height, lane=FAST)
+        except Exception as e:
+            logger.error(f"خطأ في إنشاء صورة العلامة المائية: {e}")
+            return None
+    
+    def _create_watermark_image(self, watermark_settings: dict, width: int, height: int) -> Optional[str]:
+        """ملف PNG للعلامة المائية بدقة الفيديو (يُحفظ مرة واحدة لكل دقة ويُعاد استخدامه)"""
+        try:
             if watermark_settings['watermark_type'] == 'text':
-                watermark_img = self._create_text_watermark_ultra_fast(
+                spec = text_overlay_spec(
                     watermark_settings['watermark_text'],
                     watermark_settings.get('font_size', 32),
                     watermark_settings.get('text_color', '#FFFFFF'),
                     watermark_settings.get('opacity', 70),
                     (width, height)
                 )
-                
-                if watermark_img:
-                    watermark_img.save(watermark_path, 'PNG', optimize=True)
-                    return watermark_path
             elif watermark_settings['watermark_type'] == 'image' and watermark_settings.get('watermark_image_path'):
-                # تحميل صورة العلامة، تحجيمها، وتطبيق الشفافية
-                try:
-                    wm_img = Image.open(watermark_settings['watermark_image_path'])
-                    if wm_img.mode != 'RGBA':
-                        wm_img = wm_img.convert('RGBA')
-                    size_percentage = int(watermark_settings.get('size_percentage', 20))
-                    opacity = int(watermark_settings.get('opacity', 70))
-                    # حساب أبعاد مناسبة نسبةً إلى الفيديو
-                    wm_w, wm_h = wm_img.size
-                    aspect = wm_w / wm_h if wm_h else 1
-                    target_area = max(1, int(width * height * (max(1, size_percentage) / 100.0)))
-                    new_h = int((target_area / aspect) ** 0.5)
-                    new_w = int(new_h * aspect)
-                    new_w = max(20, min(new_w, width - 10))
-                    new_h = max(20, min(new_h, height - 10))
-                    if (new_w, new_h) != wm_img.size:
-                        wm_img = wm_img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-                    if 0 <= opacity < 100:
-                        alpha = wm_img.split()[-1]
-                        alpha = alpha.point(lambda p: int(p * opacity / 100))
-                        wm_img.putalpha(alpha)
-                    wm_img.save(watermark_path, 'PNG', optimize=True)
-                    return watermark_path
-                except Exception as _e:
-                    logger.error(f"فشل تحميل/تحضير صورة العلامة: {_e}")
-             
-            return None
+                spec = image_overlay_spec(watermark_settings, (width, height))
+            else:
+                return None
+            return watermark_overlays.png_path(*spec)
              
         except Exception as e:
             logger.error(f"خطأ في إنشاء صورة العلامة المائية: {e}")
             return None
     
     async def _process_video_with_ffmpeg_async(self, input_path: str, watermark_path: str, output_path: str, 
-                                            watermark_settings: dict, original_bitrate: int, size_guard_bytes: int) -> bool:
-        """معالجة الفيديو باستخدام FFmpeg بشكل متوازي"""
+                                            watermark_settings: dict, original_bitrate: int, size_guard_bytes: int,
+                                            thumbnail_path: Optional[str] = None, thumbnail_at: float = 0,
+                                            plan: Optional[EncodingPlan] = None) -> bool:
+        """معالجة الفيديو باستخدام FFmpeg بشكل متوازي (مع صورة مصغّرة اختيارية من نفس الترميز)"""
         try:
-            # وضع الحفاظ على الجودة: CRF منخفض و preset أبطأ لضغط أفضل بدون فقد بصري
-            quality_mode = watermark_settings.get('quality_mode')
-            base_crf = self.ultra_fast_settings['crf']
-            base_preset = self.ultra_fast_settings['preset']
-            crf = int(watermark_settings.get('crf', 18 if quality_mode == 'preserve' else base_crf))
-            preset = watermark_settings.get('preset', 'slow' if quality_mode == 'preserve' else base_preset)
-            threads = int(watermark_settings.get('threads', self.ultra_fast_settings['threads']))
-            tune = watermark_settings.get('tune', self.ultra_fast_settings.get('tune', 'film'))
-            profile = watermark_settings.get('profile', self.ultra_fast_settings.get('profile', 'high'))
-            level = watermark_settings.get('level', self.ultra_fast_settings.get('level', '4.0'))
+            # preset/CRF/الخيوط من ملف الترميز المختار للمهمة (وضع preserve القديم = ملف quality)
+            if plan is None:
+                plan = encoding_engine.plan(await self._get_video_info_async(input_path) or {},
+                                            settings=watermark_settings)
+            crf, preset = plan.crf, plan.preset
+            started = time.monotonic()
             
             # حساب موقع العلامة المائية
             position = watermark_settings.get('position', 'bottom_right')
@@ -490,15 +370,13 @@ class UltraOptimizedWatermarkProcessor:
             bufsize = str(int(original_bitrate * 2)) if original_bitrate > 0 else None
             cmd = [
                 'ffmpeg', '-y', '-loglevel', 'error',
-                '-threads', str(threads),
+                *plan.thread_args(),
                 '-i', input_path,               # الفيديو المدخل
                 '-i', watermark_path,           # صورة العلامة المائية
                 '-filter_complex', f'[0:v][1:v]overlay={self._get_overlay_position(position, offset_x, offset_y)}:eval=init[v]',
                 '-map', '[v]',
                 '-map', '0:a?',                 # اجعل الصوت اختيارياً إن وجد
-                '-c:v', 'libx264',              # كودك الفيديو
-                '-preset', preset,              # preset سريع
-                '-crf', str(crf),               # جودة محسنة للسرعة
+                *plan.x264_args(),              # كودك الفيديو و preset و CRF
                 '-pix_fmt', 'yuv420p',          # توافق أعلى
                 '-movflags', '+faststart',      # تحسين بدء التشغيل
                 '-c:a', 'copy',                 # نسخ الصوت بدون إعادة ترميز
@@ -507,15 +385,29 @@ class UltraOptimizedWatermarkProcessor:
             if maxrate and bufsize:
                 cmd.extend(['-maxrate', maxrate, '-bufsize', bufsize])
             cmd.append(output_path)
- 
-            def run_ffmpeg():
-                return subprocess.run(cmd, capture_output=True, text=True, timeout=1200)
             
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(self.executor, run_ffmpeg)
+            if thumbnail_path:
+                # فرع ثانٍ من نفس الإطارات المعلَّمة: إطار واحد بعد thumbnail_at كصورة مصغّرة
+                overlay = self._get_overlay_position(position, offset_x, offset_y)
+                with_thumb = list(cmd[:-1])
+                graph_index = with_thumb.index('-filter_complex') + 1
+                with_thumb[graph_index] = (
+                    f"[0:v][1:v]overlay={overlay}:eval=init,split=2[v][tsrc];"
+                    f"[tsrc]select='gte(t\\,{max(0.0, thumbnail_at):.3f})',"
+                    f"scale=320:240:force_original_aspect_ratio=decrease[t]"
+                )
+                with_thumb += [output_path, '-map', '[t]', '-frames:v', '1', '-q:v', '4', thumbnail_path]
+                result = await ffmpeg_runner.run(with_thumb, timeout=1200, progress=True)
+                if result.returncode > 0:
+                    # فشل فرع الصورة المصغّرة لا يمنع الترميز العادي (القيمة السالبة تعني إيقاف المهمة)
+                    logger.debug(f"فشل الترميز مع الصورة المصغّرة، إعادة المحاولة بدونها: {result.stderr[-300:]}")
+                    result = await ffmpeg_runner.run(cmd, timeout=1200, progress=True)
+            else:
+                result = await ffmpeg_runner.run(cmd, timeout=1200, progress=True)
             
             if result.returncode != 0 or not os.path.exists(output_path):
                 return False
+            encoding_engine.record(plan, time.monotonic() - started)
             # حجم الإخراج وحارس الحجم
             try:
                 out_size = os.path.getsize(output_path)
@@ -523,7 +415,7 @@ class UltraOptimizedWatermarkProcessor:
                     # المحاولة الثانية: رفع CRF وتقليل السقف
                     crf_bump = str(min(int(crf) + 6, 30))
                     second = [
-                        'ffmpeg', '-y', '-loglevel', 'error', '-threads', str(threads),
+                        'ffmpeg', '-y', '-loglevel', 'error', *plan.thread_args(),
                         '-i', input_path, '-i', watermark_path,
                         '-filter_complex', f'[0:v][1:v]overlay={self._get_overlay_position(position, offset_x, offset_y)}:eval=init[v]',
                         '-map', '[v]', '-map', '0:a?',
@@ -533,9 +425,7 @@ class UltraOptimizedWatermarkProcessor:
                     if maxrate and bufsize:
                         second.extend(['-maxrate', maxrate, '-bufsize', bufsize])
                     second.append(output_path)
-                    def run_ffmpeg2():
-                        return subprocess.run(second, capture_output=True, text=True, timeout=1200)
-                    res2 = await loop.run_in_executor(self.executor, run_ffmpeg2)
+                    res2 = await ffmpeg_runner.run(second, timeout=1200, progress=True)
                     if res2.returncode != 0:
                         return False
                     # تحقق الحجم ثانية
@@ -550,13 +440,12 @@ class UltraOptimizedWatermarkProcessor:
             return False
     
     def _build_ultra_fast_ffmpeg_command(self, input_path: str, watermark_path: str, output_path: str, 
-                                       watermark_settings: dict) -> List[str]:
+                                       watermark_settings: dict, plan: Optional[EncodingPlan] = None) -> List[str]:
         """بناء أمر FFmpeg للسرعة القصوى"""
         
-        # إعدادات السرعة القصوى
-        crf = self.ultra_fast_settings['crf']
-        preset = self.ultra_fast_settings['preset']
-        threads = self.ultra_fast_settings['threads']
+        # إعدادات ملف الترميز المختار للمهمة
+        if plan is None:
+            plan = encoding_engine.plan(cached_media_info(input_path) or {}, settings=watermark_settings)
         
         # حساب موقع العلامة المائية
         position = watermark_settings.get('position', 'bottom_right')
@@ -566,15 +455,13 @@ class UltraOptimizedWatermarkProcessor:
         # بناء أمر FFmpeg للسرعة القصوى مع تصحيح الرايات
         cmd = [
             'ffmpeg', '-y', '-loglevel', 'error',
-            '-threads', str(threads),
+            *plan.thread_args(),
             '-i', input_path,               # الفيديو المدخل
             '-i', watermark_path,           # صورة العلامة المائية
             '-filter_complex', f'[0:v][1:v]overlay={self._get_overlay_position(position, offset_x, offset_y)}:eval=init[v]',
             '-map', '[v]',
             '-map', '0:a?',                 # اجعل الصوت اختيارياً إن وجد
-            '-c:v', 'libx264',              # كودك الفيديو
-            '-preset', preset,              # preset سريع
-            '-crf', str(crf),               # جودة محسنة للسرعة
+            *plan.x264_args(),              # كودك الفيديو و preset و CRF
             '-pix_fmt', 'yuv420p',          # توافق أعلى
             '-movflags', '+faststart',      # تحسين بدء التشغيل
             '-c:a', 'copy',                 # نسخ الصوت بدون إعادة ترميز
@@ -611,8 +498,7 @@ class UltraOptimizedWatermarkProcessor:
     
     def cleanup(self):
         """تنظيف الموارد"""
-        self.executor.shutdown(wait=True)
         self.global_media_cache.clear()
 
 # إنشاء instance عالمي
-ultra_optimized_processor = UltraOptimizedWatermarkProcessor()
\ No newline at end of file
+ultra_optimized_processor = UltraOptimizedWatermarkProcessor()